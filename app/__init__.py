@@ -1,21 +1,69 @@
+import multiprocessing
+import os
+
 from flask.app import Flask
 from flask_bootstrap import Bootstrap
 
+from app.api import api_bp
 from app.base import base_bp
+from app.config import cfg
+from app.downloads import downloads_bp
 from app.files import files_bp
 from app.helpers import helpers_bp
+from app.metrics import metrics_bp
 from app.utils import gen_random_password
+from app.utils.checksum_index import checksum_index
+from app.utils.jobs import job_runner
+from app.utils.search_index import search_index
+from app.utils.usage import usage_index
+from app.utils.watcher import start_watcher
+
+_started = False
 
 
 def create_app():
     application = Flask(__name__)
     application.secret_key = gen_random_password()
+    application.config["MAX_CONTENT_LENGTH"] = cfg.MAX_UPLOAD_SIZE
     Bootstrap(application)
 
     application.register_blueprint(base_bp)
     application.register_blueprint(files_bp)
+    application.register_blueprint(downloads_bp)
     application.register_blueprint(helpers_bp)
+    application.register_blueprint(api_bp)
+    application.register_blueprint(metrics_bp)
+
+    # The workers of the previews import the app but don't serve it
+    if multiprocessing.parent_process() is None:
+        start_background_threads()
 
     return application
 
+
+def start_background_threads():
+    """Starts the watcher, the job runner and the indexes, once per process."""
+    global _started
+
+    _started = True
+    start_watcher()
+    job_runner.start()
+    if cfg.CHECKSUM_INDEX:
+        checksum_index.start()
+    if cfg.SEARCH_INDEX:
+        search_index.start()
+    if cfg.USAGE_INDEX:
+        usage_index.start()
+
+
+def _after_fork():
+    # Preforking servers (like gunicorn --preload) fork the app once created,
+    # and the threads of the parent aren't copied to the workers
+    if _started:
+        start_background_threads()
+
+
+if hasattr(os, "register_at_fork"):  # Not on Windows
+    os.register_at_fork(after_in_child=_after_fork)
+
 app = create_app()
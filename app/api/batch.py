@@ -0,0 +1,196 @@
+"""Batches of file operations (mkdir, delete and move) sent in one request.
+
+Every operation of a batch is validated before any of them runs, and they are
+run in order with a shared context: the path filter is loaded once, and the
+events and the log line are emitted once the batch has finished. If the batch
+is atomic, the first failure undoes the operations already done, in reverse
+order: folders created are removed, moves are renamed back and deleted
+entries are taken out of the trash (their removal is only scheduled once the
+batch succeeds).
+"""
+import errno
+import os
+from collections import namedtuple
+from pathlib import Path
+
+from app.config import cfg
+from app.files.moves import is_cross_device, start_move
+from app.files.trash import move_to_trash, put_back
+from app.utils import events
+from app.utils.folder_tree import is_reserved, split_path
+from app.utils.jobs import job_runner
+
+OPERATIONS = ("mkdir", "delete", "move")
+
+Operation = namedtuple("Operation", ["op", "path", "dest"])
+
+
+def parse_operations(data, path_filter):
+    """Validates the operations of a batch.
+
+    Args:
+        data (list): operations, like `{"op": "move", "path": "a", "dest": "b"}`.
+        path_filter (callable): filter of the paths that the user can see.
+
+    Returns:
+        list: the `Operation` of each item, with normalized paths.
+
+    Raises:
+        ValueError: if any operation is invalid.
+    """
+    if not isinstance(data, list) or not data:
+        raise ValueError("The operations must be a non-empty list")
+    if len(data) > cfg.BATCH_MAX_OPERATIONS:
+        raise ValueError("Too many operations, the limit is %d" % cfg.BATCH_MAX_OPERATIONS)
+
+    operations = []
+    for index, item in enumerate(data):
+        if not isinstance(item, dict) or item.get("op") not in OPERATIONS:
+            raise ValueError("Operation %d: invalid operation" % index)
+
+        names = ("path", "dest") if item["op"] == "move" else ("path",)
+        paths = []
+        for name in names:
+            path = _check_path(item.get(name), path_filter)
+            if path is None:
+                raise ValueError("Operation %d: invalid %s %r" % (index, name, item.get(name)))
+            paths.append(path)
+
+        operations.append(Operation(item["op"], *paths, *[None] * (2 - len(paths))))
+    return operations
+
+
+def _check_path(relpath, path_filter):
+    if not isinstance(relpath, str):
+        return None
+    parts = split_path(relpath)
+    if not parts or is_reserved(parts) or not path_filter(relpath, is_dir=True):
+        return None
+    return Path(*parts).as_posix()
+
+
+class Batch:
+    """Runs the operations of a batch and keeps what is needed to undo them.
+
+    Args:
+        user (str): user that sent the batch.
+        atomic (bool, optional): undo every operation if any of them fails.
+            Defaults to False.
+    """
+
+    def __init__(self, user, atomic=False):
+        self.user = user
+        self.atomic = atomic
+        self._index = None
+        self._undo = []
+        self._events = []
+        self._jobs = []
+
+    def run(self, operations):
+        """Runs the operations in order.
+
+        Returns:
+            list: result of each operation, a dict with its "status" ("done",
+                "started", "failed", "undone" or "skipped") and, if it failed,
+                the "error".
+        """
+        results = []
+        failed = False
+        for index, operation in enumerate(operations):
+            result = {"op": operation.op, "path": operation.path}
+            if operation.dest is not None:
+                result["dest"] = operation.dest
+            results.append(result)
+
+            if failed and self.atomic:
+                result["status"] = "skipped"
+                continue
+
+            self._index = index
+            try:
+                result.update(getattr(self, "_" + operation.op)(operation))
+            except OSError as exc:
+                result.update(status="failed", error=str(exc))
+                failed = True
+
+        if failed and self.atomic:
+            self._rollback(results)
+
+        # Only the operations that were not undone reach the indexes
+        for _, job in self._jobs:
+            job_runner.submit(job)
+        for event in self._events:
+            events.publish(*event)
+        return results
+
+    def _rollback(self, results):
+        undone = set()
+        for index, undo in reversed(self._undo):
+            try:
+                undo()
+            except OSError as exc:
+                results[index]["error"] = "Can't be undone: %s" % exc
+                continue
+            results[index]["status"] = "undone"
+            results[index].pop("job", None)
+            undone.add(index)
+
+        # The entries that are still in the trash must be removed
+        self._jobs = [x for x in self._jobs if x[0] not in undone]
+        self._events = []
+        if len(undone) < len(self._undo):
+            # The indexes can't tell which operations are still done
+            self._events = [(events.RESCAN, ".", None, True)]
+        self._undo = []
+
+    def _add_undo(self, undo):
+        self._undo.append((self._index, undo))
+
+    def _mkdir(self, operation):
+        path = cfg.CLOUD_PATH / operation.path
+        created = []
+        for folder in [path, *path.parents]:
+            if os.path.lexists(folder):
+                break
+            created.append(folder)
+        os.makedirs(path)
+
+        def undo():
+            for folder in created:
+                os.rmdir(folder)
+
+        self._add_undo(undo)
+        self._events.append((events.CREATED, operation.path, None, True))
+        return {"status": "done"}
+
+    def _delete(self, operation):
+        job = move_to_trash(operation.path, self.user)
+
+        self._add_undo(lambda: put_back(job))
+        self._events.append((events.DELETED, operation.path, None, job.data["is_dir"]))
+        self._jobs.append((self._index, job))
+        return {"status": "done", "job": job.id}
+
+    def _move(self, operation):
+        src = cfg.CLOUD_PATH / operation.path
+        dest = cfg.CLOUD_PATH / operation.dest
+        final = operation.dest
+        # Like /move, the source is moved into the destination if it is a folder
+        if os.path.isdir(dest):
+            final = "%s/%s" % (operation.dest, src.name)
+            dest = dest / src.name
+
+        if is_cross_device(src, dest):
+            if self.atomic:
+                raise OSError("Moves between filesystems can't be undone")
+            job = start_move(operation.path, final, self.user)
+            return {"status": "started", "dest": final, "job": job.id}
+
+        if os.path.lexists(dest):
+            raise FileExistsError(errno.EEXIST, os.strerror(errno.EEXIST), final)
+        is_dir = os.path.isdir(src)
+        os.rename(src, dest)
+
+        self._add_undo(lambda: os.rename(dest, src))
+        self._events.append((events.MOVED, operation.path, final, is_dir))
+        return {"status": "done", "dest": final}
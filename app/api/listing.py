@@ -0,0 +1,226 @@
+"""Listing of the entries of a folder, sorted and paginated with cursors.
+
+The entries of a folder are read once with `os.scandir`, which gets the type
+of each entry from the directory itself, and kept sorted in memory. A page
+starts with a binary search of its cursor, so its cost doesn't depend on the
+size of the folder. When sorting by name only the entries returned are
+stat'ed; sorting by size or mtime stats the whole folder once.
+
+The listings are validated with the mtime of the folder, which changes when
+entries are added, removed or renamed, and dropped when an event reports a
+change inside the folder (like a new size or mtime of a file).
+"""
+import base64
+import binascii
+import json
+import os
+import threading
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict, namedtuple
+
+from app.config import cfg
+from app.utils import events
+from app.utils.folder_tree import split_path
+
+SORT_KEYS = ("name", "size", "mtime")
+
+Entry = namedtuple("Entry", ["name", "is_dir", "size", "mtime"])
+
+
+class Listing:
+    """Entries of a folder, read with a single `os.scandir`.
+
+    Args:
+        path (Path): absolute path of the folder.
+        mtime_ns (int): mtime of the folder when it was read.
+    """
+
+    def __init__(self, path, mtime_ns):
+        self.path = path
+        self.mtime_ns = mtime_ns
+        self.types = {}
+        self._stats = {}
+        self._keys = {}
+
+        with os.scandir(path) as iterator:
+            for entry in iterator:
+                try:
+                    self.types[entry.name] = entry.is_dir()
+                except OSError:
+                    continue
+
+    def __len__(self):
+        return len(self.types)
+
+    def entry(self, name):
+        is_dir = self.types[name]
+        if name not in self._stats:
+            try:
+                st = os.stat(self.path / name)
+            except OSError:
+                # Broken symlinks are listed with the data of the link
+                try:
+                    st = os.lstat(self.path / name)
+                except OSError:
+                    st = None
+
+            if st is None:
+                self._stats[name] = (None, None)
+            else:
+                self._stats[name] = (None if is_dir else st.st_size, st.st_mtime)
+        return Entry(name, is_dir, *self._stats[name])
+
+    def keys(self, sort):
+        """Returns the sort keys of every entry, in ascending order.
+
+        Each key is a tuple ending with the name of the entry, so keys are
+        unique and usable as cursors.
+        """
+        if sort not in self._keys:
+            if sort == "name":
+                keys = [(x,) for x in self.types]
+            elif sort == "size":
+                keys = [(_or(self.entry(x).size, -1), x) for x in self.types]
+            elif sort == "mtime":
+                keys = [(_or(self.entry(x).mtime, 0.0), x) for x in self.types]
+            else:
+                raise ValueError("Invalid sort key: %r" % sort)
+            keys.sort()
+            self._keys[sort] = keys
+        return self._keys[sort]
+
+    def page(self, sort="name", reverse=False, cursor=None, limit=100, accept=None):
+        """Returns a page of entries and the cursor of the next one.
+
+        Args:
+            sort (str, optional): "name", "size" or "mtime". Defaults to "name".
+            reverse (bool, optional): sort in descending order. Defaults to False.
+            cursor (tuple, optional): key of the last entry of the previous
+                page. Defaults to None (first page).
+            limit (int, optional): maximum number of entries. Defaults to 100.
+            accept (callable, optional): filter of the entries, which receives
+                an `Entry` and returns a bool. Defaults to None.
+
+        Returns:
+            tuple: list of `Entry` and the cursor of the next page, or None if
+                this is the last one.
+        """
+        keys = self.keys(sort)
+        step = -1 if reverse else 1
+
+        if cursor is None:
+            index = len(keys) - 1 if reverse else 0
+        elif reverse:
+            index = bisect_left(keys, tuple(cursor)) - 1
+        else:
+            index = bisect_right(keys, tuple(cursor))
+
+        entries = []
+        while 0 <= index < len(keys) and len(entries) < limit:
+            entry = self.entry(keys[index][-1])
+            if accept is None or accept(entry):
+                entries.append(entry)
+            index += step
+
+        next_cursor = keys[index - step] if 0 <= index < len(keys) else None
+        return entries, next_cursor
+
+
+def encode_cursor(sort, key):
+    """Converts the key of an entry into an opaque cursor for the client."""
+    if key is None:
+        return None
+    data = json.dumps([sort, *key]).encode("utf-8")
+    return base64.urlsafe_b64encode(data).decode("ascii")
+
+
+def decode_cursor(sort, cursor):
+    """Converts a cursor into the key of an entry.
+
+    Raises:
+        ValueError: if the cursor is invalid or belongs to another sort order.
+    """
+    if not cursor:
+        return None
+
+    try:
+        data = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+    except (binascii.Error, UnicodeError, json.JSONDecodeError):
+        raise ValueError("Invalid cursor: %r" % cursor)
+
+    if not isinstance(data, list) or not data or data[0] != sort:
+        raise ValueError("Invalid cursor for sort %r: %r" % (sort, cursor))
+
+    key = tuple(data[1:])
+    length = 1 if sort == "name" else 2
+    if len(key) != length or not isinstance(key[-1], str):
+        raise ValueError("Invalid cursor: %r" % cursor)
+    if length == 2 and (isinstance(key[0], bool) or not isinstance(key[0], (int, float))):
+        raise ValueError("Invalid cursor: %r" % cursor)
+    return key
+
+
+def _or(value, default):
+    return default if value is None else value
+
+
+class ListingCache:
+    """Least recently used cache of the listings of `cfg.LISTING_CACHE_SIZE` folders."""
+
+    def __init__(self, maxsize=None):
+        self.maxsize = maxsize
+        self._lock = threading.Lock()
+        self._listings = OrderedDict()
+
+    def get(self, relpath):
+        """Returns the listing of a folder, reading it again if it changed.
+
+        Raises:
+            FileNotFoundError: if the folder doesn't exist.
+            NotADirectoryError: if the path is not a folder.
+        """
+        path = cfg.CLOUD_PATH / relpath
+        mtime_ns = os.stat(path).st_mtime_ns
+        key = split_path(relpath)
+
+        with self._lock:
+            listing = self._listings.get(key)
+            if listing is not None and listing.mtime_ns == mtime_ns:
+                self._listings.move_to_end(key)
+                return listing
+
+        listing = Listing(path, mtime_ns)
+        with self._lock:
+            self._listings[key] = listing
+            self._listings.move_to_end(key)
+            maxsize = self.maxsize or cfg.LISTING_CACHE_SIZE
+            while len(self._listings) > maxsize:
+                self._listings.popitem(last=False)
+        return listing
+
+    def invalidate(self, relpath):
+        with self._lock:
+            self._listings.pop(split_path(relpath), None)
+
+    def clear(self):
+        with self._lock:
+            self._listings.clear()
+
+    def handle_event(self, event):
+        if event.kind == events.RESCAN:
+            self.clear()
+            return
+
+        for path in (event.path, event.dest):
+            parts = split_path(path) if path is not None else None
+            if not parts:
+                continue
+            with self._lock:
+                self._listings.pop(parts[:-1], None)
+                if event.is_dir:
+                    for key in [x for x in self._listings if x[: len(parts)] == parts]:
+                        del self._listings[key]
+
+
+listing_cache = ListingCache()
+events.subscribe(listing_cache.handle_event)
@@ -0,0 +1,336 @@
+from pathlib import Path
+
+from flask import request
+from flask.json import jsonify
+
+from app.config import cfg
+from app.utils import folder_tree, get_ignore_matcher, get_path_filter, get_user, log
+from app.utils.checksum_index import checksum_index
+from app.utils.compression import compress_response
+from app.utils.exceptions import JobError
+from app.utils.folder_tree import split_path
+from app.utils.jobs import Job
+from app.utils.search_index import SEARCH_FIELDS, search_index
+from app.utils.usage import usage_index
+
+from . import api_bp
+from .batch import Batch, parse_operations
+from .listing import SORT_KEYS, decode_cursor, encode_cursor, listing_cache
+
+
+@api_bp.after_request
+def compress(response):
+    return compress_response(response)
+
+
+@api_bp.route("/list/", defaults={"folder": "."}, methods=["GET"])
+@api_bp.route("/list/<path:folder>", methods=["GET"])
+def list_folder(folder):
+    """Lists a page of the entries of a folder.
+
+    Query args: `sort` ("name", "size" or "mtime"), `order` ("asc" or "desc"),
+    `limit`, `cursor` (the `next_cursor` of the previous page), `q` (text
+    contained in the names) and `type` ("file" or "dir").
+    """
+    path_filter = get_path_filter()
+    parts = split_path(folder)
+    if parts is None or not path_filter(folder, is_dir=True):
+        return jsonify(error="Folder %r not found" % folder), 404
+
+    sort = request.args.get("sort", "name")
+    order = request.args.get("order", "asc")
+    kind = request.args.get("type")
+    if sort not in SORT_KEYS:
+        return jsonify(error="Invalid sort key: %r" % sort), 400
+    if order not in ("asc", "desc"):
+        return jsonify(error="Invalid order: %r" % order), 400
+    if kind not in (None, "file", "dir"):
+        return jsonify(error="Invalid type: %r" % kind), 400
+
+    try:
+        limit = int(request.args.get("limit", cfg.LISTING_PAGE_SIZE))
+        cursor = decode_cursor(sort, request.args.get("cursor"))
+    except ValueError as exc:
+        return jsonify(error=str(exc)), 400
+    limit = min(max(limit, 1), cfg.LISTING_MAX_PAGE_SIZE)
+
+    try:
+        listing = listing_cache.get(folder)
+    except (FileNotFoundError, NotADirectoryError):
+        return jsonify(error="Folder %r not found" % folder), 404
+    except PermissionError as exc:
+        return jsonify(error="Permission Error: %s" % exc), 403
+
+    accept = _get_filter(path_filter, parts, request.args.get("q", "").lower(), kind)
+    entries, next_cursor = listing.page(sort, order == "desc", cursor, limit, accept)
+
+    log("User %r listed folder %r", get_user(), folder)
+    return jsonify(
+        folder=Path(*parts).as_posix(),
+        entries=[_entry_json(x) for x in entries],
+        next_cursor=encode_cursor(sort, next_cursor),
+    )
+
+
+def _get_filter(path_filter, parts, query, kind):
+    """Returns the filter of the entries that the user can see and asked for."""
+
+    def accept(entry):
+        if not path_filter(Path(*parts, entry.name), entry.is_dir):
+            return False
+        if kind is not None and entry.is_dir != (kind == "dir"):
+            return False
+        return query in entry.name.lower()
+
+    return accept
+
+
+def _entry_json(entry):
+    return {
+        "name": entry.name,
+        "type": "dir" if entry.is_dir else "file",
+        "size": entry.size,
+        "mtime": entry.mtime,
+    }
+
+
+@api_bp.route("/folders/", defaults={"folder": "."}, methods=["GET"])
+@api_bp.route("/folders/<path:folder>", methods=["GET"])
+def list_subfolders(folder):
+    """Lists a page of the subfolders of a folder, for the folder picker of the index.
+
+    The subfolders come from the folder tree, so only the children of the
+    folder are sorted. Query args: `prefix` (start of the names, ignoring
+    case), `limit` and `cursor` (the `next_cursor` of the previous page).
+    """
+    path_filter = get_path_filter()
+    parts = split_path(folder)
+    if parts is None or not path_filter(folder, is_dir=True):
+        return jsonify(error="Folder %r not found" % folder), 404
+
+    try:
+        limit = int(request.args.get("limit", cfg.LISTING_PAGE_SIZE))
+    except ValueError as exc:
+        return jsonify(error=str(exc)), 400
+    limit = min(max(limit, 1), cfg.LISTING_MAX_PAGE_SIZE)
+
+    page = folder_tree.get_subfolders(
+        cfg.CLOUD_PATH,
+        folder,
+        get_ignore_matcher(),
+        prefix=request.args.get("prefix", ""),
+        cursor=request.args.get("cursor") or None,
+        limit=limit,
+        accept=lambda name: path_filter(Path(*parts, name), is_dir=True),
+    )
+    if page is None:
+        return jsonify(error="Folder %r not found" % folder), 404
+
+    subfolders, next_cursor = page
+    relpath = Path(*parts)
+    log("User %r listed subfolders of %r", get_user(), relpath.as_posix())
+    return jsonify(
+        folder=relpath.as_posix(),
+        id=folder_tree.get_id(relpath),
+        folders=[
+            {
+                "name": x.name,
+                "path": (relpath / x.name).as_posix(),
+                "id": x.id,
+                "has_children": x.has_children,
+            }
+            for x in subfolders
+        ],
+        next_cursor=next_cursor,
+    )
+
+
+@api_bp.route("/checksum/<path:filepath>", methods=["GET"])
+def get_checksum(filepath):
+    """Checks a file against the checksum index.
+
+    With the `verify` query arg, the file is read and hashed again, so
+    corrupted files (same size and mtime, different contents) are detected.
+    """
+    if not get_path_filter()(filepath):
+        return jsonify(error="File %r not found" % filepath), 404
+
+    if "verify" in request.args:
+        status, checksum = checksum_index.verify(filepath)
+        log("User %r verified file %r: %s", get_user(), filepath, status)
+    else:
+        status, checksum = checksum_index.status(filepath)
+
+    if status == "missing":
+        return jsonify(error="File %r not found" % filepath), 404
+
+    return jsonify(
+        path=Path(*split_path(filepath)).as_posix(),
+        status=status,
+        size=checksum and checksum.size,
+        hash=checksum and checksum.hash,
+    )
+
+
+@api_bp.route("/batch", methods=["POST"])
+def run_batch():
+    """Runs a batch of file operations, sent as json.
+
+    The body has the list of `operations`, each one with its `op` ("mkdir",
+    "delete" or "move"), its `path` and, for moves, its `dest`, and `atomic`
+    to undo every operation if any of them fails. No operation is run if any
+    of them is invalid.
+    """
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify(error="Expected a json object"), 400
+
+    try:
+        operations = parse_operations(data.get("operations"), get_path_filter())
+    except ValueError as exc:
+        return jsonify(error=str(exc)), 400
+
+    user = get_user()
+    results = Batch(user, atomic=bool(data.get("atomic"))).run(operations)
+
+    log(
+        "User %r ran a batch of operations: %s",
+        user,
+        ["%s %r: %s" % (x["op"], x["path"], x["status"]) for x in results],
+    )
+    ok = all(x["status"] in ("done", "started") for x in results)
+    return jsonify(ok=ok, results=results)
+
+
+@api_bp.route("/usage/", defaults={"folder": "."}, methods=["GET"])
+@api_bp.route("/usage/<path:folder>", methods=["GET"])
+def get_usage(folder):
+    """Shows the bytes and files of a folder, including its subfolders, and of the user.
+
+    The totals come from the usage index, and the quotas are null if unlimited.
+    """
+    parts = split_path(folder)
+    if (
+        not cfg.USAGE_INDEX
+        or parts is None
+        or not (cfg.CLOUD_PATH / folder).is_dir()
+        or not get_path_filter()(folder, is_dir=True)
+    ):
+        return jsonify(error="Folder %r not found" % folder), 404
+
+    relpath = Path(*parts).as_posix()
+    user = get_user()
+    with usage_index.connect() as conn:
+        folder_usage = usage_index.folder_usage(relpath, conn)
+        user_usage = user and usage_index.user_usage(user, conn)
+
+    return jsonify(
+        path=relpath,
+        bytes=folder_usage.bytes,
+        files=folder_usage.files,
+        quota=cfg.FOLDER_QUOTAS.get(relpath),
+        user=user
+        and {
+            "name": user,
+            "bytes": user_usage.bytes,
+            "files": user_usage.files,
+            "quota": cfg.USER_QUOTAS.get(user, cfg.DEFAULT_USER_QUOTA),
+        },
+    )
+
+
+@api_bp.route("/jobs/<job_id>", methods=["GET"])
+def get_job(job_id):
+    """Shows the status of a background job, like the removal of a deleted folder."""
+    try:
+        job = Job.load(job_id)
+    except JobError as exc:
+        return jsonify(error=str(exc)), 404
+    return jsonify(job.to_dict())
+
+
+@api_bp.route("/duplicates", methods=["GET"])
+def get_duplicates():
+    """Lists the groups of files with the same contents, from the checksum index."""
+    try:
+        min_size = int(request.args.get("min_size", 1))
+        limit = min(max(int(request.args.get("limit", 100)), 1), cfg.LISTING_MAX_PAGE_SIZE)
+    except ValueError as exc:
+        return jsonify(error=str(exc)), 400
+
+    path_filter = get_path_filter()
+    duplicates = []
+    for duplicate in checksum_index.duplicates(min_size, limit):
+        paths = [x for x in duplicate.paths if path_filter(x)]
+        if len(paths) > 1:
+            duplicates.append(
+                {
+                    "hash": duplicate.hash,
+                    "size": duplicate.size,
+                    "paths": paths,
+                    "reclaimable": duplicate.reclaimable,
+                }
+            )
+
+    log("User %r listed duplicates", get_user())
+    return jsonify(duplicates=duplicates)
+
+
+@api_bp.route("/search", methods=["GET"])
+def search():
+    """Searches the files and folders of the cloud in the search index.
+
+    Query args: `q` (text to look for), `in` ("name", "path" or "content"),
+    `mode` ("substring" or "prefix"), `limit` and `cursor` (the `next_cursor`
+    of the previous page).
+    """
+    query = request.args.get("q", "").strip()
+    field = request.args.get("in", "name")
+    mode = request.args.get("mode", "substring")
+    if not query:
+        return jsonify(error="Empty query"), 400
+    if field not in SEARCH_FIELDS:
+        return jsonify(error="Invalid field: %r" % field), 400
+    if field == "content" and not cfg.SEARCH_CONTENT:
+        return jsonify(error="Content search is disabled"), 400
+    if mode not in ("substring", "prefix"):
+        return jsonify(error="Invalid mode: %r" % mode), 400
+
+    try:
+        limit = int(request.args.get("limit", cfg.LISTING_PAGE_SIZE))
+        cursor = int(request.args.get("cursor", 0))
+    except ValueError as exc:
+        return jsonify(error=str(exc)), 400
+    limit = min(max(limit, 1), cfg.LISTING_MAX_PAGE_SIZE)
+
+    # The index has every entry, the ones the user can't see are skipped here.
+    # One more result is read to know if there is a next page.
+    path_filter = get_path_filter()
+    results = []
+    more = False
+    while not more:
+        batch = search_index.search(query, field, mode == "prefix", cursor, limit + 1)
+        for result in batch:
+            if path_filter(result.path, bool(result.is_dir)):
+                if len(results) == limit:
+                    more = True
+                    break
+                results.append(result)
+            cursor = result.id
+        if len(batch) <= limit:
+            break
+
+    log("User %r searched %r", get_user(), query)
+    return jsonify(
+        results=[_result_json(x) for x in results],
+        next_cursor=cursor if more else None,
+    )
+
+
+def _result_json(result):
+    return {
+        "path": result.path,
+        "type": "dir" if result.is_dir else "file",
+        "size": None if result.is_dir else result.size,
+        "mtime": result.mtime_ns / 1e9,
+    }
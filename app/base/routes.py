@@ -1,8 +1,13 @@
+import os
 from collections import namedtuple
 
 from flask.templating import render_template
 
-from app.utils import get_folders, get_user, log
+from app.config import cfg
+from app.utils import get_user, log
+from app.utils.folder_tree import get_folder_id
+from app.utils.page_cache import page_cache
+from app.utils.usage import usage_index
 
 from . import base_bp
 
@@ -11,8 +16,25 @@ Folder = namedtuple("Folder", ["id", "name"])
 
 @base_bp.route("/", methods=["GET"])
 def index():
-    folders = get_folders()
-    folder_choices = [Folder(i, x.as_posix()) for i, x in enumerate(folders)]
-
     log("User %r opened index", get_user())
-    return render_template("index.html", folders=folder_choices)
+    upload_url = "/upload-stream" if cfg.STREAMING_UPLOADS else "/upload"
+
+    # The totals are kept by the usage index, so this is a single lookup
+    usage = usage_index.folder_usage(".") if cfg.USAGE_INDEX else None
+    quota = cfg.FOLDER_QUOTAS.get(".")
+
+    # The folder picker loads the subfolders from /api/folders, so the page
+    # only needs the root, and it is the same for every user
+    root = Folder(get_folder_id(os.stat(cfg.CLOUD_PATH)), ".")
+    key = (root, upload_url, usage, quota)
+
+    def render():
+        return render_template(
+            "index.html",
+            root=root,
+            upload_url=upload_url,
+            usage=usage,
+            quota=quota,
+        )
+
+    return page_cache.respond(key, render)
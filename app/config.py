@@ -8,8 +8,152 @@ class _Config:
     CLOUD_PATH = Path(__file__).parent.with_name("cloud")
     SUDOERS_PATH = Path(__file__).parent.with_name("sudoers.json")
     IGNORED_PATH = Path(__file__).parent.with_name("ignored.json")
+    UPLOAD_SESSIONS_PATH = Path(__file__).parent.with_name("upload-sessions")
+    CHECKSUM_DB_PATH = Path(__file__).parent.with_name("checksums.db")
+    SEARCH_DB_PATH = Path(__file__).parent.with_name("search.db")
+    USAGE_DB_PATH = Path(__file__).parent.with_name("usage.db")
+    JOBS_PATH = Path(__file__).parent.with_name("jobs")
+    PREVIEW_CACHE_PATH = Path(__file__).parent.with_name("previews")
+    COMPRESSED_CACHE_PATH = Path(__file__).parent.with_name("compressed")
     PLATFORM = ""
 
+    # Seconds before the cached folder tree is rebuilt from disk (None: never)
+    FOLDER_TREE_MAX_AGE = 300
+
+    # Watcher of external changes: "auto", "inotify", "polling" or None
+    WATCHER = "auto"
+    WATCHER_POLL_INTERVAL = 5
+
+    # Log lines are written in batches of LOG_BUFFER_SIZE bytes or every
+    # LOG_FLUSH_INTERVAL seconds, and the log is rotated at LOG_MAX_BYTES
+    LOG_BUFFER_SIZE = 64 * 1024
+    LOG_FLUSH_INTERVAL = 1.0
+    LOG_MAX_BYTES = 10 * 1024 * 1024
+    LOG_BACKUP_COUNT = 5
+
+    # Uploads: the form posts to /upload-stream if STREAMING_UPLOADS is set.
+    # MAX_UPLOAD_SIZE limits the size of any request (None: unlimited)
+    STREAMING_UPLOADS = False
+    UPLOAD_CHUNK_SIZE = 1024 * 1024
+    MAX_UPLOAD_SIZE = None
+    UPLOAD_WORKERS = 4
+
+    # Resumable uploads: chunks are kept in the STAGING_DIRNAME folder of the
+    # destination, and sessions without activity for UPLOAD_SESSION_TTL
+    # seconds are removed
+    CHUNKED_UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024
+    UPLOAD_SESSION_TTL = 24 * 60 * 60
+    STAGING_DIRNAME = ".staging"
+
+    # Deduplicated uploads: one copy of each content is kept in the
+    # STORE_DIRNAME folder of the cloud and hardlinked where it was uploaded.
+    # The copies are read-only, so a file can't be changed in place
+    DEDUP_UPLOADS = False
+    STORE_DIRNAME = ".store"
+
+    # Downloads from /cloud are sent by Python unless DOWNLOAD_OFFLOAD is
+    # "x-sendfile" or "x-accel-redirect", which leave it to the proxy. nginx
+    # must serve DOWNLOAD_ACCEL_PREFIX as an internal alias of the cloud
+    DOWNLOAD_OFFLOAD = None
+    DOWNLOAD_ACCEL_PREFIX = "/protected-cloud/"
+
+    # Compression of the json of /api and of the downloads of /cloud: the
+    # encodings offered, in order of preference ("br" needs brotli and "zstd"
+    # needs zstandard, the ones not installed are skipped; empty: disabled).
+    # Bodies and files of less than COMPRESS_MIN_SIZE bytes are sent as they
+    # are, and COMPRESSED_CACHE_SIZE bytes of compressed copies of the
+    # downloaded files are kept on disk. The copies are written by
+    # COMPRESS_WORKERS threads (0: in the request) and files are sent as they
+    # are until theirs is ready, or always if they are over COMPRESS_MAX_SIZE
+    COMPRESSION = ("br", "zstd", "gzip")
+    COMPRESS_MIN_SIZE = 1024
+    COMPRESS_MAX_SIZE = 256 * 1024 * 1024
+    COMPRESS_WORKERS = 2
+    COMPRESS_CHUNK_SIZE = 1024 * 1024
+    COMPRESSED_CACHE_SIZE = 1024 * 1024 * 1024
+
+    # Archives of folders from /archive: zip compression ("stored" or
+    # "deflate") when the request doesn't choose one, and bytes read at once
+    ARCHIVE_COMPRESSION = "stored"
+    ARCHIVE_CHUNK_SIZE = 1024 * 1024
+
+    # Folder listings of /api/list: pages of LISTING_PAGE_SIZE entries by
+    # default, and the listings of LISTING_CACHE_SIZE folders kept in memory
+    LISTING_PAGE_SIZE = 200
+    LISTING_MAX_PAGE_SIZE = 1000
+    LISTING_CACHE_SIZE = 64
+
+    # Previews of /preview: thumbnails of images (with Pillow) and of the
+    # first page of PDFs (with pypdf too), rendered by PREVIEW_WORKERS
+    # processes (0: in the request) when they are uploaded or first
+    # requested. PREVIEW_SIZES are the sizes that can be requested, in
+    # pixels, and PREVIEW_CACHE_SIZE bytes of previews are kept on disk.
+    # Browsers cache them for PREVIEW_MAX_AGE seconds
+    PREVIEWS = True
+    PREVIEW_WORKERS = 2
+    PREVIEW_SIZES = (128, 256, 512)
+    PREVIEW_DEFAULT_SIZE = 256
+    PREVIEW_CACHE_SIZE = 256 * 1024 * 1024
+    PREVIEW_MAX_AGE = 7 * 24 * 60 * 60
+
+    # Rendered pages kept in memory, like the index (0: render them every time)
+    PAGE_CACHE_SIZE = 32
+
+    # Most operations accepted by /api/batch in a request
+    BATCH_MAX_OPERATIONS = 1000
+
+    # Checksum index: a background worker hashes the files that changed
+    # every CHECKSUM_SCAN_INTERVAL seconds (None: only when the app starts)
+    CHECKSUM_INDEX = False
+    CHECKSUM_SCAN_INTERVAL = 60 * 60
+    CHECKSUM_CHUNK_SIZE = 1024 * 1024
+
+    # Search index of /api/search: a background worker indexes the names
+    # that changed every SEARCH_SCAN_INTERVAL seconds (None: only when the
+    # app starts), and the first SEARCH_CONTENT_MAX_SIZE bytes of the text
+    # files and PDFs if SEARCH_CONTENT is set
+    SEARCH_INDEX = False
+    SEARCH_SCAN_INTERVAL = 60 * 60
+    SEARCH_CONTENT = False
+    SEARCH_CONTENT_MAX_SIZE = 1024 * 1024
+
+    # Usage index: the bytes and files of every folder and user, updated on
+    # each change and reconciled with the disk every USAGE_SCAN_INTERVAL
+    # seconds (None: only when the app starts). The quotas are in bytes:
+    # FOLDER_QUOTAS maps folders to their quota, USER_QUOTAS maps users to
+    # theirs and DEFAULT_USER_QUOTA applies to the rest (None: unlimited).
+    # Quotas are only enforced if USAGE_INDEX is set
+    USAGE_INDEX = False
+    USAGE_SCAN_INTERVAL = 60 * 60
+    FOLDER_QUOTAS = {}
+    USER_QUOTAS = {}
+    DEFAULT_USER_QUOTA = None
+
+    # Background jobs: the pending jobs are looked for every
+    # JOBS_SWEEP_INTERVAL seconds, and the status of the finished ones is
+    # kept for JOB_TTL seconds
+    JOBS_SWEEP_INTERVAL = 60
+    JOB_TTL = 24 * 60 * 60
+
+    # Deletes: files and folders are moved to the TRASH_DIRNAME folder of the
+    # cloud (or of the filesystem mounted in the cloud that they are in) and
+    # removed by a job after TRASH_RETENTION seconds (0: right away). Until
+    # then they can be restored
+    TRASH_DIRNAME = ".trash"
+    TRASH_RETENTION = 0
+
+    # Moves between filesystems, done by a job: bytes copied at once, and if
+    # MOVE_VERIFY is set the copies are hashed and compared with the originals
+    MOVE_CHUNK_SIZE = 16 * 1024 * 1024
+    MOVE_VERIFY = False
+
+    # Prometheus metrics of the requests, uploads, downloads, folder walks and
+    # log writer, served by /metrics if METRICS is set
+    METRICS = True
+
+    # Folders used internally by the app, never listed
+    RESERVED_DIRNAMES = frozenset([STAGING_DIRNAME, STORE_DIRNAME, TRASH_DIRNAME])
+
     @staticmethod
     def setup_config():
         cfg.LOG_PATH.touch()
@@ -0,0 +1,5 @@
+from flask import Blueprint
+
+downloads_bp = Blueprint("downloads", __name__)
+
+from . import routes
@@ -0,0 +1,165 @@
+"""Zip and tar archives of folders, generated while they are sent.
+
+The archives are written into a small buffer that is emptied after every
+chunk of data, so the memory used doesn't depend on the size of the folder
+and nothing is written to disk. Zip files are written with data descriptors,
+which don't need to seek back to fill in the sizes, and tar files are built
+block by block, with the headers of `tarfile`.
+"""
+import os
+import stat
+import tarfile
+import zipfile
+import zlib
+from collections import namedtuple
+from pathlib import Path
+
+from app.config import cfg
+
+ARCHIVE_FORMATS = {
+    "zip": ("application/zip", ".zip"),
+    "tar": ("application/x-tar", ".tar"),
+    "tar.gz": ("application/gzip", ".tar.gz"),
+}
+ZIP_COMPRESSIONS = {"stored": zipfile.ZIP_STORED, "deflate": zipfile.ZIP_DEFLATED}
+
+ArchiveEntry = namedtuple("ArchiveEntry", ["path", "arcname", "is_dir"])
+
+
+def walk_folder(folder, name, path_filter):
+    """Yields the entries of a folder that the user can see, sorted.
+
+    Args:
+        folder (str | Path): folder relative to the cloud.
+        name (str): name of the root folder inside the archive.
+        path_filter (callable): function returned by `get_path_filter`.
+    """
+    top = cfg.CLOUD_PATH / folder
+    yield ArchiveEntry(str(top), name, True)
+
+    for dirpath, dirnames, filenames in os.walk(top, followlinks=True):
+        relpath = Path(dirpath).relative_to(cfg.CLOUD_PATH)
+        arcdir = Path(name, Path(dirpath).relative_to(top)).as_posix()
+
+        dirnames[:] = sorted(x for x in dirnames if path_filter(relpath / x, is_dir=True))
+        for dirname in dirnames:
+            yield ArchiveEntry(os.path.join(dirpath, dirname), arcdir + "/" + dirname, True)
+        for filename in sorted(filenames):
+            if path_filter(relpath / filename):
+                yield ArchiveEntry(
+                    os.path.join(dirpath, filename), arcdir + "/" + filename, False
+                )
+
+
+class _Buffer:
+    """Write-only file that keeps the data until it is taken."""
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def take(self):
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def iter_zip(entries, compression="stored", chunk_size=None):
+    """Generates a zip archive of `entries`.
+
+    Files that can't be read when their turn comes are left out.
+    """
+    chunk_size = chunk_size or cfg.ARCHIVE_CHUNK_SIZE
+    buffer = _Buffer()
+
+    with zipfile.ZipFile(buffer, "w", ZIP_COMPRESSIONS[compression]) as archive:
+        for entry in entries:
+            try:
+                zinfo = zipfile.ZipInfo.from_file(
+                    entry.path, entry.arcname, strict_timestamps=False
+                )
+                if entry.is_dir:
+                    archive.writestr(zinfo, b"")
+                    continue
+                src = open(entry.path, "rb")
+            except OSError:
+                continue
+
+            zinfo.compress_type = ZIP_COMPRESSIONS[compression]
+            with src, archive.open(zinfo, "w") as dst:
+                while True:
+                    data = src.read(chunk_size)
+                    if not data:
+                        break
+                    dst.write(data)
+                    yield buffer.take()
+            yield buffer.take()
+
+    yield buffer.take()
+
+
+def iter_tar(entries, gzip=False, chunk_size=None):
+    """Generates a tar archive of `entries`, compressed with gzip if `gzip` is set.
+
+    Files that can't be read when their turn comes are left out.
+    """
+    chunk_size = chunk_size or cfg.ARCHIVE_CHUNK_SIZE
+    if not gzip:
+        yield from _iter_tar_blocks(entries, chunk_size)
+        return
+
+    compressor = zlib.compressobj(wbits=zlib.MAX_WBITS | 16)
+    for data in _iter_tar_blocks(entries, chunk_size):
+        data = compressor.compress(data)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def _iter_tar_blocks(entries, chunk_size):
+    written = 0
+
+    for entry in entries:
+        try:
+            st = os.stat(entry.path)
+            src = None if entry.is_dir else open(entry.path, "rb")
+        except OSError:
+            continue
+
+        info = tarfile.TarInfo(entry.arcname)
+        info.mtime = int(st.st_mtime)
+        info.mode = stat.S_IMODE(st.st_mode)
+        if entry.is_dir:
+            info.type = tarfile.DIRTYPE
+        else:
+            info.size = st.st_size
+
+        header = info.tobuf(tarfile.PAX_FORMAT)
+        written += len(header)
+        yield header
+        if src is None:
+            continue
+
+        with src:
+            remaining = info.size
+            while remaining:
+                data = src.read(min(chunk_size, remaining))
+                if not data:
+                    # The file shrank since the header was written
+                    data = bytes(min(chunk_size, remaining))
+                remaining -= len(data)
+                yield data
+
+        padding = bytes(-info.size % tarfile.BLOCKSIZE)
+        written += info.size + len(padding)
+        yield padding
+
+    end = bytes(2 * tarfile.BLOCKSIZE)
+    written += len(end)
+    yield end + bytes(-written % tarfile.RECORDSIZE)
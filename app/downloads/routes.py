@@ -0,0 +1,171 @@
+import mimetypes
+import os
+import stat
+from urllib.parse import quote
+
+from flask import Response, abort, current_app, request
+from werkzeug.utils import send_file
+
+from app.config import cfg
+from app.utils import get_path_filter, get_user, is_visible, log
+from app.utils.compression import choose_encoding, is_compressible, sidecar_cache
+from app.utils.exceptions import PreviewError
+from app.utils.folder_tree import split_path
+from app.utils.previews import can_preview, preview_cache
+
+from . import downloads_bp
+from .archive import ARCHIVE_FORMATS, ZIP_COMPRESSIONS, iter_tar, iter_zip, walk_folder
+
+
+def get_etag(st):
+    """Strong validator of a file, which changes whenever its contents may change.
+
+    Includes the mtime in nanoseconds, so a file rewritten twice in the same
+    second with the same size doesn't keep the ETag of a resumed download.
+    """
+    return "%x-%x-%x" % (st.st_ino, st.st_mtime_ns, st.st_size)
+
+
+@downloads_bp.route("/cloud/<path:filepath>", methods=["GET"])
+def download(filepath):
+    if not is_visible(filepath):
+        abort(404)
+
+    path = cfg.CLOUD_PATH / filepath
+    try:
+        st = path.stat()
+    except (FileNotFoundError, NotADirectoryError):
+        abort(404)
+    if not stat.S_ISREG(st.st_mode):
+        abort(404)
+
+    offload = cfg.DOWNLOAD_OFFLOAD
+    mimetype = mimetypes.guess_type(path.name)[0]
+    compressible = (
+        not offload
+        and is_compressible(mimetype)
+        and cfg.COMPRESS_MIN_SIZE <= st.st_size <= cfg.COMPRESS_MAX_SIZE
+    )
+    source, etag, encoding = path, get_etag(st), compressible and choose_encoding()
+    if encoding:
+        try:
+            sidecar = sidecar_cache.get(path, st, encoding, wait=False)
+        except OSError as exc:
+            log("Could not compress %r: %r", filepath, exc)
+            sidecar = None
+        # The file is sent as it is while its compressed copy is written
+        if sidecar is None:
+            encoding = None
+        else:
+            source, etag = sidecar, etag + "-" + encoding
+
+    response = send_file(
+        os.fspath(source),
+        request.environ,
+        # The compressed copies are sent with the type and name of the file
+        mimetype=mimetype if encoding else None,
+        as_attachment="download" in request.args,
+        download_name=path.name if encoding else None,
+        etag=etag,
+        last_modified=st.st_mtime,
+        use_x_sendfile=bool(offload),
+        response_class=current_app.response_class,
+        # The proxy answers the range requests of offloaded downloads
+        conditional=not offload,
+    )
+    if compressible:
+        response.vary.add("Accept-Encoding")
+    if encoding:
+        response.headers["Content-Encoding"] = encoding
+
+    if offload:
+        response = response.make_conditional(request.environ)
+        if response.status_code == 304:
+            response.headers.pop("X-Sendfile", None)
+        elif offload == "x-accel-redirect":
+            del response.headers["X-Sendfile"]
+            relpath = quote(path.relative_to(cfg.CLOUD_PATH).as_posix())
+            response.headers["X-Accel-Redirect"] = cfg.DOWNLOAD_ACCEL_PREFIX + relpath
+
+    if response.status_code == 200:
+        log("User %r downloaded %r", get_user(), filepath)
+    return response
+
+
+@downloads_bp.route("/preview/<path:filepath>", methods=["GET"])
+def preview(filepath):
+    """Sends a JPEG thumbnail of an image or PDF, rendering it if it isn't cached.
+
+    Query args: `size` (one of `cfg.PREVIEW_SIZES`, in pixels).
+    """
+    if not cfg.PREVIEWS or not can_preview(filepath) or not is_visible(filepath):
+        abort(404)
+
+    try:
+        size = int(request.args.get("size", cfg.PREVIEW_DEFAULT_SIZE))
+    except ValueError:
+        abort(400)
+    if size not in cfg.PREVIEW_SIZES:
+        abort(400)
+
+    try:
+        st = (cfg.CLOUD_PATH / filepath).stat()
+    except (FileNotFoundError, NotADirectoryError):
+        abort(404)
+    if not stat.S_ISREG(st.st_mode):
+        abort(404)
+
+    try:
+        preview_path = preview_cache.get(filepath, size)
+    except (FileNotFoundError, NotADirectoryError):
+        abort(404)
+    except PreviewError as exc:
+        log("Could not render the preview of %r: %s", filepath, exc)
+        abort(415)
+
+    response = send_file(
+        os.fspath(preview_path),
+        request.environ,
+        mimetype="image/jpeg",
+        # The name of the preview is the hash of the path, mtime and size of the file
+        etag=preview_path.stem,
+        response_class=current_app.response_class,
+        max_age=cfg.PREVIEW_MAX_AGE,
+    )
+    response.cache_control.private = True
+    response.cache_control.public = False
+    return response
+
+
+@downloads_bp.route("/archive/", defaults={"folder": "."}, methods=["GET"])
+@downloads_bp.route("/archive/<path:folder>", methods=["GET"])
+def download_archive(folder):
+    """Sends a folder as a zip or tar archive, generated on the fly.
+
+    Query args: `format` ("zip", "tar" or "tar.gz") and, for zip archives,
+    `compression` ("stored" or "deflate").
+    """
+    path_filter = get_path_filter()
+    parts = split_path(folder)
+    if parts is None or not path_filter(folder, is_dir=True):
+        abort(404)
+    if not (cfg.CLOUD_PATH / folder).is_dir():
+        abort(404)
+
+    archive_format = request.args.get("format", "zip")
+    compression = request.args.get("compression", cfg.ARCHIVE_COMPRESSION)
+    if archive_format not in ARCHIVE_FORMATS or compression not in ZIP_COMPRESSIONS:
+        abort(400)
+
+    name = parts[-1] if parts else cfg.CLOUD_PATH.name
+    entries = walk_folder(folder, name, path_filter)
+    if archive_format == "zip":
+        data = iter_zip(entries, compression)
+    else:
+        data = iter_tar(entries, gzip=archive_format == "tar.gz")
+
+    mimetype, extension = ARCHIVE_FORMATS[archive_format]
+    log("User %r downloaded folder %r as %s", get_user(), folder, archive_format)
+    response = Response(data, mimetype=mimetype, direct_passthrough=True)
+    response.headers.set("Content-Disposition", "attachment", filename=name + extension)
+    return response
@@ -0,0 +1,252 @@
+"""Resumable uploads, sent in numbered chunks and assembled in the server.
+
+Each upload session is described by a json file in `cfg.UPLOAD_SESSIONS_PATH`,
+shared by every worker process. The chunks are stored in the staging area of
+the destination folder (`<folder>/.staging/<session id>/<index>`), so they are
+in the same filesystem as the final file and can be concatenated with
+`copy_file_range`.
+"""
+import json
+import math
+import os
+import re
+import tempfile
+import uuid
+from pathlib import Path
+from time import time
+
+from werkzeug.utils import secure_filename
+
+from app.config import cfg
+from app.utils.config_store import atomic_write_text
+from app.utils.exceptions import UploadError
+from app.utils.fileops import copy_range, remove_path, set_file_mode
+
+from .store import hash_file, store_file
+
+SESSION_ID_RE = re.compile(r"^[0-9a-f]{32}$")
+
+
+class UploadSession:
+    """Upload sent in chunks of `chunk_size` bytes.
+
+    Args:
+        id (str): identifier of the session.
+        folder (str): destination folder, relative to the cloud.
+        filename (str): name of the final file.
+        size (int, optional): size of the final file, if known in advance.
+        chunk_size (int, optional): size of every chunk but the last one.
+        user (str, optional): user that started the upload.
+        created (float, optional): timestamp of the creation of the session.
+    """
+
+    def __init__(self, id, folder, filename, size=None, chunk_size=None, user=None, created=None):
+        self.id = id
+        self.folder = folder
+        self.filename = filename
+        self.size = size
+        self.chunk_size = chunk_size or cfg.CHUNKED_UPLOAD_CHUNK_SIZE
+        self.user = user
+        self.created = created or time()
+
+    @classmethod
+    def create(cls, folder, filename, size=None, chunk_size=None, user=None):
+        filename = secure_filename(filename or "")
+        if not filename:
+            raise UploadError("Invalid filename")
+        if size is not None and size < 0:
+            raise UploadError("Invalid size: %r" % size)
+        if chunk_size is not None and chunk_size <= 0:
+            raise UploadError("Invalid chunk size: %r" % chunk_size)
+
+        session = cls(uuid.uuid4().hex, Path(folder).as_posix(), filename, size, chunk_size, user)
+        session.staging_dir.mkdir(parents=True, exist_ok=True)
+        session.save()
+        return session
+
+    @classmethod
+    def load(cls, session_id):
+        """Returns the session with the given id.
+
+        Raises:
+            UploadError: if the session doesn't exist.
+        """
+        if not SESSION_ID_RE.match(session_id):
+            raise UploadError("Invalid upload id: %r" % session_id)
+
+        try:
+            data = json.loads(get_session_path(session_id).read_text())
+        except (FileNotFoundError, json.JSONDecodeError):
+            raise UploadError("Upload %r not found" % session_id)
+        return cls(**data)
+
+    @property
+    def staging_dir(self):
+        return cfg.CLOUD_PATH / self.folder / cfg.STAGING_DIRNAME / self.id
+
+    @property
+    def total_chunks(self):
+        if self.size is None:
+            return None
+        return max(math.ceil(self.size / self.chunk_size), 1)
+
+    def save(self):
+        data = {
+            "id": self.id,
+            "folder": self.folder,
+            "filename": self.filename,
+            "size": self.size,
+            "chunk_size": self.chunk_size,
+            "user": self.user,
+            "created": self.created,
+        }
+        path = get_session_path(self.id)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        atomic_write_text(path, json.dumps(data))
+
+    def touch(self):
+        """Marks the session as active, so it doesn't expire."""
+        os.utime(get_session_path(self.id))
+
+    def expected_size(self, index):
+        total = self.total_chunks
+        if total is None:
+            return None
+        if index >= total:
+            raise UploadError("Invalid chunk %d, the upload has %d chunks" % (index, total))
+        if index == total - 1:
+            return self.size - self.chunk_size * (total - 1)
+        return self.chunk_size
+
+    def write_chunk(self, index, stream):
+        """Stores a chunk, replacing it if it was already sent.
+
+        Args:
+            index (int): number of the chunk, starting at 0.
+            stream (file-like): data of the chunk.
+
+        Returns:
+            int: size of the chunk.
+        """
+        expected = self.expected_size(index)
+        fd, temp_path = tempfile.mkstemp(prefix=".chunk-", dir=self.staging_dir)
+        try:
+            with os.fdopen(fd, "wb") as f:
+                while True:
+                    data = stream.read(cfg.UPLOAD_CHUNK_SIZE)
+                    if not data:
+                        break
+                    f.write(data)
+                    if f.tell() > self.chunk_size:
+                        raise UploadError("Chunk %d is bigger than the chunk size" % index)
+                size = f.tell()
+
+            if expected is not None and size != expected:
+                raise UploadError(
+                    "Chunk %d has %d bytes, expected %d" % (index, size, expected)
+                )
+            os.replace(temp_path, self.staging_dir / str(index))
+        except BaseException:
+            remove_path(temp_path)
+            raise
+
+        self.touch()
+        return size
+
+    def received(self):
+        try:
+            names = os.listdir(self.staging_dir)
+        except FileNotFoundError:
+            return []
+        return sorted(int(x) for x in names if x.isdigit())
+
+    def received_size(self):
+        """Returns the bytes of the chunks received."""
+        return sum(os.path.getsize(self.staging_dir / str(x)) for x in self.received())
+
+    def missing(self):
+        received = set(self.received())
+        if self.total_chunks is None:
+            total = max(received) + 1 if received else 0
+        else:
+            total = self.total_chunks
+        return [x for x in range(total) if x not in received]
+
+    def finalize(self):
+        """Concatenates the chunks into the final file and ends the session.
+
+        Returns:
+            Path: path of the file, relative to the cloud.
+        """
+        received = self.received()
+        missing = self.missing()
+        if missing or not received:
+            raise UploadError("Missing chunks: %s" % missing)
+
+        folder = cfg.CLOUD_PATH / self.folder
+        fd, temp_path = tempfile.mkstemp(prefix=".upload-", suffix=".part", dir=folder)
+        try:
+            set_file_mode(fd)
+            with os.fdopen(fd, "wb") as dst:
+                for index in received:
+                    with open(self.staging_dir / str(index), "rb") as src:
+                        copy_range(src, dst)
+                size = dst.tell()
+
+            if self.size is not None and size != self.size:
+                raise UploadError("The file has %d bytes, expected %d" % (size, self.size))
+
+            if cfg.DEDUP_UPLOADS:
+                # The chunks can arrive in any order, so the file is hashed at the end
+                store_file(temp_path, hash_file(temp_path), folder / self.filename)
+            else:
+                os.replace(temp_path, folder / self.filename)
+        except BaseException:
+            remove_path(temp_path)
+            raise
+
+        self.discard()
+        return Path(self.folder) / self.filename
+
+    def discard(self):
+        remove_path(self.staging_dir)
+        remove_path(get_session_path(self.id))
+
+        # Remove the staging area if no other upload is using it
+        try:
+            os.rmdir(self.staging_dir.parent)
+        except OSError:
+            pass
+
+
+def get_session_path(session_id):
+    return cfg.UPLOAD_SESSIONS_PATH / (session_id + ".json")
+
+
+def collect_expired_sessions(ttl=None):
+    """Removes the sessions that haven't received chunks in `ttl` seconds.
+
+    Returns:
+        int: number of sessions removed.
+    """
+    ttl = cfg.UPLOAD_SESSION_TTL if ttl is None else ttl
+    limit = time() - ttl
+    removed = 0
+
+    try:
+        paths = list(cfg.UPLOAD_SESSIONS_PATH.glob("*.json"))
+    except FileNotFoundError:
+        return 0
+
+    for path in paths:
+        try:
+            if path.stat().st_mtime >= limit:
+                continue
+            UploadSession.load(path.stem).discard()
+        except FileNotFoundError:
+            continue
+        except UploadError:
+            remove_path(path)
+        removed += 1
+
+    return removed
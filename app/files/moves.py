@@ -0,0 +1,182 @@
+"""Moves between filesystems, done by a background job.
+
+Inside a filesystem a move is a rename, which is atomic and takes the same
+time for any size. Between filesystems (like disks mounted inside the cloud)
+the data has to be copied, so a "move" job copies it with `copy_range` into
+the staging area of the destination folder, checks the copy, renames it to
+its final path and only then removes the source. If anything fails, the
+partial copy is removed and the source is left untouched.
+"""
+import os
+import shutil
+import stat
+from pathlib import Path
+from time import monotonic
+
+from app.config import cfg
+from app.utils import events
+from app.utils.checksum_index import hash_file
+from app.utils.exceptions import JobError
+from app.utils.fileops import copy_range, remove_path
+from app.utils.folder_tree import split_path
+from app.utils.jobs import Job, job_runner
+
+from .store import releasing
+
+# Seconds between the saves of the progress of a job
+PROGRESS_INTERVAL = 1
+
+
+def is_cross_device(src, dst):
+    """Checks if `src` and `dst` are in different filesystems, so it can't be renamed.
+
+    Args:
+        src (Path): file or folder to move.
+        dst (Path): destination, or existing folder where `src` is moved into.
+
+    Returns:
+        bool: False if they are in the same filesystem or either doesn't exist.
+    """
+    folder = dst if os.path.isdir(dst) else os.path.dirname(dst)
+    try:
+        return os.lstat(src).st_dev != os.stat(folder).st_dev
+    except OSError:
+        return False
+
+
+def start_move(src, dst, user=None):
+    """Submits a job that moves `src` to the path `dst` of another filesystem.
+
+    Returns:
+        Job: the "move" job.
+
+    Raises:
+        FileExistsError: if `dst` already exists.
+    """
+    src_parts = split_path(src)
+    dst_parts = split_path(dst)
+    if not src_parts or not dst_parts:
+        raise FileNotFoundError(src if not src_parts else dst)
+    if os.path.lexists(cfg.CLOUD_PATH / dst):
+        raise FileExistsError(dst)
+
+    data = {
+        "src": Path(*src_parts).as_posix(),
+        "dst": Path(*dst_parts).as_posix(),
+        "is_dir": os.path.isdir(cfg.CLOUD_PATH / src),
+    }
+    return job_runner.submit(Job.new("move", data, user=user))
+
+
+class TreeCopy:
+    """Copy of a file or a folder tree that reports its progress in a job."""
+
+    def __init__(self, job):
+        self.job = job
+        self.total_files = 0
+        self.total_bytes = 0
+        self.files = 0
+        self.bytes = 0
+        self._saved = monotonic()
+
+    def measure(self, src):
+        for path, st in _walk(src):
+            if stat.S_ISREG(st.st_mode):
+                self.total_files += 1
+                self.total_bytes += st.st_size
+        self.report(force=True)
+
+    def report(self, force=False):
+        if not force and monotonic() - self._saved < PROGRESS_INTERVAL:
+            return
+        self.job.progress = {
+            "files": self.files,
+            "total_files": self.total_files,
+            "bytes": self.bytes,
+            "total_bytes": self.total_bytes,
+        }
+        self.job.save()
+        self._saved = monotonic()
+
+    def copy(self, src, dst):
+        """Copies `src` to `dst`, which must not exist."""
+        src = os.fspath(src)
+        folders = []
+        for path, st in _walk(src):
+            target = os.path.join(dst, os.path.relpath(path, src)) if path != src else dst
+            if stat.S_ISLNK(st.st_mode):
+                os.symlink(os.readlink(path), target)
+            elif stat.S_ISDIR(st.st_mode):
+                os.mkdir(target)
+                folders.append((path, target))
+            elif stat.S_ISREG(st.st_mode):
+                self.copy_file(path, target, st)
+            # Sockets, fifos and devices are not copied
+
+        # Copying the files changes the mtime of the folders
+        for path, target in reversed(folders):
+            shutil.copystat(path, target)
+        self.report(force=True)
+
+    def copy_file(self, src, dst, st):
+        with open(src, "rb") as src_file, open(dst, "wb") as dst_file:
+            while True:
+                copied = copy_range(src_file, dst_file, cfg.MOVE_CHUNK_SIZE)
+                if not copied:
+                    break
+                self.bytes += copied
+                self.report()
+            # The source is removed after the move, the copy must be on disk
+            os.fsync(dst_file.fileno())
+
+        current = os.stat(src)
+        if (current.st_size, current.st_mtime_ns) != (st.st_size, st.st_mtime_ns):
+            raise JobError("%r changed while it was copied" % src)
+        if os.path.getsize(dst) != st.st_size:
+            raise JobError("The copy of %r is incomplete" % src)
+        if cfg.MOVE_VERIFY and hash_file(src) != hash_file(dst):
+            raise JobError("The copy of %r is corrupted" % src)
+
+        shutil.copystat(src, dst)
+        self.files += 1
+
+
+def _walk(top):
+    """Yields the paths and lstats of a tree, parents before their children."""
+    pending = [os.fspath(top)]
+    while pending:
+        path = pending.pop()
+        st = os.lstat(path)
+        yield path, st
+        if stat.S_ISDIR(st.st_mode):
+            with os.scandir(path) as iterator:
+                pending.extend(sorted((x.path for x in iterator), reverse=True))
+
+
+@job_runner.register("move")
+def run_move(job):
+    """Copies the source of a "move" job to its destination and removes it."""
+    src = cfg.CLOUD_PATH / job.data["src"]
+    dst = cfg.CLOUD_PATH / job.data["dst"]
+    if os.path.lexists(dst):
+        raise FileExistsError("%r already exists" % job.data["dst"])
+
+    staging_dir = dst.parent / cfg.STAGING_DIRNAME / job.id
+    remove_path(staging_dir)  # Left by an interrupted run
+    staging_dir.mkdir(parents=True)
+    tree_copy = TreeCopy(job)
+    try:
+        tree_copy.measure(src)
+        tree_copy.copy(src, staging_dir / dst.name)
+        os.rename(staging_dir / dst.name, dst)
+    finally:
+        remove_path(staging_dir)
+        try:
+            os.rmdir(staging_dir.parent)
+        except OSError:
+            pass
+
+    with releasing(src):
+        remove_path(src)
+    events.publish(events.MOVED, job.data["src"], job.data["dst"], is_dir=job.data["is_dir"])
+    return {"files": tree_copy.files, "bytes": tree_copy.bytes}
@@ -0,0 +1,102 @@
+"""Saving of the files of an upload in a bounded pool of threads.
+
+Writing files is I/O bound and releases the GIL, so the files of a bulk
+upload are saved concurrently. The pool is shared by every request of the
+process, so `cfg.UPLOAD_WORKERS` bounds the total number of files being
+written at the same time.
+"""
+import os
+import tempfile
+import threading
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from app.config import cfg
+from app.utils.fileops import remove_path, set_file_mode
+
+UploadSummary = namedtuple("UploadSummary", ["saved", "skipped", "failed"])
+
+_lock = threading.Lock()
+_executor = None
+_executor_pid = None
+
+
+def get_executor():
+    global _executor, _executor_pid
+
+    # The threads of the pool don't survive a fork
+    with _lock:
+        if _executor is None or _executor_pid != os.getpid():
+            _executor = ThreadPoolExecutor(
+                max_workers=cfg.UPLOAD_WORKERS, thread_name_prefix="upload"
+            )
+            _executor_pid = os.getpid()
+        return _executor
+
+
+def save_files(jobs, skipped=()):
+    """Runs the save functions of the files of an upload.
+
+    A failure doesn't stop the other files from being saved.
+
+    Args:
+        jobs (list): (filename, function) tuples. `function` is called without
+            arguments and must save the file.
+        skipped (list, optional): files that weren't saved. Defaults to ().
+
+    Returns:
+        UploadSummary: names of the files saved and skipped, and (filename,
+            exception) tuples of the files that couldn't be saved.
+    """
+    if len(jobs) > 1 and cfg.UPLOAD_WORKERS > 1:
+        executor = get_executor()
+        results = [(name, executor.submit(function)) for name, function in jobs]
+    else:
+        results = [(name, _run(function)) for name, function in jobs]
+
+    saved = []
+    failed = []
+    for name, future in results:
+        try:
+            future.result()
+            saved.append(name)
+        except OSError as exc:
+            failed.append((name, exc))
+
+    return UploadSummary(saved, list(skipped), failed)
+
+
+def save_file(file, destination):
+    """Saves an uploaded file through a temporary file next to `destination`.
+
+    The file is renamed once it is complete, so a failed save never leaves a
+    truncated file behind. It gets the mode of a file created by `open`.
+    """
+    fd, temp_path = tempfile.mkstemp(
+        prefix=".upload-", suffix=".part", dir=os.path.dirname(destination)
+    )
+    try:
+        set_file_mode(fd)
+        with os.fdopen(fd, "wb") as f:
+            file.save(f)
+        os.replace(temp_path, destination)
+    except BaseException:
+        remove_path(temp_path)
+        raise
+
+
+class _Done:
+    def __init__(self, exception=None):
+        self.exception = exception
+
+    def result(self):
+        if self.exception is not None:
+            raise self.exception
+
+
+def _run(function):
+    try:
+        function()
+    except OSError as exc:
+        return _Done(exc)
+    return _Done()
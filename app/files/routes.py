@@ -1,58 +1,268 @@
 import os
 import shutil
 from collections import namedtuple
+from functools import partial
 
 from flask.globals import request
 from flask.helpers import flash
+from flask.json import jsonify
 from werkzeug.utils import redirect, secure_filename
 
 from app.config import cfg
-from app.utils import get_folders, get_post_arg, get_user, log
+from app.utils import events, get_folders, get_post_arg, get_user, log, resolve_folder_id
+from app.utils.exceptions import JobError, QuotaError, UploadError
+from app.utils.previews import preview_cache
+from app.utils.usage import usage_index
 
 from . import files_bp
+from .chunked import UploadSession, collect_expired_sessions
+from .moves import is_cross_device, start_move
+from .pool import save_file, save_files
+from .store import releasing, save_stream, store_file
+from .streaming import MultipartUpload, save_uploaded_file
+from .trash import restore, trash
 
 Folder = namedtuple("Folder", ["id", "name"])
 
 
 @files_bp.route("/upload", methods=["POST"])
 def upload_files():
-    folder = get_post_arg("folder")
+    user = get_user()
+
+    log("User %r made a POST request to /upload", user)
 
-    log("User %r made a POST request to /upload", get_user())
+    # Reading the form spools the whole body, so the quotas of the root and
+    # the user are checked first
+    try:
+        _check_request_quota(".", user)
+    except QuotaError as exc:
+        log("User %r exceeded a quota uploading: %s", user, exc)
+        return _quota_exceeded(exc)
 
+    folder = get_post_arg("folder")
     if folder is None:
         flash("No folder supplied or an invalid folder was supplied", "danger")
         return redirect("/")
 
-    folders = get_folders()
-
-    try:
-        folder = folders[int(folder)]
-    except (IndexError, ValueError):
-        flash("Invalid index folder (index %r)" % folder, "danger")
+    index, folder = folder, resolve_folder(folder)
+    if folder is None:
+        flash("Invalid index folder (index %r)" % index, "danger")
         return redirect("/")
 
     files = request.files.getlist("files[]")
+    size = request.content_length
+    if size is None:
+        size = sum(_get_size(x) for x in files)
+    try:
+        usage_index.check_quota(folder, user, size)
+    except QuotaError as exc:
+        log("User %r exceeded a quota uploading to %r: %s", user, folder.as_posix(), exc)
+        return _quota_exceeded(exc)
 
     if not files:
         flash("No files supplied", "danger")
         return redirect("/")
 
-    log_files = []
+    # Files with the same name would be written at the same time, so only the
+    # last one is saved, as if they had been saved in order
+    jobs = {}
+    skipped = []
     for file in files:
         filename = secure_filename(file.filename)
         if not filename:
+            skipped.append(file.filename)
             continue
 
-        log_files.append(filename)
-        filename = cfg.CLOUD_PATH / folder / filename
-        try:
-            file.save(filename.as_posix())
-        except PermissionError as exc:
-            flash("Permission Error: %s" % exc, "danger")
+        path = (cfg.CLOUD_PATH / folder / filename).as_posix()
+        if cfg.DEDUP_UPLOADS:
+            jobs[filename] = partial(save_stream, file.stream, path)
+        else:
+            jobs[filename] = partial(save_file, file, path)
+
+    summary = save_files(list(jobs.items()), skipped)
+
+    for filename in summary.saved:
+        events.publish(events.CREATED, os.path.join(folder, filename), user=user)
+        preview_cache.schedule(folder / filename)
+
+    for filename, exc in summary.failed:
+        if isinstance(exc, PermissionError):
             log("User %r encoutered a PermissionError: %r" % (get_user(), exc))
+        else:
+            log("User %r could not save %r: %r" % (get_user(), filename, exc))
+
+    if summary.saved:
+        log(
+            "User %r upload files to folder %r: %s",
+            get_user(),
+            folder.as_posix(),
+            summary.saved,
+        )
+
+    if _wants_json():
+        status = 200 if summary.saved else 400
+        return jsonify(_summary_json(summary)), status
+
+    if not jobs:
+        flash("Supplied only %d empty files" % len(files), "danger")
+        return redirect("/")
+
+    for filename, exc in summary.failed:
+        if isinstance(exc, PermissionError):
+            flash("Permission Error: %s" % exc, "danger")
+        else:
+            flash("Error saving %s: %s" % (filename, exc), "danger")
+
+    if summary.saved and not summary.failed:
+        flash("Files uploaded successfully", "success")
+    elif summary.saved:
+        flash("Uploaded %d of %d files" % (len(summary.saved), len(jobs)), "warning")
+    return redirect("/")
+
+
+def _check_request_quota(folder, user, pending=0):
+    """Checks that the body of the request fits in the quotas of a folder and a user.
+
+    Chunked requests have no length, so their body is limited to the bytes
+    that fit instead, and reading more raises `RequestEntityTooLarge`.
+
+    Args:
+        folder (str | Path): destination folder, relative to the cloud.
+        user (str): user that uploads the files, or None.
+        pending (int, optional): bytes already received that the usage index
+            doesn't count yet. Defaults to 0.
+
+    Raises:
+        QuotaError: if the body doesn't fit.
+    """
+    size = request.content_length
+    if size is not None:
+        usage_index.check_quota(folder, user, pending + size)
+        return
+
+    remaining = usage_index.remaining_quota(folder, user)
+    if remaining is None:
+        return
+    if remaining < pending:
+        usage_index.check_quota(folder, user, pending)
+    limit = request.max_content_length
+    remaining -= pending
+    request.max_content_length = remaining if limit is None else min(limit, remaining)
+
+
+def _get_size(file):
+    # The files of a parsed form are spooled, so they can be measured
+    position = file.stream.tell()
+    size = file.stream.seek(0, os.SEEK_END)
+    file.stream.seek(position)
+    return size
+
+
+def _quota_exceeded(exc):
+    if _wants_json():
+        return jsonify(error=str(exc)), 413
+    flash(str(exc), "danger")
+    return redirect("/")
+
+
+def _wants_json():
+    best = request.accept_mimetypes.best_match(["text/html", "application/json"])
+    return best == "application/json"
+
+
+def _summary_json(summary):
+    return {
+        "saved": summary.saved,
+        "skipped": summary.skipped,
+        "failed": [
+            {"filename": filename, "error": str(exc)} for filename, exc in summary.failed
+        ],
+    }
+
+
+@files_bp.route("/upload-stream", methods=["POST"])
+def upload_files_stream():
+    log("User %r made a POST request to /upload-stream", get_user())
+
+    boundary = request.mimetype_params.get("boundary")
+    if request.mimetype != "multipart/form-data" or not boundary:
+        flash("Invalid upload: the request is not multipart/form-data", "danger")
+        return redirect("/")
+
+    # If the folder comes in the url, the files are written directly in it.
+    # Otherwise, they are kept in the cloud until the form field is parsed.
+    index = request.args.get("folder")
+    folder = None
+    if index is not None:
+        folder = resolve_folder(index)
+        if folder is None:
+            flash("Invalid index folder (index %r)" % index, "danger")
+            return redirect("/")
+        upload = MultipartUpload(cfg.CLOUD_PATH / folder, cfg.DEDUP_UPLOADS)
+    else:
+        upload = MultipartUpload(cfg.CLOUD_PATH, cfg.DEDUP_UPLOADS)
+
+    # Until the form field is parsed only the quotas of the root and the user apply
+    try:
+        _check_request_quota(folder or ".", get_user())
+    except QuotaError as exc:
+        log("User %r exceeded a quota uploading: %s", get_user(), exc)
+        flash(str(exc), "danger")
+        return redirect("/")
+
+    try:
+        upload.receive(request.stream, boundary, cfg.UPLOAD_CHUNK_SIZE)
+    except ValueError as exc:
+        flash("Invalid upload: %s" % exc, "danger")
+        return redirect("/")
+
+    try:
+        if folder is None:
+            index = upload.fields.get("folder")
+            if not index:
+                flash("No folder supplied or an invalid folder was supplied", "danger")
+                return redirect("/")
+
+            folder = resolve_folder(index)
+            if folder is None:
+                flash("Invalid index folder (index %r)" % index, "danger")
+                return redirect("/")
+
+        files = upload.getlist("files[]")
+        if not files:
+            flash("No files supplied", "danger")
+            return redirect("/")
+
+        try:
+            usage_index.check_quota(folder, get_user(), sum(x.size for x in files))
+        except QuotaError as exc:
+            log("User %r exceeded a quota uploading to %r: %s", get_user(), folder.as_posix(), exc)
+            flash(str(exc), "danger")
             return redirect("/")
 
+        log_files = []
+        for uploaded in files:
+            filename = secure_filename(uploaded.filename)
+            if not filename:
+                continue
+
+            log_files.append(filename)
+            try:
+                destination = cfg.CLOUD_PATH / folder / filename
+                if uploaded.digest is not None:
+                    store_file(uploaded.temp_path, uploaded.digest, destination)
+                else:
+                    save_uploaded_file(uploaded, destination)
+            except PermissionError as exc:
+                flash("Permission Error: %s" % exc, "danger")
+                log("User %r encoutered a PermissionError: %r" % (get_user(), exc))
+                return redirect("/")
+
+            events.publish(events.CREATED, os.path.join(folder, filename), user=get_user())
+            preview_cache.schedule(folder / filename)
+    finally:
+        upload.cleanup()
+
     if not log_files:
         flash("Supplied only %d empty files" % len(files), "danger")
         return redirect("/")
@@ -67,30 +277,181 @@ def upload_files():
     return redirect("/")
 
 
+def resolve_folder(folder):
+    """Returns the folder of the upload form with the given id, or None.
+
+    Positional indexes into `get_folders()` are still accepted from older
+    clients, but they need the whole listing and may point to another folder
+    if the tree changed since the form was rendered.
+    """
+    if isinstance(folder, str) and not folder.isdigit():
+        return resolve_folder_id(folder)
+
+    folders = get_folders()
+    try:
+        return folders[int(folder)]
+    except (IndexError, ValueError, TypeError):
+        return None
+
+
+@files_bp.route("/uploads", methods=["POST"])
+def create_upload():
+    data = request.get_json(silent=True) or request.form
+    folder = resolve_folder(data.get("folder"))
+    if folder is None:
+        return jsonify(error="Invalid folder: %r" % data.get("folder")), 400
+
+    collect_expired_sessions()
+
+    try:
+        size = data.get("size")
+        chunk_size = data.get("chunk_size")
+        if size is not None:
+            usage_index.check_quota(folder, get_user(), int(size))
+        session = UploadSession.create(
+            folder,
+            data.get("filename"),
+            size=None if size is None else int(size),
+            chunk_size=None if chunk_size is None else int(chunk_size),
+            user=get_user(),
+        )
+    except QuotaError as exc:
+        return jsonify(error=str(exc)), 413
+    except (UploadError, ValueError) as exc:
+        return jsonify(error=str(exc)), 400
+
+    log(
+        "User %r started upload %r of %r to folder %r",
+        get_user(),
+        session.id,
+        session.filename,
+        session.folder,
+    )
+    return jsonify(_upload_status(session)), 201
+
+
+@files_bp.route("/uploads/<session_id>", methods=["GET"])
+def upload_status(session_id):
+    try:
+        session = UploadSession.load(session_id)
+    except UploadError as exc:
+        return jsonify(error=str(exc)), 404
+    return jsonify(_upload_status(session)), 200
+
+
+@files_bp.route("/uploads/<session_id>/<int:index>", methods=["PUT"])
+def upload_chunk(session_id, index):
+    try:
+        session = UploadSession.load(session_id)
+    except UploadError as exc:
+        return jsonify(error=str(exc)), 404
+
+    # The chunks are kept in a reserved folder that the usage index doesn't
+    # count, and an upload without a size wasn't checked when it was created
+    try:
+        _check_request_quota(session.folder, get_user(), session.received_size())
+        size = session.write_chunk(index, request.stream)
+    except QuotaError as exc:
+        return jsonify(error=str(exc)), 413
+    except UploadError as exc:
+        return jsonify(error=str(exc)), 400
+    return jsonify(index=index, size=size), 200
+
+
+@files_bp.route("/uploads/<session_id>/finalize", methods=["POST"])
+def finalize_upload(session_id):
+    try:
+        session = UploadSession.load(session_id)
+    except UploadError as exc:
+        return jsonify(error=str(exc)), 404
+
+    try:
+        usage_index.check_quota(session.folder, get_user(), session.received_size())
+        path = session.finalize()
+    except QuotaError as exc:
+        return jsonify(error=str(exc)), 413
+    except UploadError as exc:
+        return jsonify(error=str(exc)), 400
+    except PermissionError as exc:
+        log("User %r encoutered a PermissionError: %r" % (get_user(), exc))
+        return jsonify(error="Permission Error: %s" % exc), 403
+
+    events.publish(events.CREATED, path, user=get_user())
+    preview_cache.schedule(path)
+    log("User %r upload files to folder %r: %s", get_user(), session.folder, [session.filename])
+    return jsonify(path=path.as_posix()), 200
+
+
+@files_bp.route("/uploads/<session_id>", methods=["DELETE"])
+def abort_upload(session_id):
+    try:
+        session = UploadSession.load(session_id)
+    except UploadError as exc:
+        return jsonify(error=str(exc)), 404
+
+    session.discard()
+    log("User %r aborted upload %r", get_user(), session.id)
+    return jsonify(id=session.id), 200
+
+
+def _upload_status(session):
+    return {
+        "id": session.id,
+        "folder": session.folder,
+        "filename": session.filename,
+        "size": session.size,
+        "chunk_size": session.chunk_size,
+        "total_chunks": session.total_chunks,
+        "received": session.received(),
+        "missing": session.missing(),
+    }
+
+
 @files_bp.route("/d/<path:filepath>", methods=["GET"])
 @files_bp.route("/delete/<path:filepath>", methods=["GET"])
 def delete(filepath):
+    relpath = filepath
     filepath = cfg.CLOUD_PATH / filepath
 
+    # The entry is moved to the trash and removed by a background job
     try:
-        if filepath.is_dir():
-            shutil.rmtree(filepath)
-            log("User %r removed tree %r", get_user(), filepath.as_posix())
-            return "<h1>Tree removed</h1> %s" % filepath.as_posix(), 200
-        else:
-            os.remove(filepath)
-            log("User %r removed file %r", get_user(), filepath.as_posix())
-            return "<h1>File deleted</h1>  %s" % filepath.as_posix(), 200
+        job = trash(relpath, get_user())
     except FileNotFoundError:
         log("User %r tried to incorrectly remove %r", get_user(), filepath.as_posix())
         return "<h1>File not found</h1> %s" % filepath.as_posix(), 404
 
+    undo = ""
+    if cfg.TRASH_RETENTION:
+        undo = ' <a href="/restore/%s">Undo</a>' % job.id
+
+    if job.data["is_dir"]:
+        log("User %r removed tree %r", get_user(), filepath.as_posix())
+        return "<h1>Tree removed</h1> %s%s" % (filepath.as_posix(), undo), 200
+    log("User %r removed file %r", get_user(), filepath.as_posix())
+    return "<h1>File deleted</h1>  %s%s" % (filepath.as_posix(), undo), 200
+
+
+@files_bp.route("/restore/<job_id>", methods=["GET"])
+def restore_deleted(job_id):
+    try:
+        job = restore(job_id)
+    except JobError as err:
+        log("User %r tried to restore %r, but failed (%s)", get_user(), job_id, err)
+        return "<h1>Can't restore</h1> %s" % err, 404
+    except FileExistsError as err:
+        log("User %r tried to restore %r, but it already exists", get_user(), str(err))
+        return "<h1>File already exists</h1> %s" % err, 409
+
+    log("User %r restored %r", get_user(), job.data["path"])
+    return "<h1>File restored</h1> %s" % job.data["path"], 200
+
 
 @files_bp.route("/md/<path:folder>", methods=["GET"])
 @files_bp.route("/mk/<path:folder>", methods=["GET"])
 @files_bp.route("/mkdir/<path:folder>", methods=["GET"])
 def mkdir(folder: str):
     os.makedirs(cfg.CLOUD_PATH / folder)
+    events.publish(events.CREATED, folder, is_dir=True)
 
     log("User %r made dir %r", get_user(), folder)
     return redirect("/cloud")
@@ -113,8 +474,27 @@ def move():
     real_from = cfg.CLOUD_PATH / _from
     real_to = cfg.CLOUD_PATH / _to
 
+    # shutil.move puts the source inside the destination if it is a folder
+    if real_to.is_dir():
+        _to_final = os.path.join(_to, real_from.name)
+    else:
+        _to_final = _to
+    is_dir = real_from.is_dir()
+
     try:
-        shutil.move(real_from, real_to)
+        # Between filesystems the data is copied, which is left to a job
+        if is_cross_device(real_from, real_to):
+            job = start_move(_from, _to_final, get_user())
+            log("User %r started moving file %r to %r", get_user(), _from, _to)
+            return (
+                '<h1>Moving file in the background</h1> <a href="/api/jobs/%s">Status</a>'
+                % job.id,
+                202,
+            )
+
+        with releasing(real_from, real_to):
+            shutil.move(real_from, real_to)
+        events.publish(events.MOVED, _from, _to_final, is_dir=is_dir)
         log("User %r moved file %r to %r", get_user(), _from, _to)
         return "<h1>File moved correctly</h1>", 200
     except (FileNotFoundError, FileExistsError) as err:
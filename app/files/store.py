@@ -0,0 +1,274 @@
+"""Content-addressed store that keeps a single copy of every uploaded content.
+
+When `cfg.DEDUP_UPLOADS` is set, uploaded files are hashed while they are
+written and kept as blobs in `<cloud>/<STORE_DIRNAME>/<aa>/<sha256>`. The file
+in the folder of the user is a hardlink to its blob, so uploading the same
+file to many folders uses the space (and the writes) of a single copy.
+
+The references of a blob are its links besides the blob itself, so the
+filesystem keeps the count. A blob is removed when the last file linked to it
+is deleted or moved to another filesystem. Blobs are made read-only (the mode
+of a new file without its write bits), so the other copies aren't changed by
+editing one of them in place: the deduplicated files of the users are
+read-only too, since they are the blob. Their digest
+is kept in an extended attribute of the inode (shared by all its links) to
+find the blob of a file without hashing it again.
+"""
+import errno
+import hashlib
+import os
+import tempfile
+import uuid
+from contextlib import contextmanager
+from pathlib import Path
+
+from app.config import cfg
+from app.utils.fileops import FILE_MODE, remove_path, set_file_mode
+
+DIGEST_XATTR = "user.cloud.sha256"
+BLOB_MODE = FILE_MODE & ~0o222
+
+
+class HashingWriter:
+    """Writes to a file while computing the sha256 of the data."""
+
+    def __init__(self, file):
+        self.file = file
+        self.hash = hashlib.sha256()
+
+    def write(self, data):
+        self.hash.update(data)
+        return self.file.write(data)
+
+    def hexdigest(self):
+        return self.hash.hexdigest()
+
+
+def get_store_path():
+    return cfg.CLOUD_PATH / cfg.STORE_DIRNAME
+
+
+def get_blob_path(digest):
+    return get_store_path() / digest[:2] / digest[2:]
+
+
+def hash_file(path, chunk_size=None):
+    chunk_size = chunk_size or cfg.UPLOAD_CHUNK_SIZE
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while True:
+            data = f.read(chunk_size)
+            if not data:
+                break
+            digest.update(data)
+    return digest.hexdigest()
+
+
+def save_stream(stream, destination, chunk_size=None):
+    """Saves a file-like object to `destination` through the store."""
+    chunk_size = chunk_size or cfg.UPLOAD_CHUNK_SIZE
+    fd, temp_path = tempfile.mkstemp(
+        prefix=".upload-", suffix=".part", dir=os.path.dirname(destination)
+    )
+    try:
+        # The file is kept if it can't be linked to its blob
+        set_file_mode(fd)
+        with os.fdopen(fd, "wb") as f:
+            writer = HashingWriter(f)
+            while True:
+                data = stream.read(chunk_size)
+                if not data:
+                    break
+                writer.write(data)
+        store_file(temp_path, writer.hexdigest(), destination)
+    except BaseException:
+        remove_path(temp_path)
+        raise
+
+
+def store_file(temp_path, digest, destination):
+    """Moves a temporary file to `destination`, as a link to the blob of `digest`.
+
+    If the blob doesn't exist, the temporary file becomes the blob. If the
+    file can't be linked (the blob has too many links or it was removed
+    meanwhile), it is saved as a regular file. A linked file has the mode of
+    the blob, `BLOB_MODE`, so it can't be written.
+
+    Args:
+        temp_path (str): file to store, in the same filesystem as the cloud.
+        digest (str): sha256 of the contents of the file.
+        destination (str | Path): final path of the file.
+
+    Returns:
+        bool: True if the file was deduplicated.
+    """
+    blob = get_blob_path(digest)
+    blob.parent.mkdir(parents=True, exist_ok=True)
+
+    try:
+        os.link(temp_path, blob)
+    except FileExistsError:
+        pass
+    except OSError as exc:
+        if exc.errno not in (errno.EXDEV, errno.EMLINK, errno.EPERM):
+            raise
+        os.replace(temp_path, destination)
+        return False
+    else:
+        _seal(blob, digest)
+        os.replace(temp_path, destination)
+        return True
+
+    # The content was already stored: the new data is discarded
+    try:
+        link_path = _link_near(blob, os.path.dirname(destination))
+    except OSError as exc:
+        if exc.errno not in (errno.ENOENT, errno.EXDEV, errno.EMLINK, errno.EPERM):
+            raise
+        os.replace(temp_path, destination)
+        return False
+
+    os.remove(temp_path)
+    os.replace(link_path, destination)
+    return True
+
+
+def _seal(blob, digest):
+    # Setting a user attribute needs write permission, so it goes first
+    try:
+        os.setxattr(blob, DIGEST_XATTR, digest.encode("ascii"))
+    except (AttributeError, OSError):
+        # Not supported by the platform or the filesystem
+        pass
+    os.chmod(blob, BLOB_MODE)
+
+
+def _link_near(blob, folder):
+    while True:
+        link_path = os.path.join(folder, ".upload-%s.link" % uuid.uuid4().hex)
+        try:
+            os.link(blob, link_path)
+            return link_path
+        except FileExistsError:
+            continue
+
+
+def get_digest(path):
+    """Returns the digest of the blob linked to a file, if it is known."""
+    try:
+        return os.getxattr(path, DIGEST_XATTR).decode("ascii")
+    except (AttributeError, OSError, UnicodeDecodeError):
+        return None
+
+
+def get_linked_digests(path):
+    """Returns the digests of the blobs linked from a file or a folder tree.
+
+    Files with more than one link but without a digest were linked outside
+    the app, unless the filesystem can't keep the digests.
+
+    Returns:
+        set: digests of the blobs, or None if some file has more than one link
+            but its digest is unknown.
+    """
+    if not os.path.isdir(get_store_path()):
+        return set()
+
+    if os.path.isdir(path) and not os.path.islink(path):
+        paths = (
+            os.path.join(dirpath, x)
+            for dirpath, _, filenames in os.walk(path)
+            for x in filenames
+        )
+    else:
+        paths = [path]
+
+    digests = set()
+    for file_path in paths:
+        try:
+            st = os.lstat(file_path)
+        except OSError:
+            continue
+        if st.st_nlink < 2:
+            continue
+
+        digest = get_digest(file_path)
+        if digest is not None:
+            digests.add(digest)
+        elif not _has_xattrs(file_path):
+            return None
+    return digests
+
+
+def _has_xattrs(path):
+    try:
+        os.listxattr(path)
+    except (AttributeError, OSError):
+        return False
+    return True
+
+
+def release(digests):
+    """Removes the blobs of `digests` that no file links anymore.
+
+    Args:
+        digests (set): digests of the blobs, or None to check every blob.
+
+    Returns:
+        int: number of blobs removed.
+    """
+    if digests is None:
+        return collect_orphans()
+
+    removed = 0
+    for digest in digests:
+        removed += _remove_orphan(get_blob_path(digest))
+    return removed
+
+
+def collect_orphans():
+    """Removes every blob that no file links anymore."""
+    store_path = get_store_path()
+    removed = 0
+    for dirpath, _, filenames in os.walk(store_path):
+        for filename in filenames:
+            removed += _remove_orphan(Path(dirpath, filename))
+    return removed
+
+
+def _remove_orphan(blob):
+    try:
+        if os.lstat(blob).st_nlink == 1:
+            os.remove(blob)
+            return 1
+    except FileNotFoundError:
+        pass
+    return 0
+
+
+@contextmanager
+def releasing(path, destination=None):
+    """Removes the blobs left without links after deleting or moving `path`.
+
+    Args:
+        path (Path): file or folder that is going to be removed.
+        destination (Path, optional): folder where `path` is going to be
+            moved. Moves inside the same filesystem keep the links, so they
+            don't need to be checked. Defaults to None.
+    """
+    digests = set()
+    if destination is None or not _same_device(path, destination):
+        digests = get_linked_digests(path)
+    yield
+    if digests is None or digests:
+        release(digests)
+
+
+def _same_device(path, destination):
+    destination = Path(destination)
+    if not destination.is_dir():
+        destination = destination.parent
+    try:
+        return os.stat(path).st_dev == os.stat(destination).st_dev
+    except OSError:
+        return False
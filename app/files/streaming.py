@@ -0,0 +1,166 @@
+"""Incremental parser of multipart uploads that writes the files straight to disk.
+
+Werkzeug's form parser spools every file to a temporary file (or to memory)
+and `FileStorage.save` copies it again to its destination. Here the request
+body is read in chunks of `cfg.UPLOAD_CHUNK_SIZE` bytes and the data of each
+file is written directly to a hidden temporary file, which is renamed to its
+final name once the whole request has been received.
+"""
+import errno
+import hashlib
+import os
+import shutil
+import tempfile
+from collections import namedtuple
+
+from werkzeug.sansio.multipart import (
+    Data,
+    Epilogue,
+    Field,
+    File,
+    MultipartDecoder,
+    NeedData,
+)
+
+from app.utils.fileops import set_file_mode
+
+MAX_FIELD_SIZE = 64 * 1024
+
+UploadedFile = namedtuple(
+    "UploadedFile", ["name", "filename", "temp_path", "size", "digest"], defaults=[None]
+)
+
+
+class MultipartUpload:
+    """Form fields and temporary files of a multipart request.
+
+    Args:
+        spool_dir (Path): folder where the temporary files are created. To
+            rename them without copying, it should be in the same filesystem
+            as their destination.
+        hash_files (bool, optional): compute the sha256 of the files while
+            they are received. Defaults to False.
+    """
+
+    def __init__(self, spool_dir, hash_files=False):
+        self.spool_dir = spool_dir
+        self.hash_files = hash_files
+        self.fields = {}
+        self.files = []
+        self._hash = None
+
+    def receive(self, stream, boundary, chunk_size):
+        """Reads and parses a multipart body.
+
+        Args:
+            stream (file-like): body of the request.
+            boundary (str): boundary of the multipart content type.
+            chunk_size (int): bytes read from `stream` at once.
+
+        Raises:
+            ValueError: if the body is not valid multipart data.
+        """
+        # The decoder would limit its whole buffer, which also holds the data of
+        # the files, so only the form fields are limited
+        decoder = MultipartDecoder(boundary.encode())
+        field_name = None
+        field_data = bytearray()
+        current_file = None
+
+        try:
+            while True:
+                chunk = stream.read(chunk_size)
+                decoder.receive_data(chunk or None)
+
+                event = decoder.next_event()
+                while not isinstance(event, (NeedData, Epilogue)):
+                    if isinstance(event, File):
+                        current_file = self._open_file(event)
+                    elif isinstance(event, Field):
+                        field_name = event.name
+                        field_data.clear()
+                    elif isinstance(event, Data):
+                        if current_file is not None:
+                            self._write_file(current_file, event.data)
+                        else:
+                            field_data += event.data
+                            if len(field_data) > MAX_FIELD_SIZE:
+                                raise ValueError("Field %r is too large" % field_name)
+
+                        if not event.more_data:
+                            if current_file is not None:
+                                self._close_file(current_file)
+                                current_file = None
+                            else:
+                                self.fields[field_name] = field_data.decode("utf-8")
+                    event = decoder.next_event()
+
+                if isinstance(event, Epilogue):
+                    return
+                if not chunk:
+                    raise ValueError("Unexpected end of multipart data")
+        except BaseException:
+            if current_file is not None:
+                current_file.close()
+            self.cleanup()
+            raise
+
+    def _open_file(self, event):
+        fd, temp_path = tempfile.mkstemp(
+            prefix=".upload-", suffix=".part", dir=self.spool_dir
+        )
+        self.files.append(UploadedFile(event.name, event.filename, temp_path, 0))
+        # The file is renamed to its destination, so it gets the mode of a new file
+        set_file_mode(fd)
+        self._hash = hashlib.sha256() if self.hash_files else None
+        return os.fdopen(fd, "wb")
+
+    def _write_file(self, file, data):
+        file.write(data)
+        if self._hash is not None:
+            self._hash.update(data)
+
+    def _close_file(self, file):
+        size = file.tell()
+        file.close()
+        digest = None if self._hash is None else self._hash.hexdigest()
+        self.files[-1] = self.files[-1]._replace(size=size, digest=digest)
+
+    def getlist(self, name):
+        return [x for x in self.files if x.name == name]
+
+    def cleanup(self):
+        """Removes the temporary files that haven't been saved."""
+        for uploaded in self.files:
+            try:
+                os.remove(uploaded.temp_path)
+            except FileNotFoundError:
+                pass
+
+
+def save_uploaded_file(uploaded, destination):
+    """Moves a temporary file to its destination.
+
+    The file is renamed atomically, so the destination never exists
+    half-written. If it is in another filesystem, it is first copied to a
+    temporary file next to the destination.
+    """
+    try:
+        os.replace(uploaded.temp_path, destination)
+        return
+    except OSError as exc:
+        if exc.errno != errno.EXDEV:
+            raise
+
+    fd, temp_path = tempfile.mkstemp(
+        prefix=".upload-", suffix=".part", dir=os.path.dirname(destination)
+    )
+    try:
+        set_file_mode(fd)
+        with open(uploaded.temp_path, "rb") as src, os.fdopen(fd, "wb") as dst:
+            shutil.copyfileobj(src, dst)
+        os.replace(temp_path, destination)
+    except BaseException:
+        os.remove(temp_path)
+        raise
+    os.remove(uploaded.temp_path)
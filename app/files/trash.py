@@ -0,0 +1,147 @@
+"""Deletes done in two steps: a rename to the trash and a background removal.
+
+Renaming is atomic and takes the same time for a file and for a folder with
+millions of files, so the request returns right away. The entry is moved to
+`<cloud>/<TRASH_DIRNAME>/<job id>/` and a "delete" job removes it after
+`cfg.TRASH_RETENTION` seconds; until then it can be restored to its path.
+
+An entry can't be renamed to another filesystem, so the filesystems mounted
+inside the cloud have their own trash, in the topmost folder of the cloud that
+is in them. Its path is kept in the "root" of the data of the job.
+"""
+import errno
+import os
+from pathlib import Path
+
+from app.config import cfg
+from app.utils import events
+from app.utils.exceptions import JobError
+from app.utils.fileops import remove_path
+from app.utils.folder_tree import is_reserved, split_path
+from app.utils.jobs import CANCELLED, Job, job_runner
+
+from .store import releasing
+
+
+def get_trash_dir(job_id, root=""):
+    return cfg.CLOUD_PATH / root / cfg.TRASH_DIRNAME / job_id
+
+
+def get_job_trash_dir(job):
+    return get_trash_dir(job.id, job.data.get("root", ""))
+
+
+def trash(relpath, user=None):
+    """Moves a file or a folder to the trash and schedules its removal.
+
+    Returns:
+        Job: the "delete" job that removes it.
+
+    Raises:
+        FileNotFoundError: if the path doesn't exist or is reserved by the app.
+    """
+    job = move_to_trash(relpath, user)
+    events.publish(events.DELETED, relpath, is_dir=job.data["is_dir"])
+    return job_runner.submit(job)
+
+
+def move_to_trash(relpath, user=None):
+    """Moves a file or a folder to the trash, without scheduling its removal.
+
+    Until the job is submitted the entry can be put back with `put_back`.
+
+    Returns:
+        Job: the "delete" job that has to be submitted to remove the entry.
+    """
+    parts = split_path(relpath)
+    if not parts or is_reserved(parts):
+        raise FileNotFoundError(errno.ENOENT, os.strerror(errno.ENOENT), relpath)
+
+    path = cfg.CLOUD_PATH / relpath
+    is_dir = os.path.isdir(path) and not os.path.islink(path)
+    job = Job.new(
+        "delete",
+        {"path": Path(*parts).as_posix(), "is_dir": is_dir},
+        user=user,
+        delay=cfg.TRASH_RETENTION,
+    )
+
+    try:
+        _rename_to_trash(path, get_trash_dir(job.id))
+    except OSError as exc:
+        root = _get_mount_root(parts) if exc.errno == errno.EXDEV else ()
+        if not root:
+            raise
+        job.data["root"] = Path(*root).as_posix()
+        _rename_to_trash(path, get_job_trash_dir(job))
+    return job
+
+
+def _rename_to_trash(path, trash_dir):
+    trash_dir.mkdir(parents=True)
+    try:
+        os.rename(path, trash_dir / path.name)
+    except OSError:
+        os.rmdir(trash_dir)
+        raise
+
+
+def _get_device(path):
+    return os.stat(path).st_dev
+
+
+def _get_mount_root(parts):
+    # The topmost folder of the cloud in the filesystem of the parent of the entry
+    device = _get_device(cfg.CLOUD_PATH.joinpath(*parts[:-1]))
+    root = parts[:-1]
+    while root and _get_device(cfg.CLOUD_PATH.joinpath(*root[:-1])) == device:
+        root = root[:-1]
+    return root
+
+
+def put_back(job):
+    """Moves the entry of a "delete" job back to its path.
+
+    Raises:
+        FileExistsError: if something was created in its path meanwhile.
+    """
+    relpath = job.data["path"]
+    path = cfg.CLOUD_PATH / relpath
+    if os.path.lexists(path):
+        raise FileExistsError(relpath)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    os.rename(get_job_trash_dir(job) / path.name, path)
+    remove_path(get_job_trash_dir(job))
+
+
+@job_runner.register("delete")
+def reclaim(job):
+    """Removes an entry of the trash, and the blobs that only it used."""
+    trash_dir = get_job_trash_dir(job)
+    with releasing(trash_dir):
+        remove_path(trash_dir)
+
+
+def restore(job_id):
+    """Moves an entry of the trash back to its path, cancelling its removal.
+
+    Returns:
+        Job: the cancelled "delete" job.
+
+    Raises:
+        JobError: if the job doesn't exist or the entry was already removed.
+        FileExistsError: if something was created in its path meanwhile.
+    """
+    job = Job.load(job_id)
+    if job.kind != "delete" or not job.claim():
+        raise JobError("%r can't be restored" % job.data.get("path", job_id))
+
+    try:
+        put_back(job)
+    except BaseException:
+        job.release()
+        raise
+
+    job.finish(CANCELLED)
+    events.publish(events.CREATED, job.data["path"], is_dir=job.data["is_dir"])
+    return job
@@ -1,4 +1,4 @@
-from app.utils import add_to_ignored, get_ignored, remove_from_ignored
+from app.utils import add_to_ignored, folder_tree, get_ignored, remove_from_ignored
 
 from . import helpers_bp
 
@@ -25,3 +25,9 @@ def unignore_all():
     for folder in get_ignored():
         remove_from_ignored(folder)
     return "done", 200
+
+
+@helpers_bp.route("/rescan", methods=["GET"])
+def rescan():
+    folder_tree.invalidate()
+    return "done", 200
@@ -0,0 +1,76 @@
+from time import perf_counter
+
+from flask import Response, g, request
+
+from app.config import cfg
+from app.utils.metrics import (
+    DOWNLOADED_BYTES,
+    REQUEST_DURATION,
+    REQUESTS,
+    UPLOADED_BYTES,
+    registry,
+)
+
+from . import metrics_bp
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+@metrics_bp.route("/metrics", methods=["GET"])
+def metrics():
+    if not cfg.METRICS:
+        return "<h1>Not Found</h1>", 404
+    return Response(registry.render(), content_type=CONTENT_TYPE)
+
+
+@metrics_bp.before_app_request
+def start_timer():
+    g.metrics_start = perf_counter()
+
+
+@metrics_bp.after_app_request
+def record_request(response):
+    """Records the latency of the request and the bytes received and sent.
+
+    The latency is measured until the response is ready, so the time spent
+    streaming a download is not included, but its bytes are counted when the
+    body has been sent.
+    """
+    start = g.pop("metrics_start", None)
+    if not cfg.METRICS or start is None:
+        return response
+
+    # Urls that don't match any route are grouped, so they can't add labels
+    endpoint = request.endpoint or ""
+    blueprint = request.blueprint or ""
+    REQUEST_DURATION.observe(
+        perf_counter() - start, blueprint=blueprint, endpoint=endpoint, method=request.method
+    )
+    REQUESTS.inc(
+        blueprint=blueprint,
+        endpoint=endpoint,
+        method=request.method,
+        status=str(response.status_code),
+    )
+
+    if request.content_length:
+        UPLOADED_BYTES.inc(request.content_length, endpoint=endpoint)
+    if response.content_length is not None:
+        if request.method != "HEAD":
+            DOWNLOADED_BYTES.inc(response.content_length, endpoint=endpoint)
+    elif response.is_streamed:
+        response.response = _count_bytes(response.response, endpoint)
+    return response
+
+
+def _count_bytes(iterable, endpoint):
+    sent = 0
+    try:
+        for chunk in iterable:
+            sent += len(chunk)
+            yield chunk
+    finally:
+        DOWNLOADED_BYTES.inc(sent, endpoint=endpoint)
+        close = getattr(iterable, "close", None)
+        if close is not None:
+            close()
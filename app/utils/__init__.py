@@ -1,22 +1,24 @@
 import json
-import os
-import re
 import warnings
-from pathlib import Path
 from random import choice
 from string import ascii_letters, digits
+from pathlib import Path
 from time import asctime
 
 from flask import request
 
 from app.config import cfg
 
+from .config_store import atomic_write_text, config_store
 from .exceptions import IngoredWarning, SudoersWarning
+from .folder_tree import folder_tree, is_reserved, split_path
+from .ignore_matcher import compile_ignored
+from .log_writer import log_writer
 
 
-def get_sudoers():
+def _load_sudoers(path):
     try:
-        with cfg.SUDOERS_PATH.open() as f:
+        with path.open() as f:
             return json.load(f)
     except json.JSONDecodeError as exc:
         warnings.warn(f"json decode error: {exc}", SudoersWarning)
@@ -26,8 +28,12 @@ def get_sudoers():
         return []
 
 
-def get_ignored():
-    data = cfg.IGNORED_PATH.read_text()
+def get_sudoers():
+    return list(config_store.get(cfg.SUDOERS_PATH, _load_sudoers))
+
+
+def _load_ignored(path):
+    data = path.read_text()
     try:
         data = list(set(json.loads(data)))
         data.sort()
@@ -37,16 +43,25 @@ def get_ignored():
         return []
 
 
+def get_ignored():
+    return list(config_store.get(cfg.IGNORED_PATH, _load_ignored))
+
+
+def _write_ignored(ignored):
+    ignored = list(set(ignored))
+    ignored.sort()
+    data = json.dumps(ignored, indent=4)
+    atomic_write_text(cfg.IGNORED_PATH, data)
+    config_store.invalidate(cfg.IGNORED_PATH)
+
+
 def add_to_ignored(folder):
     current_ignored = get_ignored()
     if folder in current_ignored:
         return False
 
     current_ignored.append(folder)
-    current_ignored = list(set(current_ignored))
-    current_ignored.sort()
-    data = json.dumps(current_ignored, indent=4)
-    cfg.IGNORED_PATH.write_text(data)
+    _write_ignored(current_ignored)
     return True
 
 
@@ -56,17 +71,13 @@ def remove_from_ignored(folder):
         return False
 
     current_ignored.remove(folder)
-    current_ignored = list(set(current_ignored))
-    current_ignored.sort()
-    data = json.dumps(current_ignored, indent=4)
-    cfg.IGNORED_PATH.write_text(data)
+    _write_ignored(current_ignored)
     return True
 
 
 def log(string, *args):
     timestamp = "[%s] - %s - " % (asctime(), request.remote_addr)
-    with cfg.LOG_PATH.open("at") as f:
-        f.write(timestamp + string % args + "\n")
+    log_writer.write(timestamp + string % args + "\n")
 
 
 def get_user():
@@ -81,29 +92,79 @@ def get_user():
         return auth.username
 
 
+def get_ignore_matcher():
+    return compile_ignored(tuple(get_ignored()))
+
+
 def get_folders():
-    ignored = get_ignored()
-    folder_choices = [
-        Path(x[0]).relative_to(cfg.CLOUD_PATH)
-        for x in os.walk(cfg.CLOUD_PATH, followlinks=True)
-    ]
-
-    folders = []
-    for folder in folder_choices:
-        for pattern in ignored:
-            if re.search(pattern, folder.as_posix(), re.IGNORECASE):
-                break
-        else:
-            folders.append(folder)
-    folder_choices = folders
+    folder_choices = folder_tree.get_folders(cfg.CLOUD_PATH, get_ignore_matcher())
 
     if get_user() not in get_sudoers():
         folder_choices = [x for x in folder_choices if filter_non_admin_folders(x)]
 
-    folder_choices.sort()
     return folder_choices
 
 
+def resolve_folder_id(folder_id):
+    """Returns the folder of the cloud with the given id, following the rules of `get_folders`.
+
+    Args:
+        folder_id (str): stable id of the folder, as rendered in the upload form.
+
+    Returns:
+        Path: folder relative to the cloud, or None if the id is unknown, the
+            folder no longer exists or it is hidden from the user.
+    """
+    folder = folder_tree.resolve(cfg.CLOUD_PATH, folder_id, get_ignore_matcher())
+    if folder is None:
+        return None
+    if not filter_non_admin_folders(folder) and get_user() not in get_sudoers():
+        return None
+    return folder
+
+
+def get_path_filter():
+    """Returns a function that checks paths like `is_visible`.
+
+    The ignored patterns and the role of the user are loaded only once, so
+    the function is cheap enough to check every entry of a folder.
+    """
+    matcher = get_ignore_matcher()
+    is_admin = get_user() in get_sudoers()
+
+    def path_filter(relpath, is_dir=False):
+        parts = split_path(relpath)
+        if parts is None or is_reserved(parts):
+            return False
+
+        if matcher:
+            for index in range(1, len(parts) + is_dir):
+                if matcher.matches("/".join(parts[:index])):
+                    return False
+
+        if parts and not is_admin:
+            return filter_non_admin_folders(Path(*parts))
+        return True
+
+    return path_filter
+
+
+def is_visible(relpath, is_dir=False):
+    """Checks if the user can see a path, following the rules of `get_folders`.
+
+    Args:
+        relpath (str | Path): path relative to the cloud folder.
+        is_dir (bool, optional): the path is a folder, so it is hidden if it
+            matches an ignored pattern itself. Defaults to False.
+
+    Returns:
+        bool: False if the path is outside the cloud, inside a folder reserved
+            by the app or inside an ignored folder, or if it is hidden from
+            non admin users.
+    """
+    return get_path_filter()(relpath, is_dir)
+
+
 def filter_non_admin_folders(x):
     return not (x.as_posix().startswith(".") and len(x.as_posix()) > 1)
 
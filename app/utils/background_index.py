@@ -0,0 +1,198 @@
+"""Base class of the indexes of the cloud kept in SQLite by a background worker.
+
+The worker thread applies the events published by the routes and the watcher
+and rescans the cloud periodically, so the requests never wait for the index
+to be updated. Each process runs its own worker, but only one of them scans
+the whole cloud at a time.
+"""
+import os
+import queue
+import sqlite3
+import threading
+import warnings
+from contextlib import closing, contextmanager
+from time import monotonic
+
+from app.config import cfg
+
+from . import events
+from .exceptions import IndexWarning
+from .folder_tree import split_path
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+_STOP = object()
+_SCAN = object()
+
+# Temporary files of the uploads in progress
+TEMP_PREFIX = ".upload-"
+
+
+def normalize(relpath):
+    """Returns the posix form of a path of the cloud, or None if it is outside."""
+    parts = split_path(relpath)
+    if parts is None:
+        return None
+    return "/".join(parts) or "."
+
+
+def parent(relpath):
+    return relpath.rpartition("/")[0] or "."
+
+
+def subtree_range(relpath):
+    """Returns the bounds of the paths inside a folder, for range queries.
+
+    '0' is the character after '/', so every path that starts with
+    `relpath + "/"` sorts between the two bounds.
+    """
+    return relpath + "/", relpath + "0"
+
+
+def has_paths(conn, table, relpath):
+    """Checks if a table has the row of a path or of any path inside it."""
+    row = conn.execute(
+        "SELECT 1 FROM %s WHERE path = ? OR (path > ? AND path < ?) LIMIT 1" % table,
+        (relpath, *subtree_range(relpath)),
+    ).fetchone()
+    return row is not None
+
+
+class BackgroundIndex:
+    """SQLite index of the cloud, updated by a worker thread.
+
+    Subclasses define `schema`, `default_db_path`, `scan_interval`, `scan`
+    and `apply`.
+    """
+
+    schema = ""
+
+    def __init__(self, db_path=None, root=None):
+        self._db_path = db_path
+        self._root = root
+        self._lock = threading.Lock()
+        self._queue = queue.Queue()
+        self._thread = None
+        self._pid = None
+        self._schema_ready = False
+
+    @property
+    def db_path(self):
+        return self._db_path or self.default_db_path
+
+    @property
+    def default_db_path(self):
+        raise NotImplementedError
+
+    @property
+    def scan_interval(self):
+        """Seconds between full scans, or None to scan only when the worker starts."""
+        raise NotImplementedError
+
+    @property
+    def root(self):
+        return self._root or cfg.CLOUD_PATH
+
+    @property
+    def is_running(self):
+        return self._thread is not None and self._pid == os.getpid()
+
+    @contextmanager
+    def connect(self):
+        with closing(sqlite3.connect(self.db_path, timeout=30)) as conn:
+            if not self._schema_ready:
+                conn.execute("PRAGMA journal_mode=WAL")
+                conn.executescript(self.schema)
+                self._schema_ready = True
+            with conn:
+                yield conn
+
+    def scan(self, relpath=".", conn=None):
+        raise NotImplementedError
+
+    def apply(self, event, conn):
+        """Updates the index with an event other than RESCAN."""
+        raise NotImplementedError
+
+    def handle_event(self, event):
+        if self.is_running:
+            self._queue.put(event)
+
+    def start(self):
+        """Starts the background worker, once per process."""
+        with self._lock:
+            if self.is_running:
+                return
+            self._queue = queue.Queue()
+            self._pid = os.getpid()
+            self._thread = threading.Thread(
+                target=self._run, name=type(self).__name__, daemon=True
+            )
+            self._thread.start()
+
+    def stop(self):
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is not None and self._pid == os.getpid():
+            self._queue.put(_STOP)
+            thread.join()
+
+    def request_scan(self):
+        self._queue.put(_SCAN)
+
+    def join(self, timeout=None):
+        """Blocks until the worker has processed every pending item."""
+        if not self.is_running:
+            return True
+        done = threading.Event()
+        self._queue.put(done)
+        return done.wait(timeout)
+
+    def _run(self):
+        next_scan = monotonic()
+        while True:
+            timeout = None if next_scan is None else max(next_scan - monotonic(), 0)
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                item = _SCAN
+
+            if item is _STOP:
+                break
+            if isinstance(item, threading.Event):
+                item.set()
+                continue
+
+            try:
+                if item is _SCAN or item.kind == events.RESCAN:
+                    self._scan_once()
+                    interval = self.scan_interval
+                    next_scan = None if interval is None else monotonic() + interval
+                else:
+                    self._apply(item)
+            except (OSError, sqlite3.Error) as exc:
+                warnings.warn(f"{type(self).__name__} error: {exc!r}", IndexWarning)
+
+    def _scan_once(self):
+        # Only one process scans the whole cloud at a time
+        if fcntl is None:
+            self.scan()
+            return
+
+        lock_path = "%s.lock" % self.db_path
+        with open(lock_path, "a") as lock_file:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return
+            try:
+                self.scan()
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _apply(self, event):
+        with self.connect() as conn:
+            self.apply(event, conn)
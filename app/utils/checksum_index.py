@@ -0,0 +1,338 @@
+"""Persistent index of the checksums of the files of the cloud.
+
+Every file is stored in a SQLite database with its size, mtime, inode and
+BLAKE2b hash. A background worker scans the cloud every
+`cfg.CHECKSUM_SCAN_INTERVAL` seconds and only rehashes the files whose stat
+changed, and the events of the routes and the watcher keep the index current
+between scans: renames update the paths without hashing the files again.
+
+The files are scanned folder by folder, with an index on the folder of each
+row, so the memory used depends on the size of the largest folder and not on
+the size of the cloud.
+"""
+import hashlib
+import os
+import stat
+from collections import namedtuple
+from time import time
+
+from app.config import cfg
+
+from . import events
+from .background_index import (
+    TEMP_PREFIX,
+    BackgroundIndex,
+    has_paths,
+    normalize,
+    parent,
+    subtree_range,
+)
+from .folder_tree import is_reserved
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    dir TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    inode INTEGER NOT NULL,
+    hash TEXT NOT NULL,
+    checked REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS files_dir ON files (dir);
+CREATE INDEX IF NOT EXISTS files_hash ON files (hash, size);
+CREATE INDEX IF NOT EXISTS files_inode ON files (inode);
+"""
+
+FileChecksum = namedtuple("FileChecksum", ["path", "size", "mtime_ns", "inode", "hash"])
+Duplicate = namedtuple("Duplicate", ["hash", "size", "paths", "reclaimable"])
+
+
+def hash_file(path, chunk_size=None):
+    chunk_size = chunk_size or cfg.CHECKSUM_CHUNK_SIZE
+    digest = hashlib.blake2b(digest_size=32)
+    with open(path, "rb") as f:
+        while True:
+            data = f.read(chunk_size)
+            if not data:
+                break
+            digest.update(data)
+    return digest.hexdigest()
+
+
+def _stat_key(st):
+    return st.st_size, st.st_mtime_ns, st.st_ino
+
+
+def _same_stat(row, st):
+    return (row.size, row.mtime_ns, row.inode) == _stat_key(st)
+
+
+class ChecksumIndex(BackgroundIndex):
+    """Checksums of the files of the cloud, stored in `cfg.CHECKSUM_DB_PATH`."""
+
+    schema = SCHEMA
+
+    @property
+    def default_db_path(self):
+        return cfg.CHECKSUM_DB_PATH
+
+    @property
+    def scan_interval(self):
+        return cfg.CHECKSUM_SCAN_INTERVAL
+
+    def get(self, relpath, conn=None):
+        if conn is None:
+            with self.connect() as conn:
+                return self.get(relpath, conn)
+
+        row = conn.execute(
+            "SELECT path, size, mtime_ns, inode, hash FROM files WHERE path = ?",
+            (normalize(relpath),),
+        ).fetchone()
+        return None if row is None else FileChecksum(*row)
+
+    def update(self, relpath, conn=None):
+        """Hashes a file if it changed since it was indexed.
+
+        Returns:
+            FileChecksum: the data indexed, or None if the file doesn't exist.
+        """
+        if conn is None:
+            with self.connect() as conn:
+                return self.update(relpath, conn)
+
+        relpath = normalize(relpath)
+        try:
+            st = os.stat(self.root / relpath)
+        except (FileNotFoundError, NotADirectoryError):
+            self.remove(relpath, conn)
+            return None
+
+        row = self.get(relpath, conn)
+        if row is not None and _same_stat(row, st):
+            return row
+        return self._hash(conn, relpath, st)
+
+    def _hash(self, conn, relpath, st):
+        # Reading a fifo or a device could block the worker forever
+        if not stat.S_ISREG(st.st_mode):
+            return None
+
+        # The links of a file share its inode, so they are hashed only once
+        linked = conn.execute(
+            "SELECT hash FROM files WHERE inode = ? AND size = ? AND mtime_ns = ? LIMIT 1",
+            (st.st_ino, st.st_size, st.st_mtime_ns),
+        ).fetchone()
+        if linked is not None:
+            digest = linked[0]
+        else:
+            digest = hash_file(self.root / relpath)
+            # The file changed while it was read, its next event will index it
+            if _stat_key(os.stat(self.root / relpath)) != _stat_key(st):
+                return None
+
+        row = FileChecksum(relpath, st.st_size, st.st_mtime_ns, st.st_ino, digest)
+        conn.execute(
+            "INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (relpath, parent(relpath), *row[1:], time()),
+        )
+        return row
+
+    def status(self, relpath):
+        """Checks a file against the index without reading it.
+
+        Returns:
+            tuple: status ("ok", "stale", "unindexed" or "missing") and the
+                `FileChecksum` indexed, if any.
+        """
+        row = self.get(relpath)
+        try:
+            st = os.stat(self.root / normalize(relpath))
+        except (FileNotFoundError, NotADirectoryError):
+            return "missing", row
+
+        if row is None:
+            return "unindexed", None
+        return ("ok" if _same_stat(row, st) else "stale"), row
+
+    def verify(self, relpath):
+        """Hashes a file again and compares it with the index.
+
+        A file with the same stat but a different hash is reported as
+        "corrupted" and its indexed hash is kept. Files modified since they
+        were indexed are indexed again.
+
+        Returns:
+            tuple: status ("ok", "modified", "corrupted", "new" or "missing")
+                and the `FileChecksum` of the file.
+        """
+        relpath = normalize(relpath)
+        path = self.root / relpath
+        with self.connect() as conn:
+            row = self.get(relpath, conn)
+            try:
+                st = os.stat(path)
+                if not stat.S_ISREG(st.st_mode):
+                    return "missing", row
+                digest = hash_file(path)
+            except (FileNotFoundError, NotADirectoryError):
+                return "missing", row
+
+            current = FileChecksum(relpath, st.st_size, st.st_mtime_ns, st.st_ino, digest)
+            if row is not None and _same_stat(row, st):
+                return ("ok" if row.hash == digest else "corrupted"), current
+
+            conn.execute(
+                "INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (relpath, parent(relpath), *current[1:], time()),
+            )
+            return ("new" if row is None else "modified"), current
+
+    def remove(self, relpath, conn=None):
+        """Removes a file or every file of a folder from the index."""
+        if conn is None:
+            with self.connect() as conn:
+                return self.remove(relpath, conn)
+
+        relpath = normalize(relpath)
+        if relpath == ".":
+            conn.execute("DELETE FROM files")
+            return
+        conn.execute(
+            "DELETE FROM files WHERE path = ? OR (path > ? AND path < ?)",
+            (relpath, *subtree_range(relpath)),
+        )
+
+    def move(self, src, dst, conn=None):
+        """Renames the paths of a file or a folder, without hashing them again."""
+        if conn is None:
+            with self.connect() as conn:
+                return self.move(src, dst, conn)
+
+        src = normalize(src)
+        dst = normalize(dst)
+        if src in (None, ".") or dst in (None, "."):
+            return
+
+        # The same move can arrive twice (from the route and the watcher), and
+        # the second time there is nothing to move into the destination
+        if not has_paths(conn, "files", src):
+            return
+
+        self.remove(dst, conn)
+        conn.execute(
+            "UPDATE files SET path = ?, dir = ? WHERE path = ?", (dst, parent(dst), src)
+        )
+        conn.execute(
+            "UPDATE files SET path = ? || substr(path, ?), dir = ? || substr(dir, ?)"
+            " WHERE path > ? AND path < ?",
+            (dst, len(src) + 1, dst, len(src) + 1, *subtree_range(src)),
+        )
+
+    def scan(self, relpath=".", conn=None):
+        """Indexes the files of a folder tree, rehashing the ones that changed.
+
+        Returns:
+            int: number of files hashed.
+        """
+        if conn is None:
+            with self.connect() as conn:
+                return self.scan(relpath, conn)
+
+        relpath = normalize(relpath)
+        top = self.root / relpath
+        visited = set()
+        hashed = 0
+
+        for dirpath, dirnames, filenames in os.walk(top, followlinks=True):
+            dirnames[:] = [x for x in dirnames if x not in cfg.RESERVED_DIRNAMES]
+            current = normalize(os.path.relpath(dirpath, self.root))
+            if is_reserved(current.split("/")):
+                dirnames[:] = []
+                continue
+            visited.add(current)
+
+            indexed = {
+                row[0]: FileChecksum(*row)
+                for row in conn.execute(
+                    "SELECT path, size, mtime_ns, inode, hash FROM files WHERE dir = ?",
+                    (current,),
+                )
+            }
+            for filename in filenames:
+                if filename.startswith(TEMP_PREFIX):
+                    continue
+                path = filename if current == "." else current + "/" + filename
+                row = indexed.pop(path, None)
+                try:
+                    st = os.stat(os.path.join(dirpath, filename))
+                    if row is None or not _same_stat(row, st):
+                        hashed += self._hash(conn, path, st) is not None
+                except OSError:
+                    continue
+
+            conn.executemany("DELETE FROM files WHERE path = ?", [(x,) for x in indexed])
+            conn.commit()
+
+        # Folders that don't exist anymore
+        if relpath == ".":
+            dirs = conn.execute("SELECT DISTINCT dir FROM files")
+        else:
+            dirs = conn.execute(
+                "SELECT DISTINCT dir FROM files WHERE dir = ? OR (dir > ? AND dir < ?)",
+                (relpath, *subtree_range(relpath)),
+            )
+        gone = [(x,) for (x,) in dirs.fetchall() if x not in visited]
+        conn.executemany("DELETE FROM files WHERE dir = ?", gone)
+        return hashed
+
+    def duplicates(self, min_size=1, limit=100):
+        """Returns the groups of files with the same contents.
+
+        The groups are sorted by the space that could be reclaimed, which
+        doesn't count files that are links of the same inode.
+        """
+        with self.connect() as conn:
+            groups = conn.execute(
+                "SELECT hash, size, (COUNT(DISTINCT inode) - 1) * size AS reclaimable"
+                " FROM files WHERE size >= ? GROUP BY hash, size HAVING COUNT(*) > 1"
+                " ORDER BY reclaimable DESC, hash LIMIT ?",
+                (min_size, limit),
+            ).fetchall()
+
+            result = []
+            for digest, size, reclaimable in groups:
+                paths = [
+                    x
+                    for (x,) in conn.execute(
+                        "SELECT path FROM files WHERE hash = ? AND size = ? ORDER BY path",
+                        (digest, size),
+                    )
+                ]
+                result.append(Duplicate(digest, size, paths, reclaimable))
+            return result
+
+    def apply(self, event, conn):
+        path = normalize(event.path)
+        if path is None or is_reserved(path.split("/")):
+            return
+
+        if event.kind == events.DELETED:
+            self.remove(path, conn)
+        elif event.kind == events.MOVED:
+            dest = normalize(event.dest)
+            if dest is None or is_reserved(dest.split("/")):
+                self.remove(path, conn)
+            else:
+                self.move(path, dest, conn)
+                if not event.is_dir:
+                    self.update(dest, conn)
+        elif event.is_dir:
+            self.scan(path, conn)
+        elif not path.rpartition("/")[2].startswith(TEMP_PREFIX):
+            self.update(path, conn)
+
+
+checksum_index = ChecksumIndex()
+events.subscribe(checksum_index.handle_event)
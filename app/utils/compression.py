@@ -0,0 +1,269 @@
+"""Content negotiation of compressed responses, and the compressed copies of files.
+
+The encodings offered are `cfg.COMPRESSION`, in order of preference: "br"
+needs brotli and "zstd" needs zstandard, and they are skipped if those aren't
+installed, while "gzip" is always available. Small bodies and types that are
+already compressed (images, videos, archives) are sent as they are.
+
+The json of the API is compressed in memory, since it is small. Downloads are
+sent from compressed copies of the files (sidecars), written the first time
+each encoding of a file is requested and kept in `cfg.COMPRESSED_CACHE_PATH`,
+so the files requested often are compressed only once. They are named after
+the path, mtime and size of the file, like the previews, and the least
+recently used are removed when they take more than `cfg.COMPRESSED_CACHE_SIZE`
+bytes.
+
+The copies are written by a pool of `cfg.COMPRESS_WORKERS` threads, since the
+compressors release the GIL, so the first download of a file doesn't wait for
+the whole file to be compressed: it is sent as it is until its copy is ready.
+"""
+import hashlib
+import os
+import threading
+import zlib
+from concurrent.futures import Future, ThreadPoolExecutor
+from functools import partial
+
+from flask import request
+
+from app.config import cfg
+
+from .disk_cache import DiskCache, get_temp_path
+
+try:
+    import brotli
+except ImportError:  # "br" is not offered
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:  # "zstd" is not offered
+    zstandard = None
+
+EXTENSIONS = {"br": ".br", "gzip": ".gz", "zstd": ".zst"}
+
+_lock = threading.Lock()
+_executor = None
+_executor_pid = None
+
+COMPRESSIBLE_TYPES = frozenset(
+    [
+        "application/csv",
+        "application/javascript",
+        "application/json",
+        "application/ld+json",
+        "application/sql",
+        "application/x-ndjson",
+        "application/x-sh",
+        "application/x-yaml",
+        "application/xml",
+        "application/yaml",
+        "image/bmp",
+        "image/svg+xml",
+    ]
+)
+
+
+def is_compressible(mimetype):
+    """Checks if a type is text or another format that compresses well."""
+    if not mimetype:
+        return False
+    return (
+        mimetype.startswith("text/")
+        or mimetype in COMPRESSIBLE_TYPES
+        or mimetype.endswith(("+json", "+xml"))
+    )
+
+
+def get_encodings():
+    """Returns the encodings of `cfg.COMPRESSION` that are installed."""
+    available = {"br": brotli is not None, "gzip": True, "zstd": zstandard is not None}
+    return [x for x in cfg.COMPRESSION if available.get(x)]
+
+
+def choose_encoding():
+    """Returns the encoding of the request's Accept-Encoding that the app prefers, or None."""
+    encodings = get_encodings()
+    if not encodings:
+        return None
+    return request.accept_encodings.best_match(encodings)
+
+
+class _Brotli:
+    def __init__(self):
+        self._compressor = brotli.Compressor(quality=5)
+
+    def compress(self, data):
+        return self._compressor.process(data)
+
+    def flush(self):
+        return self._compressor.finish()
+
+
+def get_compressor(encoding):
+    """Returns an object that compresses a stream with `compress` and `flush`, like zlib."""
+    if encoding == "gzip":
+        # wbits 16 + 15 writes the gzip header and trailer
+        return zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    if encoding == "br":
+        return _Brotli()
+    if encoding == "zstd":
+        return zstandard.ZstdCompressor(level=3).compressobj()
+    raise ValueError("Unknown encoding: %r" % encoding)
+
+
+def compress(data, encoding):
+    compressor = get_compressor(encoding)
+    return compressor.compress(data) + compressor.flush()
+
+
+def compress_file(source, destination, encoding, chunk_size=1024 * 1024):
+    """Writes the compressed contents of `source` to `destination`.
+
+    The data is written to a temporary file and renamed, so readers never see
+    a partial copy.
+
+    Returns:
+        int: size of the compressed file in bytes.
+    """
+    temp = get_temp_path(destination)
+    compressor = get_compressor(encoding)
+    try:
+        with open(source, "rb") as src, open(temp, "wb") as dst:
+            for chunk in iter(lambda: src.read(chunk_size), b""):
+                dst.write(compressor.compress(chunk))
+            dst.write(compressor.flush())
+        os.replace(temp, destination)
+    except BaseException:
+        try:
+            os.remove(temp)
+        except FileNotFoundError:
+            pass
+        raise
+    return os.path.getsize(destination)
+
+
+def get_executor():
+    global _executor, _executor_pid
+
+    # The threads of the pool don't survive a fork
+    with _lock:
+        if _executor is None or _executor_pid != os.getpid():
+            _executor = ThreadPoolExecutor(
+                max_workers=cfg.COMPRESS_WORKERS, thread_name_prefix="compress"
+            )
+            _executor_pid = os.getpid()
+        return _executor
+
+
+def _submit(function, *args):
+    if cfg.COMPRESS_WORKERS:
+        return get_executor().submit(function, *args)
+
+    future = Future()
+    try:
+        future.set_result(function(*args))
+    except Exception as exc:
+        future.set_exception(exc)
+    return future
+
+
+def compress_response(response):
+    """Compresses the body of a response in memory, if the client accepts it.
+
+    Streamed responses and responses that are already encoded are left as
+    they are.
+    """
+    if (
+        not cfg.COMPRESSION
+        or response.direct_passthrough
+        or response.is_streamed
+        or response.status_code < 200
+        or response.status_code in (204, 206, 304)
+        or "Content-Encoding" in response.headers
+        or not is_compressible(response.mimetype)
+    ):
+        return response
+
+    response.vary.add("Accept-Encoding")
+    data = response.get_data()
+    encoding = choose_encoding()
+    if encoding is None or len(data) < cfg.COMPRESS_MIN_SIZE:
+        return response
+
+    response.set_data(compress(data, encoding))
+    response.headers["Content-Encoding"] = encoding
+    if response.headers.get("ETag"):
+        etag, weak = response.get_etag()
+        response.set_etag("%s-%s" % (etag, encoding), weak)
+    return response
+
+
+class SidecarCache(DiskCache):
+    """Compressed copies of the files of the cloud, at most `cfg.COMPRESSED_CACHE_SIZE` bytes."""
+
+    def __init__(self, path=None, maxsize=None):
+        super().__init__(path, maxsize)
+        self._pending = {}
+
+    def default_path(self):
+        return cfg.COMPRESSED_CACHE_PATH
+
+    def default_maxsize(self):
+        return cfg.COMPRESSED_CACHE_SIZE
+
+    @staticmethod
+    def get_name(path, st, encoding):
+        key = "%s\0%d\0%d" % (os.fspath(path), st.st_mtime_ns, st.st_size)
+        digest = hashlib.blake2b(key.encode("utf-8"), digest_size=16).hexdigest()
+        return digest + EXTENSIONS[encoding]
+
+    def get(self, path, st, encoding, wait=True):
+        """Returns the compressed copy of a file, compressing it if it isn't cached.
+
+        A file is compressed once at a time, concurrent requests share the
+        same compression.
+
+        Args:
+            path (Path): absolute path of the file.
+            st (os.stat_result): stat of the file, which identifies its version.
+            encoding (str): "gzip", "br" or "zstd".
+            wait (bool, optional): wait for the copy to be written. Defaults to
+                True.
+
+        Raises:
+            OSError: if the file can't be read or the copy can't be written.
+
+        Returns:
+            Path: the compressed copy, or None if it is still being written or
+                it is larger than the cache.
+        """
+        name = self.get_name(path, st, encoding)
+
+        # The lock is reentrant, since the copies written without workers are
+        # released by their callback while it is held
+        with self._lock:
+            sidecar = self.lookup(name)
+            if sidecar is not None:
+                return sidecar
+
+            future = self._pending.get(name)
+            if future is None:
+                self.path.mkdir(parents=True, exist_ok=True)
+                future = self._pending[name] = _submit(self._compress, name, path, encoding)
+                future.add_done_callback(partial(self._compressed, name))
+
+        if not wait and not future.done():
+            return None
+        return self.path / name if future.result() else None
+
+    def _compress(self, name, path, encoding):
+        size = compress_file(path, self.path / name, encoding, cfg.COMPRESS_CHUNK_SIZE)
+        return self.add(name, size)
+
+    def _compressed(self, name, future):
+        with self._lock:
+            self._pending.pop(name, None)
+
+
+sidecar_cache = SidecarCache()
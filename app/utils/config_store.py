@@ -0,0 +1,85 @@
+import os
+import stat
+import tempfile
+import threading
+
+from .fileops import FILE_MODE, set_file_mode
+
+
+class ConfigStore:
+    """Keeps the parsed contents of the config files in memory.
+
+    A file is parsed again only when its stat (mtime, size or inode) changes,
+    so every process notices the changes made by the others.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._cache = {}
+
+    def get(self, path, loader):
+        """Returns the contents of a config file.
+
+        Args:
+            path (Path): path of the file.
+            loader (callable): function that parses the file, given its path.
+
+        Returns:
+            any: value returned by `loader` the last time the file changed.
+        """
+        try:
+            stat = path.stat()
+            key = (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+        except FileNotFoundError:
+            key = None
+
+        with self._lock:
+            cached = self._cache.get(path)
+        if cached is not None and cached[0] == key:
+            return cached[1]
+
+        value = loader(path)
+        with self._lock:
+            self._cache[path] = (key, value)
+        return value
+
+    def invalidate(self, path):
+        with self._lock:
+            self._cache.pop(path, None)
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+
+
+def atomic_write_text(path, data):
+    """Replaces the contents of a file, so readers never see it half-written.
+
+    The data is written to a temporary file in the same folder and then
+    renamed over the original file, keeping its mode (or the mode of a new
+    file if it doesn't exist).
+    """
+    try:
+        mode = stat.S_IMODE(path.stat().st_mode)
+    except FileNotFoundError:
+        mode = FILE_MODE
+
+    fd, tmp_path = tempfile.mkstemp(
+        prefix="." + path.name + ".", suffix=".tmp", dir=path.parent
+    )
+    try:
+        set_file_mode(fd, mode)
+        with os.fdopen(fd, "wt") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except FileNotFoundError:
+            pass
+        raise
+
+
+config_store = ConfigStore()
@@ -0,0 +1,127 @@
+"""Folder of generated files bounded in bytes, like the previews.
+
+The files are removed least recently used first when they take more than the
+size of the cache. Their order is kept in their mtime, which is updated on
+every hit, so it survives restarts. Files being written end with
+`TEMP_SUFFIX` and are renamed once complete, so they are never listed.
+"""
+import os
+import threading
+from collections import OrderedDict
+from pathlib import Path
+
+TEMP_SUFFIX = ".tmp"
+
+
+def get_temp_path(path):
+    """Returns the path where a file of the cache is written before it is renamed."""
+    return "%s.%d-%d%s" % (path, os.getpid(), threading.get_ident(), TEMP_SUFFIX)
+
+
+class DiskCache:
+    """Files of a folder, at most `maxsize` bytes of them.
+
+    Subclasses give the defaults of the folder and the size, usually from the
+    config, in `default_path` and `default_maxsize`.
+    """
+
+    def __init__(self, path=None, maxsize=None):
+        self._path = path
+        self._maxsize = maxsize
+        self._lock = threading.RLock()
+        self._files = None
+        self._total = 0
+
+    def default_path(self):
+        raise NotImplementedError
+
+    def default_maxsize(self):
+        raise NotImplementedError
+
+    @property
+    def path(self):
+        return Path(self._path or self.default_path())
+
+    @property
+    def maxsize(self):
+        return self._maxsize if self._maxsize is not None else self.default_maxsize()
+
+    def lookup(self, name):
+        """Returns the path of a file of the cache and marks it as used, or None."""
+        with self._lock:
+            self._load()
+            path = self.path / name
+            if name not in self._files:
+                return None
+            if not path.exists():
+                self._total -= self._files.pop(name)
+                return None
+
+            self._files.move_to_end(name)
+            try:
+                os.utime(path)
+            except OSError:
+                pass
+            return path
+
+    def add(self, name, size):
+        """Registers a file written in the cache, removing the old ones if it is full.
+
+        A file larger than the whole cache is removed instead.
+
+        Returns:
+            bool: whether the file was kept.
+        """
+        with self._lock:
+            self._load()
+            self._total -= self._files.pop(name, 0)
+            if size > self.maxsize:
+                _remove(self.path / name)
+                return False
+
+            self._total += size
+            self._files[name] = size
+            self._evict()
+            return True
+
+    def clear(self):
+        """Forgets the files, which are listed again on the next lookup."""
+        with self._lock:
+            self._files = None
+            self._total = 0
+
+    def _load(self):
+        if self._files is not None:
+            return
+
+        files = []
+        try:
+            with os.scandir(self.path) as iterator:
+                for entry in iterator:
+                    if entry.name.endswith(TEMP_SUFFIX):
+                        continue
+                    try:
+                        st = entry.stat()
+                    except OSError:
+                        continue
+                    files.append((st.st_mtime_ns, entry.name, st.st_size))
+        except FileNotFoundError:
+            pass
+
+        files.sort()
+        self._files = OrderedDict((name, size) for _, name, size in files)
+        self._total = sum(self._files.values())
+
+    def _evict(self):
+        maxsize = self.maxsize
+        while self._total > maxsize and self._files:
+            name, size = self._files.popitem(last=False)
+            self._total -= size
+            _remove(self.path / name)
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
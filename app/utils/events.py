@@ -0,0 +1,56 @@
+"""Notifications of changes made to the files of the cloud.
+
+Both the routes and the filesystem watcher publish events here, and the
+in-memory indexes subscribe to keep themselves up to date. Paths are always
+relative to `cfg.CLOUD_PATH`.
+"""
+import threading
+import warnings
+from collections import namedtuple
+
+from .exceptions import WatcherWarning
+
+CREATED = "created"
+DELETED = "deleted"
+MODIFIED = "modified"
+MOVED = "moved"
+RESCAN = "rescan"
+
+Event = namedtuple("Event", ["kind", "path", "dest", "is_dir", "user"], defaults=[None])
+
+_subscribers = []
+_lock = threading.Lock()
+
+
+def subscribe(callback):
+    with _lock:
+        if callback not in _subscribers:
+            _subscribers.append(callback)
+    return callback
+
+
+def unsubscribe(callback):
+    with _lock:
+        if callback in _subscribers:
+            _subscribers.remove(callback)
+
+
+def publish(kind, path, dest=None, is_dir=False, user=None):
+    """Sends an event to every subscriber.
+
+    Args:
+        kind (str): one of CREATED, DELETED, MODIFIED, MOVED or RESCAN.
+        path (str | Path): path affected, relative to the cloud folder.
+        dest (str | Path, optional): destination of a MOVED event. Defaults to None.
+        is_dir (bool, optional): the path is a folder. Defaults to False.
+        user (str, optional): user that made the change, if known. Defaults to None.
+    """
+    event = Event(kind, path, dest, is_dir, user)
+    with _lock:
+        subscribers = list(_subscribers)
+
+    for callback in subscribers:
+        try:
+            callback(event)
+        except Exception as exc:
+            warnings.warn(f"error handling {event}: {exc!r}", WatcherWarning)
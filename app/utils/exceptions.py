@@ -12,3 +12,31 @@ class SudoersWarning(CloudWarning):
 
 class IngoredWarning(CloudWarning):
     """Ignored warning."""
+
+
+class WatcherWarning(CloudWarning):
+    """Watcher warning."""
+
+
+class UploadError(CloudError):
+    """Upload error."""
+
+
+class IndexWarning(CloudWarning):
+    """Index warning."""
+
+
+class JobError(CloudError):
+    """Job error."""
+
+
+class JobWarning(CloudWarning):
+    """Job warning."""
+
+
+class QuotaError(CloudError):
+    """Quota error."""
+
+
+class PreviewError(CloudError):
+    """Preview error."""
@@ -0,0 +1,119 @@
+import errno
+import os
+import shutil
+
+# Errors raised by copy_file_range and sendfile when the kernel or the
+# filesystems involved don't support them
+_UNSUPPORTED = {errno.EXDEV, errno.ENOSYS, errno.EOPNOTSUPP, errno.EINVAL, errno.EBADF}
+
+
+def _read_umask():
+    # The umask can only be read by replacing it
+    umask = os.umask(0o022)
+    os.umask(umask)
+    return umask
+
+
+# Mode of the files created by open(): tempfile.mkstemp creates them with 0600
+FILE_MODE = 0o666 & ~_read_umask()
+
+
+def copy_range(src, dst, count=None, block_size=16 * 1024 * 1024):
+    """Copies data between two open files without passing it through Python.
+
+    The data is copied from the current position of `src` to the current
+    position of `dst`, with `os.copy_file_range` (which can share the blocks
+    on filesystems with reflinks), `os.sendfile` or, if neither is available,
+    with a regular buffered copy.
+
+    Args:
+        src (file): file opened for reading.
+        dst (file): file opened for writing.
+        count (int, optional): bytes to copy. Defaults to None (until EOF).
+        block_size (int, optional): bytes copied by each system call.
+
+    Returns:
+        int: bytes copied.
+    """
+    dst.flush()
+    src_fd = src.fileno()
+    dst_fd = dst.fileno()
+    copied = 0
+
+    for copy in (_copy_file_range, _sendfile):
+        try:
+            copied += copy(src_fd, dst_fd, count, block_size)
+            return copied
+        except _PartialCopy as exc:
+            copied += exc.copied
+            if count is not None:
+                count -= exc.copied
+
+    src.seek(os.lseek(src_fd, 0, os.SEEK_CUR))
+    dst.seek(os.lseek(dst_fd, 0, os.SEEK_CUR))
+    remaining = count
+    while remaining is None or remaining > 0:
+        size = block_size if remaining is None else min(block_size, remaining)
+        data = src.read(size)
+        if not data:
+            break
+        dst.write(data)
+        copied += len(data)
+        if remaining is not None:
+            remaining -= len(data)
+    dst.flush()
+    return copied
+
+
+class _PartialCopy(Exception):
+    def __init__(self, copied):
+        super().__init__(copied)
+        self.copied = copied
+
+
+def _copy_loop(function, count, block_size):
+    copied = 0
+    while count is None or copied < count:
+        size = block_size if count is None else min(block_size, count - copied)
+        try:
+            done = function(size)
+        except AttributeError:
+            raise _PartialCopy(copied)
+        except OSError as exc:
+            if exc.errno in _UNSUPPORTED:
+                raise _PartialCopy(copied)
+            raise
+        if done == 0:
+            break
+        copied += done
+    return copied
+
+
+def _copy_file_range(src_fd, dst_fd, count, block_size):
+    return _copy_loop(
+        lambda size: os.copy_file_range(src_fd, dst_fd, size), count, block_size
+    )
+
+
+def _sendfile(src_fd, dst_fd, count, block_size):
+    return _copy_loop(
+        lambda size: os.sendfile(dst_fd, src_fd, None, size), count, block_size
+    )
+
+
+def set_file_mode(fd, mode=FILE_MODE):
+    """Gives a file created by `tempfile.mkstemp` the mode of a regular new file."""
+    # Windows has no fchmod, and its files have no other permissions anyway
+    if hasattr(os, "fchmod"):
+        os.fchmod(fd, mode)
+
+
+def remove_path(path):
+    """Removes a file or a folder tree, if it exists."""
+    try:
+        if os.path.isdir(path) and not os.path.islink(path):
+            shutil.rmtree(path)
+        else:
+            os.remove(path)
+    except FileNotFoundError:
+        pass
@@ -0,0 +1,409 @@
+import os
+import threading
+from bisect import bisect_left, bisect_right
+from collections import namedtuple
+from pathlib import Path, PurePosixPath
+from time import monotonic
+
+from app.config import cfg
+
+from . import events
+from .ignore_matcher import IgnoreMatcher
+from .metrics import FOLDER_WALK_DURATION, FOLDERS
+
+NO_MATCHER = IgnoreMatcher(())
+
+Subfolder = namedtuple("Subfolder", ["name", "id", "has_children"])
+
+
+class _Node:
+    __slots__ = ("children", "listed", "parent", "name", "id", "keys")
+
+    def __init__(self, listed=True, parent=None, name=None):
+        self.children = {}
+        self.listed = listed
+        self.parent = parent
+        self.name = name
+        self.id = None
+        # Names of the children sorted ignoring case, built when first listed
+        self.keys = None
+
+    def sorted_keys(self):
+        if self.keys is None:
+            self.keys = sorted((x.casefold(), x) for x in self.children)
+        return self.keys
+
+
+def get_folder_id(stat):
+    """Returns the id of a folder from its stat: its device and inode, in hex.
+
+    The id doesn't change when the folder is renamed or moved inside the same
+    filesystem, and it is the same in every process serving the cloud.
+    """
+    return "%x-%x" % (stat.st_dev, stat.st_ino)
+
+
+def is_reserved(parts):
+    """Checks if a path is inside a folder used internally by the app."""
+    return not cfg.RESERVED_DIRNAMES.isdisjoint(parts)
+
+
+def split_path(relpath):
+    """Splits a path relative to the cloud into its parts.
+
+    Args:
+        relpath (str | Path): path relative to the cloud folder.
+
+    Returns:
+        tuple: parts of the normalized path, or None if it points outside the cloud.
+    """
+    posix = os.path.normpath(PurePosixPath(relpath).as_posix()).replace(os.sep, "/")
+    if posix == ".":
+        return ()
+    if posix.startswith("/") or posix == ".." or posix.startswith("../"):
+        return None
+    return tuple(posix.split("/"))
+
+
+class FolderTree:
+    """In-memory index of the folders of the cloud.
+
+    The tree is built with a single walk of the cloud and then kept up to date
+    with the events published by the routes and the watcher. It is rebuilt when
+    it is older than `cfg.FOLDER_TREE_MAX_AGE` seconds, unless a watcher is
+    keeping it live, or when it is invalidated.
+
+    Folders matched by the ignore matcher or reserved by the app are pruned
+    during the walk, so their subtrees are never traversed. Changing the
+    matcher rebuilds the tree.
+
+    Every folder has a stable id (see `get_folder_id`), indexed so `resolve` finds
+    it without listing the tree.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._root = None
+        self._cloud_path = None
+        self._live_path = None
+        self._matcher = NO_MATCHER
+        self._built_at = 0.0
+        self._listing = None
+        self._ids = {}
+        self.version = 0
+
+    @property
+    def is_built(self):
+        return self._root is not None
+
+    def invalidate(self):
+        with self._lock:
+            self._root = None
+            self._listing = None
+            self._ids = {}
+            self.version += 1
+
+    def set_live(self, cloud_path):
+        """Marks the tree of `cloud_path` as watched, so it never expires."""
+        self._live_path = cloud_path
+
+    def is_stale(self, cloud_path, matcher=NO_MATCHER):
+        if self._root is None or self._cloud_path != cloud_path:
+            return True
+        if self._matcher.patterns != matcher.patterns:
+            return True
+        if self._live_path == cloud_path:
+            return False
+
+        max_age = cfg.FOLDER_TREE_MAX_AGE
+        if max_age is None:
+            return False
+        return monotonic() - self._built_at >= max_age
+
+    def get_folders(self, cloud_path, matcher=NO_MATCHER):
+        """Returns the sorted list of folders of the cloud, relative to `cloud_path`."""
+        with self._lock:
+            if self.is_stale(cloud_path, matcher):
+                self.build(cloud_path, matcher)
+
+            if self._listing is None:
+                self._listing = list(self._iter_listed(self._root, ()))
+            return list(self._listing)
+
+    def get_id(self, relpath):
+        """Returns the id of a folder of the tree, or None if it isn't in it."""
+        parts = split_path(relpath)
+        with self._lock:
+            node = self._find(parts) if parts is not None else None
+            return node.id if node is not None else None
+
+    def get_subfolders(
+        self,
+        cloud_path,
+        relpath,
+        matcher=NO_MATCHER,
+        prefix="",
+        cursor=None,
+        limit=100,
+        accept=None,
+    ):
+        """Returns a page of the subfolders of a folder, sorted by name ignoring case.
+
+        Only the children of the folder are read, and their sorted names are
+        kept in its node until they change, so the cost doesn't depend on the
+        size of the rest of the tree.
+
+        Args:
+            cloud_path (Path): path of the cloud.
+            relpath (str | Path): folder relative to `cloud_path`.
+            matcher (IgnoreMatcher, optional): ignored patterns.
+            prefix (str, optional): start of the names, ignoring case. Defaults to "".
+            cursor (str, optional): name of the last subfolder of the previous
+                page. Defaults to None (first page).
+            limit (int, optional): maximum number of subfolders. Defaults to 100.
+            accept (callable, optional): filter of the subfolders, which receives
+                their name. Defaults to None.
+
+        Returns:
+            tuple: list of `Subfolder` and the cursor of the next page (None if
+                this is the last one), or None if the folder isn't in the tree.
+        """
+        parts = split_path(relpath)
+        if parts is None:
+            return None
+
+        with self._lock:
+            if self.is_stale(cloud_path, matcher):
+                self.build(cloud_path, matcher)
+
+            node = self._find(parts)
+            if node is None:
+                return None
+
+            keys = node.sorted_keys()
+            prefix = prefix.casefold()
+            index = bisect_left(keys, (prefix,))
+            if cursor is not None:
+                index = max(index, bisect_right(keys, (cursor.casefold(), cursor)))
+
+            subfolders = []
+            while index < len(keys) and len(subfolders) < limit:
+                if not keys[index][0].startswith(prefix):
+                    break
+                name = keys[index][1]
+                child = node.children[name]
+                index += 1
+                if child.listed and (accept is None or accept(name)):
+                    subfolders.append(Subfolder(name, child.id, bool(child.children)))
+
+            more = index < len(keys) and keys[index][0].startswith(prefix)
+            return subfolders, keys[index - 1][1] if more else None
+
+    def resolve(self, cloud_path, folder_id, matcher=NO_MATCHER):
+        """Returns the listed folder with the given id, relative to `cloud_path`.
+
+        The folder is found through the index of ids and checked with a single
+        stat, so it is None if it was removed or replaced by another one.
+        """
+        with self._lock:
+            if self.is_stale(cloud_path, matcher):
+                self.build(cloud_path, matcher)
+
+            node = self._ids.get(folder_id)
+            if node is None or not node.listed:
+                return None
+            parts = []
+            while node.parent is not None:
+                parts.append(node.name)
+                node = node.parent
+            if node is not self._root:
+                return None
+
+        relpath = Path(*reversed(parts))
+        try:
+            stat = os.stat(cloud_path / relpath)
+        except OSError:
+            return None
+        return relpath if folder_id == get_folder_id(stat) else None
+
+    def build(self, cloud_path, matcher=NO_MATCHER):
+        # Holding the lock during the walk keeps events from being applied to
+        # the tree that is being replaced.
+        with self._lock, FOLDER_WALK_DURATION.time():
+            root = _Node(listed=False)
+            ids = {}
+            count = 0
+            for dirpath, dirnames, _ in os.walk(cloud_path, followlinks=True):
+                dirnames[:] = [x for x in dirnames if x not in cfg.RESERVED_DIRNAMES]
+                parts = Path(dirpath).relative_to(cloud_path).parts
+                if matcher and matcher.matches(Path(*parts).as_posix()):
+                    if parts:
+                        dirnames[:] = []
+                        continue
+                    # The root can't be pruned, only hidden
+                    node = self._insert(root, parts)
+                else:
+                    node = self._insert(root, parts)
+                    node.listed = True
+                self._register(node, dirpath, ids)
+                count += 1
+
+            FOLDERS.set(count)
+            self._root = root
+            self._ids = ids
+            self._cloud_path = cloud_path
+            self._matcher = matcher
+            self._built_at = monotonic()
+            self._listing = None
+            self.version += 1
+
+    def add(self, relpath):
+        """Registers a new folder (and its parents) in the tree."""
+        parts = split_path(relpath)
+        if parts is None or is_reserved(parts):
+            return
+
+        with self._lock:
+            if self._root is None:
+                return
+
+            node = self._root
+            for index, part in enumerate(parts, 1):
+                if self._matcher.matches("/".join(parts[:index])):
+                    break
+                node = self._insert(node, (part,))
+                node.listed = True
+                if node.id is None:
+                    path = Path(self._cloud_path).joinpath(*parts[:index])
+                    self._register(node, path, self._ids)
+            self._changed()
+
+    def remove(self, relpath):
+        """Removes a folder and all its subfolders from the tree."""
+        parts = split_path(relpath)
+        if not parts:
+            return
+
+        with self._lock:
+            parent = self._find(parts[:-1])
+            node = parent.children.pop(parts[-1], None) if parent is not None else None
+            if node is None:
+                return
+            parent.keys = None
+            self._unregister(node)
+            self._changed()
+
+    def move(self, src, dst):
+        """Moves the subtree of the folder `src` to `dst`."""
+        src_parts = split_path(src)
+        dst_parts = split_path(dst)
+        if not src_parts or not dst_parts:
+            return
+
+        with self._lock:
+            src_parent = self._find(src_parts[:-1])
+            if src_parent is None or src_parts[-1] not in src_parent.children:
+                return
+
+            node = src_parent.children.pop(src_parts[-1])
+            src_parent.keys = None
+            self._changed()
+            # Like in a walk, nothing under an ignored folder is kept
+            if is_reserved(dst_parts) or any(
+                self._matcher.matches("/".join(dst_parts[:index]))
+                for index in range(1, len(dst_parts) + 1)
+            ):
+                self._unregister(node)
+                return
+
+            # The folder keeps its id, only its place in the tree changes
+            dst_parent = self._insert(self._root, dst_parts[:-1])
+            dst_parent.children[dst_parts[-1]] = node
+            dst_parent.keys = None
+            node.parent = dst_parent
+            node.name = dst_parts[-1]
+            self._relist(node, dst_parts)
+            self._changed()
+
+    def handle_event(self, event):
+        if event.kind == events.RESCAN:
+            self.invalidate()
+        elif not event.is_dir:
+            return
+        elif event.kind == events.CREATED:
+            self.add(event.path)
+        elif event.kind == events.DELETED:
+            self.remove(event.path)
+        elif event.kind == events.MOVED:
+            self.move(event.path, event.dest)
+
+    def _changed(self):
+        self._listing = None
+        self.version += 1
+
+    def _find(self, parts):
+        node = self._root
+        for part in parts:
+            if node is None:
+                return None
+            node = node.children.get(part)
+        return node
+
+    @staticmethod
+    def _insert(root, parts):
+        node = root
+        for part in parts:
+            child = node.children.get(part)
+            if child is None:
+                child = node.children[part] = _Node(listed=False, parent=node, name=part)
+                node.keys = None
+            node = child
+        return node
+
+    @staticmethod
+    def _register(node, path, ids):
+        try:
+            node.id = get_folder_id(os.stat(path))
+        except OSError:
+            return
+        # Links to an indexed folder share its id, the first one found keeps it
+        ids.setdefault(node.id, node)
+
+    def _unregister(self, node):
+        stack = [node]
+        while stack:
+            node = stack.pop()
+            if node.id is not None and self._ids.get(node.id) is node:
+                del self._ids[node.id]
+            stack.extend(node.children.values())
+
+    def _relist(self, node, parts):
+        # The patterns match whole paths, so the new path of a moved folder may
+        # ignore some of its subfolders
+        node.listed = True
+        if not self._matcher:
+            return
+
+        stack = [(node, parts)]
+        while stack:
+            node, parts = stack.pop()
+            for name, child in list(node.children.items()):
+                child_parts = parts + (name,)
+                if self._matcher.matches("/".join(child_parts)):
+                    del node.children[name]
+                    node.keys = None
+                    self._unregister(child)
+                else:
+                    child.listed = True
+                    stack.append((child, child_parts))
+
+    def _iter_listed(self, node, parts):
+        if node.listed:
+            yield Path(*parts)
+
+        for name in sorted(node.children):
+            yield from self._iter_listed(node.children[name], parts + (name,))
+
+
+folder_tree = FolderTree()
+events.subscribe(folder_tree.handle_event)
@@ -0,0 +1,55 @@
+import re
+import warnings
+from functools import lru_cache
+
+from .exceptions import IngoredWarning
+
+
+class IgnoreMatcher:
+    """Matches paths against every ignored pattern at once.
+
+    The patterns are joined into a single regex, so checking a folder costs one
+    search instead of one per pattern. If the patterns can't be combined (for
+    example, they use backreferences), each one is compiled on its own.
+    """
+
+    def __init__(self, patterns):
+        self.patterns = tuple(patterns)
+        self._regexes = []
+
+        if not self.patterns:
+            return
+
+        try:
+            combined = "|".join("(?:%s)" % x for x in self.patterns)
+            self._regexes = [re.compile(combined, re.IGNORECASE)]
+        except re.error:
+            for pattern in self.patterns:
+                try:
+                    self._regexes.append(re.compile(pattern, re.IGNORECASE))
+                except re.error as exc:
+                    msg = f"invalid ignored pattern {pattern!r}: {exc}"
+                    warnings.warn(msg, IngoredWarning)
+
+    def __bool__(self):
+        return bool(self._regexes)
+
+    def matches(self, relpath):
+        """Checks if a path relative to the cloud must be ignored.
+
+        Args:
+            relpath (str): posix path relative to the cloud folder.
+
+        Returns:
+            bool: True if any ignored pattern matches the path.
+        """
+        for regex in self._regexes:
+            if regex.search(relpath):
+                return True
+        return False
+
+
+@lru_cache(maxsize=16)
+def compile_ignored(patterns):
+    """Returns the matcher of a tuple of patterns, compiled only once."""
+    return IgnoreMatcher(patterns)
@@ -0,0 +1,352 @@
+"""Jobs run in the background, outside of the requests.
+
+Each job is described by a json file in `cfg.JOBS_PATH`, so its status can be
+checked from any worker process. A job is run by a thread of the process that
+submitted it, or by the periodic sweep of any process if it was delayed with
+`run_at` or its process exited before running it. An flock on a lock file
+makes sure that only one process runs each job. The kernel releases it when
+its process dies, so the sweep runs again a job left running by a process
+that died.
+"""
+import atexit
+import json
+import os
+import queue
+import re
+import threading
+import uuid
+import warnings
+from time import monotonic, time
+
+from app.config import cfg
+
+from .config_store import atomic_write_text
+from .exceptions import JobError, JobWarning
+
+try:
+    import fcntl
+except ImportError:  # Windows, the lock is the existence of the file
+    fcntl = None
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+
+FINISHED = frozenset([DONE, FAILED, CANCELLED])
+
+JOB_ID_RE = re.compile(r"^[0-9a-f]{32}$")
+
+_STOP = object()
+_SWEEP = object()
+
+
+class Job:
+    """Job of type `kind`, run by the handler registered for it.
+
+    Args:
+        id (str): identifier of the job.
+        kind (str): type of the job.
+        data (dict, optional): arguments of the handler.
+        user (str, optional): user that started the job.
+        status (str, optional): "queued", "running", "done", "failed" or
+            "cancelled".
+        created (float, optional): timestamp of the creation of the job.
+        run_at (float, optional): timestamp before which the job is not run.
+        started (float, optional): timestamp of the start of the job.
+        finished (float, optional): timestamp of the end of the job.
+        error (str, optional): error of a failed job.
+        result (any, optional): value returned by the handler.
+        progress (dict, optional): progress reported by the handler.
+    """
+
+    def __init__(
+        self,
+        id,
+        kind,
+        data=None,
+        user=None,
+        status=QUEUED,
+        created=None,
+        run_at=None,
+        started=None,
+        finished=None,
+        error=None,
+        result=None,
+        progress=None,
+    ):
+        self.id = id
+        self.kind = kind
+        self.data = data or {}
+        self.user = user
+        self.status = status
+        self.created = created or time()
+        self.run_at = run_at or self.created
+        self.started = started
+        self.finished = finished
+        self.error = error
+        self.result = result
+        self.progress = progress
+        self._lock_fd = None
+
+    @classmethod
+    def new(cls, kind, data=None, user=None, delay=0):
+        """Returns a job that hasn't been saved yet."""
+        created = time()
+        return cls(uuid.uuid4().hex, kind, data, user, created=created, run_at=created + delay)
+
+    @classmethod
+    def load(cls, job_id):
+        """Returns the job with the given id.
+
+        Raises:
+            JobError: if the job doesn't exist.
+        """
+        if not JOB_ID_RE.match(job_id):
+            raise JobError("Invalid job id: %r" % job_id)
+
+        try:
+            data = json.loads(get_job_path(job_id).read_text())
+        except (FileNotFoundError, json.JSONDecodeError):
+            raise JobError("Job %r not found" % job_id)
+        return cls(**data)
+
+    @property
+    def is_due(self):
+        return self.status == QUEUED and self.run_at <= time()
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "kind": self.kind,
+            "data": self.data,
+            "user": self.user,
+            "status": self.status,
+            "created": self.created,
+            "run_at": self.run_at,
+            "started": self.started,
+            "finished": self.finished,
+            "error": self.error,
+            "result": self.result,
+            "progress": self.progress,
+        }
+
+    def save(self):
+        path = get_job_path(self.id)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        atomic_write_text(path, json.dumps(self.to_dict()))
+
+    def claim(self):
+        """Takes the job if it is still queued, so no other process runs it.
+
+        A job that is running can be taken too if its lock is free, as the
+        process that was running it died.
+
+        Returns:
+            bool: True if the job was taken and has to be released.
+        """
+        path = get_lock_path(self.id)
+        if fcntl is None:
+            try:
+                os.close(os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o644))
+            except FileExistsError:
+                return False
+            claimable = (QUEUED,)
+        else:
+            fd = os.open(path, os.O_WRONLY | os.O_CREAT, 0o644)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                os.close(fd)
+                return False
+            self._lock_fd = fd
+            claimable = (QUEUED, RUNNING)
+
+        # Another process may have run it before the lock was taken
+        try:
+            self.status = Job.load(self.id).status
+        except JobError:
+            self.status = CANCELLED
+        if self.status not in claimable:
+            self.release()
+            return False
+        return True
+
+    def release(self):
+        # The status is final when the lock is released, so a process that
+        # locks the removed file meanwhile won't run the job
+        try:
+            os.remove(get_lock_path(self.id))
+        except FileNotFoundError:
+            pass
+        if self._lock_fd is not None:
+            os.close(self._lock_fd)
+            self._lock_fd = None
+
+    def finish(self, status, error=None, result=None):
+        """Saves the final status of a claimed job and releases it."""
+        self.status = status
+        self.error = error
+        self.result = result
+        self.finished = time()
+        self.save()
+        self.release()
+
+
+def get_job_path(job_id):
+    return cfg.JOBS_PATH / (job_id + ".json")
+
+
+def get_lock_path(job_id):
+    return cfg.JOBS_PATH / (job_id + ".lock")
+
+
+class JobRunner:
+    """Runs the jobs in a background thread, started once per process."""
+
+    def __init__(self):
+        self._handlers = {}
+        self._lock = threading.Lock()
+        self._queue = queue.Queue()
+        self._thread = None
+        self._pid = None
+
+    def register(self, kind):
+        """Decorator that registers the handler of the jobs of type `kind`.
+
+        The handler receives the job, and its return value (which must be
+        serializable to json) is saved as the result of the job.
+        """
+
+        def decorator(handler):
+            self._handlers[kind] = handler
+            return handler
+
+        return decorator
+
+    @property
+    def is_running(self):
+        return self._thread is not None and self._pid == os.getpid()
+
+    def submit(self, job):
+        """Saves a job and runs it as soon as possible (or at its `run_at`)."""
+        job.save()
+        self.start()
+        if job.run_at <= time():
+            self._queue.put(job.id)
+        return job
+
+    def start(self):
+        with self._lock:
+            if self.is_running:
+                return
+            self._queue = queue.Queue()
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name="JobRunner", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is not None and self._pid == os.getpid():
+            self._queue.put(_STOP)
+            thread.join()
+
+    def join(self, timeout=None):
+        """Blocks until the worker has processed every pending item."""
+        if not self.is_running:
+            return True
+        done = threading.Event()
+        self._queue.put(done)
+        return done.wait(timeout)
+
+    def request_sweep(self):
+        self._queue.put(_SWEEP)
+
+    def run(self, job_id):
+        """Runs a queued job (or one left running by a dead process), unless another
+        process is running it.
+
+        Returns:
+            Job: the job, or None if it doesn't exist.
+        """
+        try:
+            job = Job.load(job_id)
+        except JobError:
+            return None
+        if not job.claim():
+            return job
+
+        job.status = RUNNING
+        job.started = time()
+        job.save()
+
+        try:
+            handler = self._handlers.get(job.kind)
+            if handler is None:
+                raise JobError("Unknown job kind: %r" % job.kind)
+            result = handler(job)
+        except Exception as exc:  # pylint: disable=broad-except
+            # The error is reported in the status of the job
+            job.finish(FAILED, error=str(exc) or repr(exc))
+        else:
+            job.finish(DONE, result=result)
+        return job
+
+    def sweep(self):
+        """Runs the due jobs and removes the finished ones older than `cfg.JOB_TTL`.
+
+        Returns:
+            int: number of jobs run.
+        """
+        try:
+            paths = list(cfg.JOBS_PATH.glob("*.json"))
+        except FileNotFoundError:
+            return 0
+
+        limit = time() - cfg.JOB_TTL
+        run = 0
+        for path in paths:
+            try:
+                job = Job.load(path.stem)
+            except JobError:
+                continue
+
+            # The running jobs are only taken if their process died
+            if job.is_due or job.status == RUNNING:
+                job = self.run(job.id)
+                run += job is not None and job.status in FINISHED
+            elif job.status in FINISHED and job.finished < limit:
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+        return run
+
+    def _run(self):
+        next_sweep = monotonic()
+        while True:
+            try:
+                item = self._queue.get(timeout=max(next_sweep - monotonic(), 0))
+            except queue.Empty:
+                item = _SWEEP
+
+            if item is _STOP:
+                break
+            if isinstance(item, threading.Event):
+                item.set()
+                continue
+
+            try:
+                if item is _SWEEP:
+                    self.sweep()
+                    next_sweep = monotonic() + cfg.JOBS_SWEEP_INTERVAL
+                else:
+                    self.run(item)
+            except OSError as exc:
+                warnings.warn(f"job runner error: {exc!r}", JobWarning)
+
+
+job_runner = JobRunner()
+atexit.register(job_runner.stop)
@@ -0,0 +1,181 @@
+import atexit
+import os
+import queue
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from time import monotonic
+
+from app.config import cfg
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+_STOP = object()
+
+
+class LogWriter:
+    """Writes the log lines to a file from a background thread.
+
+    The lines are queued and written in batches, with a single `os.write` on a
+    file descriptor opened with O_APPEND, so the lines of different processes
+    are never interleaved. The batch is written when it reaches `buffer_size`
+    bytes, after `flush_interval` seconds or when the process exits.
+
+    If `max_bytes` is set, the file is rotated (web.log -> web.log.1 -> ...)
+    when it grows beyond it. The rotation is done under a lock file, and
+    the other processes reopen the log file when they detect it.
+    """
+
+    def __init__(
+        self, path, buffer_size=None, flush_interval=None, max_bytes=None, backup_count=None
+    ):
+        self.path = Path(path)
+        self.buffer_size = buffer_size or cfg.LOG_BUFFER_SIZE
+        self.flush_interval = flush_interval or cfg.LOG_FLUSH_INTERVAL
+        self.max_bytes = cfg.LOG_MAX_BYTES if max_bytes is None else max_bytes
+        self.backup_count = cfg.LOG_BACKUP_COUNT if backup_count is None else backup_count
+
+        self._lock = threading.Lock()
+        self._queue = queue.Queue()
+        self._thread = None
+        self._pid = None
+        self._fd = None
+
+    def write(self, line):
+        self._ensure_started()
+        # Encoded here, so the batches are measured in bytes
+        self._queue.put(line.encode("utf-8"))
+
+    def qsize(self):
+        return self._queue.qsize()
+
+    def flush(self, timeout=None):
+        """Blocks until every line queued so far has been written."""
+        if self._thread is None or self._pid != os.getpid():
+            return True
+        done = threading.Event()
+        self._queue.put(done)
+        return done.wait(timeout)
+
+    def close(self):
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is not None and self._pid == os.getpid():
+            self._queue.put(_STOP)
+            thread.join()
+
+    def _ensure_started(self):
+        # The thread doesn't survive a fork, so each worker process starts its own
+        if self._thread is not None and self._pid == os.getpid():
+            return
+
+        with self._lock:
+            if self._thread is not None and self._pid == os.getpid():
+                return
+
+            self._queue = queue.Queue()
+            self._fd = None
+            self._pid = os.getpid()
+            self._thread = threading.Thread(
+                target=self._run, name="LogWriter", daemon=True
+            )
+            self._thread.start()
+
+    def _run(self):
+        buffer = []
+        size = 0
+        deadline = None
+
+        while True:
+            timeout = None if deadline is None else max(deadline - monotonic(), 0)
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                item = None
+
+            if isinstance(item, bytes):
+                buffer.append(item)
+                size += len(item)
+                if deadline is None:
+                    deadline = monotonic() + self.flush_interval
+                if size < self.buffer_size:
+                    continue
+
+            if buffer:
+                self._write(b"".join(buffer))
+                buffer = []
+                size = 0
+            deadline = None
+
+            if isinstance(item, threading.Event):
+                item.set()
+            elif item is _STOP:
+                break
+
+        self._close_fd()
+
+    def _write(self, data):
+        try:
+            if self._fd is None or self._was_rotated():
+                self._reopen()
+            if self.max_bytes and os.fstat(self._fd).st_size + len(data) > self.max_bytes:
+                self._rotate()
+
+            while data:
+                written = os.write(self._fd, data)
+                data = data[written:]
+        except OSError:
+            # Logging must never break the app, the lines are lost
+            self._close_fd()
+
+    def _reopen(self):
+        self._close_fd()
+        flags = os.O_WRONLY | os.O_APPEND | os.O_CREAT | getattr(os, "O_CLOEXEC", 0)
+        self._fd = os.open(self.path, flags, 0o644)
+
+    def _close_fd(self):
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+    def _was_rotated(self):
+        try:
+            return os.stat(self.path).st_ino != os.fstat(self._fd).st_ino
+        except FileNotFoundError:
+            return True
+
+    def _rotate(self):
+        with self._rotation_lock():
+            # Another process may have rotated the file while we were waiting
+            if not self._was_rotated():
+                for index in range(self.backup_count - 1, 0, -1):
+                    src = self.path.with_name("%s.%d" % (self.path.name, index))
+                    if src.exists():
+                        os.replace(src, src.with_name("%s.%d" % (self.path.name, index + 1)))
+
+                if self.backup_count:
+                    os.replace(self.path, self.path.with_name(self.path.name + ".1"))
+                else:
+                    os.truncate(self.path, 0)
+            self._reopen()
+
+    @contextmanager
+    def _rotation_lock(self):
+        if fcntl is None:
+            yield
+            return
+
+        lock_path = self.path.with_name(self.path.name + ".lock")
+        with open(lock_path, "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+log_writer = LogWriter(cfg.LOG_PATH)
+atexit.register(log_writer.close)
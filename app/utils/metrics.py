@@ -0,0 +1,215 @@
+"""Metrics of the app, exposed in the Prometheus text format by /metrics.
+
+The metrics are kept in memory by each process, like the log writer and the
+indexes, so with several workers every one of them has to be scraped (or the
+metrics of the one that answers are seen). Updating a metric takes a lock and
+a dict lookup, so it is cheap enough to do on every request.
+"""
+import bisect
+import math
+import threading
+from time import perf_counter
+
+from .log_writer import log_writer
+
+# Seconds, like the default buckets of the Prometheus clients
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _format_value(value):
+    if value == math.inf:
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value)
+
+
+def _format_labels(names, values):
+    if not names:
+        return ""
+    escaped = (
+        str(x).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"') for x in values
+    )
+    return "{%s}" % ",".join('%s="%s"' % x for x in zip(names, escaped))
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(labels)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def _key(self, labels):
+        if set(labels) != set(self.label_names):
+            raise ValueError("%s expects the labels %s" % (self.name, self.label_names))
+        return tuple(labels[x] for x in self.label_names)
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+
+    def render(self):
+        lines = [
+            "# HELP %s %s" % (self.name, self.documentation),
+            "# TYPE %s %s" % (self.name, self.kind),
+        ]
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            lines.extend(self._samples(key, value))
+        return lines
+
+    def _samples(self, key, value):
+        labels = _format_labels(self.label_names, key)
+        return ["%s%s %s" % (self.name, labels, _format_value(value))]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        if amount < 0:
+            raise ValueError("Counters can only increase")
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def get(self, **labels):
+        return self._values.get(self._key(labels), 0)
+
+
+class Gauge(_Metric):
+    """Gauge set by the app, or read from `function` when it is rendered."""
+
+    kind = "gauge"
+
+    def __init__(self, name, documentation, labels=(), function=None):
+        super().__init__(name, documentation, labels)
+        self.function = function
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def get(self, **labels):
+        if self.function is not None:
+            return self.function()
+        return self._values.get(self._key(labels), 0)
+
+    def render(self):
+        if self.function is not None:
+            self.set(self.function())
+        return super().render()
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts, total = self._values.get(key) or ([0] * (len(self.buckets) + 1), 0)
+            counts[index] += 1
+            self._values[key] = (counts, total + value)
+
+    def time(self, **labels):
+        """Context manager that observes the seconds its block takes."""
+        return _Timer(self, labels)
+
+    def get(self, **labels):
+        """Returns the number of observations and their sum."""
+        counts, total = self._values.get(self._key(labels)) or ((), 0)
+        return sum(counts), total
+
+    def _samples(self, key, value):
+        counts, total = value
+        samples = []
+        cumulative = 0
+        for bound, count in zip((*self.buckets, math.inf), counts):
+            cumulative += count
+            labels = _format_labels((*self.label_names, "le"), (*key, _format_value(bound)))
+            samples.append("%s_bucket%s %d" % (self.name, labels, cumulative))
+
+        labels = _format_labels(self.label_names, key)
+        samples.append("%s_sum%s %s" % (self.name, labels, _format_value(total)))
+        samples.append("%s_count%s %d" % (self.name, labels, cumulative))
+        return samples
+
+
+class _Timer:
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.histogram.observe(perf_counter() - self.start, **self.labels)
+
+
+class Registry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics = {}
+
+    def register(self, metric):
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError("Metric %r already registered" % metric.name)
+            self._metrics[metric.name] = metric
+        return metric
+
+    def render(self):
+        """Returns every metric in the Prometheus text format."""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+REQUEST_DURATION = registry.register(
+    Histogram(
+        "cloud_request_duration_seconds",
+        "Time spent answering requests.",
+        ["blueprint", "endpoint", "method"],
+    )
+)
+REQUESTS = registry.register(
+    Counter(
+        "cloud_requests_total",
+        "Requests answered.",
+        ["blueprint", "endpoint", "method", "status"],
+    )
+)
+UPLOADED_BYTES = registry.register(
+    Counter("cloud_uploaded_bytes_total", "Bytes received in requests.", ["endpoint"])
+)
+DOWNLOADED_BYTES = registry.register(
+    Counter("cloud_downloaded_bytes_total", "Bytes sent in responses.", ["endpoint"])
+)
+FOLDER_WALK_DURATION = registry.register(
+    Histogram("cloud_folder_walk_seconds", "Time spent walking the cloud for the folder tree.")
+)
+FOLDERS = registry.register(Gauge("cloud_folders", "Folders found by the last walk of the cloud."))
+LOG_QUEUE_SIZE = registry.register(
+    Gauge(
+        "cloud_log_queue_lines",
+        "Log lines waiting to be written by the log writer.",
+        function=lambda: log_writer.qsize(),
+    )
+)
@@ -0,0 +1,86 @@
+"""Cache of rendered pages whose html only changes with a few known inputs.
+
+The routes build a key with everything the page depends on (like the version
+of the folder tree, the ignored patterns and the role of the user), so a
+repeated load costs a dict lookup instead of a walk of the cloud and a
+template render. The responses carry the hash of the page as ETag, so the
+browsers revalidate with a 304 instead of downloading it again.
+"""
+import hashlib
+import threading
+from collections import OrderedDict, namedtuple
+
+from flask import current_app, request, session
+from flask.globals import request_ctx
+
+from app.config import cfg
+
+Page = namedtuple("Page", ["body", "etag"])
+
+
+class PageCache:
+    """Least recently used cache of `cfg.PAGE_CACHE_SIZE` rendered pages."""
+
+    def __init__(self, maxsize=None):
+        self.maxsize = maxsize
+        self._lock = threading.Lock()
+        self._pages = OrderedDict()
+
+    def get(self, key):
+        with self._lock:
+            page = self._pages.get(key)
+            if page is not None:
+                self._pages.move_to_end(key)
+            return page
+
+    def put(self, key, body):
+        if isinstance(body, str):
+            body = body.encode("utf-8")
+        page = Page(body, hashlib.blake2b(body, digest_size=16).hexdigest())
+
+        maxsize = self.maxsize if self.maxsize is not None else cfg.PAGE_CACHE_SIZE
+        with self._lock:
+            self._pages[key] = page
+            self._pages.move_to_end(key)
+            while len(self._pages) > maxsize:
+                self._pages.popitem(last=False)
+        return page
+
+    def clear(self):
+        with self._lock:
+            self._pages.clear()
+
+    def respond(self, key, render):
+        """Returns the response of a page, rendering it only if it isn't cached.
+
+        Pages with flashed messages are rendered every time, since the messages
+        are shown only once.
+
+        Args:
+            key (tuple): hashable inputs of the page, without the url.
+            render (callable): function that returns the html of the page.
+
+        Returns:
+            Response: the page, or a 304 if the browser already has it.
+        """
+        if not cfg.PAGE_CACHE_SIZE or session.get("_flashes"):
+            return render()
+
+        key = (request.path, request.query_string, *key)
+        page = self.get(key)
+        if page is None:
+            body = render()
+            # Messages flashed while rendering are shown in this response only
+            if request_ctx.flashes:
+                return body
+            page = self.put(key, body)
+
+        response = current_app.response_class(page.body, mimetype="text/html")
+        response.set_etag(page.etag)
+        response.headers["Cache-Control"] = "no-cache"
+        response.vary.add("Authorization")
+        response.vary.add("Cookie")
+        return response.make_conditional(request)
+
+
+page_cache = PageCache()
@@ -0,0 +1,250 @@
+"""Thumbnails of the images and PDFs of the cloud, kept in a cache on disk.
+
+The previews are rendered by a pool of `cfg.PREVIEW_WORKERS` processes, since
+decoding and resizing images is CPU bound and holds the GIL. They are queued
+when a file is uploaded and rendered on the first request otherwise, and a
+request for a preview that is being rendered waits for it instead of
+rendering it again.
+
+Each preview is a JPEG named after the hash of the path, mtime and size of
+its file, so a modified file gets a new preview and the old one is left to
+expire. The cache keeps `cfg.PREVIEW_CACHE_SIZE` bytes, removing the least
+recently used previews first (see `DiskCache`). The files that can't be
+decoded are remembered too, so they aren't rendered again on every request.
+
+The workers are started by a fork server instead of forking the app, whose
+other threads could be holding locks at the time of the fork.
+
+Images need Pillow, and the first page of PDFs needs pypdf too (the largest
+image of the page is used, which covers scanned documents). Without them,
+nothing can be previewed.
+"""
+import hashlib
+import io
+import multiprocessing
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import partial
+from pathlib import Path
+
+from app.config import cfg
+
+from .disk_cache import DiskCache, get_temp_path
+from .exceptions import PreviewError
+
+# Errors of the decoders of invalid or unsupported files
+DECODE_ERRORS = (EOFError, SyntaxError, ValueError)
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # Nothing can be previewed
+    Image = ImageOps = None
+else:
+    DECODE_ERRORS += (Image.DecompressionBombError,)
+
+try:
+    from pypdf import PdfReader
+    from pypdf.errors import PyPdfError
+except ImportError:  # PDFs are not previewed
+    PdfReader = None
+else:
+    DECODE_ERRORS += (PyPdfError,)
+
+IMAGE_EXTENSIONS = frozenset([".bmp", ".gif", ".jpeg", ".jpg", ".png", ".tif", ".tiff", ".webp"])
+PREVIEW_EXTENSION = ".jpg"
+
+# Files that couldn't be decoded, remembered per process
+MAX_FAILURES = 1024
+
+_lock = threading.Lock()
+_executor = None
+_executor_pid = None
+
+
+def can_preview(relpath):
+    """Checks if a file is an image or PDF that can be previewed with the installed libraries."""
+    if Image is None:
+        return False
+    extension = os.path.splitext(str(relpath))[1].lower()
+    return extension in IMAGE_EXTENSIONS or (extension == ".pdf" and PdfReader is not None)
+
+
+def render_preview(source, destination, size):
+    """Writes a JPEG of `source` that fits in a square of `size` pixels.
+
+    Runs in the worker processes, so it only receives strings and ints.
+
+    Raises:
+        PreviewError: if the file can't be decoded.
+        OSError: if the file can't be read or the preview can't be written.
+
+    Returns:
+        int: size of the preview in bytes.
+    """
+    temp = get_temp_path(destination)
+    try:
+        with _open_image(source) as original:
+            image = ImageOps.exif_transpose(original)
+            image.thumbnail((size, size))
+            if image.mode != "RGB":
+                image = image.convert("RGB")
+            image.save(temp, "JPEG", quality=85)
+    except OSError as exc:
+        # The decoders raise OSErrors without errno, like "image file is truncated"
+        if exc.errno is not None:
+            raise
+        raise PreviewError("Could not decode %r: %s" % (source, exc)) from None
+    except DECODE_ERRORS as exc:
+        raise PreviewError("Could not decode %r: %s" % (source, exc)) from None
+    os.replace(temp, destination)
+    return os.path.getsize(destination)
+
+
+def _open_image(source):
+    if not source.lower().endswith(".pdf"):
+        return Image.open(source)
+
+    images = PdfReader(source).pages[0].images
+    if not images:
+        raise ValueError("The first page of %r has no images" % source)
+    return Image.open(io.BytesIO(max(images, key=lambda x: len(x.data)).data))
+
+
+def get_executor():
+    global _executor, _executor_pid
+
+    # The processes of the pool belong to the process that started them
+    with _lock:
+        if _executor is None or _executor_pid != os.getpid():
+            method = "forkserver"
+            if method not in multiprocessing.get_all_start_methods():
+                method = "spawn"
+            _executor = ProcessPoolExecutor(
+                max_workers=cfg.PREVIEW_WORKERS, mp_context=multiprocessing.get_context(method)
+            )
+            _executor_pid = os.getpid()
+        return _executor
+
+
+def _drop_executor(executor):
+    global _executor
+
+    with _lock:
+        if _executor is executor:
+            _executor = None
+    executor.shutdown(wait=False)
+
+
+def _submit(function, *args):
+    if cfg.PREVIEW_WORKERS:
+        executor = get_executor()
+        try:
+            return executor.submit(function, *args)
+        except BrokenProcessPool:
+            # A worker died (a decoder crashed or ran out of memory), and the
+            # pool doesn't accept more work
+            _drop_executor(executor)
+            return get_executor().submit(function, *args)
+
+    future = Future()
+    try:
+        future.set_result(function(*args))
+    except Exception as exc:
+        future.set_exception(exc)
+    return future
+
+
+class PreviewCache(DiskCache):
+    """Previews on disk, at most `cfg.PREVIEW_CACHE_SIZE` bytes of them."""
+
+    def __init__(self, path=None, maxsize=None):
+        super().__init__(path, maxsize)
+        self._pending = {}
+        self._failed = OrderedDict()
+
+    def default_path(self):
+        return cfg.PREVIEW_CACHE_PATH
+
+    def default_maxsize(self):
+        return cfg.PREVIEW_CACHE_SIZE
+
+    @staticmethod
+    def get_name(relpath, st, size):
+        key = "%s\0%d\0%d\0%d" % (Path(relpath).as_posix(), st.st_mtime_ns, st.st_size, size)
+        return hashlib.blake2b(key.encode("utf-8"), digest_size=16).hexdigest() + PREVIEW_EXTENSION
+
+    def get(self, relpath, size, wait=True):
+        """Returns the preview of a file of the cloud, rendering it if it isn't cached.
+
+        Args:
+            relpath (str | Path): file relative to the cloud folder.
+            size (int): pixels of the side of the square the preview fits in.
+            wait (bool, optional): wait for the preview to be rendered. Defaults
+                to True.
+
+        Raises:
+            OSError: if the file can't be read.
+            PreviewError: if the file can't be decoded, now or in a previous
+                request.
+
+        Returns:
+            Path: the preview, or None if it is still being rendered.
+        """
+        st = os.stat(cfg.CLOUD_PATH / relpath)
+        name = self.get_name(relpath, st, size)
+
+        # The lock is reentrant, since the previews rendered without workers
+        # are added by their callback while it is held
+        with self._lock:
+            path = self.lookup(name)
+            if path is not None:
+                return path
+            if name in self._failed:
+                raise PreviewError(self._failed[name])
+
+            future = self._pending.get(name)
+            if future is None:
+                self.path.mkdir(parents=True, exist_ok=True)
+                future = self._pending[name] = _submit(
+                    render_preview,
+                    os.fspath(cfg.CLOUD_PATH / relpath),
+                    os.fspath(self.path / name),
+                    size,
+                )
+                future.add_done_callback(partial(self._rendered, name))
+
+        if not wait:
+            return None
+        try:
+            future.result()
+        except BrokenProcessPool:
+            raise PreviewError("The worker rendering %r died" % os.fspath(relpath)) from None
+        return self.path / name
+
+    def schedule(self, relpath):
+        """Queues the rendering of the preview of a new file, if it can be previewed."""
+        if not cfg.PREVIEWS or not can_preview(relpath):
+            return
+        try:
+            self.get(relpath, cfg.PREVIEW_DEFAULT_SIZE, wait=False)
+        except (OSError, PreviewError):
+            pass
+
+    def _rendered(self, name, future):
+        with self._lock:
+            self._pending.pop(name, None)
+            if future.cancelled():
+                return
+            exc = future.exception()
+            if exc is None:
+                self.add(name, future.result())
+            elif isinstance(exc, PreviewError):
+                self._failed[name] = str(exc)
+                if len(self._failed) > MAX_FAILURES:
+                    self._failed.popitem(last=False)
+
+
+preview_cache = PreviewCache()
@@ -0,0 +1,344 @@
+"""Persistent search index of the names and contents of the cloud.
+
+The names and paths of the files and folders are kept in a SQLite FTS5 table
+with the trigram tokenizer, so substring queries of 3 or more characters are
+answered from the index instead of walking the cloud. If `cfg.SEARCH_CONTENT`
+is set, the text of the text files (and of the PDFs, if pypdf is installed)
+is also indexed for full-text queries.
+
+Everything but the folders reserved by the app is indexed, and the ignore and
+admin rules are applied to the results, so changing them doesn't require
+rebuilding the index. Like the checksum index, it is kept current with the
+events of the routes and the watcher and rescanned periodically.
+"""
+import mimetypes
+import os
+import stat
+from collections import namedtuple
+
+from app.config import cfg
+
+from . import events
+from .background_index import (
+    TEMP_PREFIX,
+    BackgroundIndex,
+    has_paths,
+    normalize,
+    parent,
+    subtree_range,
+)
+from .folder_tree import is_reserved
+
+try:
+    from pypdf import PdfReader
+except ImportError:  # PDFs are not indexed
+    PdfReader = None
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    id INTEGER PRIMARY KEY,
+    path TEXT NOT NULL UNIQUE,
+    dir TEXT NOT NULL,
+    name TEXT NOT NULL,
+    is_dir INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS entries_dir ON entries (dir);
+CREATE VIRTUAL TABLE IF NOT EXISTS names USING fts5 (
+    name, path, content='entries', content_rowid='id', tokenize='trigram'
+);
+CREATE VIRTUAL TABLE IF NOT EXISTS contents USING fts5 (text);
+CREATE TRIGGER IF NOT EXISTS entries_insert AFTER INSERT ON entries BEGIN
+    INSERT INTO names (rowid, name, path) VALUES (new.id, new.name, new.path);
+END;
+CREATE TRIGGER IF NOT EXISTS entries_delete AFTER DELETE ON entries BEGIN
+    INSERT INTO names (names, rowid, name, path) VALUES ('delete', old.id, old.name, old.path);
+    DELETE FROM contents WHERE rowid = old.id;
+END;
+CREATE TRIGGER IF NOT EXISTS entries_rename AFTER UPDATE OF name, path ON entries BEGIN
+    INSERT INTO names (names, rowid, name, path) VALUES ('delete', old.id, old.name, old.path);
+    INSERT INTO names (rowid, name, path) VALUES (new.id, new.name, new.path);
+END;
+"""
+
+SEARCH_FIELDS = ("name", "path", "content")
+
+# Shortest query that the trigram tokenizer can look up
+MIN_TRIGRAM_QUERY = 3
+
+# Types indexed as text besides text/*
+TEXT_MIMETYPES = frozenset(
+    ["application/json", "application/xml", "application/javascript", "application/x-sh"]
+)
+
+SearchResult = namedtuple("SearchResult", ["id", "path", "is_dir", "size", "mtime_ns"])
+
+_COLUMNS = "entries.id, entries.path, entries.is_dir, entries.size, entries.mtime_ns"
+
+
+def extract_text(path, max_size=None):
+    """Returns the text of a file, or None if it isn't a text file or a PDF.
+
+    Only the first `max_size` bytes of text files (and characters of PDFs)
+    are returned.
+    """
+    max_size = max_size or cfg.SEARCH_CONTENT_MAX_SIZE
+    mimetype = mimetypes.guess_type(path)[0]
+
+    if mimetype == "application/pdf":
+        return _extract_pdf(path, max_size)
+    if mimetype is None or not (mimetype.startswith("text/") or mimetype in TEXT_MIMETYPES):
+        return None
+
+    with open(path, "rb") as f:
+        data = f.read(max_size)
+    if b"\0" in data:
+        return None
+    return data.decode("utf-8", errors="replace")
+
+
+def _extract_pdf(path, max_size):
+    if PdfReader is None:
+        return None
+
+    text = []
+    size = 0
+    try:
+        for page in PdfReader(path).pages:
+            text.append(page.extract_text() or "")
+            size += len(text[-1])
+            if size >= max_size:
+                break
+    except Exception:  # pylint: disable=broad-except
+        # Damaged PDFs raise all kinds of errors, their name is still indexed
+        return None
+    return "\n".join(text)[:max_size]
+
+
+def _quote(query):
+    """Returns an FTS5 string that matches `query` literally."""
+    return '"%s"' % query.replace('"', '""')
+
+
+def _stat_key(st):
+    return int(stat.S_ISDIR(st.st_mode)), st.st_size, st.st_mtime_ns
+
+
+class SearchIndex(BackgroundIndex):
+    """Names and contents of the cloud, stored in `cfg.SEARCH_DB_PATH`."""
+
+    schema = SCHEMA
+
+    @property
+    def default_db_path(self):
+        return cfg.SEARCH_DB_PATH
+
+    @property
+    def scan_interval(self):
+        return cfg.SEARCH_SCAN_INTERVAL
+
+    def search(self, query, field="name", prefix=False, after=0, limit=100):
+        """Returns the entries that match a query, in the order they were indexed.
+
+        Args:
+            query (str): text to look for, case insensitive.
+            field (str, optional): "name", "path" or "content". Defaults to "name".
+            prefix (bool, optional): match only names or paths that start with
+                `query`, or words of the contents. Defaults to False.
+            after (int, optional): `id` of the last result of the previous page.
+            limit (int, optional): maximum number of results.
+
+        Returns:
+            list: `SearchResult` of the entries.
+        """
+        if field not in SEARCH_FIELDS:
+            raise ValueError("Invalid search field: %r" % field)
+
+        with self.connect() as conn:
+            if field == "content":
+                sql = (
+                    "SELECT %s FROM contents JOIN entries ON entries.id = contents.rowid"
+                    " WHERE contents MATCH ? AND contents.rowid > ?"
+                    " ORDER BY contents.rowid LIMIT ?" % _COLUMNS
+                )
+                args = (_quote(query) + (" *" if prefix else ""), after, limit)
+            else:
+                condition = "instr(lower(entries.%s), lower(?))" % field
+                condition += " = 1" if prefix else " > 0"
+                if len(query) >= MIN_TRIGRAM_QUERY:
+                    sql = (
+                        "SELECT %s FROM names JOIN entries ON entries.id = names.rowid"
+                        " WHERE names MATCH ? AND names.rowid > ? AND %s"
+                        " ORDER BY names.rowid LIMIT ?" % (_COLUMNS, condition)
+                    )
+                    args = ("%s : %s" % (field, _quote(query)), after, query, limit)
+                else:
+                    # Too short for the trigrams, the entries are scanned
+                    sql = (
+                        "SELECT %s FROM entries WHERE entries.id > ? AND %s"
+                        " ORDER BY entries.id LIMIT ?" % (_COLUMNS, condition)
+                    )
+                    args = (after, query, limit)
+
+            return [SearchResult(*row) for row in conn.execute(sql, args)]
+
+    def update(self, relpath, conn=None):
+        """Indexes a file or a folder (but not its contents) if it changed."""
+        if conn is None:
+            with self.connect() as conn:
+                return self.update(relpath, conn)
+
+        relpath = normalize(relpath)
+        if relpath == ".":
+            return
+        try:
+            st = os.stat(self.root / relpath)
+        except (FileNotFoundError, NotADirectoryError):
+            self.remove(relpath, conn)
+            return
+
+        row = conn.execute(
+            "SELECT is_dir, size, mtime_ns FROM entries WHERE path = ?", (relpath,)
+        ).fetchone()
+        if row != _stat_key(st):
+            self._index(conn, relpath, st)
+
+    def _index(self, conn, relpath, st):
+        (entry_id,) = conn.execute(
+            "INSERT INTO entries (path, dir, name, is_dir, size, mtime_ns)"
+            " VALUES (?, ?, ?, ?, ?, ?) ON CONFLICT (path) DO UPDATE SET"
+            " is_dir = excluded.is_dir, size = excluded.size, mtime_ns = excluded.mtime_ns"
+            " RETURNING id",
+            (relpath, parent(relpath), relpath.rpartition("/")[2], *_stat_key(st)),
+        ).fetchone()
+
+        if not cfg.SEARCH_CONTENT or not stat.S_ISREG(st.st_mode):
+            return
+
+        conn.execute("DELETE FROM contents WHERE rowid = ?", (entry_id,))
+        text = extract_text(self.root / relpath)
+        if text:
+            conn.execute("INSERT INTO contents (rowid, text) VALUES (?, ?)", (entry_id, text))
+
+    def remove(self, relpath, conn=None):
+        """Removes a file or a folder and everything inside it from the index."""
+        if conn is None:
+            with self.connect() as conn:
+                return self.remove(relpath, conn)
+
+        relpath = normalize(relpath)
+        if relpath == ".":
+            conn.execute("DELETE FROM entries")
+            return
+        conn.execute(
+            "DELETE FROM entries WHERE path = ? OR (path > ? AND path < ?)",
+            (relpath, *subtree_range(relpath)),
+        )
+
+    def move(self, src, dst, conn=None):
+        """Renames the paths of a file or a folder, without reading them again."""
+        if conn is None:
+            with self.connect() as conn:
+                return self.move(src, dst, conn)
+
+        src = normalize(src)
+        dst = normalize(dst)
+        if src in (None, ".") or dst in (None, "."):
+            return
+
+        # The same move can arrive twice (from the route and the watcher), and
+        # the second time there is nothing to move into the destination
+        if not has_paths(conn, "entries", src):
+            return
+
+        self.remove(dst, conn)
+        conn.execute(
+            "UPDATE entries SET path = ?, dir = ?, name = ? WHERE path = ?",
+            (dst, parent(dst), dst.rpartition("/")[2], src),
+        )
+        conn.execute(
+            "UPDATE entries SET path = ? || substr(path, ?), dir = ? || substr(dir, ?)"
+            " WHERE path > ? AND path < ?",
+            (dst, len(src) + 1, dst, len(src) + 1, *subtree_range(src)),
+        )
+
+    def scan(self, relpath=".", conn=None):
+        """Indexes a folder tree, reading only the entries that changed.
+
+        Returns:
+            int: number of entries indexed.
+        """
+        if conn is None:
+            with self.connect() as conn:
+                return self.scan(relpath, conn)
+
+        relpath = normalize(relpath)
+        self.update(relpath, conn)
+        top = self.root / relpath
+        visited = set()
+        indexed = 0
+
+        for dirpath, dirnames, filenames in os.walk(top, followlinks=True):
+            dirnames[:] = [x for x in dirnames if x not in cfg.RESERVED_DIRNAMES]
+            current = normalize(os.path.relpath(dirpath, self.root))
+            if is_reserved(current.split("/")):
+                dirnames[:] = []
+                continue
+            visited.add(current)
+
+            rows = {
+                row[0]: row[1:]
+                for row in conn.execute(
+                    "SELECT path, is_dir, size, mtime_ns FROM entries WHERE dir = ?",
+                    (current,),
+                )
+            }
+            names = dirnames + [x for x in filenames if not x.startswith(TEMP_PREFIX)]
+            for name in names:
+                path = name if current == "." else current + "/" + name
+                row = rows.pop(path, None)
+                try:
+                    st = os.stat(os.path.join(dirpath, name))
+                    if row != _stat_key(st):
+                        self._index(conn, path, st)
+                        indexed += 1
+                except OSError:
+                    continue
+
+            conn.executemany("DELETE FROM entries WHERE path = ?", [(x,) for x in rows])
+            conn.commit()
+
+        # Folders that don't exist anymore
+        if relpath == ".":
+            dirs = conn.execute("SELECT DISTINCT dir FROM entries")
+        else:
+            dirs = conn.execute(
+                "SELECT DISTINCT dir FROM entries WHERE dir = ? OR (dir > ? AND dir < ?)",
+                (relpath, *subtree_range(relpath)),
+            )
+        gone = [(x,) for (x,) in dirs.fetchall() if x not in visited]
+        conn.executemany("DELETE FROM entries WHERE dir = ?", gone)
+        return indexed
+
+    def apply(self, event, conn):
+        path = normalize(event.path)
+        if path is None or is_reserved(path.split("/")):
+            return
+
+        if event.kind == events.DELETED:
+            self.remove(path, conn)
+        elif event.kind == events.MOVED:
+            dest = normalize(event.dest)
+            if dest is None or is_reserved(dest.split("/")):
+                self.remove(path, conn)
+            else:
+                self.move(path, dest, conn)
+        elif event.is_dir:
+            self.scan(path, conn)
+        elif not path.rpartition("/")[2].startswith(TEMP_PREFIX):
+            self.update(path, conn)
+
+
+search_index = SearchIndex()
+events.subscribe(search_index.handle_event)
@@ -0,0 +1,362 @@
+"""Disk usage of the folders and users of the cloud, and their quotas.
+
+Every file is stored in a SQLite database with its size and the user that
+uploaded it, and the `folders` table keeps the bytes and files of each folder
+including its subfolders, so the usage of any folder is a single lookup
+instead of a walk of its tree. The events of the routes and the watcher
+update the totals of the folder of each change and of its parents, and the
+periodic scan reconciles them with the disk.
+
+The changes are computed from the rows of the files, so applying an event
+twice (like the same external change seen by the watcher of every process)
+doesn't count it twice.
+"""
+import os
+import stat
+from collections import defaultdict, namedtuple
+
+from app.config import cfg
+
+from . import events
+from .background_index import (
+    TEMP_PREFIX,
+    BackgroundIndex,
+    has_paths,
+    normalize,
+    parent,
+    subtree_range,
+)
+from .exceptions import QuotaError
+from .folder_tree import is_reserved
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    dir TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    owner TEXT
+);
+CREATE INDEX IF NOT EXISTS files_dir ON files (dir);
+CREATE TABLE IF NOT EXISTS folders (
+    path TEXT PRIMARY KEY,
+    bytes INTEGER NOT NULL,
+    files INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS users (
+    user TEXT PRIMARY KEY,
+    bytes INTEGER NOT NULL,
+    files INTEGER NOT NULL
+);
+"""
+
+Usage = namedtuple("Usage", ["bytes", "files"])
+
+NO_USAGE = Usage(0, 0)
+
+
+def ancestors(relpath):
+    """Returns a folder and all its parents, up to the root of the cloud."""
+    result = [relpath]
+    while relpath != ".":
+        relpath = parent(relpath)
+        result.append(relpath)
+    return result
+
+
+def _add(conn, folders, user, size, count):
+    if not size and not count:
+        return
+    conn.executemany(
+        "INSERT INTO folders VALUES (?, ?, ?) ON CONFLICT (path) DO UPDATE SET"
+        " bytes = bytes + excluded.bytes, files = files + excluded.files",
+        [(x, size, count) for x in folders],
+    )
+    if user is not None:
+        conn.execute(
+            "INSERT INTO users VALUES (?, ?, ?) ON CONFLICT (user) DO UPDATE SET"
+            " bytes = bytes + excluded.bytes, files = files + excluded.files",
+            (user, size, count),
+        )
+
+
+class UsageIndex(BackgroundIndex):
+    """Usage of the folders and users of the cloud, stored in `cfg.USAGE_DB_PATH`."""
+
+    schema = SCHEMA
+
+    @property
+    def default_db_path(self):
+        return cfg.USAGE_DB_PATH
+
+    @property
+    def scan_interval(self):
+        return cfg.USAGE_SCAN_INTERVAL
+
+    def folder_usage(self, relpath, conn=None):
+        """Returns the `Usage` of a folder, including its subfolders."""
+        if conn is None:
+            with self.connect() as conn:
+                return self.folder_usage(relpath, conn)
+
+        row = conn.execute(
+            "SELECT bytes, files FROM folders WHERE path = ?", (normalize(relpath),)
+        ).fetchone()
+        return NO_USAGE if row is None else Usage(*row)
+
+    def user_usage(self, user, conn=None):
+        """Returns the `Usage` of the files uploaded by a user."""
+        if conn is None:
+            with self.connect() as conn:
+                return self.user_usage(user, conn)
+
+        row = conn.execute("SELECT bytes, files FROM users WHERE user = ?", (user,)).fetchone()
+        return NO_USAGE if row is None else Usage(*row)
+
+    def check_quota(self, folder, user, size):
+        """Checks that `size` more bytes fit in the quotas of a folder and a user.
+
+        Args:
+            folder (str | Path): destination folder, relative to the cloud.
+            user (str): user that uploads the files, or None.
+            size (int): bytes that are going to be written.
+
+        Raises:
+            QuotaError: if any quota would be exceeded.
+        """
+        for name, quota, used in self._get_quotas(folder, user):
+            if used + size > quota:
+                raise QuotaError("Quota of %s exceeded (%d bytes)" % (name, quota))
+
+    def remaining_quota(self, folder, user):
+        """Returns the bytes that still fit in the quotas of a folder and a user.
+
+        Returns:
+            int: the bytes, or None if no quota applies.
+        """
+        remaining = [quota - used for _, quota, used in self._get_quotas(folder, user)]
+        return max(min(remaining), 0) if remaining else None
+
+    def _get_quotas(self, folder, user):
+        # (name, quota, bytes used) of the quotas that apply to an upload
+        if not cfg.USAGE_INDEX:
+            return []
+        folder_quotas = {normalize(k): v for k, v in cfg.FOLDER_QUOTAS.items()}
+        user_quota = cfg.USER_QUOTAS.get(user, cfg.DEFAULT_USER_QUOTA)
+        if not folder_quotas and (user is None or user_quota is None):
+            return []
+
+        quotas = []
+        with self.connect() as conn:
+            for path in ancestors(normalize(folder)):
+                quota = folder_quotas.get(path)
+                if quota is not None:
+                    used = self.folder_usage(path, conn).bytes
+                    quotas.append(("folder %r" % path, quota, used))
+
+            if user is not None and user_quota is not None:
+                quotas.append(("user %r" % user, user_quota, self.user_usage(user, conn).bytes))
+        return quotas
+
+    def update(self, relpath, user=None, conn=None):
+        """Updates the size of a file, and its owner if `user` is given."""
+        if conn is None:
+            with self.connect() as conn:
+                return self.update(relpath, user, conn)
+
+        relpath = normalize(relpath)
+        try:
+            st = os.stat(self.root / relpath)
+        except (FileNotFoundError, NotADirectoryError):
+            self.remove(relpath, conn)
+            return
+        if not stat.S_ISREG(st.st_mode):
+            return
+
+        row = conn.execute("SELECT size, owner FROM files WHERE path = ?", (relpath,)).fetchone()
+        owner = user if user is not None or row is None else row[1]
+        if row is not None and row == (st.st_size, owner):
+            return
+
+        folders = ancestors(parent(relpath))
+        if row is not None:
+            _add(conn, folders, row[1], -row[0], -1)
+        _add(conn, folders, owner, st.st_size, 1)
+        conn.execute(
+            "INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?)",
+            (relpath, parent(relpath), st.st_size, owner),
+        )
+
+    def remove(self, relpath, conn=None):
+        """Removes a file or a folder tree from the totals."""
+        if conn is None:
+            with self.connect() as conn:
+                return self.remove(relpath, conn)
+
+        relpath = normalize(relpath)
+        if relpath == ".":
+            for table in ("files", "folders", "users"):
+                conn.execute("DELETE FROM %s" % table)
+            return
+
+        condition = "path = ? OR (path > ? AND path < ?)"
+        args = (relpath, *subtree_range(relpath))
+        folders = ancestors(parent(relpath))
+        for owner, size, count in conn.execute(
+            "SELECT owner, SUM(size), COUNT(*) FROM files WHERE %s GROUP BY owner" % condition,
+            args,
+        ).fetchall():
+            _add(conn, folders, owner, -size, -count)
+
+        conn.execute("DELETE FROM files WHERE " + condition, args)
+        conn.execute("DELETE FROM folders WHERE " + condition, args)
+
+    def move(self, src, dst, conn=None):
+        """Moves the totals of a file or a folder tree to another folder."""
+        if conn is None:
+            with self.connect() as conn:
+                return self.move(src, dst, conn)
+
+        src = normalize(src)
+        dst = normalize(dst)
+        if src in (None, ".") or dst in (None, "."):
+            return
+
+        # The same move can arrive twice (from the route and the watcher), and
+        # the second time there is nothing to move into the destination
+        if not has_paths(conn, "files", src) and not has_paths(conn, "folders", src):
+            return
+
+        self.remove(dst, conn)
+        condition = "path = ? OR (path > ? AND path < ?)"
+        args = (src, *subtree_range(src))
+        totals = conn.execute(
+            "SELECT owner, SUM(size), COUNT(*) FROM files WHERE %s GROUP BY owner" % condition,
+            args,
+        ).fetchall()
+
+        # The owners don't change, only the folders
+        for _, size, count in totals:
+            _add(conn, ancestors(parent(src)), None, -size, -count)
+            _add(conn, ancestors(parent(dst)), None, size, count)
+
+        for table in ("files", "folders"):
+            conn.execute(
+                "UPDATE %s SET path = ? || substr(path, ?) WHERE %s" % (table, condition),
+                (dst, len(src) + 1, *args),
+            )
+        conn.execute(
+            "UPDATE files SET dir = ? || substr(dir, ?) WHERE dir = ? OR (dir > ? AND dir < ?)",
+            (dst, len(src) + 1, src, *subtree_range(src)),
+        )
+        conn.execute("UPDATE files SET dir = ? WHERE path = ?", (parent(dst), dst))
+
+    def scan(self, relpath=".", conn=None):
+        """Reconciles the sizes of the files of a folder with the disk and recomputes the totals.
+
+        The owners of the files are kept.
+
+        Returns:
+            int: number of files added, removed or whose size changed.
+        """
+        if conn is None:
+            with self.connect() as conn:
+                return self.scan(relpath, conn)
+
+        relpath = normalize(relpath)
+        visited = set()
+        changed = 0
+        for dirpath, dirnames, filenames in os.walk(self.root / relpath, followlinks=True):
+            dirnames[:] = [x for x in dirnames if x not in cfg.RESERVED_DIRNAMES]
+            current = normalize(os.path.relpath(dirpath, self.root))
+            if is_reserved(current.split("/")):
+                dirnames[:] = []
+                continue
+            visited.add(current)
+
+            rows = dict(
+                conn.execute("SELECT path, size FROM files WHERE dir = ?", (current,)).fetchall()
+            )
+            updates = []
+            for filename in filenames:
+                if filename.startswith(TEMP_PREFIX):
+                    continue
+                path = filename if current == "." else current + "/" + filename
+                size = rows.pop(path, None)
+                try:
+                    st = os.stat(os.path.join(dirpath, filename))
+                except OSError:
+                    continue
+                if stat.S_ISREG(st.st_mode) and st.st_size != size:
+                    updates.append((path, current, st.st_size))
+
+            conn.executemany(
+                "INSERT INTO files VALUES (?, ?, ?, NULL) ON CONFLICT (path) DO UPDATE SET"
+                " size = excluded.size",
+                updates,
+            )
+            conn.executemany("DELETE FROM files WHERE path = ?", [(x,) for x in rows])
+            changed += len(updates) + len(rows)
+
+        # Folders that don't exist anymore
+        if relpath == ".":
+            dirs = conn.execute("SELECT DISTINCT dir FROM files")
+        else:
+            dirs = conn.execute(
+                "SELECT DISTINCT dir FROM files WHERE dir = ? OR (dir > ? AND dir < ?)",
+                (relpath, *subtree_range(relpath)),
+            )
+        gone = [(x,) for (x,) in dirs.fetchall() if x not in visited]
+        changed += conn.executemany("DELETE FROM files WHERE dir = ?", gone).rowcount
+
+        self._rebuild_totals(conn)
+        return changed
+
+    def _rebuild_totals(self, conn):
+        totals = defaultdict(lambda: [0, 0])
+        for folder, size, count in conn.execute(
+            "SELECT dir, SUM(size), COUNT(*) FROM files GROUP BY dir"
+        ).fetchall():
+            for path in ancestors(folder):
+                totals[path][0] += size
+                totals[path][1] += count
+
+        conn.execute("DELETE FROM folders")
+        conn.executemany(
+            "INSERT INTO folders VALUES (?, ?, ?)", [(k, *v) for k, v in totals.items()]
+        )
+        conn.execute("DELETE FROM users")
+        conn.execute(
+            "INSERT INTO users SELECT owner, SUM(size), COUNT(*) FROM files"
+            " WHERE owner IS NOT NULL GROUP BY owner"
+        )
+
+    def apply(self, event, conn):
+        path = normalize(event.path)
+        if path is None or is_reserved(path.split("/")):
+            return
+
+        if event.kind == events.DELETED:
+            self.remove(path, conn)
+        elif event.kind == events.MOVED:
+            dest = normalize(event.dest)
+            if dest is None or is_reserved(dest.split("/")):
+                self.remove(path, conn)
+            else:
+                self.move(path, dest, conn)
+        elif event.is_dir:
+            self._scan_folder(path, conn)
+        elif not path.rpartition("/")[2].startswith(TEMP_PREFIX):
+            self.update(path, event.user, conn)
+
+    def _scan_folder(self, relpath, conn):
+        # A folder created with its contents, like one moved into the cloud
+        for dirpath, dirnames, filenames in os.walk(self.root / relpath, followlinks=True):
+            dirnames[:] = [x for x in dirnames if x not in cfg.RESERVED_DIRNAMES]
+            current = normalize(os.path.relpath(dirpath, self.root))
+            for filename in filenames:
+                if not filename.startswith(TEMP_PREFIX):
+                    self.update(current + "/" + filename, conn=conn)
+
+
+usage_index = UsageIndex()
+events.subscribe(usage_index.handle_event)
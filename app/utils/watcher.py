@@ -0,0 +1,442 @@
+"""Watchers that publish the changes made to the cloud from outside the app.
+
+Files copied with rsync or scp never go through the routes, so a watcher
+running in a background thread translates the filesystem notifications into
+`app.utils.events` events. On Linux the kernel notifies the changes through
+inotify; everywhere else (or if inotify is unavailable, or the cloud has more
+folders than inotify can watch) the folders are polled.
+
+The folders reserved by the app and the ignored ones are not watched, and
+they are watched again when the ignored patterns change.
+"""
+import ctypes
+import ctypes.util
+import errno
+import os
+import select
+import struct
+import threading
+import warnings
+from pathlib import Path
+
+from app.config import cfg
+
+from . import events, get_ignore_matcher
+from .exceptions import WatcherWarning
+from .folder_tree import folder_tree, is_reserved, split_path
+from .ignore_matcher import IgnoreMatcher
+
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = getattr(os, "O_CLOEXEC", 0)
+
+WATCH_MASK = (
+    IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_ONLYDIR
+)
+EVENT_HEADER = struct.Struct("iIII")
+
+
+def join(parent, name):
+    return name if parent == "." else parent + "/" + name
+
+
+def is_relative(path, folder):
+    return folder == "." or path == folder or path.startswith(folder + "/")
+
+
+def rebase(path, src, dst):
+    return dst + path[len(src) :] if path != src else dst
+
+
+class Watcher:
+    """Base class of the watchers, which run in a daemon thread."""
+
+    def __init__(self, root):
+        self.root = Path(root)
+        self.ready = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self._matcher = IgnoreMatcher(())
+
+    def start(self):
+        self._thread = threading.Thread(
+            target=self._run, name=type(self).__name__, daemon=True
+        )
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def setup(self):
+        raise NotImplementedError
+
+    def poll(self):
+        raise NotImplementedError
+
+    def setup_failed(self, exc):
+        warnings.warn(f"watcher could not start: {exc!r}", WatcherWarning)
+
+    def is_excluded(self, relpath):
+        """Checks if a folder is reserved by the app or ignored, so it isn't watched."""
+        parts = split_path(relpath)
+        if parts is None or is_reserved(parts):
+            return True
+        return any(
+            self._matcher.matches("/".join(parts[:index])) for index in range(1, len(parts) + 1)
+        )
+
+    def _load_matcher(self):
+        self._matcher = get_ignore_matcher()
+
+    def _run(self):
+        try:
+            self._load_matcher()
+            self.setup()
+        except OSError as exc:
+            self.setup_failed(exc)
+            return
+
+        # Changes made while the watches were being set up could have been lost
+        folder_tree.set_live(self.root)
+        events.publish(events.RESCAN, ".", is_dir=True)
+        self.ready.set()
+
+        while not self._stop.is_set():
+            try:
+                # The folders that are no longer ignored must be watched
+                if get_ignore_matcher().patterns != self._matcher.patterns:
+                    self._load_matcher()
+                    self.setup()
+                self.poll()
+            except OSError as exc:
+                warnings.warn(f"watcher error: {exc!r}", WatcherWarning)
+                self._stop.wait(1)
+
+
+class InotifyWatcher(Watcher):
+    """Watcher based on the inotify API of the Linux kernel."""
+
+    # Seconds to wait for events before checking if the watcher was stopped
+    timeout = 1
+
+    def __init__(self, root):
+        super().__init__(root)
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        try:
+            self._init = libc.inotify_init1
+            self._add = libc.inotify_add_watch
+            self._rm = libc.inotify_rm_watch
+        except AttributeError as exc:
+            raise OSError(errno.ENOSYS, "inotify is not available") from exc
+
+        self._add.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        self._fd = self._init(IN_NONBLOCK | IN_CLOEXEC)
+        if self._fd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err))
+
+        self._paths = {}
+        self._wds = {}
+
+    def stop(self):
+        super().stop()
+        self._close()
+
+    def setup(self):
+        self.add_tree(".")
+
+    def setup_failed(self, exc):
+        # Usually ENOSPC: the cloud has more folders than fs.inotify.max_user_watches
+        self._close()
+        warnings.warn(f"inotify could not watch the cloud ({exc}), polling", WatcherWarning)
+
+        # The polling watcher runs in this thread and shares its events
+        fallback = PollingWatcher(self.root)
+        fallback.ready = self.ready
+        fallback._stop = self._stop
+        fallback._run()
+
+    def _close(self):
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+    def add_tree(self, relpath, publish=False):
+        """Watches every folder of the subtree of `relpath`.
+
+        If `publish` is True, CREATED events are sent for everything inside
+        the subtree, as it could have been populated before being watched.
+        """
+        if self.is_excluded(relpath):
+            return
+
+        top = self.root / relpath
+        for dirpath, dirnames, filenames in os.walk(top, followlinks=True):
+            current = Path(dirpath).relative_to(self.root).as_posix()
+            if self._add_watch(current) is None:
+                dirnames[:] = []
+                continue
+            dirnames[:] = [x for x in dirnames if not self.is_excluded(join(current, x))]
+            if publish:
+                for name in dirnames:
+                    events.publish(events.CREATED, join(current, name), is_dir=True)
+                for name in filenames:
+                    events.publish(events.CREATED, join(current, name))
+
+    def _add_watch(self, relpath):
+        path = os.fsencode(self.root / relpath)
+        wd = self._add(self._fd, path, WATCH_MASK)
+        if wd < 0:
+            err = ctypes.get_errno()
+            if err in (errno.ENOENT, errno.ENOTDIR):
+                return None
+            raise OSError(err, os.strerror(err), os.fsdecode(path))
+
+        self._paths[wd] = relpath
+        self._wds[relpath] = wd
+        return wd
+
+    def _forget(self, relpath, remove_watch=False):
+        for path in [x for x in self._wds if is_relative(x, relpath)]:
+            wd = self._wds.pop(path)
+            self._paths.pop(wd, None)
+            if remove_watch:
+                self._rm(self._fd, wd)
+
+    def _rebase(self, src, dst):
+        for path in [x for x in self._wds if is_relative(x, src)]:
+            wd = self._wds.pop(path)
+            self._wds[rebase(path, src, dst)] = wd
+            self._paths[wd] = rebase(path, src, dst)
+
+    def poll(self):
+        readable, _, _ = select.select([self._fd], [], [], self.timeout)
+        if not readable:
+            return
+
+        try:
+            data = os.read(self._fd, 64 * 1024)
+        except BlockingIOError:
+            return
+
+        for event in self.parse(data):
+            self.dispatch(*event)
+
+    def parse(self, data):
+        """Converts the raw inotify events into (kind, path, dest, is_dir) tuples.
+
+        The MOVED_FROM and MOVED_TO events of a rename are paired with their
+        cookie. A MOVED_FROM without its MOVED_TO in the same read is treated as
+        a deletion (the file left the cloud) and a lonely MOVED_TO as a creation.
+        """
+        moved_from = {}
+        result = []
+        offset = 0
+
+        while offset < len(data):
+            wd, mask, cookie, length = EVENT_HEADER.unpack_from(data, offset)
+            offset += EVENT_HEADER.size
+            name = os.fsdecode(data[offset : offset + length].rstrip(b"\0"))
+            offset += length
+
+            if mask & IN_Q_OVERFLOW:
+                result.append((events.RESCAN, ".", None, True))
+                continue
+            if mask & IN_IGNORED:
+                self._paths.pop(wd, None)
+                continue
+
+            parent = self._paths.get(wd)
+            if parent is None or not name:
+                continue
+
+            path = join(parent, name)
+            is_dir = bool(mask & IN_ISDIR)
+
+            if mask & IN_MOVED_FROM:
+                moved_from[cookie] = len(result)
+                result.append((events.DELETED, path, None, is_dir))
+            elif mask & IN_MOVED_TO and cookie in moved_from:
+                index = moved_from.pop(cookie)
+                result[index] = (events.MOVED, result[index][1], path, is_dir)
+            elif mask & (IN_CREATE | IN_MOVED_TO):
+                result.append((events.CREATED, path, None, is_dir))
+            elif mask & IN_DELETE:
+                result.append((events.DELETED, path, None, is_dir))
+            elif mask & IN_CLOSE_WRITE:
+                result.append((events.MODIFIED, path, None, False))
+
+        return result
+
+    def dispatch(self, kind, path, dest, is_dir):
+        if kind == events.RESCAN:
+            events.publish(kind, path, is_dir=True)
+            self.add_tree(".")
+            return
+
+        events.publish(kind, path, dest, is_dir)
+        if not is_dir:
+            return
+
+        if kind == events.CREATED:
+            self.add_tree(path, publish=True)
+        elif kind == events.MOVED:
+            if self.is_excluded(dest):
+                self._forget(path, remove_watch=True)
+            elif self.is_excluded(path):
+                self.add_tree(dest, publish=True)
+            else:
+                self._rebase(path, dest)
+        elif kind == events.DELETED:
+            self._forget(path, remove_watch=True)
+
+
+class PollingWatcher(Watcher):
+    """Watcher that checks the modification time of every folder periodically.
+
+    A folder's mtime changes whenever an entry is created, deleted or renamed
+    inside it, so only the folders that changed are listed again. Renames are
+    reported as a deletion followed by a creation, and modifications of the
+    contents of a file are not reported.
+    """
+
+    def __init__(self, root, interval=None):
+        super().__init__(root)
+        self.interval = interval or cfg.WATCHER_POLL_INTERVAL
+        self._dirs = {}
+
+    def setup(self):
+        self._dirs.clear()
+        self._scan(".")
+
+    def poll(self):
+        if self._stop.wait(self.interval):
+            return
+        self.check()
+
+    def check(self):
+        pending = ["."]
+        while pending:
+            relpath = pending.pop()
+            try:
+                mtime = os.stat(self.root / relpath).st_mtime_ns
+            except (FileNotFoundError, NotADirectoryError):
+                continue
+
+            old_mtime, old_entries = self._dirs[relpath]
+            if mtime != old_mtime:
+                self._diff(relpath, old_entries)
+
+            for name, is_dir in self._dirs[relpath][1].items():
+                path = join(relpath, name)
+                if is_dir and path in self._dirs:
+                    pending.append(path)
+
+    def _diff(self, relpath, old_entries):
+        mtime, entries = self._list(relpath)
+        self._dirs[relpath] = (mtime, entries)
+
+        for name, is_dir in old_entries.items():
+            if entries.get(name) != is_dir:
+                path = join(relpath, name)
+                if is_dir:
+                    self._forget(path)
+                events.publish(events.DELETED, path, is_dir=is_dir)
+
+        for name, is_dir in entries.items():
+            if old_entries.get(name) != is_dir:
+                path = join(relpath, name)
+                events.publish(events.CREATED, path, is_dir=is_dir)
+                if is_dir and not self.is_excluded(path):
+                    self._scan(path, publish=True)
+
+    def _scan(self, relpath, publish=False):
+        pending = [relpath]
+        while pending:
+            current = pending.pop()
+            try:
+                self._dirs[current] = self._list(current)
+            except (FileNotFoundError, NotADirectoryError):
+                continue
+
+            for name, is_dir in self._dirs[current][1].items():
+                path = join(current, name)
+                if publish:
+                    events.publish(events.CREATED, path, is_dir=is_dir)
+                if is_dir and not self.is_excluded(path):
+                    pending.append(path)
+
+    def _list(self, relpath):
+        folder = self.root / relpath
+        mtime = os.stat(folder).st_mtime_ns
+        entries = {}
+        with os.scandir(folder) as iterator:
+            for entry in iterator:
+                try:
+                    entries[entry.name] = entry.is_dir()
+                except OSError:
+                    continue
+        return mtime, entries
+
+    def _forget(self, relpath):
+        for path in [x for x in self._dirs if is_relative(x, relpath)]:
+            del self._dirs[path]
+
+
+_watcher = None
+_watcher_pid = None
+
+
+def start_watcher(root=None):
+    """Starts the watcher configured in `cfg.WATCHER`, once per process.
+
+    Returns:
+        Watcher: the watcher running, or None if they are disabled.
+    """
+    global _watcher, _watcher_pid
+
+    if _watcher is not None and _watcher_pid == os.getpid():
+        return _watcher
+    if not cfg.WATCHER:
+        return None
+
+    _watcher = None
+    _watcher_pid = os.getpid()
+    root = root or cfg.CLOUD_PATH
+    if cfg.WATCHER in ("auto", "inotify"):
+        try:
+            _watcher = InotifyWatcher(root)
+        except OSError as exc:
+            warnings.warn(f"inotify not available ({exc}), polling", WatcherWarning)
+
+    if _watcher is None:
+        _watcher = PollingWatcher(root)
+
+    _watcher.start()
+    return _watcher
+
+
+def _after_fork():
+    global _watcher
+
+    # The thread of the watcher isn't copied to the child, so its folder tree
+    # isn't live until the child starts its own watcher
+    if _watcher is not None:
+        folder_tree.set_live(None)
+        if isinstance(_watcher, InotifyWatcher):
+            _watcher._close()
+        _watcher = None
+
+
+if hasattr(os, "register_at_fork"):  # Not on Windows
+    os.register_at_fork(after_in_child=_after_fork)
@@ -0,0 +1,401 @@
+"""Benchmarks of the hot paths of the cloud.
+
+Each run creates a synthetic cloud in a temporary folder, points the config
+of the app to it and times the folder listing, the config files and the
+uploads, deletes and moves through the Flask test client. The results are
+written as json, with the commit and the parameters, so runs of different
+commits can be compared:
+
+    python -m benchmarks.run --output before.json
+    git checkout other-branch
+    python -m benchmarks.run --output after.json --compare before.json
+
+Use the same parameters in both runs, the comparison warns if they differ.
+"""
+import argparse
+import importlib.util
+import io
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+from contextlib import ExitStack, contextmanager
+from datetime import datetime, timezone
+from pathlib import Path
+from time import perf_counter
+from unittest import mock
+
+from .trees import TreeParams, make_cloud, make_tree
+
+BENCHMARKS = {}
+
+
+def benchmark(function):
+    BENCHMARKS[function.__name__.replace("bench_", "", 1)] = function
+    return function
+
+
+def measure(function, repeat, setup=None):
+    """Times `repeat` calls of `function`, running `setup` untimed before each one.
+
+    Returns:
+        list: seconds of each call.
+    """
+    timings = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = perf_counter()
+        function()
+        timings.append(perf_counter() - start)
+    return timings
+
+
+def summarize(timings):
+    return {
+        "repeat": len(timings),
+        "min": min(timings),
+        "median": statistics.median(timings),
+        "mean": statistics.mean(timings),
+        "max": max(timings),
+    }
+
+
+class Env:
+    """Synthetic cloud, and the app configured to use it."""
+
+    def __init__(self, base, params, options):
+        self.base = base
+        self.params = params
+        self.options = options
+        self.cloud = base / "cloud"
+        self.stats = make_cloud(base, params)
+
+        from app import app
+        from app.utils.jobs import job_runner
+
+        self.app = app
+        self.client = app.test_client()
+        self.job_runner = job_runner
+
+    def check(self, response, status=200):
+        if response.status_code != status:
+            raise RuntimeError(
+                "%s returned %d: %r" % (response.request.path, response.status_code, response.data)
+            )
+        return response
+
+
+def load_config():
+    """Returns the config module of the app, without creating the app.
+
+    Importing any module of `app` runs `app/__init__.py`, which creates the app
+    and starts the watcher and the job runner on the paths of the config, so the
+    config is loaded on its own to patch them first.
+    """
+    module = sys.modules.get("app.config")
+    if module is None:
+        path = Path(__file__).resolve().parents[1] / "app" / "config.py"
+        spec = importlib.util.spec_from_file_location("app.config", path)
+        module = importlib.util.module_from_spec(spec)
+        sys.modules["app.config"] = module
+        spec.loader.exec_module(module)
+    return module
+
+
+@contextmanager
+def configured(base):
+    """Points the paths of the config and the log writer to `base`.
+
+    The paths are patched before the app is imported, and the watcher is
+    disabled so it doesn't add noise to the timings.
+    """
+    cfg = load_config().cfg
+    paths = {
+        "CLOUD_PATH": base / "cloud",
+        "SUDOERS_PATH": base / "sudoers.json",
+        "IGNORED_PATH": base / "ignored.json",
+        "UPLOAD_SESSIONS_PATH": base / "upload-sessions",
+        "CHECKSUM_DB_PATH": base / "checksums.db",
+        "SEARCH_DB_PATH": base / "search.db",
+        "USAGE_DB_PATH": base / "usage.db",
+        "JOBS_PATH": base / "jobs",
+        "PREVIEW_CACHE_PATH": base / "previews",
+        "COMPRESSED_CACHE_PATH": base / "compressed",
+        "LOG_PATH": base / "web.log",
+    }
+    with ExitStack() as stack:
+        for name, value in paths.items():
+            stack.enter_context(mock.patch.object(cfg, name, value))
+        stack.enter_context(mock.patch.object(cfg, "TRASH_RETENTION", 0))
+        stack.enter_context(mock.patch.object(cfg, "WATCHER", None))
+
+        # The app finds the patched config in sys.modules, but the package
+        # doesn't get it as an attribute as it would from a regular import
+        import app
+
+        app.config = sys.modules["app.config"]
+        from app.utils.log_writer import log_writer
+
+        # The log writer keeps the path of the first run of the process
+        stack.enter_context(mock.patch.object(log_writer, "path", paths["LOG_PATH"]))
+        try:
+            yield
+        finally:
+            log_writer.close()
+
+
+@benchmark
+def bench_get_folders_cold(env, repeat):
+    """get_folders() walking the whole cloud."""
+    from app.utils import folder_tree, get_folders
+
+    with env.app.test_request_context("/"):
+        return measure(get_folders, repeat, setup=folder_tree.invalidate)
+
+
+@benchmark
+def bench_get_folders_warm(env, repeat):
+    """get_folders() from the cached folder tree."""
+    from app.utils import get_folders
+
+    with env.app.test_request_context("/"):
+        get_folders()
+        return measure(get_folders, repeat)
+
+
+def _config_benchmark(getter, path_name, cold):
+    from app.config import cfg
+    from app.utils.config_store import config_store
+
+    def run(env, repeat):
+        getter()
+        setup = (lambda: config_store.invalidate(getattr(cfg, path_name))) if cold else None
+        return measure(getter, repeat, setup=setup)
+
+    return run
+
+
+def _register_config_benchmarks():
+    from app.utils import get_ignored, get_sudoers
+
+    for name, getter, path_name in [
+        ("get_ignored", get_ignored, "IGNORED_PATH"),
+        ("get_sudoers", get_sudoers, "SUDOERS_PATH"),
+    ]:
+        BENCHMARKS[name + "_cold"] = _config_benchmark(getter, path_name, cold=True)
+        BENCHMARKS[name + "_warm"] = _config_benchmark(getter, path_name, cold=False)
+
+
+def _root_id(env):
+    """Returns the id of the root folder, as rendered in the upload form."""
+    from app.utils import folder_tree, get_folders
+
+    with env.app.test_request_context("/"):
+        get_folders()
+    return folder_tree.get_id(".")
+
+
+@benchmark
+def bench_upload_many(env, repeat):
+    """/upload of many small files in one request."""
+    contents = os.urandom(env.params.file_size)
+    folder = _root_id(env)
+
+    def upload():
+        files = [(io.BytesIO(contents), "many-%d.bin" % x) for x in range(env.options.upload_files)]
+        env.check(
+            env.client.post(
+                "/upload",
+                data={"files[]": files, "folder": folder},
+                headers={"Accept": "application/json"},
+            )
+        )
+
+    return measure(upload, repeat)
+
+
+@benchmark
+def bench_upload_large(env, repeat):
+    """/upload of a single large file."""
+    contents = os.urandom(env.options.upload_size)
+    folder = _root_id(env)
+
+    def upload():
+        files = [(io.BytesIO(contents), "large.bin")]
+        env.check(
+            env.client.post(
+                "/upload",
+                data={"files[]": files, "folder": folder},
+                headers={"Accept": "application/json"},
+            )
+        )
+
+    return measure(upload, repeat)
+
+
+@benchmark
+def bench_upload_stream_large(env, repeat):
+    """/upload-stream of a single large file."""
+    contents = os.urandom(env.options.upload_size)
+    folder = _root_id(env)
+
+    def upload():
+        files = [(io.BytesIO(contents), "large-stream.bin")]
+        env.check(env.client.post("/upload-stream?folder=" + folder, data={"files[]": files}), 302)
+
+    return measure(upload, repeat)
+
+
+def _make_subtree(env, name):
+    params = env.params
+    make_tree(env.cloud / name, params.depth, params.fanout, params.files, params.file_size)
+
+
+@benchmark
+def bench_delete_tree(env, repeat):
+    """/delete of a tree as big as the cloud, until the request returns."""
+
+    def setup():
+        env.job_runner.join()
+        _make_subtree(env, "to-delete")
+
+    timings = measure(lambda: env.check(env.client.get("/delete/to-delete")), repeat, setup)
+    env.job_runner.join()
+    return timings
+
+
+@benchmark
+def bench_delete_tree_reclaimed(env, repeat):
+    """/delete of a tree as big as the cloud, until the background job removes it."""
+
+    def delete():
+        env.check(env.client.get("/delete/to-delete"))
+        env.job_runner.join()
+
+    return measure(delete, repeat, lambda: _make_subtree(env, "to-delete"))
+
+
+@benchmark
+def bench_move_tree(env, repeat):
+    """/move of a tree as big as the cloud to another folder."""
+
+    def setup():
+        shutil.rmtree(env.cloud / "move-dst", ignore_errors=True)
+        _make_subtree(env, "move-src")
+
+    def move():
+        env.check(env.client.get("/move?from=move-src&to=move-dst"))
+
+    timings = measure(move, repeat, setup)
+    shutil.rmtree(env.cloud / "move-dst", ignore_errors=True)
+    return timings
+
+
+def get_commit():
+    try:
+        output = subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+            cwd=Path(__file__).parent,
+        ).stdout
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return output.strip()
+
+
+def run(params, options, names=None):
+    """Runs the benchmarks on a fresh synthetic cloud.
+
+    Returns:
+        dict: the parameters of the run and the summary of each benchmark.
+    """
+    _register_config_benchmarks()
+    names = names or list(BENCHMARKS)
+    unknown = set(names) - set(BENCHMARKS)
+    if unknown:
+        raise ValueError("Unknown benchmarks: %s" % ", ".join(sorted(unknown)))
+
+    results = {}
+    with tempfile.TemporaryDirectory(prefix="cloud-bench-") as temp_dir:
+        base = Path(temp_dir)
+        with configured(base):
+            env = Env(base, params, options)
+            for name in names:
+                results[name] = summarize(BENCHMARKS[name](env, options.repeat))
+
+    return {
+        "commit": get_commit(),
+        "date": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "params": {
+            **params._asdict(),
+            "repeat": options.repeat,
+            "upload_files": options.upload_files,
+            "upload_size": options.upload_size,
+        },
+        "tree": env.stats._asdict(),
+        "results": results,
+    }
+
+
+def compare(baseline, current):
+    """Returns the lines of a table with the medians of two runs and their ratio."""
+    lines = []
+    if baseline["params"] != current["params"]:
+        lines.append("Warning: the runs used different parameters")
+    lines.append("%-28s %12s %12s %8s" % ("benchmark", "baseline", "current", "ratio"))
+    for name, result in current["results"].items():
+        before = baseline["results"].get(name)
+        if before is None:
+            lines.append("%-28s %12s %12.6f %8s" % (name, "-", result["median"], "-"))
+            continue
+        ratio = result["median"] / before["median"] if before["median"] else float("inf")
+        lines.append(
+            "%-28s %12.6f %12.6f %7.2fx" % (name, before["median"], result["median"], ratio)
+        )
+    return lines
+
+
+def main(argv=None):
+    defaults = TreeParams()
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--depth", type=int, default=defaults.depth, help="levels of folders")
+    parser.add_argument("--fanout", type=int, default=defaults.fanout, help="folders per folder")
+    parser.add_argument("--files", type=int, default=defaults.files, help="files per folder")
+    parser.add_argument("--file-size", type=int, default=defaults.file_size, help="bytes per file")
+    parser.add_argument("--ignored", type=int, default=defaults.ignored, help="ignored patterns")
+    parser.add_argument("--sudoers", type=int, default=defaults.sudoers, help="sudoers")
+    parser.add_argument("--upload-files", type=int, default=100, help="files per upload")
+    parser.add_argument("--upload-size", type=int, default=16 * 1024 * 1024, help="large upload")
+    parser.add_argument("--repeat", type=int, default=5, help="runs of each benchmark")
+    parser.add_argument("--only", action="append", help="run only this benchmark (repeatable)")
+    parser.add_argument("--output", help="write the results to this json file")
+    parser.add_argument("--compare", help="compare with the results of a previous run")
+    args = parser.parse_args(argv)
+
+    params = TreeParams(
+        args.depth, args.fanout, args.files, args.file_size, args.ignored, args.sudoers
+    )
+    report = run(params, args, args.only)
+
+    data = json.dumps(report, indent=2)
+    if args.output:
+        Path(args.output).write_text(data + "\n")
+    else:
+        print(data)
+
+    if args.compare:
+        baseline = json.loads(Path(args.compare).read_text())
+        print("\n".join(compare(baseline, report)), file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
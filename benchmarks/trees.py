@@ -0,0 +1,66 @@
+"""Synthetic cloud trees for the benchmarks.
+
+The trees are deterministic: the same parameters always create the same
+folders, files and contents, so the results of different commits can be
+compared.
+"""
+import json
+import os
+from collections import namedtuple
+
+TreeParams = namedtuple(
+    "TreeParams",
+    ["depth", "fanout", "files", "file_size", "ignored", "sudoers"],
+    defaults=[3, 5, 5, 1024, 50, 10],
+)
+
+TreeStats = namedtuple("TreeStats", ["folders", "files", "bytes"])
+
+
+def make_tree(root, depth, fanout, files, file_size):
+    """Creates a tree of `fanout` folders per folder, `depth` levels deep.
+
+    Every folder, including `root`, has `files` files of `file_size` bytes.
+
+    Returns:
+        TreeStats: folders (including `root`), files and bytes created.
+    """
+    data = bytes(range(256)) * (file_size // 256 + 1)
+    stats = TreeStats(0, 0, 0)
+    pending = [(os.fspath(root), 0)]
+    while pending:
+        folder, level = pending.pop()
+        os.makedirs(folder, exist_ok=True)
+        for index in range(files):
+            with open(os.path.join(folder, "file-%d.bin" % index), "wb") as f:
+                f.write(data[:file_size])
+        stats = TreeStats(stats.folders + 1, stats.files + files, stats.bytes + files * file_size)
+
+        if level < depth:
+            for index in range(fanout):
+                pending.append((os.path.join(folder, "d%d-%d" % (level + 1, index)), level + 1))
+    return stats
+
+
+def make_ignored(count):
+    """Returns `count` ignored patterns that don't match any folder of the trees.
+
+    The matcher still has to check every folder against all of them.
+    """
+    return ["^excluded-%d(/|$)" % index for index in range(count)]
+
+
+def make_sudoers(count):
+    return ["admin-%d" % index for index in range(count)]
+
+
+def make_cloud(base, params):
+    """Creates a cloud with its `ignored.json` and `sudoers.json` in `base`.
+
+    Returns:
+        TreeStats: the stats of the tree of the cloud.
+    """
+    stats = make_tree(base / "cloud", params.depth, params.fanout, params.files, params.file_size)
+    (base / "ignored.json").write_text(json.dumps(make_ignored(params.ignored)))
+    (base / "sudoers.json").write_text(json.dumps(make_sudoers(params.sudoers)))
+    return stats
@@ -1,6 +1,24 @@
+from unittest import mock
+
 import pytest
 
 from app import create_app
+from app.config import cfg
+
+
+@pytest.fixture(scope="session", autouse=True)
+def caches(tmp_path_factory):
+    # Previews and compressed copies of the tests are written in the test process
+    with mock.patch.object(
+        cfg, "PREVIEW_CACHE_PATH", tmp_path_factory.mktemp("previews")
+    ), mock.patch.object(
+        cfg, "COMPRESSED_CACHE_PATH", tmp_path_factory.mktemp("compressed")
+    ), mock.patch.object(
+        cfg, "PREVIEW_WORKERS", 0
+    ), mock.patch.object(
+        cfg, "COMPRESS_WORKERS", 0
+    ):
+        yield
 
 
 @pytest.fixture(scope="session", autouse=True)
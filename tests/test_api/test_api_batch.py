@@ -0,0 +1,187 @@
+import os
+from unittest import mock
+
+import pytest
+
+from app.api.batch import Batch, Operation, parse_operations
+from app.utils import events
+from app.utils.jobs import Job, job_runner
+
+
+@pytest.fixture(autouse=True)
+def cloud(tmp_path):
+    root = tmp_path / "cloud"
+    (root / "a" / "b").mkdir(parents=True)
+    (root / "a" / "x.txt").write_text("x")
+    (root / "c").mkdir()
+
+    with mock.patch("app.api.batch.cfg") as cfg_m, mock.patch(
+        "app.files.trash.cfg"
+    ) as trash_cfg_m, mock.patch("app.utils.jobs.cfg") as jobs_cfg_m:
+        cfg_m.CLOUD_PATH = trash_cfg_m.CLOUD_PATH = root
+        cfg_m.BATCH_MAX_OPERATIONS = 3
+        trash_cfg_m.TRASH_DIRNAME = ".trash"
+        trash_cfg_m.TRASH_RETENTION = 0
+        jobs_cfg_m.JOBS_PATH = tmp_path / "jobs"
+        yield root
+
+
+@pytest.fixture(autouse=True)
+def submit_m():
+    with mock.patch.object(job_runner, "submit") as submit_m:
+        yield submit_m
+
+
+@pytest.fixture(autouse=True)
+def publish_m():
+    with mock.patch("app.utils.events.publish") as publish_m:
+        yield publish_m
+
+
+def path_filter(relpath, is_dir=False):
+    return not relpath.startswith("hidden")
+
+
+def listing(root):
+    return sorted(
+        os.path.relpath(os.path.join(dirpath, x), root)
+        for dirpath, dirnames, filenames in os.walk(root)
+        for x in dirnames + filenames
+        if ".trash" not in dirpath and x != ".trash"
+    )
+
+
+class TestParseOperations:
+    def test_parse(self):
+        operations = parse_operations(
+            [
+                {"op": "mkdir", "path": "new/./folder"},
+                {"op": "delete", "path": "a/x.txt", "dest": "ignored"},
+                {"op": "move", "path": "a/b/", "dest": "c"},
+            ],
+            path_filter,
+        )
+
+        assert operations == [
+            Operation("mkdir", "new/folder", None),
+            Operation("delete", "a/x.txt", None),
+            Operation("move", "a/b", "c"),
+        ]
+
+    @pytest.mark.parametrize(
+        "data",
+        [
+            None,
+            [],
+            {"op": "mkdir", "path": "a"},
+            [{"op": "mkdir", "path": "a"}] * 4,
+            ["mkdir a"],
+            [{"op": "copy", "path": "a", "dest": "b"}],
+            [{"op": "mkdir"}],
+            [{"op": "mkdir", "path": 1}],
+            [{"op": "move", "path": "a"}],
+            [{"op": "delete", "path": "."}],
+            [{"op": "delete", "path": "../a"}],
+            [{"op": "delete", "path": ".store/blob"}],
+            [{"op": "delete", "path": "hidden/a"}],
+            [{"op": "move", "path": "a", "dest": "hidden"}],
+        ],
+    )
+    def test_invalid(self, data):
+        with pytest.raises(ValueError):
+            parse_operations(data, path_filter)
+
+
+class TestBatch:
+    def test_run(self, cloud, submit_m, publish_m):
+        results = Batch("user-foo").run(
+            [
+                Operation("mkdir", "d/e", None),
+                Operation("move", "a/x.txt", "c"),
+                Operation("delete", "a/b", None),
+            ]
+        )
+
+        assert [x["status"] for x in results] == ["done", "done", "done"]
+        assert results[1]["dest"] == "c/x.txt"
+        assert listing(cloud) == ["a", "c", "c/x.txt", "d", "d/e"]
+
+        (job,) = [x.args[0] for x in submit_m.call_args_list]
+        assert job.data == {"path": "a/b", "is_dir": True}
+        assert job.id == results[2]["job"]
+        assert publish_m.call_args_list == [
+            mock.call(events.CREATED, "d/e", None, True),
+            mock.call(events.MOVED, "a/x.txt", "c/x.txt", False),
+            mock.call(events.DELETED, "a/b", None, True),
+        ]
+
+    def test_failures_dont_stop_the_batch(self, cloud, publish_m):
+        results = Batch("user-foo").run(
+            [
+                Operation("delete", "missing", None),
+                Operation("mkdir", "a", None),
+                Operation("move", "a/x.txt", "c/y.txt"),
+            ]
+        )
+
+        assert [x["status"] for x in results] == ["failed", "failed", "done"]
+        assert "missing" in results[0]["error"]
+        assert "File exists" in results[1]["error"]
+        assert (cloud / "c" / "y.txt").exists()
+        publish_m.assert_called_once_with(events.MOVED, "a/x.txt", "c/y.txt", False)
+
+    def test_move_doesnt_overwrite(self, cloud):
+        (cloud / "c" / "x.txt").write_text("other x")
+
+        (result,) = Batch("user-foo").run([Operation("move", "a/x.txt", "c")])
+
+        assert result["status"] == "failed"
+        assert (cloud / "c" / "x.txt").read_text() == "other x"
+
+    def test_atomic(self, cloud, submit_m, publish_m):
+        before = listing(cloud)
+
+        results = Batch("user-foo", atomic=True).run(
+            [
+                Operation("mkdir", "d/e", None),
+                Operation("move", "a/x.txt", "c"),
+                Operation("delete", "a/b", None),
+                Operation("delete", "missing", None),
+                Operation("mkdir", "f", None),
+            ]
+        )
+
+        assert [x["status"] for x in results] == ["undone", "undone", "undone", "failed", "skipped"]
+        assert "job" not in results[2]
+        assert listing(cloud) == before
+        assert os.listdir(cloud / ".trash") == []
+        submit_m.assert_not_called()
+        publish_m.assert_not_called()
+
+    def test_atomic_undo_fails(self, cloud, submit_m, publish_m):
+        batch = Batch("user-foo", atomic=True)
+        operations = [Operation("delete", "a/b", None), Operation("delete", "missing", None)]
+
+        with mock.patch("app.api.batch.put_back", side_effect=FileExistsError("a/b")):
+            results = batch.run(operations)
+
+        assert [x["status"] for x in results] == ["done", "failed"]
+        assert "Can't be undone" in results[0]["error"]
+        submit_m.assert_called_once()
+        publish_m.assert_called_once_with(events.RESCAN, ".", None, True)
+
+    def test_atomic_cross_device(self, cloud):
+        with mock.patch("app.api.batch.is_cross_device", return_value=True):
+            (result,) = Batch("user-foo", atomic=True).run([Operation("move", "a", "c")])
+
+        assert result["status"] == "failed"
+        assert (cloud / "a").exists()
+
+    def test_cross_device(self, cloud):
+        with mock.patch("app.api.batch.is_cross_device", return_value=True), mock.patch(
+            "app.api.batch.start_move", return_value=Job("abc", "move")
+        ) as start_m:
+            (result,) = Batch("user-foo").run([Operation("move", "a", "c")])
+
+        assert result == {"op": "move", "path": "a", "dest": "c/a", "status": "started", "job": "abc"}
+        start_m.assert_called_once_with("a", "c/a", "user-foo")
@@ -0,0 +1,7 @@
+from flask import Blueprint
+
+
+def test_import_blueprint():
+    from app.api import api_bp
+
+    assert isinstance(api_bp, Blueprint)
@@ -0,0 +1,218 @@
+import os
+from pathlib import Path
+from unittest import mock
+
+import pytest
+
+from app.api.listing import (
+    Entry,
+    Listing,
+    ListingCache,
+    decode_cursor,
+    encode_cursor,
+)
+from app.utils import events
+
+
+@pytest.fixture
+def folder(tmp_path):
+    for index, name in enumerate(["b.txt", "a.txt", "c.txt"]):
+        path = tmp_path / name
+        path.write_bytes(b"x" * (10 - index))
+        os.utime(path, (1000 + index, 1000 + index))
+    (tmp_path / "sub").mkdir()
+    return tmp_path
+
+
+@pytest.fixture
+def cfg_m(folder):
+    with mock.patch("app.api.listing.cfg") as cfg_m:
+        cfg_m.CLOUD_PATH = folder
+        cfg_m.LISTING_CACHE_SIZE = 2
+        yield cfg_m
+
+
+def names(entries):
+    return [x.name for x in entries]
+
+
+class TestListing:
+    def test_scandir(self, folder):
+        listing = Listing(folder, 0)
+
+        assert len(listing) == 4
+        assert listing.types == {"a.txt": False, "b.txt": False, "c.txt": False, "sub": True}
+
+    def test_entry(self, folder):
+        listing = Listing(folder, 0)
+
+        assert listing.entry("b.txt") == Entry("b.txt", False, 10, 1000)
+        assert listing.entry("sub").is_dir is True
+        assert listing.entry("sub").size is None
+
+    def test_broken_symlink(self, folder):
+        os.symlink(folder / "missing", folder / "link")
+        entry = Listing(folder, 0).entry("link")
+
+        assert entry.name == "link"
+        assert entry.is_dir is False
+
+    def test_name_sort_stats_only_the_page(self, folder):
+        listing = Listing(folder, 0)
+
+        with mock.patch("os.stat", wraps=os.stat) as stat_m:
+            entries, cursor = listing.page(limit=2)
+
+        assert names(entries) == ["a.txt", "b.txt"]
+        assert cursor == ("b.txt",)
+        assert stat_m.call_count == 2
+
+    @pytest.mark.parametrize(
+        "sort, expected",
+        [
+            ("name", ["a.txt", "b.txt", "c.txt", "sub"]),
+            ("size", ["sub", "c.txt", "a.txt", "b.txt"]),
+            ("mtime", ["b.txt", "a.txt", "c.txt", "sub"]),
+        ],
+    )
+    def test_sort(self, folder, sort, expected):
+        listing = Listing(folder, 0)
+
+        assert names(listing.page(sort)[0]) == expected
+        assert names(listing.page(sort, reverse=True)[0]) == expected[::-1]
+
+    @pytest.mark.parametrize("reverse", [False, True])
+    @pytest.mark.parametrize("sort", ["name", "size", "mtime"])
+    def test_pagination(self, folder, sort, reverse):
+        listing = Listing(folder, 0)
+        expected = names(listing.page(sort, reverse)[0])
+
+        result = []
+        cursor = None
+        while True:
+            entries, cursor = listing.page(sort, reverse, cursor, limit=1)
+            result += names(entries)
+            if cursor is None:
+                break
+
+        assert result == expected
+
+    def test_cursor_of_removed_entry(self, folder):
+        listing = Listing(folder, 0)
+
+        entries, _ = listing.page(cursor=("aaa.txt",), limit=10)
+        assert names(entries) == ["b.txt", "c.txt", "sub"]
+
+        entries, _ = listing.page(reverse=True, cursor=("bbb.txt",), limit=10)
+        assert names(entries) == ["b.txt", "a.txt"]
+
+    def test_accept(self, folder):
+        listing = Listing(folder, 0)
+
+        entries, cursor = listing.page(limit=1, accept=lambda x: x.is_dir)
+        assert names(entries) == ["sub"]
+        assert cursor is None
+
+        entries, cursor = listing.page(limit=1, accept=lambda x: x.name != "a.txt")
+        assert names(entries) == ["b.txt"]
+        assert cursor == ("b.txt",)
+
+    def test_invalid_sort(self, folder):
+        with pytest.raises(ValueError):
+            Listing(folder, 0).page("owner")
+
+
+class TestCursor:
+    @pytest.mark.parametrize(
+        "sort, key", [("name", ("a.txt",)), ("size", (10, "b")), ("mtime", (1.5, "ñ"))]
+    )
+    def test_roundtrip(self, sort, key):
+        cursor = encode_cursor(sort, key)
+
+        assert isinstance(cursor, str)
+        assert decode_cursor(sort, cursor) == key
+
+    def test_none(self):
+        assert encode_cursor("name", None) is None
+        assert decode_cursor("name", None) is None
+        assert decode_cursor("name", "") is None
+
+    @pytest.mark.parametrize(
+        "sort, cursor",
+        [
+            ("name", "not base64!"),
+            ("name", encode_cursor("size", (1, "a"))),
+            ("size", encode_cursor("size", ("1", "a"))),
+            ("size", encode_cursor("size", (True, "a"))),
+            ("mtime", encode_cursor("mtime", (1,))),
+            ("name", encode_cursor("name", (1,))),
+        ],
+    )
+    def test_invalid(self, sort, cursor):
+        with pytest.raises(ValueError):
+            decode_cursor(sort, cursor)
+
+
+class TestListingCache:
+    def test_cached(self, cfg_m, folder):
+        cache = ListingCache()
+
+        listing = cache.get(".")
+        assert cache.get(".") is listing
+        assert cache.get(Path("sub/..")) is listing
+
+    def test_folder_changed(self, cfg_m, folder):
+        cache = ListingCache()
+        listing = cache.get(".")
+
+        (folder / "d.txt").touch()
+        os.utime(folder, ns=(0, listing.mtime_ns + 1))
+
+        new_listing = cache.get(".")
+        assert new_listing is not listing
+        assert "d.txt" in new_listing.types
+
+    def test_not_found(self, cfg_m):
+        with pytest.raises(FileNotFoundError):
+            ListingCache().get("missing")
+        with pytest.raises(NotADirectoryError):
+            ListingCache().get("a.txt")
+
+    def test_lru(self, cfg_m, folder):
+        (folder / "sub" / "x").mkdir()
+        cache = ListingCache()
+
+        root = cache.get(".")
+        cache.get("sub")
+        cache.get(".")
+        cache.get("sub/x")
+
+        assert cache.get(".") is root
+        assert list(cache._listings) == [("sub", "x"), ()]
+
+    @pytest.mark.parametrize(
+        "event, dropped",
+        [
+            (events.Event(events.MODIFIED, "a.txt", None, False), [()]),
+            (events.Event(events.CREATED, "sub/new", None, False), [("sub",)]),
+            (events.Event(events.DELETED, "sub", None, True), [(), ("sub",)]),
+            (events.Event(events.MOVED, "sub/a", "b", False), [(), ("sub",)]),
+            (events.Event(events.RESCAN, ".", None, True), [(), ("sub",)]),
+        ],
+    )
+    def test_handle_event(self, cfg_m, event, dropped):
+        cache = ListingCache(maxsize=10)
+        cache.get(".")
+        cache.get("sub")
+
+        cache.handle_event(event)
+
+        assert sorted(set([(), ("sub",)]) - set(cache._listings)) == dropped
+
+    def test_subscribed(self, cfg_m):
+        from app.api.listing import listing_cache
+
+        listing_cache.get(".")
+        events.publish(events.CREATED, "new.txt")
+
+        assert () not in listing_cache._listings
@@ -0,0 +1,482 @@
+import gzip
+import json
+import os
+from unittest import mock
+
+import pytest
+
+from app.api.batch import Operation
+from app.api.listing import encode_cursor
+from app.utils.checksum_index import Duplicate, FileChecksum
+from app.utils.exceptions import JobError
+from app.utils.folder_tree import folder_tree
+from app.utils.ignore_matcher import IgnoreMatcher
+from app.utils.jobs import Job
+from app.utils.search_index import SearchResult
+from app.utils.usage import Usage
+
+
+@pytest.fixture(autouse=True)
+def mocks(tmp_path):
+    for name in ["a.txt", "b.txt", "c.md"]:
+        (tmp_path / name).write_text(name)
+    for name in ["folder", "ignored", ".hidden", ".staging"]:
+        (tmp_path / name).mkdir()
+    (tmp_path / "folder" / "inner.txt").write_text("inner")
+
+    with mock.patch("app.api.listing.cfg") as listing_cfg_m, mock.patch(
+        "app.api.routes.cfg"
+    ) as cfg_m, mock.patch("app.utils.get_ignore_matcher") as matcher_m, mock.patch(
+        "app.utils.get_sudoers", return_value=[]
+    ) as sudoers_m, mock.patch(
+        "app.utils.get_user", return_value="user-foo"
+    ), mock.patch(
+        "app.api.routes.get_user", return_value="user-foo"
+    ), mock.patch(
+        "app.api.routes.log"
+    ):
+        listing_cfg_m.CLOUD_PATH = tmp_path
+        listing_cfg_m.LISTING_CACHE_SIZE = 8
+        cfg_m.LISTING_PAGE_SIZE = 2
+        cfg_m.LISTING_MAX_PAGE_SIZE = 3
+        matcher_m.return_value.matches.side_effect = lambda x: x.endswith("ignored")
+        yield sudoers_m
+
+    from app.api.listing import listing_cache
+
+    listing_cache.clear()
+
+
+def get_all(client, query=""):
+    names = []
+    url = "/api/list/?" + query
+    while url:
+        rv = client.get(url)
+        assert rv.status_code == 200
+        names += [x["name"] for x in rv.json["entries"]]
+        cursor = rv.json["next_cursor"]
+        url = cursor and "/api/list/?%s&cursor=%s" % (query, cursor)
+    return names
+
+
+def test_list(client):
+    rv = client.get("/api/list/")
+
+    assert rv.status_code == 200
+    assert rv.json["folder"] == "."
+    assert rv.json["entries"] == [
+        {"name": "a.txt", "type": "file", "size": 5, "mtime": mock.ANY},
+        {"name": "b.txt", "type": "file", "size": 5, "mtime": mock.ANY},
+    ]
+    assert rv.json["next_cursor"]
+
+
+def test_pagination(client):
+    assert get_all(client) == ["a.txt", "b.txt", "c.md", "folder"]
+
+
+def test_sudoers(client, mocks):
+    sudoers_m = mocks
+    sudoers_m.return_value = ["user-foo"]
+
+    assert get_all(client) == [".hidden", "a.txt", "b.txt", "c.md", "folder"]
+
+
+def test_subfolder(client):
+    rv = client.get("/api/list/folder")
+
+    assert rv.status_code == 200
+    assert rv.json["folder"] == "folder"
+    assert [x["name"] for x in rv.json["entries"]] == ["inner.txt"]
+    assert rv.json["next_cursor"] is None
+
+
+@pytest.mark.parametrize(
+    "query, expected",
+    [
+        ("sort=size&order=desc&type=file&limit=5", ["b.txt", "a.txt", "c.md"]),
+        ("type=dir", ["folder"]),
+        ("q=TXT&limit=5", ["a.txt", "b.txt"]),
+        ("order=desc&limit=1", ["folder"]),
+    ],
+)
+def test_query(client, query, expected):
+    rv = client.get("/api/list/?" + query)
+
+    assert rv.status_code == 200
+    assert [x["name"] for x in rv.json["entries"]] == expected
+
+
+@pytest.mark.parametrize(
+    "query",
+    [
+        "sort=owner",
+        "order=random",
+        "type=link",
+        "limit=many",
+        "cursor=garbage",
+        "sort=size&cursor=" + encode_cursor("name", ("a",)),
+    ],
+)
+def test_bad_request(client, query):
+    rv = client.get("/api/list/?" + query)
+
+    assert rv.status_code == 400
+    assert rv.json["error"]
+
+
+@pytest.mark.parametrize("folder", ["missing", "a.txt", "../outside"])
+def test_not_found(client, folder):
+    assert client.get("/api/list/" + folder).status_code == 404
+
+
+@pytest.mark.parametrize("folder", ["ignored", ".hidden", ".staging"])
+def test_not_visible(client, folder):
+    assert client.get("/api/list/" + folder).status_code == 404
+
+
+def test_compressed(client):
+    with mock.patch("app.utils.compression.cfg") as compression_cfg_m:
+        compression_cfg_m.COMPRESSION = ("gzip",)
+        compression_cfg_m.COMPRESS_MIN_SIZE = 10
+        rv = client.get("/api/list/", headers={"Accept-Encoding": "gzip"})
+
+    assert rv.headers["Content-Encoding"] == "gzip"
+    assert "Accept-Encoding" in rv.vary
+    assert json.loads(gzip.decompress(rv.data)) == client.get("/api/list/").json
+
+
+def test_updated_after_changes(client, tmp_path):
+    assert get_all(client, "type=file") == ["a.txt", "b.txt", "c.md"]
+
+    (tmp_path / "d.txt").touch()
+    os.utime(tmp_path, ns=(0, os.stat(tmp_path).st_mtime_ns + 1))
+
+    rv = client.get("/api/list/?type=file&limit=2&cursor=" + encode_cursor("name", ("b.txt",)))
+    assert [x["name"] for x in rv.json["entries"]] == ["c.md", "d.txt"]
+
+
+class TestSubfolders:
+    @pytest.fixture(autouse=True)
+    def cfg_m(self, tmp_path):
+        for name in ["folder/Beta", "folder/alpha/x", "folder/alps", "folder/gamma", "folder/.dot"]:
+            (tmp_path / name).mkdir(parents=True)
+
+        with mock.patch("app.api.routes.cfg") as cfg_m, mock.patch(
+            "app.api.routes.get_ignore_matcher", return_value=IgnoreMatcher(["ignored"])
+        ):
+            cfg_m.CLOUD_PATH = tmp_path
+            cfg_m.LISTING_PAGE_SIZE = 2
+            cfg_m.LISTING_MAX_PAGE_SIZE = 3
+            folder_tree.invalidate()
+            yield cfg_m
+        folder_tree.invalidate()
+
+    def test_root(self, client, tmp_path):
+        rv = client.get("/api/folders/?limit=10")
+
+        assert rv.status_code == 200
+        assert rv.json["folder"] == "."
+        assert rv.json["id"] == folder_tree.get_id(".")
+        assert rv.json["folders"] == [
+            {
+                "name": "folder",
+                "path": "folder",
+                "id": folder_tree.get_id("folder"),
+                "has_children": True,
+            }
+        ]
+        assert rv.json["next_cursor"] is None
+
+    def test_pagination(self, client):
+        rv = client.get("/api/folders/folder")
+        assert [x["name"] for x in rv.json["folders"]] == [".dot", "alpha"]
+        assert rv.json["folders"][1]["path"] == "folder/alpha"
+        assert rv.json["folders"][1]["has_children"] is True
+
+        rv = client.get("/api/folders/folder?cursor=" + rv.json["next_cursor"])
+        assert [x["name"] for x in rv.json["folders"]] == ["alps", "Beta"]
+
+        rv = client.get("/api/folders/folder?cursor=" + rv.json["next_cursor"])
+        assert [x["name"] for x in rv.json["folders"]] == ["gamma"]
+        assert rv.json["next_cursor"] is None
+
+    @pytest.mark.parametrize(
+        "prefix, expected",
+        [("al", ["alpha", "alps"]), ("ALP", ["alpha", "alps"]), ("b", ["Beta"]), ("z", [])],
+    )
+    def test_prefix(self, client, prefix, expected):
+        rv = client.get("/api/folders/folder?limit=3&prefix=" + prefix)
+
+        assert [x["name"] for x in rv.json["folders"]] == expected
+        assert rv.json["next_cursor"] is None
+
+    def test_updated_after_changes(self, client, tmp_path):
+        client.get("/api/folders/folder")
+        (tmp_path / "folder" / "delta").mkdir()
+        folder_tree.add("folder/delta")
+
+        rv = client.get("/api/folders/folder?prefix=d")
+        assert [x["name"] for x in rv.json["folders"]] == ["delta"]
+
+    def test_limit(self, client):
+        assert len(client.get("/api/folders/folder?limit=100").json["folders"]) == 3
+        assert client.get("/api/folders/folder?limit=x").status_code == 400
+
+    @pytest.mark.parametrize("folder", ["a.txt", "missing", "ignored", ".hidden", "../folder"])
+    def test_not_found(self, client, folder):
+        assert client.get("/api/folders/" + folder).status_code == 404
+
+
+class TestChecksums:
+    @pytest.fixture(autouse=True)
+    def index_m(self):
+        with mock.patch("app.api.routes.checksum_index") as index_m:
+            yield index_m
+
+    def test_status(self, client, index_m):
+        index_m.status.return_value = ("ok", FileChecksum("a.txt", 5, 0, 1, "abc"))
+
+        rv = client.get("/api/checksum/./a.txt")
+
+        assert rv.status_code == 200
+        assert rv.json == {"path": "a.txt", "status": "ok", "size": 5, "hash": "abc"}
+        index_m.status.assert_called_once_with("./a.txt")
+        index_m.verify.assert_not_called()
+
+    def test_unindexed(self, client, index_m):
+        index_m.status.return_value = ("unindexed", None)
+
+        rv = client.get("/api/checksum/a.txt")
+
+        assert rv.json == {"path": "a.txt", "status": "unindexed", "size": None, "hash": None}
+
+    def test_verify(self, client, index_m):
+        index_m.verify.return_value = ("corrupted", FileChecksum("a.txt", 5, 0, 1, "def"))
+
+        rv = client.get("/api/checksum/a.txt?verify")
+
+        assert rv.json["status"] == "corrupted"
+        index_m.verify.assert_called_once_with("a.txt")
+
+    @pytest.mark.parametrize("filepath", ["missing.txt", ".hidden/a.txt", "../a.txt"])
+    def test_not_found(self, client, index_m, filepath):
+        index_m.status.return_value = ("missing", None)
+
+        assert client.get("/api/checksum/" + filepath).status_code == 404
+
+    def test_duplicates(self, client, index_m):
+        index_m.duplicates.return_value = [
+            Duplicate("abc", 10, ["a.txt", "folder/a.txt"], 10),
+            Duplicate("def", 5, ["b.txt", ".hidden/b.txt"], 5),
+        ]
+
+        rv = client.get("/api/duplicates?min_size=5&limit=10")
+
+        assert rv.status_code == 200
+        assert rv.json == {
+            "duplicates": [
+                {"hash": "abc", "size": 10, "paths": ["a.txt", "folder/a.txt"], "reclaimable": 10}
+            ]
+        }
+        index_m.duplicates.assert_called_once_with(5, 3)
+
+    def test_duplicates_bad_request(self, client):
+        assert client.get("/api/duplicates?min_size=big").status_code == 400
+
+
+class TestSearch:
+    @pytest.fixture(autouse=True)
+    def index_m(self):
+        with mock.patch("app.api.routes.search_index") as index_m:
+            yield index_m
+
+    def result(self, id, path, is_dir=False):
+        return SearchResult(id, path, is_dir, 5, 2 * 10 ** 9)
+
+    def test_search(self, client, index_m):
+        index_m.search.return_value = [self.result(1, "a.txt"), self.result(2, "folder", True)]
+
+        rv = client.get("/api/search?q=a&limit=3")
+
+        assert rv.status_code == 200
+        assert rv.json == {
+            "results": [
+                {"path": "a.txt", "type": "file", "size": 5, "mtime": 2.0},
+                {"path": "folder", "type": "dir", "size": None, "mtime": 2.0},
+            ],
+            "next_cursor": None,
+        }
+        index_m.search.assert_called_once_with("a", "name", False, 0, 4)
+
+    def test_last_page_full(self, client, index_m):
+        index_m.search.return_value = [self.result(1, "a.txt"), self.result(2, "b.txt")]
+
+        rv = client.get("/api/search?q=a&limit=2")
+
+        assert [x["path"] for x in rv.json["results"]] == ["a.txt", "b.txt"]
+        assert rv.json["next_cursor"] is None
+        index_m.search.assert_called_once_with("a", "name", False, 0, 3)
+
+    def test_hidden_results_are_skipped(self, client, index_m):
+        index_m.search.side_effect = [
+            [
+                self.result(1, ".hidden/a"),
+                self.result(2, "a.txt"),
+                self.result(3, "ignored", True),
+                self.result(4, "ignored/b"),
+            ],
+            [self.result(5, "b.txt"), self.result(6, "c.md"), self.result(7, "d.md")],
+        ]
+
+        rv = client.get("/api/search?q=txt&in=path&mode=prefix&limit=3")
+
+        assert [x["path"] for x in rv.json["results"]] == ["a.txt", "b.txt", "c.md"]
+        assert rv.json["next_cursor"] == 6
+        assert index_m.search.call_args_list == [
+            mock.call("txt", "path", True, 0, 4),
+            mock.call("txt", "path", True, 4, 4),
+        ]
+
+    def test_cursor(self, client, index_m):
+        index_m.search.return_value = [self.result(8, "a.txt")]
+
+        rv = client.get("/api/search?q=a&cursor=7")
+
+        assert rv.json["next_cursor"] is None
+        index_m.search.assert_called_once_with("a", "name", False, 7, 3)
+
+    def test_content(self, client, index_m):
+        with mock.patch("app.api.routes.cfg.SEARCH_CONTENT", False):
+            assert client.get("/api/search?q=a&in=content").status_code == 400
+        index_m.search.assert_not_called()
+
+    @pytest.mark.parametrize(
+        "query", ["", "q=", "q=a&in=size", "q=a&mode=regex", "q=a&limit=x", "q=a&cursor=x"]
+    )
+    def test_bad_request(self, client, index_m, query):
+        assert client.get("/api/search?" + query).status_code == 400
+        index_m.search.assert_not_called()
+
+
+class TestUsage:
+    @pytest.fixture(autouse=True)
+    def cfg_m(self, tmp_path):
+        with mock.patch("app.api.routes.cfg") as cfg_m:
+            cfg_m.CLOUD_PATH = tmp_path
+            cfg_m.USAGE_INDEX = True
+            cfg_m.FOLDER_QUOTAS = {"folder": 1000}
+            cfg_m.USER_QUOTAS = {}
+            cfg_m.DEFAULT_USER_QUOTA = None
+            yield cfg_m
+
+    @pytest.fixture(autouse=True)
+    def index_m(self):
+        with mock.patch("app.api.routes.usage_index") as index_m:
+            index_m.folder_usage.return_value = Usage(300, 2)
+            index_m.user_usage.return_value = Usage(100, 1)
+            yield index_m
+
+    def test_usage(self, client, index_m):
+        rv = client.get("/api/usage/folder/")
+
+        assert rv.status_code == 200
+        assert rv.json == {
+            "path": "folder",
+            "bytes": 300,
+            "files": 2,
+            "quota": 1000,
+            "user": {"name": "user-foo", "bytes": 100, "files": 1, "quota": None},
+        }
+        assert index_m.folder_usage.call_args.args[0] == "folder"
+        assert index_m.user_usage.call_args.args[0] == "user-foo"
+
+    def test_root(self, client, index_m):
+        rv = client.get("/api/usage/")
+
+        assert rv.json["path"] == "."
+        assert rv.json["quota"] is None
+
+    @pytest.mark.parametrize("folder", ["a.txt", "missing", "ignored", ".hidden", "../folder"])
+    def test_not_found(self, client, folder):
+        assert client.get("/api/usage/" + folder).status_code == 404
+
+    def test_disabled(self, client, cfg_m):
+        cfg_m.USAGE_INDEX = False
+
+        assert client.get("/api/usage/").status_code == 404
+
+
+class TestJobs:
+    def test_job(self, client):
+        job = Job.new("delete", {"path": "a.txt", "is_dir": False}, user="user-foo")
+
+        with mock.patch("app.api.routes.Job.load", return_value=job) as load_m:
+            rv = client.get("/api/jobs/" + job.id)
+
+        assert rv.status_code == 200
+        assert rv.json["status"] == "queued"
+        assert rv.json["data"] == {"path": "a.txt", "is_dir": False}
+        load_m.assert_called_once_with(job.id)
+
+    def test_not_found(self, client):
+        with mock.patch("app.api.routes.Job.load", side_effect=JobError("Job 'x' not found")):
+            rv = client.get("/api/jobs/x")
+
+        assert rv.status_code == 404
+        assert rv.json == {"error": "Job 'x' not found"}
+
+
+class TestBatch:
+    @pytest.fixture(autouse=True)
+    def batch_m(self):
+        with mock.patch("app.api.routes.Batch") as batch_m:
+            yield batch_m
+
+    def test_batch(self, client, batch_m):
+        batch_m.return_value.run.return_value = [
+            {"op": "mkdir", "path": "new", "status": "done"},
+            {"op": "delete", "path": "a.txt", "status": "done", "job": "abc"},
+        ]
+
+        rv = client.post(
+            "/api/batch",
+            json={
+                "operations": [{"op": "mkdir", "path": "new"}, {"op": "delete", "path": "a.txt"}],
+                "atomic": True,
+            },
+        )
+
+        assert rv.status_code == 200
+        assert rv.json["ok"] is True
+        assert len(rv.json["results"]) == 2
+        batch_m.assert_called_once_with("user-foo", atomic=True)
+        batch_m.return_value.run.assert_called_once_with(
+            [Operation("mkdir", "new", None), Operation("delete", "a.txt", None)]
+        )
+
+    def test_failed(self, client, batch_m):
+        batch_m.return_value.run.return_value = [
+            {"op": "delete", "path": "a.txt", "status": "failed", "error": "No such file"}
+        ]
+
+        rv = client.post("/api/batch", json={"operations": [{"op": "delete", "path": "a.txt"}]})
+
+        assert rv.json["ok"] is False
+        batch_m.assert_called_once_with("user-foo", atomic=False)
+
+    @pytest.mark.parametrize(
+        "body",
+        [
+            None,
+            [{"op": "mkdir", "path": "new"}],
+            {"operations": [{"op": "mkdir", "path": "new"}, {"op": "delete", "path": ".hidden"}]},
+            {"operations": [{"op": "move", "path": "a.txt", "dest": "ignored/a.txt"}]},
+        ],
+    )
+    def test_invalid(self, client, batch_m, body):
+        rv = client.post("/api/batch", json=body)
+
+        assert rv.status_code == 400
+        assert "error" in rv.json
+        batch_m.return_value.run.assert_not_called()
@@ -1,9 +1,20 @@
+from unittest import mock
+
+import pytest
+
+from app.config import cfg
+from app.utils import folder_tree
+from app.utils.page_cache import page_cache
+from app.utils.usage import Usage
+
+
 def test_index(client):
     rs = client.get("/")
 
     assert rs.status_code == 200
     assert b"Alloza's Cloud" in rs.data
     assert b"folder" in rs.data
+    assert b'id="folder-picker"' in rs.data
     assert b"Files" in rs.data
     assert b"Upload" in rs.data
 
@@ -11,3 +22,70 @@ def test_index(client):
     assert client.patch("/").status_code == 405
     assert client.delete("/").status_code == 405
     assert client.put("/").status_code == 405
+
+
+@mock.patch("app.base.routes.usage_index")
+@mock.patch("app.base.routes.cfg")
+def test_index_usage(cfg_m, index_m, client):
+    cfg_m.CLOUD_PATH = cfg.CLOUD_PATH
+    cfg_m.STREAMING_UPLOADS = False
+    cfg_m.USAGE_INDEX = True
+    cfg_m.FOLDER_QUOTAS = {".": 10 * 1000 ** 3}
+    index_m.folder_usage.return_value = Usage(1500, 3)
+
+    rs = client.get("/")
+
+    assert b"1.5 kB in 3 files" in rs.data
+    assert b"of 10.0 GB" in rs.data
+    index_m.folder_usage.assert_called_once_with(".")
+
+
+class TestIndexCache:
+    @pytest.fixture(autouse=True)
+    def render_m(self):
+        page_cache.clear()
+        with mock.patch(
+            "app.base.routes.render_template", return_value="<p>index</p>"
+        ) as render_m, mock.patch("app.base.routes.log"):
+            yield render_m
+        page_cache.clear()
+
+    def test_cached(self, client, render_m):
+        first = client.get("/")
+        second = client.get("/")
+
+        render_m.assert_called_once()
+        assert first.data == second.data == b"<p>index</p>"
+
+        rv = client.get("/", headers={"If-None-Match": first.headers["ETag"]})
+        assert rv.status_code == 304
+        assert rv.data == b""
+
+    def test_same_for_every_folder_and_role(self, client, render_m):
+        client.get("/")
+        folder_tree.invalidate()
+        with mock.patch("app.utils.get_sudoers", return_value=[None]), mock.patch(
+            "app.utils.get_ignored", return_value=["^never$"]
+        ):
+            client.get("/")
+
+        render_m.assert_called_once()
+
+    def test_usage_changed(self, client, render_m):
+        client.get("/")
+        with mock.patch("app.base.routes.cfg") as cfg_m:
+            cfg_m.CLOUD_PATH = cfg.CLOUD_PATH
+            cfg_m.STREAMING_UPLOADS = False
+            cfg_m.USAGE_INDEX = False
+            cfg_m.FOLDER_QUOTAS = {".": 100}
+            client.get("/")
+
+        assert render_m.call_count == 2
+
+    def test_flashes(self, client, render_m):
+        client.get("/")
+        with client.session_transaction() as session:
+            session["_flashes"] = [("success", "Files uploaded successfully")]
+        client.get("/")
+
+        assert render_m.call_count == 2
@@ -0,0 +1,60 @@
+import argparse
+import json
+import os
+
+from benchmarks.run import compare, measure, run, summarize
+from benchmarks.trees import TreeParams, make_cloud, make_tree
+
+
+def test_make_tree(tmp_path):
+    stats = make_tree(tmp_path / "cloud", depth=2, fanout=2, files=3, file_size=10)
+
+    assert stats == (7, 21, 210)
+    assert sorted(os.listdir(tmp_path / "cloud")) == [
+        "d1-0",
+        "d1-1",
+        "file-0.bin",
+        "file-1.bin",
+        "file-2.bin",
+    ]
+    assert os.path.getsize(tmp_path / "cloud" / "d1-1" / "d2-0" / "file-2.bin") == 10
+
+
+def test_make_cloud(tmp_path):
+    make_cloud(tmp_path, TreeParams(depth=0, ignored=3, sudoers=2))
+
+    assert len(json.loads((tmp_path / "ignored.json").read_text())) == 3
+    assert json.loads((tmp_path / "sudoers.json").read_text()) == ["admin-0", "admin-1"]
+
+
+def test_measure():
+    calls = []
+
+    timings = measure(lambda: calls.append("run"), 3, setup=lambda: calls.append("setup"))
+
+    assert len(timings) == 3
+    assert calls == ["setup", "run"] * 3
+    assert summarize([3, 1, 2])["median"] == 2
+
+
+def test_compare():
+    baseline = {"params": {"depth": 1}, "results": {"a": {"median": 2.0}}}
+    current = {"params": {"depth": 2}, "results": {"a": {"median": 3.0}, "b": {"median": 1.0}}}
+
+    lines = compare(baseline, current)
+
+    assert lines[0].startswith("Warning")
+    assert lines[2].split() == ["a", "2.000000", "3.000000", "1.50x"]
+    assert lines[3].split() == ["b", "-", "1.000000", "-"]
+
+
+def test_run():
+    options = argparse.Namespace(repeat=1, upload_files=2, upload_size=1024)
+    names = ["get_folders_cold", "get_ignored_cold", "upload_many", "delete_tree", "move_tree"]
+
+    report = run(TreeParams(depth=1, fanout=2, files=1, file_size=16), options, names)
+
+    assert list(report["results"]) == names
+    assert report["tree"] == {"folders": 3, "files": 3, "bytes": 48}
+    assert report["params"]["repeat"] == 1
+    assert all(x["repeat"] == 1 for x in report["results"].values())
@@ -0,0 +1,275 @@
+import hashlib
+import os
+import threading
+from unittest import mock
+
+import pytest
+
+from app.utils import events
+from app.utils.checksum_index import ChecksumIndex, hash_file, normalize, subtree_range
+
+
+def blake(data):
+    return hashlib.blake2b(data, digest_size=32).hexdigest()
+
+
+@pytest.fixture
+def cloud(tmp_path):
+    root = tmp_path / "cloud"
+    (root / "a" / "b").mkdir(parents=True)
+    (root / ".store").mkdir()
+    (root / "x.txt").write_bytes(b"x")
+    (root / "a" / "y.txt").write_bytes(b"y")
+    (root / "a" / "b" / "z.txt").write_bytes(b"x")
+    (root / ".store" / "blob").write_bytes(b"blob")
+    (root / "a" / ".upload-123.part").write_bytes(b"partial")
+    return root
+
+
+@pytest.fixture
+def index(tmp_path, cloud):
+    index = ChecksumIndex(tmp_path / "checksums.db", cloud)
+    yield index
+    index.stop()
+
+
+def paths(index):
+    with index.connect() as conn:
+        return [x for (x,) in conn.execute("SELECT path FROM files ORDER BY path")]
+
+
+def test_hash_file(tmp_path):
+    (tmp_path / "file").write_bytes(b"data" * 1000)
+
+    assert hash_file(tmp_path / "file", chunk_size=7) == blake(b"data" * 1000)
+
+
+@pytest.mark.parametrize(
+    "relpath, expected", [(".", "."), ("a/./b/", "a/b"), ("a/../b", "b"), ("../a", None)]
+)
+def test_normalize(relpath, expected):
+    assert normalize(relpath) == expected
+
+
+def test_subtree_range():
+    low, high = subtree_range("a/b")
+
+    assert low < "a/b/c" < "a/b/~" < high
+    assert not low < "a/b.txt" < high
+    assert not low < "a/bc" < high
+
+
+class TestScan:
+    def test_scan(self, index):
+        assert index.scan() == 3
+        assert paths(index) == ["a/b/z.txt", "a/y.txt", "x.txt"]
+
+        row = index.get("a/y.txt")
+        assert row.hash == blake(b"y")
+        assert row.size == 1
+
+    def test_only_changed_files_are_hashed(self, index, cloud):
+        index.scan()
+
+        with mock.patch("app.utils.checksum_index.hash_file") as hash_m:
+            assert index.scan() == 0
+        hash_m.assert_not_called()
+
+        (cloud / "a" / "y.txt").write_bytes(b"changed")
+        assert index.scan() == 1
+        assert index.get("a/y.txt").hash == blake(b"changed")
+
+    def test_removed_files(self, index, cloud):
+        index.scan()
+
+        os.remove(cloud / "x.txt")
+        os.remove(cloud / "a" / "b" / "z.txt")
+        os.rmdir(cloud / "a" / "b")
+        index.scan()
+
+        assert paths(index) == ["a/y.txt"]
+
+    def test_subtree(self, index, cloud):
+        index.scan("a/b")
+        assert paths(index) == ["a/b/z.txt"]
+
+        os.remove(cloud / "a" / "b" / "z.txt")
+        index.scan("a")
+        assert paths(index) == ["a/y.txt"]
+
+    def test_hardlinks_are_hashed_once(self, index, cloud):
+        os.link(cloud / "x.txt", cloud / "a" / "link.txt")
+
+        with mock.patch("app.utils.checksum_index.hash_file", return_value="h") as hash_m:
+            index.scan()
+
+        assert hash_m.call_count == 3
+        assert index.get("a/link.txt").hash == "h"
+
+    def test_special_files_are_skipped(self, index, cloud):
+        os.mkfifo(cloud / "a" / "fifo")
+        index.scan()
+
+        assert "a/fifo" not in paths(index)
+
+
+class TestUpdates:
+    def test_update(self, index, cloud):
+        assert index.update("x.txt").hash == blake(b"x")
+
+        (cloud / "x.txt").write_bytes(b"new")
+        assert index.update("x.txt").hash == blake(b"new")
+
+        os.remove(cloud / "x.txt")
+        assert index.update("x.txt") is None
+        assert index.get("x.txt") is None
+
+    def test_remove(self, index):
+        index.scan()
+
+        index.remove("a")
+        assert paths(index) == ["x.txt"]
+
+        index.remove(".")
+        assert paths(index) == []
+
+    def test_move(self, index, cloud):
+        index.scan()
+        os.rename(cloud / "a", cloud / "c")
+
+        with mock.patch("app.utils.checksum_index.hash_file") as hash_m:
+            index.move("a", "c")
+            assert index.scan() == 0
+
+        hash_m.assert_not_called()
+        assert paths(index) == ["c/b/z.txt", "c/y.txt", "x.txt"]
+
+        index.move("x.txt", "c/b/x.txt")
+        assert index.get("c/b/x.txt").hash == blake(b"x")
+        with index.connect() as conn:
+            dirs = dict(conn.execute("SELECT path, dir FROM files"))
+        assert dirs == {"c/b/z.txt": "c/b", "c/y.txt": "c", "c/b/x.txt": "c/b"}
+
+    def test_move_twice(self, index, cloud):
+        index.scan()
+        os.rename(cloud / "a", cloud / "c")
+
+        index.move("a", "c")
+        index.move("a", "c")
+
+        assert paths(index) == ["c/b/z.txt", "c/y.txt", "x.txt"]
+        with mock.patch("app.utils.checksum_index.hash_file") as hash_m:
+            assert index.scan() == 0
+        hash_m.assert_not_called()
+
+
+class TestChecks:
+    def test_status(self, index, cloud):
+        assert index.status("x.txt") == ("unindexed", None)
+
+        index.scan()
+        status, row = index.status("x.txt")
+        assert status == "ok"
+        assert row.hash == blake(b"x")
+
+        (cloud / "x.txt").write_bytes(b"new")
+        assert index.status("x.txt")[0] == "stale"
+
+        os.remove(cloud / "x.txt")
+        assert index.status("x.txt")[0] == "missing"
+
+    def test_verify(self, index, cloud):
+        assert index.verify("x.txt")[0] == "new"
+        assert index.verify("x.txt")[0] == "ok"
+
+        path = cloud / "x.txt"
+        st = path.stat()
+        path.write_bytes(b"z")
+        os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns))
+        status, row = index.verify("x.txt")
+        assert status == "corrupted"
+        assert row.hash == blake(b"z")
+        assert index.get("x.txt").hash == blake(b"x")
+
+        path.write_bytes(b"modified")
+        assert index.verify("x.txt")[0] == "modified"
+        assert index.get("x.txt").hash == blake(b"modified")
+
+        assert index.verify("missing.txt")[0] == "missing"
+        assert index.verify("a")[0] == "missing"
+
+    def test_duplicates(self, index, cloud):
+        (cloud / "a" / "big-1").write_bytes(b"big" * 10)
+        (cloud / "a" / "b" / "big-2").write_bytes(b"big" * 10)
+        os.link(cloud / "a" / "big-1", cloud / "big-link")
+        index.scan()
+
+        duplicates = index.duplicates()
+        assert [(x.paths, x.reclaimable) for x in duplicates] == [
+            (["a/b/big-2", "a/big-1", "big-link"], 30),
+            (["a/b/z.txt", "x.txt"], 1),
+        ]
+        assert [x.paths for x in index.duplicates(min_size=2)] == [
+            ["a/b/big-2", "a/big-1", "big-link"]
+        ]
+        assert len(index.duplicates(limit=1)) == 1
+
+
+class TestWorker:
+    def test_events_ignored_when_stopped(self, index):
+        index.handle_event(events.Event(events.CREATED, "x.txt", None, False))
+
+        assert index._queue.qsize() == 0
+
+    def test_worker(self, index, cloud):
+        with mock.patch("app.utils.checksum_index.cfg") as cfg_m:
+            cfg_m.CHECKSUM_SCAN_INTERVAL = None
+            cfg_m.CHECKSUM_CHUNK_SIZE = 1024
+            cfg_m.RESERVED_DIRNAMES = frozenset([".store"])
+
+            index.start()
+            assert index.join(5)
+            assert paths(index) == ["a/b/z.txt", "a/y.txt", "x.txt"]
+
+            (cloud / "new.txt").write_bytes(b"new")
+            os.rename(cloud / "a", cloud / "c")
+            (cloud / "d" / "e").mkdir(parents=True)
+            (cloud / "d" / "e" / "f.txt").write_bytes(b"f")
+            os.remove(cloud / "x.txt")
+            for event in [
+                events.Event(events.CREATED, "new.txt", None, False),
+                events.Event(events.MOVED, "a", "c", True),
+                events.Event(events.CREATED, "d", None, True),
+                events.Event(events.DELETED, "x.txt", None, False),
+                events.Event(events.CREATED, ".store/blob", None, False),
+            ]:
+                index.handle_event(event)
+            assert index.join(5)
+
+        assert paths(index) == ["c/b/z.txt", "c/y.txt", "d/e/f.txt", "new.txt"]
+
+    def test_worker_errors(self, index):
+        with mock.patch.object(index, "_apply", side_effect=OSError("disk error")):
+            with mock.patch("app.utils.checksum_index.cfg") as cfg_m:
+                cfg_m.CHECKSUM_SCAN_INTERVAL = None
+                cfg_m.RESERVED_DIRNAMES = frozenset()
+                index.start()
+                index.join(5)
+
+                with pytest.warns(Warning, match="disk error"):
+                    index.handle_event(events.Event(events.CREATED, "x.txt", None, False))
+                    index.join(5)
+
+        assert index.is_running
+
+    def test_scan_lock(self, index, tmp_path):
+        fcntl = pytest.importorskip("fcntl")
+        with open("%s.lock" % index.db_path, "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            done = []
+            thread = threading.Thread(target=lambda: done.append(index._scan_once()))
+            thread.start()
+            thread.join(5)
+
+        assert done == [None]
+        assert paths(index) == []
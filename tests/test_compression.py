@@ -0,0 +1,228 @@
+import gzip
+import os
+import threading
+from unittest import mock
+
+import pytest
+from flask import Flask, jsonify
+
+from app.utils import compression
+from app.utils.compression import (
+    SidecarCache,
+    choose_encoding,
+    compress,
+    compress_file,
+    compress_response,
+    get_encodings,
+    is_compressible,
+)
+
+app = Flask(__name__)
+
+
+@pytest.fixture(autouse=True)
+def cfg_m(tmp_path):
+    with mock.patch("app.utils.compression.cfg") as cfg_m:
+        cfg_m.COMPRESSION = ("br", "zstd", "gzip")
+        cfg_m.COMPRESS_MIN_SIZE = 100
+        cfg_m.COMPRESS_CHUNK_SIZE = 16
+        cfg_m.COMPRESS_WORKERS = 0
+        yield cfg_m
+
+
+@pytest.mark.parametrize(
+    "mimetype, expected",
+    [
+        ("text/csv", True),
+        ("application/json", True),
+        ("application/vnd.api+json", True),
+        ("image/svg+xml", True),
+        ("image/png", False),
+        ("application/zip", False),
+        (None, False),
+    ],
+)
+def test_is_compressible(mimetype, expected):
+    assert is_compressible(mimetype) is expected
+
+
+def test_get_encodings(cfg_m):
+    with mock.patch("app.utils.compression.brotli", None), mock.patch(
+        "app.utils.compression.zstandard", mock.Mock()
+    ):
+        assert get_encodings() == ["zstd", "gzip"]
+        cfg_m.COMPRESSION = ("gzip", "zstd")
+        assert get_encodings() == ["gzip", "zstd"]
+        cfg_m.COMPRESSION = ()
+        assert get_encodings() == []
+
+
+@pytest.mark.parametrize(
+    "header, expected",
+    [
+        ("gzip, deflate", "gzip"),
+        ("gzip;q=0", None),
+        ("identity", None),
+        ("*", "gzip"),
+        (None, None),
+    ],
+)
+def test_choose_encoding(cfg_m, header, expected):
+    cfg_m.COMPRESSION = ("gzip",)
+    headers = {"Accept-Encoding": header} if header else {}
+    with app.test_request_context("/", headers=headers):
+        assert choose_encoding() == expected
+
+
+def test_choose_encoding_preference(cfg_m):
+    with mock.patch("app.utils.compression.zstandard", mock.Mock()), app.test_request_context(
+        "/", headers={"Accept-Encoding": "gzip, zstd"}
+    ):
+        assert choose_encoding() == "zstd"
+
+
+@pytest.mark.parametrize("encoding", ["gzip", "br", "zstd"])
+def test_compress(encoding):
+    data = b"some text " * 100
+    if encoding == "gzip":
+        decompress = gzip.decompress
+    elif encoding == "br":
+        decompress = pytest.importorskip("brotli").decompress
+    else:
+        decompress = pytest.importorskip("zstandard").ZstdDecompressor().decompress
+
+    assert decompress(compress(data, encoding)) == data
+
+
+def test_compress_unknown_encoding():
+    with pytest.raises(ValueError, match="deflate"):
+        compress(b"data", "deflate")
+
+
+def test_compress_file(tmp_path):
+    (tmp_path / "a.txt").write_bytes(b"some text " * 100)
+
+    size = compress_file(tmp_path / "a.txt", tmp_path / "a.txt.gz", "gzip", chunk_size=16)
+
+    assert gzip.decompress((tmp_path / "a.txt.gz").read_bytes()) == b"some text " * 100
+    assert size == (tmp_path / "a.txt.gz").stat().st_size
+    assert sorted(os.listdir(tmp_path)) == ["a.txt", "a.txt.gz"]
+
+
+def test_compress_file_error(tmp_path):
+    with pytest.raises(FileNotFoundError):
+        compress_file(tmp_path / "missing.txt", tmp_path / "a.gz", "gzip")
+
+    assert os.listdir(tmp_path) == []
+
+
+class TestCompressResponse:
+    def respond(self, data, headers=None, **kwargs):
+        with app.test_request_context("/", headers=headers or {"Accept-Encoding": "gzip"}):
+            response = jsonify(data) if not kwargs else app.response_class(data, **kwargs)
+            return compress_response(response)
+
+    def test_compressed(self):
+        response = self.respond(list(range(100)))
+
+        assert response.headers["Content-Encoding"] == "gzip"
+        assert "Accept-Encoding" in response.vary
+        assert response.content_length == len(response.get_data())
+        assert gzip.decompress(response.get_data()).startswith(b"[")
+
+    def test_small(self):
+        response = self.respond([1])
+
+        assert "Content-Encoding" not in response.headers
+        assert "Accept-Encoding" in response.vary
+
+    def test_not_accepted(self):
+        response = self.respond(list(range(100)), headers={"Accept-Encoding": "identity"})
+
+        assert "Content-Encoding" not in response.headers
+
+    def test_not_compressible(self):
+        response = self.respond(b"x" * 200, mimetype="image/png")
+
+        assert "Content-Encoding" not in response.headers
+        assert "Accept-Encoding" not in response.vary
+
+    def test_streamed(self):
+        response = self.respond(iter([b"x" * 200]), mimetype="text/plain")
+
+        assert "Content-Encoding" not in response.headers
+
+    def test_disabled(self, cfg_m):
+        cfg_m.COMPRESSION = ()
+
+        assert "Content-Encoding" not in self.respond(list(range(100))).headers
+
+
+class TestSidecarCache:
+    @pytest.fixture
+    def cache(self, tmp_path):
+        (tmp_path / "a.csv").write_bytes(b"a,b,c\n" * 100)
+        return SidecarCache(tmp_path / "sidecars", maxsize=1024)
+
+    def test_compressed_once(self, cache, tmp_path):
+        st = (tmp_path / "a.csv").stat()
+        path = cache.get(tmp_path / "a.csv", st, "gzip")
+
+        assert path.suffix == ".gz"
+        assert gzip.decompress(path.read_bytes()) == b"a,b,c\n" * 100
+        with mock.patch("app.utils.compression.compress_file") as compress_m:
+            assert cache.get(tmp_path / "a.csv", st, "gzip") == path
+            compress_m.assert_not_called()
+
+    def test_keyed_by_version(self, cache, tmp_path):
+        path = cache.get(tmp_path / "a.csv", (tmp_path / "a.csv").stat(), "gzip")
+        (tmp_path / "a.csv").write_bytes(b"changed\n" * 100)
+
+        new_path = cache.get(tmp_path / "a.csv", (tmp_path / "a.csv").stat(), "gzip")
+
+        assert new_path != path
+        assert gzip.decompress(new_path.read_bytes()) == b"changed\n" * 100
+
+    def test_missing_file(self, cache, tmp_path):
+        st = (tmp_path / "a.csv").stat()
+        os.remove(tmp_path / "a.csv")
+
+        with pytest.raises(FileNotFoundError):
+            cache.get(tmp_path / "a.csv", st, "gzip")
+
+    def test_larger_than_cache(self, cache, tmp_path):
+        (tmp_path / "b.csv").write_bytes(os.urandom(2048))
+
+        assert cache.get(tmp_path / "b.csv", (tmp_path / "b.csv").stat(), "gzip") is None
+        assert os.listdir(cache.path) == []
+
+    def test_background(self, cache, cfg_m, tmp_path):
+        cfg_m.COMPRESS_WORKERS = 1
+        st = (tmp_path / "a.csv").stat()
+        started, release = threading.Event(), threading.Event()
+
+        def slow_compress_file(*args):
+            started.set()
+            release.wait(5)
+            return compress_file(*args)
+
+        with mock.patch("app.utils.compression._executor", None), mock.patch(
+            "app.utils.compression.compress_file", side_effect=slow_compress_file
+        ) as compress_m:
+            assert cache.get(tmp_path / "a.csv", st, "gzip", wait=False) is None
+            assert started.wait(5)
+            assert cache.get(tmp_path / "a.csv", st, "gzip", wait=False) is None
+            release.set()
+            path = cache.get(tmp_path / "a.csv", st, "gzip")
+
+        assert gzip.decompress(path.read_bytes()) == b"a,b,c\n" * 100
+        assert cache.get(tmp_path / "a.csv", st, "gzip", wait=False) == path
+        compress_m.assert_called_once()
+
+
+def test_sidecar_cache_defaults(cfg_m, tmp_path):
+    cfg_m.COMPRESSED_CACHE_PATH = tmp_path / "sidecars"
+    cfg_m.COMPRESSED_CACHE_SIZE = 10
+
+    assert compression.sidecar_cache.path == tmp_path / "sidecars"
+    assert compression.sidecar_cache.maxsize == 10
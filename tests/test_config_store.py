@@ -0,0 +1,91 @@
+import os
+import stat
+from unittest import mock
+
+import pytest
+
+from app.utils.config_store import ConfigStore, atomic_write_text
+from app.utils.fileops import FILE_MODE
+
+
+@pytest.fixture
+def path(tmp_path):
+    path = tmp_path / "config.json"
+    path.write_text("first")
+    return path
+
+
+class TestConfigStore:
+    def test_cached(self, path):
+        store = ConfigStore()
+        loader = mock.Mock(side_effect=lambda x: x.read_text())
+
+        assert store.get(path, loader) == "first"
+        assert store.get(path, loader) == "first"
+        loader.assert_called_once_with(path)
+
+    def test_changed(self, path):
+        store = ConfigStore()
+        loader = mock.Mock(side_effect=lambda x: x.read_text())
+
+        assert store.get(path, loader) == "first"
+        path.write_text("second")
+        assert store.get(path, loader) == "second"
+        assert loader.call_count == 2
+
+    def test_replaced(self, path):
+        store = ConfigStore()
+        loader = mock.Mock(side_effect=lambda x: x.read_text())
+        store.get(path, loader)
+
+        stat = path.stat()
+        new_path = path.with_name("new.json")
+        new_path.write_text("other")
+        os.utime(new_path, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+        os.replace(new_path, path)
+
+        assert store.get(path, loader) == "other"
+
+    def test_missing(self, tmp_path):
+        store = ConfigStore()
+        loader = mock.Mock(return_value=[])
+
+        assert store.get(tmp_path / "missing.json", loader) == []
+        assert store.get(tmp_path / "missing.json", loader) == []
+        loader.assert_called_once()
+
+    def test_invalidate(self, path):
+        store = ConfigStore()
+        loader = mock.Mock(return_value="value")
+
+        store.get(path, loader)
+        store.invalidate(path)
+        store.get(path, loader)
+        assert loader.call_count == 2
+
+
+class TestAtomicWriteText:
+    def test_write(self, path):
+        atomic_write_text(path, "new data")
+
+        assert path.read_text() == "new data"
+        assert list(path.parent.iterdir()) == [path]
+
+    def test_keeps_mode(self, path):
+        os.chmod(path, 0o640)
+        atomic_write_text(path, "new data")
+
+        assert stat.S_IMODE(path.stat().st_mode) == 0o640
+
+    def test_new_file_mode(self, tmp_path):
+        atomic_write_text(tmp_path / "new.json", "new data")
+
+        assert stat.S_IMODE((tmp_path / "new.json").stat().st_mode) == FILE_MODE
+
+    def test_error(self, path):
+        with mock.patch("os.replace", side_effect=OSError("boom")):
+            with pytest.raises(OSError, match="boom"):
+                atomic_write_text(path, "new data")
+
+        assert path.read_text() == "first"
+        assert list(path.parent.iterdir()) == [path]
@@ -0,0 +1,92 @@
+import os
+
+import pytest
+
+from app.utils.disk_cache import TEMP_SUFFIX, DiskCache, get_temp_path
+
+
+class Cache(DiskCache):
+    def default_path(self):
+        raise AssertionError("the tests give the path")
+
+    def default_maxsize(self):
+        return 25
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return Cache(tmp_path)
+
+
+def write(cache, name, size=10):
+    (cache.path / name).write_bytes(b"x" * size)
+    cache.add(name, size)
+    return cache.path / name
+
+
+def test_lookup(cache):
+    path = write(cache, "a")
+
+    assert cache.lookup("a") == path
+    assert cache.lookup("b") is None
+
+
+def test_lookup_removed(cache):
+    os.remove(write(cache, "a"))
+
+    assert cache.lookup("a") is None
+    write(cache, "b")
+    write(cache, "c")
+    assert cache.lookup("b") and cache.lookup("c")
+
+
+def test_evicts_least_recently_used(cache):
+    a = write(cache, "a")
+    b = write(cache, "b")
+    cache.lookup("a")
+    c = write(cache, "c")
+
+    assert a.exists() and c.exists()
+    assert not b.exists()
+
+
+def test_larger_than_cache(cache):
+    a = write(cache, "a")
+    (cache.path / "b").write_bytes(b"x" * 100)
+
+    assert cache.add("b", 100) is False
+    assert not (cache.path / "b").exists()
+    assert cache.lookup("a") == a
+
+
+def test_replaced(cache):
+    write(cache, "a")
+    write(cache, "a", 20)
+    write(cache, "b", 5)
+
+    assert cache.lookup("a") and cache.lookup("b")
+    (cache.path / "a").write_bytes(b"x" * 30)
+    assert cache.add("a", 30) is False
+    assert cache.lookup("a") is None
+    assert cache.lookup("b")
+
+
+def test_loaded_from_disk(tmp_path):
+    for name in ["a", "b"]:
+        (tmp_path / name).write_bytes(b"x" * 10)
+    (tmp_path / ("c" + TEMP_SUFFIX)).write_bytes(b"partial")
+    os.utime(tmp_path / "a", ns=(0, 0))
+
+    cache = Cache(tmp_path)
+    write(cache, "d")
+
+    assert sorted(os.listdir(tmp_path)) == ["b", "c" + TEMP_SUFFIX, "d"]
+
+
+def test_missing_folder(tmp_path):
+    assert Cache(tmp_path / "missing").lookup("a") is None
+
+
+def test_get_temp_path():
+    assert get_temp_path("/cache/a").startswith("/cache/a.%d-" % os.getpid())
+    assert get_temp_path("/cache/a").endswith(TEMP_SUFFIX)
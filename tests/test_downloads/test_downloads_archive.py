@@ -0,0 +1,124 @@
+import io
+import os
+import tarfile
+import zipfile
+from unittest import mock
+
+import pytest
+
+from app.downloads.archive import ArchiveEntry, iter_tar, iter_zip, walk_folder
+
+
+@pytest.fixture
+def cloud(tmp_path):
+    (tmp_path / "folder" / "sub" / "empty").mkdir(parents=True)
+    (tmp_path / "folder" / "ignored").mkdir()
+    (tmp_path / "folder" / "a.txt").write_bytes(b"a" * 1000)
+    (tmp_path / "folder" / "sub" / "b.bin").write_bytes(os.urandom(3000))
+    (tmp_path / "folder" / "ignored" / "c.txt").write_bytes(b"c")
+
+    with mock.patch("app.downloads.archive.cfg") as cfg_m:
+        cfg_m.CLOUD_PATH = tmp_path
+        cfg_m.ARCHIVE_CHUNK_SIZE = 512
+        yield tmp_path
+
+
+def path_filter(relpath, is_dir=False):
+    return "ignored" not in str(relpath)
+
+
+def test_walk_folder(cloud):
+    entries = list(walk_folder("folder", "name", path_filter))
+
+    assert [(x.arcname, x.is_dir) for x in entries] == [
+        ("name", True),
+        ("name/sub", True),
+        ("name/a.txt", False),
+        ("name/sub/empty", True),
+        ("name/sub/b.bin", False),
+    ]
+    assert entries[2].path == str(cloud / "folder" / "a.txt")
+
+
+def test_walk_folder_filter(cloud):
+    calls = []
+
+    def recorder(relpath, is_dir=False):
+        calls.append((relpath.as_posix(), is_dir))
+        return True
+
+    list(walk_folder("folder", "folder", recorder))
+
+    assert ("folder/ignored", True) in calls
+    assert ("folder/ignored/c.txt", False) in calls
+    assert ("folder/sub/b.bin", False) in calls
+
+
+@pytest.mark.parametrize("compression", ["stored", "deflate"])
+def test_zip(cloud, compression):
+    chunks = list(iter_zip(walk_folder("folder", "folder", path_filter), compression))
+
+    assert len([x for x in chunks if x]) > 3
+    with zipfile.ZipFile(io.BytesIO(b"".join(chunks))) as archive:
+        assert archive.testzip() is None
+        assert archive.namelist() == [
+            "folder/",
+            "folder/sub/",
+            "folder/a.txt",
+            "folder/sub/empty/",
+            "folder/sub/b.bin",
+        ]
+        assert archive.read("folder/a.txt") == b"a" * 1000
+        assert archive.read("folder/sub/b.bin") == (cloud / "folder/sub/b.bin").read_bytes()
+
+        expected = zipfile.ZIP_STORED if compression == "stored" else zipfile.ZIP_DEFLATED
+        assert archive.getinfo("folder/a.txt").compress_type == expected
+
+
+@pytest.mark.parametrize("gzip", [False, True])
+def test_tar(cloud, gzip):
+    chunks = list(iter_tar(walk_folder("folder", "folder", path_filter), gzip))
+    data = b"".join(chunks)
+
+    if not gzip:
+        assert len([x for x in chunks if x]) > 3
+        assert len(data) % tarfile.RECORDSIZE == 0
+
+    with tarfile.open(fileobj=io.BytesIO(data), mode="r:gz" if gzip else "r:") as archive:
+        members = archive.getmembers()
+        assert [(x.name, x.isdir()) for x in members] == [
+            ("folder", True),
+            ("folder/sub", True),
+            ("folder/a.txt", False),
+            ("folder/sub/empty", True),
+            ("folder/sub/b.bin", False),
+        ]
+        assert archive.extractfile("folder/a.txt").read() == b"a" * 1000
+        b_bin = archive.extractfile("folder/sub/b.bin").read()
+        assert b_bin == (cloud / "folder/sub/b.bin").read_bytes()
+
+
+def test_unreadable_files_are_skipped(cloud):
+    entries = [
+        ArchiveEntry(str(cloud / "missing"), "missing", False),
+        ArchiveEntry(str(cloud / "folder" / "a.txt"), "a.txt", False),
+    ]
+
+    with zipfile.ZipFile(io.BytesIO(b"".join(iter_zip(entries)))) as archive:
+        assert archive.namelist() == ["a.txt"]
+
+    with tarfile.open(fileobj=io.BytesIO(b"".join(iter_tar(entries)))) as archive:
+        assert archive.getnames() == ["a.txt"]
+
+
+def test_tar_file_shrinks(cloud):
+    path = cloud / "folder" / "a.txt"
+    entries = [ArchiveEntry(str(path), "a.txt", False)]
+    data = iter_tar(entries)
+
+    header = next(data)
+    path.write_bytes(b"short")
+    data = header + b"".join(data)
+
+    with tarfile.open(fileobj=io.BytesIO(data)) as archive:
+        assert archive.extractfile("a.txt").read() == b"short" + bytes(995)
@@ -0,0 +1,7 @@
+from flask import Blueprint
+
+
+def test_import_blueprint():
+    from app.downloads import downloads_bp
+
+    assert isinstance(downloads_bp, Blueprint)
@@ -0,0 +1,351 @@
+import gzip
+import io
+import os
+import tarfile
+import zipfile
+from unittest import mock
+
+import pytest
+
+from app.utils.exceptions import PreviewError
+
+CONTENT = b"0123456789" * 100
+
+
+@pytest.fixture(autouse=True)
+def mocks(tmp_path):
+    (tmp_path / "folder").mkdir()
+    (tmp_path / "folder" / "video.mp4").write_bytes(CONTENT)
+
+    with mock.patch("app.downloads.routes.cfg") as cfg_m, mock.patch(
+        "app.downloads.routes.is_visible", return_value=True
+    ) as visible_m, mock.patch("app.downloads.routes.log"), mock.patch(
+        "app.downloads.routes.get_user", return_value="user-foo"
+    ):
+        cfg_m.CLOUD_PATH = tmp_path
+        cfg_m.DOWNLOAD_OFFLOAD = None
+        cfg_m.DOWNLOAD_ACCEL_PREFIX = "/protected/"
+        cfg_m.COMPRESS_MIN_SIZE = 100
+        cfg_m.COMPRESS_MAX_SIZE = 10000
+        yield cfg_m, visible_m
+
+
+def test_download(client):
+    rv = client.get("/cloud/folder/video.mp4")
+
+    assert rv.status_code == 200
+    assert rv.data == CONTENT
+    assert rv.headers["Accept-Ranges"] == "bytes"
+    assert rv.headers["Content-Length"] == str(len(CONTENT))
+    assert rv.headers["Last-Modified"]
+    assert not rv.headers["ETag"].startswith("W/")
+    assert "attachment" not in rv.headers.get("Content-Disposition", "")
+    rv.close()
+
+
+def test_download_attachment(client):
+    rv = client.get("/cloud/folder/video.mp4?download")
+
+    assert rv.headers["Content-Disposition"] == "attachment; filename=video.mp4"
+    rv.close()
+
+
+def test_range(client):
+    rv = client.get("/cloud/folder/video.mp4", headers={"Range": "bytes=10-19"})
+
+    assert rv.status_code == 206
+    assert rv.data == CONTENT[10:20]
+    assert rv.headers["Content-Range"] == "bytes 10-19/%d" % len(CONTENT)
+    rv.close()
+
+
+def test_range_not_satisfiable(client):
+    rv = client.get("/cloud/folder/video.mp4", headers={"Range": "bytes=5000-"})
+
+    assert rv.status_code == 416
+
+
+def test_if_range(client):
+    etag = client.get("/cloud/folder/video.mp4").headers["ETag"]
+    headers = {"Range": "bytes=0-9", "If-Range": etag}
+
+    rv = client.get("/cloud/folder/video.mp4", headers=headers)
+    assert rv.status_code == 206
+    rv.close()
+
+    headers["If-Range"] = '"other"'
+    rv = client.get("/cloud/folder/video.mp4", headers=headers)
+    assert rv.status_code == 200
+    assert rv.data == CONTENT
+    rv.close()
+
+
+def test_not_modified(client, tmp_path):
+    etag = client.get("/cloud/folder/video.mp4").headers["ETag"]
+
+    rv = client.get("/cloud/folder/video.mp4", headers={"If-None-Match": etag})
+    assert rv.status_code == 304
+    assert rv.data == b""
+
+    path = tmp_path / "folder" / "video.mp4"
+    path.write_bytes(CONTENT[::-1])
+    os.utime(path, ns=(0, path.stat().st_mtime_ns + 1))
+
+    rv = client.get("/cloud/folder/video.mp4", headers={"If-None-Match": etag})
+    assert rv.status_code == 200
+    assert rv.data == CONTENT[::-1]
+    rv.close()
+
+
+@pytest.mark.parametrize("filepath", ["folder", "folder/missing", "folder/video.mp4/x"])
+def test_not_found(client, filepath):
+    assert client.get("/cloud/" + filepath).status_code == 404
+
+
+def test_not_visible(client, mocks):
+    _, visible_m = mocks
+    visible_m.return_value = False
+
+    rv = client.get("/cloud/folder/video.mp4")
+
+    assert rv.status_code == 404
+    visible_m.assert_called_once_with("folder/video.mp4")
+
+
+def test_x_sendfile(client, mocks, tmp_path):
+    cfg_m, _ = mocks
+    cfg_m.DOWNLOAD_OFFLOAD = "x-sendfile"
+
+    rv = client.get("/cloud/folder/video.mp4", headers={"Range": "bytes=10-19"})
+
+    assert rv.status_code == 200
+    assert rv.data == b""
+    assert rv.headers["X-Sendfile"] == str(tmp_path / "folder" / "video.mp4")
+
+    rv = client.get("/cloud/folder/video.mp4", headers={"If-None-Match": rv.headers["ETag"]})
+    assert rv.status_code == 304
+    assert "X-Sendfile" not in rv.headers
+
+
+def test_x_accel_redirect(client, mocks, tmp_path):
+    cfg_m, _ = mocks
+    cfg_m.DOWNLOAD_OFFLOAD = "x-accel-redirect"
+    (tmp_path / "folder" / "a b.txt").write_bytes(CONTENT)
+
+    rv = client.get("/cloud/folder/a b.txt")
+
+    assert rv.status_code == 200
+    assert rv.data == b""
+    assert rv.headers["X-Accel-Redirect"] == "/protected/folder/a%20b.txt"
+    assert "X-Sendfile" not in rv.headers
+
+
+class TestCompression:
+    TEXT = b"date,value\n" + b"2020-01-01,1\n" * 100
+
+    @pytest.fixture(autouse=True)
+    def text(self, tmp_path):
+        (tmp_path / "folder" / "data.csv").write_bytes(self.TEXT)
+        (tmp_path / "folder" / "small.csv").write_bytes(b"a,b\n")
+
+    def test_compressed(self, client):
+        rv = client.get("/cloud/folder/data.csv", headers={"Accept-Encoding": "gzip"})
+
+        assert rv.status_code == 200
+        assert rv.headers["Content-Encoding"] == "gzip"
+        assert rv.mimetype == "text/csv"
+        assert "Accept-Encoding" in rv.vary
+        assert rv.headers["ETag"].endswith('-gzip"')
+        assert gzip.decompress(rv.data) == self.TEXT
+        rv.close()
+
+        rv = client.get(
+            "/cloud/folder/data.csv",
+            headers={"Accept-Encoding": "gzip", "If-None-Match": rv.headers["ETag"]},
+        )
+        assert rv.status_code == 304
+
+    def test_attachment(self, client):
+        rv = client.get("/cloud/folder/data.csv?download", headers={"Accept-Encoding": "gzip"})
+
+        assert rv.headers["Content-Disposition"] == "attachment; filename=data.csv"
+        rv.close()
+
+    def test_compression_error(self, client):
+        with mock.patch("app.downloads.routes.sidecar_cache") as cache_m:
+            cache_m.get.side_effect = OSError("read-only")
+            rv = client.get("/cloud/folder/data.csv", headers={"Accept-Encoding": "gzip"})
+
+        assert "Content-Encoding" not in rv.headers
+        assert rv.data == self.TEXT
+        rv.close()
+
+    def test_not_ready(self, client):
+        with mock.patch("app.downloads.routes.sidecar_cache") as cache_m:
+            cache_m.get.return_value = None
+            rv = client.get("/cloud/folder/data.csv", headers={"Accept-Encoding": "gzip"})
+
+        assert cache_m.get.call_args.kwargs == {"wait": False}
+        assert "Content-Encoding" not in rv.headers
+        assert "Accept-Encoding" in rv.vary
+        assert not rv.headers["ETag"].endswith('-gzip"')
+        assert rv.data == self.TEXT
+        rv.close()
+
+    def test_large(self, client, mocks):
+        cfg_m, _ = mocks
+        cfg_m.COMPRESS_MAX_SIZE = 1000
+
+        with mock.patch("app.downloads.routes.sidecar_cache") as cache_m:
+            rv = client.get("/cloud/folder/data.csv", headers={"Accept-Encoding": "gzip"})
+
+        cache_m.get.assert_not_called()
+        assert "Content-Encoding" not in rv.headers
+        assert rv.data == self.TEXT
+        rv.close()
+
+    @pytest.mark.parametrize("headers", [{}, {"Accept-Encoding": "identity"}])
+    def test_not_accepted(self, client, headers):
+        rv = client.get("/cloud/folder/data.csv", headers=headers)
+
+        assert "Content-Encoding" not in rv.headers
+        assert "Accept-Encoding" in rv.vary
+        assert rv.data == self.TEXT
+        rv.close()
+
+    def test_small(self, client):
+        rv = client.get("/cloud/folder/small.csv", headers={"Accept-Encoding": "gzip"})
+
+        assert "Content-Encoding" not in rv.headers
+        rv.close()
+
+    def test_not_compressible(self, client):
+        rv = client.get("/cloud/folder/video.mp4", headers={"Accept-Encoding": "gzip"})
+
+        assert "Content-Encoding" not in rv.headers
+        assert rv.data == CONTENT
+        rv.close()
+
+    def test_offloaded(self, client, mocks):
+        cfg_m, _ = mocks
+        cfg_m.DOWNLOAD_OFFLOAD = "x-sendfile"
+
+        rv = client.get("/cloud/folder/data.csv", headers={"Accept-Encoding": "gzip"})
+
+        assert "Content-Encoding" not in rv.headers
+        rv.close()
+
+
+class TestPreview:
+    @pytest.fixture(autouse=True)
+    def preview_m(self, mocks, tmp_path):
+        cfg_m, _ = mocks
+        cfg_m.PREVIEWS = True
+        cfg_m.PREVIEW_SIZES = (128, 256)
+        cfg_m.PREVIEW_DEFAULT_SIZE = 256
+        cfg_m.PREVIEW_MAX_AGE = 3600
+        (tmp_path / "folder" / "photo.png").write_bytes(b"image")
+        preview = tmp_path / "previews" / "0123abcd.jpg"
+        preview.parent.mkdir()
+        preview.write_bytes(b"preview")
+
+        with mock.patch("app.downloads.routes.can_preview", return_value=True), mock.patch(
+            "app.downloads.routes.preview_cache"
+        ) as cache_m:
+            cache_m.get.return_value = preview
+            yield cache_m
+
+    def test_preview(self, client, preview_m):
+        rv = client.get("/preview/folder/photo.png?size=128")
+
+        assert rv.status_code == 200
+        assert rv.data == b"preview"
+        assert rv.mimetype == "image/jpeg"
+        assert rv.headers["ETag"] == '"0123abcd"'
+        assert rv.cache_control.max_age == 3600
+        assert rv.cache_control.private
+        assert not rv.cache_control.public
+        preview_m.get.assert_called_once_with("folder/photo.png", 128)
+        rv.close()
+
+    def test_not_modified(self, client):
+        rv = client.get("/preview/folder/photo.png", headers={"If-None-Match": '"0123abcd"'})
+
+        assert rv.status_code == 304
+
+    @pytest.mark.parametrize("size", ["64", "big"])
+    def test_invalid_size(self, client, size):
+        assert client.get("/preview/folder/photo.png?size=" + size).status_code == 400
+
+    def test_not_found(self, client, mocks):
+        cfg_m, visible_m = mocks
+
+        assert client.get("/preview/folder/missing.png").status_code == 404
+        assert client.get("/preview/folder").status_code == 404
+        visible_m.return_value = False
+        assert client.get("/preview/folder/photo.png").status_code == 404
+        visible_m.return_value = True
+        cfg_m.PREVIEWS = False
+        assert client.get("/preview/folder/photo.png").status_code == 404
+
+    def test_not_previewable(self, client):
+        with mock.patch("app.downloads.routes.can_preview", return_value=False):
+            assert client.get("/preview/folder/video.mp4").status_code == 404
+
+    def test_render_error(self, client, preview_m):
+        preview_m.get.side_effect = PreviewError("not an image")
+
+        assert client.get("/preview/folder/photo.png").status_code == 415
+
+
+class TestArchive:
+    @pytest.fixture(autouse=True)
+    def archive_mocks(self, mocks, tmp_path):
+        cfg_m, _ = mocks
+        cfg_m.ARCHIVE_COMPRESSION = "stored"
+        (tmp_path / "folder" / "hidden").mkdir()
+        (tmp_path / "folder" / "hidden" / "secret.txt").write_text("secret")
+
+        def path_filter(relpath, is_dir=False):
+            return "hidden" not in str(relpath)
+
+        with mock.patch("app.downloads.archive.cfg") as archive_cfg_m, mock.patch(
+            "app.downloads.routes.get_path_filter", return_value=path_filter
+        ):
+            archive_cfg_m.CLOUD_PATH = tmp_path
+            archive_cfg_m.ARCHIVE_CHUNK_SIZE = 1024
+            yield
+
+    def test_zip(self, client):
+        rv = client.get("/archive/folder?compression=deflate")
+
+        assert rv.status_code == 200
+        assert rv.mimetype == "application/zip"
+        assert rv.headers["Content-Disposition"] == "attachment; filename=folder.zip"
+        with zipfile.ZipFile(io.BytesIO(rv.data)) as archive:
+            assert archive.namelist() == ["folder/", "folder/video.mp4"]
+            assert archive.read("folder/video.mp4") == CONTENT
+
+    def test_tar_gz(self, client, tmp_path):
+        rv = client.get("/archive/?format=tar.gz")
+
+        assert rv.status_code == 200
+        assert rv.mimetype == "application/gzip"
+        filename = tmp_path.name + ".tar.gz"
+        assert rv.headers["Content-Disposition"] == "attachment; filename=" + filename
+        with tarfile.open(fileobj=io.BytesIO(rv.data), mode="r:gz") as archive:
+            assert archive.getnames() == [
+                tmp_path.name,
+                tmp_path.name + "/folder",
+                tmp_path.name + "/folder/video.mp4",
+            ]
+
+    @pytest.mark.parametrize("query", ["format=rar", "compression=bzip2"])
+    def test_bad_request(self, client, query):
+        assert client.get("/archive/folder?" + query).status_code == 400
+
+    @pytest.mark.parametrize(
+        "folder", ["missing", "folder/video.mp4", "folder/hidden", "../outside"]
+    )
+    def test_not_found(self, client, folder):
+        assert client.get("/archive/" + folder).status_code == 404
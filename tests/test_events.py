@@ -0,0 +1,38 @@
+from unittest import mock
+
+import pytest
+
+from app.utils import events
+from app.utils.exceptions import WatcherWarning
+
+
+@pytest.fixture
+def callback():
+    callback = mock.Mock()
+    events.subscribe(callback)
+    yield callback
+    events.unsubscribe(callback)
+
+
+def test_publish(callback):
+    events.publish(events.MOVED, "a", "b", is_dir=True)
+    callback.assert_called_once_with(events.Event("moved", "a", "b", True))
+
+
+def test_subscribe_twice(callback):
+    events.subscribe(callback)
+    events.publish(events.CREATED, "a")
+    callback.assert_called_once_with(events.Event("created", "a", None, False))
+
+
+def test_unsubscribe(callback):
+    events.unsubscribe(callback)
+    events.publish(events.CREATED, "a")
+    callback.assert_not_called()
+
+
+def test_subscriber_error(callback):
+    callback.side_effect = ValueError("boom")
+
+    with pytest.warns(WatcherWarning, match="boom"):
+        events.publish(events.DELETED, "a")
@@ -2,7 +2,19 @@ import warnings
 
 import pytest
 
-from app.utils.exceptions import CloudError, CloudWarning, IngoredWarning, SudoersWarning
+from app.utils.exceptions import (
+    CloudError,
+    CloudWarning,
+    IndexWarning,
+    IngoredWarning,
+    JobError,
+    JobWarning,
+    PreviewError,
+    QuotaError,
+    SudoersWarning,
+    UploadError,
+    WatcherWarning,
+)
 
 
 class TestCloudError:
@@ -47,3 +59,80 @@ class TestIngoredWarning:
     def test_raise(self):
         with pytest.warns(IngoredWarning):
             warnings.warn("message", IngoredWarning)
+
+
+class TestWatcherWarning:
+    def test_inheritance(self):
+        warn = WatcherWarning()
+        assert isinstance(warn, WatcherWarning)
+        assert isinstance(warn, CloudWarning)
+
+    def test_raise(self):
+        with pytest.warns(WatcherWarning):
+            warnings.warn("message", WatcherWarning)
+
+
+class TestUploadError:
+    def test_inheritance(self):
+        exc = UploadError()
+        assert isinstance(exc, UploadError)
+        assert isinstance(exc, CloudError)
+
+    def test_raise(self):
+        with pytest.raises(UploadError):
+            raise UploadError
+
+
+class TestIndexWarning:
+    def test_inheritance(self):
+        warn = IndexWarning()
+        assert isinstance(warn, IndexWarning)
+        assert isinstance(warn, CloudWarning)
+
+    def test_raise(self):
+        with pytest.warns(IndexWarning):
+            warnings.warn("message", IndexWarning)
+
+
+class TestJobError:
+    def test_inheritance(self):
+        exc = JobError()
+        assert isinstance(exc, JobError)
+        assert isinstance(exc, CloudError)
+
+    def test_raise(self):
+        with pytest.raises(JobError):
+            raise JobError
+
+
+class TestJobWarning:
+    def test_inheritance(self):
+        warn = JobWarning()
+        assert isinstance(warn, JobWarning)
+        assert isinstance(warn, CloudWarning)
+
+    def test_raise(self):
+        with pytest.warns(JobWarning):
+            warnings.warn("message", JobWarning)
+
+
+class TestQuotaError:
+    def test_inheritance(self):
+        exc = QuotaError()
+        assert isinstance(exc, QuotaError)
+        assert isinstance(exc, CloudError)
+
+    def test_raise(self):
+        with pytest.raises(QuotaError):
+            raise QuotaError
+
+
+class TestPreviewError:
+    def test_inheritance(self):
+        exc = PreviewError()
+        assert isinstance(exc, PreviewError)
+        assert isinstance(exc, CloudError)
+
+    def test_raise(self):
+        with pytest.raises(PreviewError):
+            raise PreviewError
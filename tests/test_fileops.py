@@ -0,0 +1,102 @@
+import errno
+import os
+import stat
+import tempfile
+from unittest import mock
+
+import pytest
+
+from app.utils.fileops import FILE_MODE, copy_range, remove_path, set_file_mode
+
+
+@pytest.fixture
+def src_path(tmp_path):
+    path = tmp_path / "src"
+    path.write_bytes(bytes(range(256)) * 100)
+    return path
+
+
+def copy(src_path, dst_path, count=None, block_size=1000):
+    with open(src_path, "rb") as src, open(dst_path, "ab") as dst:
+        copied = copy_range(src, dst, count=count, block_size=block_size)
+        assert dst.tell() == os.path.getsize(dst_path)
+    return copied
+
+
+class TestCopyRange:
+    def test_copy(self, src_path, tmp_path):
+        assert copy(src_path, tmp_path / "dst") == 25600
+        assert (tmp_path / "dst").read_bytes() == src_path.read_bytes()
+
+    def test_append(self, src_path, tmp_path):
+        (tmp_path / "dst").write_bytes(b"header")
+        copy(src_path, tmp_path / "dst")
+        assert (tmp_path / "dst").read_bytes() == b"header" + src_path.read_bytes()
+
+    def test_count(self, src_path, tmp_path):
+        assert copy(src_path, tmp_path / "dst", count=300) == 300
+        assert (tmp_path / "dst").read_bytes() == src_path.read_bytes()[:300]
+
+    @pytest.mark.parametrize("error", [errno.EXDEV, errno.ENOSYS])
+    def test_sendfile_fallback(self, src_path, tmp_path, error):
+        with mock.patch("os.copy_file_range", side_effect=OSError(error, "")):
+            assert copy(src_path, tmp_path / "dst") == 25600
+        assert (tmp_path / "dst").read_bytes() == src_path.read_bytes()
+
+    def test_python_fallback(self, src_path, tmp_path):
+        with mock.patch("os.copy_file_range", side_effect=AttributeError):
+            with mock.patch("os.sendfile", side_effect=OSError(errno.EINVAL, "")):
+                assert copy(src_path, tmp_path / "dst", count=5000) == 5000
+        assert (tmp_path / "dst").read_bytes() == src_path.read_bytes()[:5000]
+
+    def test_partial_fallback(self, src_path, tmp_path):
+        real_copy_file_range = os.copy_file_range
+        calls = []
+
+        def copy_file_range(*args):
+            calls.append(args)
+            if len(calls) > 1:
+                raise OSError(errno.EXDEV, "")
+            return real_copy_file_range(*args)
+
+        with mock.patch("os.copy_file_range", copy_file_range):
+            assert copy(src_path, tmp_path / "dst", count=2500) == 2500
+        assert (tmp_path / "dst").read_bytes() == src_path.read_bytes()[:2500]
+
+    def test_other_errors(self, src_path, tmp_path):
+        with mock.patch("os.copy_file_range", side_effect=PermissionError):
+            with pytest.raises(PermissionError):
+                copy(src_path, tmp_path / "dst")
+
+
+class TestRemovePath:
+    def test_file(self, src_path):
+        remove_path(src_path)
+        assert not src_path.exists()
+
+    def test_tree(self, tmp_path):
+        (tmp_path / "a" / "b").mkdir(parents=True)
+        (tmp_path / "a" / "b" / "c").write_text("c")
+        remove_path(tmp_path / "a")
+        assert not (tmp_path / "a").exists()
+
+    def test_missing(self, tmp_path):
+        remove_path(tmp_path / "missing")
+
+
+@pytest.mark.skipif(not hasattr(os, "fchmod"), reason="needs fchmod")
+def test_set_file_mode(tmp_path):
+    fd, path = tempfile.mkstemp(dir=tmp_path)
+    try:
+        set_file_mode(fd)
+        assert stat.S_IMODE(os.fstat(fd).st_mode) == FILE_MODE
+        set_file_mode(fd, 0o640)
+        assert stat.S_IMODE(os.fstat(fd).st_mode) == 0o640
+    finally:
+        os.close(fd)
+
+
+def test_file_mode():
+    umask = os.umask(0o022)
+    os.umask(umask)
+    assert FILE_MODE == 0o666 & ~umask
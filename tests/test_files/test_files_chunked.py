@@ -0,0 +1,142 @@
+import hashlib
+import io
+import os
+import stat
+from pathlib import Path
+from unittest import mock
+
+import pytest
+
+from app.files.chunked import UploadSession, collect_expired_sessions, get_session_path
+from app.files.store import get_blob_path
+from app.utils.exceptions import UploadError
+from app.utils.fileops import FILE_MODE
+
+
+@pytest.fixture(autouse=True)
+def cfg_m(tmp_path):
+    with mock.patch("app.files.chunked.cfg") as cfg_m:
+        cfg_m.CLOUD_PATH = tmp_path / "cloud"
+        cfg_m.UPLOAD_SESSIONS_PATH = tmp_path / "sessions"
+        cfg_m.CHUNKED_UPLOAD_CHUNK_SIZE = 4
+        cfg_m.UPLOAD_CHUNK_SIZE = 3
+        cfg_m.UPLOAD_SESSION_TTL = 60
+        cfg_m.STAGING_DIRNAME = ".staging"
+        cfg_m.DEDUP_UPLOADS = False
+        (tmp_path / "cloud" / "folder").mkdir(parents=True)
+        yield cfg_m
+
+
+class TestUploadSession:
+    def test_create_and_load(self, cfg_m):
+        session = UploadSession.create("folder", "../my file.txt", size=10, user="user")
+        loaded = UploadSession.load(session.id)
+
+        assert loaded.filename == "my_file.txt"
+        assert loaded.folder == "folder"
+        assert loaded.size == 10
+        assert loaded.chunk_size == 4
+        assert loaded.total_chunks == 3
+        assert loaded.user == "user"
+        assert session.staging_dir.is_dir()
+        assert session.staging_dir.parent == cfg_m.CLOUD_PATH / "folder" / ".staging"
+
+    @pytest.mark.parametrize(
+        "kwargs",
+        [{"filename": ""}, {"size": -1}, {"chunk_size": 0}],
+    )
+    def test_create_invalid(self, kwargs):
+        kwargs.setdefault("filename", "file.txt")
+        with pytest.raises(UploadError):
+            UploadSession.create("folder", **kwargs)
+
+    @pytest.mark.parametrize("session_id", ["../../etc", "0" * 32])
+    def test_load_invalid(self, session_id):
+        with pytest.raises(UploadError):
+            UploadSession.load(session_id)
+
+    def test_upload(self, cfg_m):
+        session = UploadSession.create("folder", "file.txt", size=10)
+        assert session.missing() == [0, 1, 2]
+
+        assert session.write_chunk(2, io.BytesIO(b"89")) == 2
+        assert session.write_chunk(0, io.BytesIO(b"0123")) == 4
+        assert session.received() == [0, 2]
+        assert session.missing() == [1]
+
+        with pytest.raises(UploadError, match="Missing chunks"):
+            session.finalize()
+
+        session.write_chunk(1, io.BytesIO(b"4567"))
+        assert session.finalize() == Path("folder/file.txt")
+        assert (cfg_m.CLOUD_PATH / "folder" / "file.txt").read_bytes() == b"0123456789"
+        assert os.listdir(cfg_m.CLOUD_PATH / "folder") == ["file.txt"]
+        assert stat.S_IMODE((cfg_m.CLOUD_PATH / "folder" / "file.txt").stat().st_mode) == FILE_MODE
+        assert not get_session_path(session.id).exists()
+
+    def test_unknown_size(self, cfg_m):
+        session = UploadSession.create("folder", "file.txt")
+        session.write_chunk(0, io.BytesIO(b"01"))
+        session.write_chunk(2, io.BytesIO(b"23"))
+        assert session.missing() == [1]
+
+        session.write_chunk(1, io.BytesIO(b"ab"))
+        session.finalize()
+        assert (cfg_m.CLOUD_PATH / "folder" / "file.txt").read_bytes() == b"01ab23"
+
+    @mock.patch("app.files.store.cfg")
+    def test_dedup(self, store_cfg_m, cfg_m):
+        cfg_m.DEDUP_UPLOADS = True
+        store_cfg_m.CLOUD_PATH = cfg_m.CLOUD_PATH
+        store_cfg_m.STORE_DIRNAME = ".store"
+        store_cfg_m.UPLOAD_CHUNK_SIZE = 3
+
+        paths = []
+        for folder in ["folder-1", "folder-2"]:
+            session = UploadSession.create(folder, "file.txt", size=6)
+            session.write_chunk(1, io.BytesIO(b"23"))
+            session.write_chunk(0, io.BytesIO(b"0145"))
+            paths.append(cfg_m.CLOUD_PATH / session.finalize())
+
+        blob = get_blob_path(hashlib.sha256(b"014523").hexdigest())
+        assert blob.read_bytes() == b"014523"
+        assert os.path.samefile(blob, paths[0])
+        assert os.path.samefile(blob, paths[1])
+
+    @pytest.mark.parametrize(
+        "index, data", [(0, b"012"), (2, b"8"), (3, b"0"), (0, b"01234")]
+    )
+    def test_invalid_chunk(self, index, data):
+        session = UploadSession.create("folder", "file.txt", size=10)
+        with pytest.raises(UploadError):
+            session.write_chunk(index, io.BytesIO(data))
+        assert session.received() == []
+        assert os.listdir(session.staging_dir) == []
+
+    def test_rewrite_chunk(self):
+        session = UploadSession.create("folder", "file.txt", size=4)
+        session.write_chunk(0, io.BytesIO(b"aaaa"))
+        session.write_chunk(0, io.BytesIO(b"bbbb"))
+        session.finalize()
+
+    def test_discard(self, cfg_m):
+        session = UploadSession.create("folder", "file.txt", size=4)
+        session.write_chunk(0, io.BytesIO(b"aaaa"))
+        session.discard()
+
+        assert os.listdir(cfg_m.CLOUD_PATH / "folder") == []
+        assert not get_session_path(session.id).exists()
+
+
+def test_collect_expired_sessions(cfg_m):
+    old = UploadSession.create("folder", "old.txt")
+    new = UploadSession.create("folder", "new.txt")
+    os.utime(get_session_path(old.id), (0, 0))
+
+    assert collect_expired_sessions() == 1
+    assert not old.staging_dir.exists()
+    assert UploadSession.load(new.id).filename == "new.txt"
+
+
+def test_collect_expired_sessions_empty(cfg_m):
+    assert collect_expired_sessions() == 0
@@ -0,0 +1,139 @@
+import os
+from unittest import mock
+
+import pytest
+
+from app.files.moves import TreeCopy, is_cross_device, run_move, start_move
+from app.utils import events
+from app.utils.exceptions import JobError
+from app.utils.jobs import DONE, FAILED, Job, job_runner
+
+
+@pytest.fixture(autouse=True)
+def cloud(tmp_path):
+    root = tmp_path / "cloud"
+    (root / "src" / "inner").mkdir(parents=True)
+    (root / "src" / "a.txt").write_bytes(b"a" * 100)
+    (root / "src" / "inner" / "b.txt").write_bytes(b"b" * 10)
+    os.symlink("a.txt", root / "src" / "link")
+    os.utime(root / "src" / "inner", ns=(0, 10 ** 9))
+    (root / "dst").mkdir()
+
+    with mock.patch("app.files.moves.cfg") as cfg_m, mock.patch(
+        "app.utils.jobs.cfg"
+    ) as jobs_cfg_m, mock.patch("app.files.store.cfg") as store_cfg_m:
+        cfg_m.CLOUD_PATH = store_cfg_m.CLOUD_PATH = root
+        cfg_m.STAGING_DIRNAME = ".staging"
+        cfg_m.MOVE_CHUNK_SIZE = 16
+        cfg_m.MOVE_VERIFY = True
+        store_cfg_m.STORE_DIRNAME = ".store"
+        jobs_cfg_m.JOBS_PATH = tmp_path / "jobs"
+        jobs_cfg_m.JOB_TTL = 60
+        yield root
+
+
+@pytest.fixture(autouse=True)
+def publish_m():
+    with mock.patch("app.utils.events.publish") as publish_m:
+        yield publish_m
+
+
+@pytest.fixture(autouse=True)
+def submit_m():
+    with mock.patch.object(job_runner, "submit", side_effect=lambda job: job.save() or job):
+        yield
+
+
+class TestIsCrossDevice:
+    def test_same_device(self, cloud):
+        assert not is_cross_device(cloud / "src", cloud / "dst")
+        assert not is_cross_device(cloud / "src", cloud / "dst" / "new")
+
+    def test_other_device(self, cloud):
+        st = os.stat(cloud)
+        other = mock.Mock(st_dev=st.st_dev + 1)
+
+        with mock.patch("os.lstat", return_value=other):
+            assert is_cross_device(cloud / "src", cloud / "dst")
+
+    def test_missing(self, cloud):
+        assert not is_cross_device(cloud / "missing", cloud / "dst")
+        assert not is_cross_device(cloud / "src", cloud / "missing" / "new")
+
+
+class TestStartMove:
+    def test_start(self):
+        job = start_move("src/", "dst/./moved", "user-foo")
+
+        assert job.kind == "move"
+        assert job.data == {"src": "src", "dst": "dst/moved", "is_dir": True}
+        assert Job.load(job.id).user == "user-foo"
+
+    def test_exists(self):
+        with pytest.raises(FileExistsError):
+            start_move("src", "dst")
+
+    @pytest.mark.parametrize("src, dst", [("..", "dst/x"), ("src", "../x"), (".", "dst/x")])
+    def test_outside(self, src, dst):
+        with pytest.raises(FileNotFoundError):
+            start_move(src, dst)
+
+
+class TestRunMove:
+    def test_move_folder(self, cloud, publish_m):
+        job = start_move("src", "dst/src")
+
+        job_runner.run(job.id)
+
+        job = Job.load(job.id)
+        assert job.status == DONE, job.error
+        assert job.result == {"files": 2, "bytes": 110}
+        assert job.progress == {"files": 2, "total_files": 2, "bytes": 110, "total_bytes": 110}
+
+        assert not (cloud / "src").exists()
+        moved = cloud / "dst" / "src"
+        assert (moved / "a.txt").read_bytes() == b"a" * 100
+        assert (moved / "inner" / "b.txt").read_bytes() == b"b" * 10
+        assert os.readlink(moved / "link") == "a.txt"
+        assert os.stat(moved / "inner").st_mtime_ns == 10 ** 9
+        assert os.listdir(cloud / "dst") == ["src"]
+        publish_m.assert_called_once_with(events.MOVED, "src", "dst/src", is_dir=True)
+
+    def test_move_file(self, cloud):
+        job = start_move("src/a.txt", "dst/a.txt")
+
+        assert run_move(job) == {"files": 1, "bytes": 100}
+
+        assert (cloud / "dst" / "a.txt").read_bytes() == b"a" * 100
+        assert not (cloud / "src" / "a.txt").exists()
+
+    def test_destination_created_meanwhile(self, cloud):
+        job = start_move("src", "dst/src")
+        (cloud / "dst" / "src").mkdir()
+
+        with pytest.raises(FileExistsError):
+            run_move(job)
+
+        assert (cloud / "src" / "a.txt").exists()
+
+    def test_corrupted_copy(self, cloud, publish_m):
+        job = start_move("src", "dst/src")
+
+        with mock.patch("app.files.moves.hash_file", side_effect=["x", "y"]):
+            job_runner.run(job.id)
+
+        job = Job.load(job.id)
+        assert job.status == FAILED
+        assert "corrupted" in job.error
+        assert (cloud / "src" / "a.txt").read_bytes() == b"a" * 100
+        assert os.listdir(cloud / "dst") == []
+        publish_m.assert_not_called()
+
+    def test_source_changed(self, cloud):
+        job = start_move("src/a.txt", "dst/a.txt")
+        tree_copy = TreeCopy(job)
+        st = os.stat(cloud / "src" / "a.txt")
+        (cloud / "src" / "a.txt").write_bytes(b"changed")
+
+        with pytest.raises(JobError, match="changed"):
+            tree_copy.copy_file(cloud / "src" / "a.txt", cloud / "dst" / "a.txt", st)
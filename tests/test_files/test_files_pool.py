@@ -0,0 +1,85 @@
+import io
+import stat
+import threading
+from unittest import mock
+
+import pytest
+from werkzeug.datastructures import FileStorage
+
+from app.files.pool import UploadSummary, save_file, save_files
+from app.utils.fileops import FILE_MODE
+
+
+@pytest.fixture(params=[1, 4])
+def workers(request):
+    with mock.patch("app.files.pool.cfg") as cfg_m:
+        cfg_m.UPLOAD_WORKERS = request.param
+        yield request.param
+
+
+def test_save_files(workers):
+    functions = [mock.Mock() for _ in range(5)]
+    jobs = [("file-%d" % i, function) for i, function in enumerate(functions)]
+
+    summary = save_files(jobs, skipped=[""])
+
+    assert summary == UploadSummary(["file-%d" % i for i in range(5)], [""], [])
+    for function in functions:
+        function.assert_called_once_with()
+
+
+def test_failures(workers):
+    exc = PermissionError("denied")
+    jobs = [
+        ("file-1", mock.Mock()),
+        ("file-2", mock.Mock(side_effect=exc)),
+        ("file-3", mock.Mock()),
+    ]
+
+    summary = save_files(jobs)
+
+    assert summary.saved == ["file-1", "file-3"]
+    assert summary.failed == [("file-2", exc)]
+    assert summary.skipped == []
+
+
+def test_other_errors_propagate(workers):
+    with pytest.raises(ValueError):
+        save_files([("a", mock.Mock(side_effect=ValueError)), ("b", mock.Mock())])
+
+
+def test_concurrent():
+    barrier = threading.Barrier(3, timeout=5)
+    jobs = [("file-%d" % i, barrier.wait) for i in range(3)]
+
+    with mock.patch("app.files.pool.cfg") as cfg_m:
+        cfg_m.UPLOAD_WORKERS = 3
+        with mock.patch("app.files.pool._executor", None):
+            summary = save_files(jobs)
+
+    assert summary.saved == ["file-0", "file-1", "file-2"]
+
+
+def test_save_file(tmp_path):
+    (tmp_path / "file.txt").write_bytes(b"old")
+    save_file(FileStorage(io.BytesIO(b"new"), "file.txt"), str(tmp_path / "file.txt"))
+
+    assert [x.name for x in tmp_path.iterdir()] == ["file.txt"]
+    assert (tmp_path / "file.txt").read_bytes() == b"new"
+
+
+def test_save_file_mode(tmp_path):
+    save_file(FileStorage(io.BytesIO(b"new"), "file.txt"), str(tmp_path / "file.txt"))
+
+    assert stat.S_IMODE((tmp_path / "file.txt").stat().st_mode) == FILE_MODE
+
+
+def test_save_file_error(tmp_path):
+    (tmp_path / "file.txt").write_bytes(b"old")
+    stream = mock.Mock(read=mock.Mock(side_effect=OSError("Connection lost")))
+
+    with pytest.raises(OSError, match="Connection lost"):
+        save_file(FileStorage(stream, "file.txt"), str(tmp_path / "file.txt"))
+
+    assert [x.name for x in tmp_path.iterdir()] == ["file.txt"]
+    assert (tmp_path / "file.txt").read_bytes() == b"old"
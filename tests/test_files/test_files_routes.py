@@ -1,9 +1,15 @@
 import io
+import os
 from itertools import product
 from pathlib import Path
 from unittest import mock
 
 import pytest
+from werkzeug.datastructures import FileStorage
+from werkzeug.test import encode_multipart
+
+from app.utils.exceptions import JobError, QuotaError
+from app.utils.jobs import job_runner
 
 FILEPATHS = [
     "hello/world",
@@ -24,12 +30,15 @@ class TestUpload:
         folders = [Path(x) for x in ["folder-1", "folder-2", "folder-3"]]
 
         self.cfg_m = mock.patch("app.files.routes.cfg").start()
-        self.save_m = mock.patch("werkzeug.datastructures.FileStorage.save").start()
+        self.save_m = mock.patch("app.files.routes.save_file").start()
         self.folders_m = mock.patch("app.files.routes.get_folders").start()
+        self.resolve_m = mock.patch("app.files.routes.resolve_folder_id").start()
         self.log_m = mock.patch("app.files.routes.log").start()
         self.gu_m = mock.patch("app.files.routes.get_user").start()
 
         self.cfg_m.CLOUD_PATH = Path("/cloud")
+        self.resolve_m.return_value = None
+        self.cfg_m.DEDUP_UPLOADS = False
         self.folders_m.return_value = folders
         self.gu_m.return_value = "user-foo"
 
@@ -56,7 +65,7 @@ class TestUpload:
         assert self.log_m.call_count == 2
         assert self.gu_m.call_count == 2
 
-        self.save_m.assert_called_once_with("/cloud/folder-1/test.pdf")
+        self.save_m.assert_called_once_with(mock.ANY, "/cloud/folder-1/test.pdf")
         assert self.save_m.call_count == 1
 
         rv = client.post(
@@ -78,7 +87,7 @@ class TestUpload:
         assert self.log_m.call_count == 4
         assert self.gu_m.call_count == 4
 
-        self.save_m.assert_called_with("/cloud/folder-3/test.rar")
+        self.save_m.assert_called_with(mock.ANY, "/cloud/folder-3/test.rar")
         assert self.save_m.call_count == 2
 
         assert b"success" in rv.data
@@ -105,13 +114,145 @@ class TestUpload:
         assert self.log_m.call_count == 2
         assert self.gu_m.call_count == 2
 
-        self.save_m.assert_called_once_with("/cloud/folder-1/test.pdf")
+        self.save_m.assert_called_once_with(mock.ANY, "/cloud/folder-1/test.pdf")
         assert self.save_m.call_count == 1
 
         assert b"Permission Error" in rv.data
         assert b"danger" in rv.data
         assert "PermissionError" in self.log_m.call_args_list[-1][0][0]
 
+    def test_partial_failure(self, client):
+        def save(file, path):
+            if path.endswith("test-2.py"):
+                raise PermissionError("Read only")
+
+        self.save_m.side_effect = save
+        rv = client.post(
+            "/upload",
+            data={
+                "files[]": [
+                    (io.BytesIO(b"this is a test"), "test-1.py"),
+                    (io.BytesIO(b"this is a test"), "test-2.py"),
+                    (io.BytesIO(b"this is a test"), "test-3.py"),
+                ],
+                "folder": 0,
+            },
+            follow_redirects=True,
+        )
+
+        assert rv.status_code == 200
+        assert self.save_m.call_count == 3
+        assert b"Permission Error: Read only" in rv.data
+        assert b"Uploaded 2 of 3 files" in rv.data
+        self.log_m.assert_called_with(
+            "User %r upload files to folder %r: %s",
+            "user-foo",
+            "folder-1",
+            ["test-1.py", "test-3.py"],
+        )
+
+    def test_json_summary(self, client):
+        self.save_m.side_effect = [None, OSError("Disk full")]
+        rv = client.post(
+            "/upload",
+            data={
+                "files[]": [
+                    (io.BytesIO(b"this is a test"), "test-1.py"),
+                    (io.BytesIO(b"this is a test"), "test-2.py"),
+                    (io.BytesIO(b""), ""),
+                ],
+                "folder": 1,
+            },
+            headers={"Accept": "application/json"},
+        )
+
+        assert rv.status_code == 200
+        assert sorted(rv.json) == ["failed", "saved", "skipped"]
+        assert len(rv.json["saved"]) == 1
+        assert rv.json["skipped"] == [""]
+        assert len(rv.json["failed"]) == 1
+        assert rv.json["failed"][0]["error"] == "Disk full"
+
+    def test_quota_exceeded(self, client):
+        with mock.patch("app.files.routes.usage_index") as usage_m:
+            usage_m.check_quota.side_effect = [
+                None,
+                QuotaError("Quota of folder 'folder-2' exceeded"),
+            ]
+            rv = client.post(
+                "/upload",
+                data={"files[]": [(io.BytesIO(b"this is a test"), "test.py")], "folder": 1},
+                headers={"Accept": "application/json"},
+            )
+
+        assert rv.status_code == 413
+        assert rv.json == {"error": "Quota of folder 'folder-2' exceeded"}
+        folder, user, size = usage_m.check_quota.call_args.args
+        assert (folder, user) == (Path("folder-2"), "user-foo")
+        assert size > len(b"this is a test")
+        self.save_m.assert_not_called()
+
+    def test_quota_checked_before_reading(self, client):
+        with mock.patch("app.files.routes.usage_index") as usage_m, mock.patch(
+            "app.files.routes.get_post_arg"
+        ) as get_post_arg_m:
+            usage_m.check_quota.side_effect = QuotaError("Quota of user 'user-foo' exceeded")
+            rv = client.post(
+                "/upload",
+                data={"files[]": [(io.BytesIO(b"this is a test"), "test.py")], "folder": 1},
+                headers={"Accept": "application/json"},
+            )
+
+        assert rv.status_code == 413
+        usage_m.check_quota.assert_called_once_with(".", "user-foo", mock.ANY)
+        get_post_arg_m.assert_not_called()
+        self.folders_m.assert_not_called()
+
+    @pytest.mark.parametrize("remaining, status_code", [(None, 200), (10, 413)])
+    def test_quota_without_length(self, client, remaining, status_code):
+        boundary, body = encode_multipart(
+            {"files[]": FileStorage(io.BytesIO(b"this is a test"), "test.py"), "folder": "1"}
+        )
+        with mock.patch("app.files.routes.usage_index") as usage_m:
+            usage_m.remaining_quota.return_value = remaining
+            rv = client.post(
+                "/upload",
+                input_stream=io.BytesIO(body),
+                content_type="multipart/form-data; boundary=%s" % boundary,
+                headers={"Accept": "application/json", "Transfer-Encoding": "chunked"},
+                environ_overrides={"wsgi.input_terminated": True},
+            )
+
+        assert rv.status_code == status_code
+        usage_m.remaining_quota.assert_called_once_with(".", "user-foo")
+        if status_code == 200:
+            usage_m.check_quota.assert_called_once_with(Path("folder-2"), "user-foo", 14)
+        else:
+            self.save_m.assert_not_called()
+
+    def test_same_name(self, client):
+        def save(file, path):
+            saved.append((file.read(), path))
+
+        saved = []
+        self.save_m.side_effect = save
+        rv = client.post(
+            "/upload",
+            data={
+                "files[]": [
+                    (io.BytesIO(b"first"), "test.py"),
+                    (io.BytesIO(b"second"), "test.py"),
+                    (io.BytesIO(b"third"), "../test.py"),
+                ],
+                "folder": 0,
+            },
+            headers={"Accept": "application/json"},
+        )
+
+        assert rv.status_code == 200
+        assert rv.json["saved"] == ["test.py"]
+        assert saved == [(b"third", "/cloud/folder-1/test.py")]
+
     def test_multiple_files(self, client):
         rv = client.post(
             "/upload",
@@ -129,9 +270,9 @@ class TestUpload:
 
         assert rv.status_code == 200
 
-        self.save_m.assert_any_call("/cloud/folder-3/test-1.py")
-        self.save_m.assert_any_call("/cloud/folder-3/test-2.py")
-        self.save_m.assert_any_call("/cloud/folder-3/test-3.py")
+        self.save_m.assert_any_call(mock.ANY, "/cloud/folder-3/test-1.py")
+        self.save_m.assert_any_call(mock.ANY, "/cloud/folder-3/test-2.py")
+        self.save_m.assert_any_call(mock.ANY, "/cloud/folder-3/test-3.py")
         assert self.save_m.call_count == 3
 
         self.folders_m.assert_called_once()
@@ -189,7 +330,7 @@ class TestUpload:
         )
 
         assert rv.status_code == 200
-        self.save_m.assert_called_once_with("/cloud/folder-3/whatever.rar")
+        self.save_m.assert_called_once_with(mock.ANY, "/cloud/folder-3/whatever.rar")
         self.folders_m.assert_called_once()
 
         self.log_m.assert_called()
@@ -234,10 +375,47 @@ class TestUpload:
         assert b"Invalid index folder" in rv.data
         assert b"danger" in rv.data
         self.save_m.assert_not_called()
-        self.folders_m.assert_called_once()
+        self.resolve_m.assert_called_once_with("-")
+        self.folders_m.assert_not_called()
         self.log_m.assert_called_once()
         self.gu_m.assert_called_once()
 
+    def test_folder_id(self, client):
+        self.resolve_m.return_value = Path("folder-2")
+        rv = client.post(
+            "/upload",
+            data={
+                "files[]": [(io.BytesIO(b"this is a test"), "test.pdf")],
+                "folder": "fd01-1a2b",
+                "submit": "Upload",
+            },
+            follow_redirects=True,
+        )
+
+        assert rv.status_code == 200
+        assert b"Files uploaded successfully" in rv.data
+        self.resolve_m.assert_called_once_with("fd01-1a2b")
+        self.folders_m.assert_not_called()
+        self.save_m.assert_called_once_with(mock.ANY, "/cloud/folder-2/test.pdf")
+
+    def test_previews_scheduled(self, client):
+        with mock.patch("app.files.routes.preview_cache") as cache_m:
+            client.post(
+                "/upload",
+                data={
+                    "files[]": [
+                        (io.BytesIO(b"image"), "photo.png"),
+                        (io.BytesIO(b"text"), "notes.txt"),
+                    ],
+                    "folder": 1,
+                },
+            )
+
+        cache_m.schedule.assert_has_calls(
+            [mock.call(Path("folder-2/photo.png")), mock.call(Path("folder-2/notes.txt"))],
+            any_order=True,
+        )
+
     def test_index_invalid_folder(self, client):
         rv = client.post(
             "/upload",
@@ -271,18 +449,359 @@ class TestUpload:
         self.gu_m.assert_called()
 
 
+class TestUploadStream:
+    @pytest.fixture(scope="function", autouse=True)
+    def mocks(self, tmp_path):
+        folders = [Path(x) for x in ["folder-1", "folder-2", "folder-3"]]
+        for folder in folders:
+            (tmp_path / folder).mkdir()
+
+        self.cloud = tmp_path
+        self.cfg_m = mock.patch("app.files.routes.cfg").start()
+        self.folders_m = mock.patch("app.files.routes.get_folders").start()
+        self.log_m = mock.patch("app.files.routes.log").start()
+        self.gu_m = mock.patch("app.files.routes.get_user").start()
+
+        self.cfg_m.CLOUD_PATH = tmp_path
+        self.cfg_m.UPLOAD_CHUNK_SIZE = 1024
+        self.cfg_m.DEDUP_UPLOADS = False
+        self.folders_m.return_value = folders
+        self.gu_m.return_value = "user-foo"
+
+        yield
+
+        mock.patch.stopall()
+
+    def test_folder_in_form(self, client):
+        rv = client.post(
+            "/upload-stream",
+            data={
+                "files[]": [
+                    (io.BytesIO(b"this is a test"), "test-1.pdf"),
+                    (io.BytesIO(b"another test"), "test-2.pdf"),
+                ],
+                "folder": 1,
+            },
+            follow_redirects=True,
+        )
+
+        assert rv.status_code == 200
+        assert b"Files uploaded successfully" in rv.data
+        assert (self.cloud / "folder-2" / "test-1.pdf").read_bytes() == b"this is a test"
+        assert (self.cloud / "folder-2" / "test-2.pdf").read_bytes() == b"another test"
+        assert sorted(x.name for x in self.cloud.iterdir()) == [
+            "folder-1",
+            "folder-2",
+            "folder-3",
+        ]
+        self.log_m.assert_called_with(
+            "User %r upload files to folder %r: %s",
+            "user-foo",
+            "folder-2",
+            ["test-1.pdf", "test-2.pdf"],
+        )
+
+    def test_folder_id(self, client):
+        with mock.patch("app.files.routes.resolve_folder_id") as resolve_m:
+            resolve_m.return_value = Path("folder-3")
+            rv = client.post(
+                "/upload-stream?folder=fd01-1a2b",
+                data={"files[]": [(io.BytesIO(b"this is a test"), "test.pdf")]},
+                follow_redirects=True,
+            )
+
+        assert b"Files uploaded successfully" in rv.data
+        resolve_m.assert_called_once_with("fd01-1a2b")
+        self.folders_m.assert_not_called()
+        assert (self.cloud / "folder-3" / "test.pdf").read_bytes() == b"this is a test"
+
+    def test_dedup(self, client):
+        self.cfg_m.DEDUP_UPLOADS = True
+        store_cfg_m = mock.patch("app.files.store.cfg").start()
+        store_cfg_m.CLOUD_PATH = self.cloud
+        store_cfg_m.STORE_DIRNAME = ".store"
+
+        for index in (0, 1):
+            rv = client.post(
+                "/upload-stream?folder=%d" % index,
+                data={"files[]": [(io.BytesIO(b"same data"), "test.pdf")]},
+                follow_redirects=True,
+            )
+            assert b"Files uploaded successfully" in rv.data
+
+        blobs = [x for x in (self.cloud / ".store").glob("*/*")]
+        assert len(blobs) == 1
+        assert os.path.samefile(blobs[0], self.cloud / "folder-1" / "test.pdf")
+        assert os.path.samefile(blobs[0], self.cloud / "folder-2" / "test.pdf")
+
+        self.cfg_m.CLOUD_PATH = self.cloud
+        self.cfg_m.TRASH_RETENTION = 0
+        with mock.patch("app.files.trash.cfg") as trash_cfg_m, mock.patch(
+            "app.utils.jobs.cfg"
+        ) as jobs_cfg_m, mock.patch("app.files.trash.events"):
+            trash_cfg_m.CLOUD_PATH = self.cloud
+            trash_cfg_m.TRASH_DIRNAME = ".trash"
+            trash_cfg_m.TRASH_RETENTION = 0
+            trash_cfg_m.RESERVED_DIRNAMES = frozenset([".store", ".trash"])
+            jobs_cfg_m.JOBS_PATH = self.cloud.parent / "jobs"
+            jobs_cfg_m.JOBS_SWEEP_INTERVAL = 60
+
+            client.get("/delete/folder-1/test.pdf")
+            assert job_runner.join(5)
+            assert blobs[0].exists()
+            client.get("/delete/folder-2")
+            assert job_runner.join(5)
+        assert not blobs[0].exists()
+        assert not (self.cloud / "folder-2").exists()
+
+    def test_folder_in_url(self, client):
+        rv = client.post(
+            "/upload-stream?folder=2",
+            data={"files[]": [(io.BytesIO(b"this is a test"), "test.pdf")]},
+            follow_redirects=True,
+        )
+
+        assert rv.status_code == 200
+        assert b"Files uploaded successfully" in rv.data
+        assert (self.cloud / "folder-3" / "test.pdf").read_bytes() == b"this is a test"
+
+    def test_no_folder(self, client):
+        rv = client.post(
+            "/upload-stream",
+            data={"files[]": [(io.BytesIO(b"this is a test"), "test.pdf")]},
+            follow_redirects=True,
+        )
+
+        assert b"No folder supplied" in rv.data
+        assert list(self.cloud.glob("**/*.pdf")) == []
+        assert list(self.cloud.glob(".upload-*")) == []
+
+    def test_invalid_folder(self, client):
+        rv = client.post(
+            "/upload-stream?folder=99",
+            data={"files[]": [(io.BytesIO(b"this is a test"), "test.pdf")]},
+            follow_redirects=True,
+        )
+
+        assert b"Invalid index folder" in rv.data
+        assert list(self.cloud.glob("**/*.pdf")) == []
+
+    def test_empty_files(self, client):
+        rv = client.post(
+            "/upload-stream",
+            data={"files[]": [(io.BytesIO(b""), "")] * 2, "folder": 0},
+            follow_redirects=True,
+        )
+
+        assert b"Supplied only 2 empty files" in rv.data
+        assert list(self.cloud.glob("**/.upload-*")) == []
+
+    def test_not_multipart(self, client):
+        rv = client.post("/upload-stream", data="raw", follow_redirects=True)
+
+        assert rv.status_code == 200
+        assert b"not multipart/form-data" in rv.data
+
+    def test_too_large(self, app, client):
+        app.config["MAX_CONTENT_LENGTH"] = 100
+        try:
+            rv = client.post(
+                "/upload-stream",
+                data={"files[]": [(io.BytesIO(b"x" * 1000), "big.bin")], "folder": 0},
+            )
+        finally:
+            app.config["MAX_CONTENT_LENGTH"] = None
+
+        assert rv.status_code == 413
+        assert list(self.cloud.glob("**/.upload-*")) == []
+
+    def test_quota_exceeded(self, client):
+        with mock.patch("app.files.routes.usage_index") as usage_m:
+            usage_m.check_quota.side_effect = [None, QuotaError("Quota of user 'user-foo' exceeded")]
+            rv = client.post(
+                "/upload-stream",
+                data={"files[]": [(io.BytesIO(b"this is a test"), "test.pdf")], "folder": 0},
+                follow_redirects=True,
+            )
+
+        assert b"Quota of user" in rv.data
+        assert usage_m.check_quota.call_args_list[0].args[0] == "."
+        assert usage_m.check_quota.call_args == mock.call(Path("folder-1"), "user-foo", 14)
+        assert list(self.cloud.glob("**/*.pdf")) == []
+        assert list(self.cloud.glob("**/.upload-*")) == []
+
+    def test_quota_without_length(self, client):
+        boundary, body = encode_multipart(
+            {"files[]": FileStorage(io.BytesIO(b"x" * 1000), "big.bin"), "folder": "0"}
+        )
+        with mock.patch("app.files.routes.usage_index") as usage_m:
+            usage_m.remaining_quota.return_value = 100
+            rv = client.post(
+                "/upload-stream",
+                input_stream=io.BytesIO(body),
+                content_type="multipart/form-data; boundary=%s" % boundary,
+                headers={"Transfer-Encoding": "chunked"},
+                environ_overrides={"wsgi.input_terminated": True},
+            )
+
+        assert rv.status_code == 413
+        usage_m.remaining_quota.assert_called_once_with(".", "user-foo")
+        assert list(self.cloud.glob("**/big.bin")) == []
+        assert list(self.cloud.glob("**/.upload-*")) == []
+
+
+class TestChunkedUpload:
+    @pytest.fixture(scope="function", autouse=True)
+    def mocks(self, tmp_path):
+        (tmp_path / "folder-1").mkdir()
+
+        self.cloud = tmp_path
+        self.cfg_m = mock.patch("app.files.chunked.cfg").start()
+        self.folders_m = mock.patch("app.files.routes.get_folders").start()
+        self.log_m = mock.patch("app.files.routes.log").start()
+        self.gu_m = mock.patch("app.files.routes.get_user").start()
+        self.publish_m = mock.patch("app.utils.events.publish").start()
+
+        self.cfg_m.CLOUD_PATH = tmp_path
+        self.cfg_m.UPLOAD_SESSIONS_PATH = tmp_path / ".sessions"
+        self.cfg_m.UPLOAD_CHUNK_SIZE = 1024
+        self.cfg_m.CHUNKED_UPLOAD_CHUNK_SIZE = 4096
+        self.cfg_m.UPLOAD_SESSION_TTL = 60
+        self.cfg_m.STAGING_DIRNAME = ".staging"
+        self.cfg_m.DEDUP_UPLOADS = False
+        self.folders_m.return_value = [Path("folder-1")]
+        self.gu_m.return_value = "user-foo"
+
+        yield
+
+        mock.patch.stopall()
+
+    def create(self, client, **data):
+        data.setdefault("folder", 0)
+        data.setdefault("filename", "test.bin")
+        return client.post("/uploads", json=data)
+
+    def test_upload(self, client):
+        rv = self.create(client, size=10, chunk_size=4)
+        assert rv.status_code == 201
+        upload_id = rv.json["id"]
+        assert rv.json["total_chunks"] == 3
+        assert rv.json["missing"] == [0, 1, 2]
+
+        for index, data in [(2, b"89"), (0, b"0123"), (1, b"4567")]:
+            rv = client.put(f"/uploads/{upload_id}/{index}", data=data)
+            assert rv.status_code == 200
+            assert rv.json == {"index": index, "size": len(data)}
+
+        rv = client.get(f"/uploads/{upload_id}")
+        assert rv.json["received"] == [0, 1, 2]
+        assert rv.json["missing"] == []
+
+        rv = client.post(f"/uploads/{upload_id}/finalize")
+        assert rv.status_code == 200
+        assert rv.json == {"path": "folder-1/test.bin"}
+        assert (self.cloud / "folder-1" / "test.bin").read_bytes() == b"0123456789"
+        self.publish_m.assert_called_once_with(
+            "created", Path("folder-1/test.bin"), user="user-foo"
+        )
+        self.log_m.assert_called_with(
+            "User %r upload files to folder %r: %s", "user-foo", "folder-1", ["test.bin"]
+        )
+
+        assert client.get(f"/uploads/{upload_id}").status_code == 404
+
+    def test_invalid_folder(self, client):
+        rv = self.create(client, folder=5)
+        assert rv.status_code == 400
+        assert "Invalid folder" in rv.json["error"]
+
+    def test_invalid_size(self, client):
+        assert self.create(client, size="big").status_code == 400
+
+    def test_quota_exceeded(self, client):
+        with mock.patch("app.files.routes.usage_index") as usage_m:
+            usage_m.check_quota.side_effect = QuotaError("Quota exceeded")
+            assert self.create(client, size=10).status_code == 413
+            usage_m.check_quota.assert_called_once_with(Path("folder-1"), "user-foo", 10)
+
+            usage_m.check_quota.side_effect = None
+            upload_id = self.create(client).json["id"]
+            client.put(f"/uploads/{upload_id}/0", data=b"data")
+            usage_m.check_quota.side_effect = QuotaError("Quota exceeded")
+            rv = client.post(f"/uploads/{upload_id}/finalize")
+
+        assert rv.status_code == 413
+        usage_m.check_quota.assert_called_with("folder-1", "user-foo", 4)
+        assert os.listdir(self.cloud / "folder-1") == [".staging"]
+
+    def test_chunk_quota_exceeded(self, client):
+        with mock.patch("app.files.routes.usage_index") as usage_m:
+            upload_id = self.create(client, chunk_size=4).json["id"]
+            assert client.put(f"/uploads/{upload_id}/0", data=b"0123").status_code == 200
+            usage_m.check_quota.side_effect = QuotaError("Quota exceeded")
+            rv = client.put(f"/uploads/{upload_id}/1", data=b"4567")
+
+        assert rv.status_code == 413
+        usage_m.check_quota.assert_called_with("folder-1", "user-foo", 8)
+        assert client.get(f"/uploads/{upload_id}").json["received"] == [0]
+
+    @pytest.mark.parametrize("remaining, status_code", [(None, 200), (5, 200), (3, 413)])
+    def test_chunk_without_length(self, client, remaining, status_code):
+        with mock.patch("app.files.routes.usage_index") as usage_m:
+            usage_m.remaining_quota.return_value = remaining
+            upload_id = self.create(client, chunk_size=4).json["id"]
+            rv = client.put(
+                f"/uploads/{upload_id}/0",
+                input_stream=io.BytesIO(b"0123"),
+                headers={"Transfer-Encoding": "chunked"},
+                environ_overrides={"wsgi.input_terminated": True},
+            )
+
+        assert rv.status_code == status_code
+        usage_m.remaining_quota.assert_called_once_with("folder-1", "user-foo")
+        received = client.get(f"/uploads/{upload_id}").json["received"]
+        assert received == ([0] if status_code == 200 else [])
+
+    def test_invalid_chunk(self, client):
+        upload_id = self.create(client, size=10, chunk_size=4).json["id"]
+        rv = client.put(f"/uploads/{upload_id}/0", data=b"01")
+        assert rv.status_code == 400
+        assert "expected 4" in rv.json["error"]
+
+    def test_finalize_missing(self, client):
+        upload_id = self.create(client, size=10, chunk_size=4).json["id"]
+        rv = client.post(f"/uploads/{upload_id}/finalize")
+        assert rv.status_code == 400
+        assert "Missing chunks" in rv.json["error"]
+
+    def test_not_found(self, client):
+        upload_id = "0" * 32
+        assert client.get(f"/uploads/{upload_id}").status_code == 404
+        assert client.put(f"/uploads/{upload_id}/0", data=b"0").status_code == 404
+        assert client.post(f"/uploads/{upload_id}/finalize").status_code == 404
+        assert client.delete(f"/uploads/{upload_id}").status_code == 404
+
+    def test_abort(self, client):
+        upload_id = self.create(client).json["id"]
+        client.put(f"/uploads/{upload_id}/0", data=b"data")
+
+        assert client.delete(f"/uploads/{upload_id}").status_code == 200
+        assert client.get(f"/uploads/{upload_id}").status_code == 404
+        assert os.listdir(self.cloud / "folder-1") == []
+
+
 class TestDelete:
     @pytest.fixture(scope="function", autouse=True)
     def mocks(self):
-        self.rm_m = mock.patch("os.remove").start()
+        self.trash_m = mock.patch("app.files.routes.trash").start()
         self.cfg_m = mock.patch("app.files.routes.cfg").start()
-        self.rmtree_m = mock.patch("shutil.rmtree").start()
-        self.is_dir_m = mock.patch("pathlib.Path.is_dir").start()
         self.gu_m = mock.patch("app.files.routes.get_user").start()
         self.log_m = mock.patch("app.files.routes.log").start()
 
         self.cfg_m.CLOUD_PATH = Path("/cloud")
+        self.cfg_m.TRASH_RETENTION = 0
         self.gu_m.return_value = "user-foo"
+        self.trash_m.return_value.id = "abc"
 
         yield
 
@@ -293,7 +812,7 @@ class TestDelete:
         return request.param
 
     def test_delete_file(self, client, filepath):
-        self.is_dir_m.return_value = False
+        self.trash_m.return_value.data = {"is_dir": False}
 
         url = f"/d/{filepath}/"
         delete_path = Path(f"/cloud/{filepath}")
@@ -301,19 +820,17 @@ class TestDelete:
         rv = client.get(url)
         assert rv.status_code == 200
 
-        self.is_dir_m.assert_called_once()
-        self.rm_m.assert_called_once_with(delete_path)
-        self.rmtree_m.assert_not_called()
-        self.gu_m.assert_called_once_with()
+        self.trash_m.assert_called_once_with(filepath + "/", "user-foo")
         self.log_m.assert_called_once_with(
             "User %r removed file %r", "user-foo", delete_path.as_posix()
         )
 
         assert b"File deleted" in rv.data
         assert delete_path.as_posix().encode() in rv.data
+        assert b"Undo" not in rv.data
 
     def test_delete_folder(self, client, filepath):
-        self.is_dir_m.return_value = True
+        self.trash_m.return_value.data = {"is_dir": True}
 
         url = f"/d/{filepath}/"
         delete_path = Path(f"/cloud/{filepath}")
@@ -321,10 +838,7 @@ class TestDelete:
         rv = client.get(url)
         assert rv.status_code == 200
 
-        self.is_dir_m.assert_called_once()
-        self.rm_m.assert_not_called()
-        self.rmtree_m.assert_called_once_with(delete_path)
-        self.gu_m.assert_called_once_with()
+        self.trash_m.assert_called_once_with(filepath + "/", "user-foo")
         self.log_m.assert_called_once_with(
             "User %r removed tree %r", "user-foo", delete_path.as_posix()
         )
@@ -332,20 +846,24 @@ class TestDelete:
         assert b"Tree removed" in rv.data
         assert delete_path.as_posix().encode() in rv.data
 
+    def test_delete_with_retention(self, client):
+        self.cfg_m.TRASH_RETENTION = 60
+        self.trash_m.return_value.data = {"is_dir": False}
+
+        rv = client.get("/d/a.txt")
+
+        assert b'<a href="/restore/abc">Undo</a>' in rv.data
+
     def test_delete_non_existing_file(self, client, filepath):
-        self.is_dir_m.return_value = False
-        self.rm_m.side_effect = FileNotFoundError
+        self.trash_m.side_effect = FileNotFoundError
 
         url = f"/d/{filepath}/"
         delete_path = Path(f"/cloud/{filepath}")
 
         rv = client.get(url)
-        # assert rv.status_code == 404
+        assert rv.status_code == 404
 
-        self.is_dir_m.assert_called_once()
-        self.rm_m.assert_called_once_with(delete_path)
-        self.rmtree_m.assert_not_called()
-        self.gu_m.assert_called_once_with()
+        self.trash_m.assert_called_once()
         self.log_m.assert_called_once_with(
             "User %r tried to incorrectly remove %r", "user-foo", delete_path.as_posix()
         )
@@ -353,25 +871,38 @@ class TestDelete:
         assert b"File not found" in rv.data
         assert delete_path.as_posix().encode() in rv.data
 
-    def test_delete_non_existing_folder(self, client, filepath):
-        self.is_dir_m.return_value = True
-        self.rmtree_m.side_effect = FileNotFoundError
 
-        url = f"/d/{filepath}/"
-        delete_path = Path(f"/cloud/{filepath}")
+class TestRestore:
+    @pytest.fixture(autouse=True)
+    def mocks(self):
+        with mock.patch("app.files.routes.restore") as restore_m, mock.patch(
+            "app.files.routes.get_user", return_value="user-foo"
+        ), mock.patch("app.files.routes.log") as log_m:
+            self.log_m = log_m
+            yield restore_m
 
-        rv = client.get(url)
+    def test_restore(self, client, mocks):
+        mocks.return_value.data = {"path": "a/b.txt"}
 
-        self.is_dir_m.assert_called_once()
-        self.rm_m.assert_not_called()
-        self.rmtree_m.assert_called_once_with(delete_path)
-        self.gu_m.assert_called_once_with()
-        self.log_m.assert_called_once_with(
-            "User %r tried to incorrectly remove %r", "user-foo", delete_path.as_posix()
-        )
+        rv = client.get("/restore/abc")
 
-        assert b"File not found" in rv.data
-        assert delete_path.as_posix().encode() in rv.data
+        assert rv.status_code == 200
+        assert b"a/b.txt" in rv.data
+        mocks.assert_called_once_with("abc")
+        self.log_m.assert_called_once_with("User %r restored %r", "user-foo", "a/b.txt")
+
+    def test_already_removed(self, client, mocks):
+        mocks.side_effect = JobError("'a/b.txt' can't be restored")
+
+        rv = client.get("/restore/abc")
+
+        assert rv.status_code == 404
+        assert b"can't be restored" in rv.data
+
+    def test_path_exists(self, client, mocks):
+        mocks.side_effect = FileExistsError("a/b.txt")
+
+        assert client.get("/restore/abc").status_code == 409
 
 
 class TestMkdir:
@@ -381,6 +912,7 @@ class TestMkdir:
         self.cfg_m = mock.patch("app.files.routes.cfg").start()
         self.log_m = mock.patch("app.files.routes.log").start()
         self.gu_m = mock.patch("app.files.routes.get_user").start()
+        self.publish_m = mock.patch("app.utils.events.publish").start()
 
         self.cfg_m.CLOUD_PATH = Path("/cloud")
         self.gu_m.return_value = "user-foo"
@@ -401,6 +933,7 @@ class TestMkdir:
         self.mkdirs_m.assert_called_once_with(make_path)
         self.log_m.assert_called_once_with("User %r made dir %r", "user-foo", filepath)
         self.gu_m.assert_called_once_with()
+        self.publish_m.assert_called_once_with("created", filepath, is_dir=True)
 
 
 class TestMove:
@@ -465,3 +998,18 @@ class TestMove:
         self.log_m.assert_called_once()
         self.gu_m.assert_called_once()
         assert b"File not found" in rv.data
+
+    def test_cross_device(self, client):
+        with mock.patch("app.files.routes.is_cross_device", return_value=True), mock.patch(
+            "app.files.routes.start_move"
+        ) as start_m:
+            start_m.return_value.id = "abc"
+            rv = client.get("/mv?from=a/b.txt&to=c/b.txt")
+
+        assert rv.status_code == 202
+        assert b'href="/api/jobs/abc"' in rv.data
+        start_m.assert_called_once_with("a/b.txt", "c/b.txt", "user-bar")
+        self.mv_m.assert_not_called()
+        self.log_m.assert_called_once_with(
+            "User %r started moving file %r to %r", "user-bar", "a/b.txt", "c/b.txt"
+        )
@@ -0,0 +1,207 @@
+import errno
+import hashlib
+import io
+import os
+import shutil
+import stat
+from unittest import mock
+
+import pytest
+
+from app.files.store import (
+    collect_orphans,
+    get_blob_path,
+    get_digest,
+    get_linked_digests,
+    hash_file,
+    release,
+    releasing,
+    save_stream,
+    store_file,
+)
+from app.utils.fileops import FILE_MODE
+
+DATA = b"the same installer" * 100
+DIGEST = hashlib.sha256(DATA).hexdigest()
+
+
+@pytest.fixture(autouse=True)
+def cloud(tmp_path):
+    (tmp_path / "a").mkdir()
+    (tmp_path / "b").mkdir()
+    with mock.patch("app.files.store.cfg") as cfg_m:
+        cfg_m.CLOUD_PATH = tmp_path
+        cfg_m.STORE_DIRNAME = ".store"
+        cfg_m.UPLOAD_CHUNK_SIZE = 64
+        yield tmp_path
+
+
+def make_temp(folder, data=DATA):
+    path = folder / (".upload-%d.part" % len(os.listdir(folder)))
+    path.write_bytes(data)
+    return str(path)
+
+
+def test_blob_path(cloud):
+    assert get_blob_path(DIGEST) == cloud / ".store" / DIGEST[:2] / DIGEST[2:]
+
+
+def test_hash_file(cloud):
+    (cloud / "file").write_bytes(DATA)
+
+    assert hash_file(cloud / "file") == DIGEST
+
+
+def test_store_file(cloud):
+    assert store_file(make_temp(cloud / "a"), DIGEST, cloud / "a" / "file") is True
+    assert store_file(make_temp(cloud / "b"), DIGEST, cloud / "b" / "file") is True
+
+    blob = get_blob_path(DIGEST)
+    assert blob.read_bytes() == DATA
+    assert os.stat(blob).st_nlink == 3
+    assert os.path.samefile(blob, cloud / "a" / "file")
+    assert os.path.samefile(blob, cloud / "b" / "file")
+    assert stat.S_IMODE(os.stat(blob).st_mode) == FILE_MODE & ~0o222
+    assert os.listdir(cloud / "a") == ["file"]
+    assert os.listdir(cloud / "b") == ["file"]
+
+
+def test_store_file_replaces_destination(cloud):
+    (cloud / "a" / "file").write_bytes(b"old")
+
+    store_file(make_temp(cloud / "a"), DIGEST, cloud / "a" / "file")
+
+    assert (cloud / "a" / "file").read_bytes() == DATA
+
+
+def test_store_file_too_many_links(cloud):
+    store_file(make_temp(cloud / "a"), DIGEST, cloud / "a" / "file")
+
+    with mock.patch("app.files.store._link_near", side_effect=OSError(31, "EMLINK")):
+        assert store_file(make_temp(cloud / "b"), DIGEST, cloud / "b" / "file") is False
+
+    assert (cloud / "b" / "file").read_bytes() == DATA
+    assert os.stat(cloud / "b" / "file").st_nlink == 1
+    assert stat.S_IMODE(os.stat(cloud / "b" / "file").st_mode) == FILE_MODE
+
+
+def test_save_stream(cloud):
+    save_stream(io.BytesIO(DATA), str(cloud / "a" / "file"))
+
+    assert os.path.samefile(get_blob_path(DIGEST), cloud / "a" / "file")
+    assert os.listdir(cloud / "a") == ["file"]
+    assert stat.S_IMODE(os.stat(cloud / "a" / "file").st_mode) == FILE_MODE & ~0o222
+
+
+def test_save_stream_not_linked(cloud):
+    with mock.patch("os.link", side_effect=OSError(errno.EXDEV, "EXDEV")):
+        save_stream(io.BytesIO(DATA), str(cloud / "a" / "file"))
+
+    assert stat.S_IMODE(os.stat(cloud / "a" / "file").st_mode) == FILE_MODE
+
+
+def test_save_stream_error(cloud):
+    stream = mock.Mock()
+    stream.read.side_effect = OSError("connection reset")
+
+    with pytest.raises(OSError):
+        save_stream(stream, str(cloud / "a" / "file"))
+
+    assert os.listdir(cloud / "a") == []
+
+
+def test_digest(cloud):
+    store_file(make_temp(cloud / "a"), DIGEST, cloud / "a" / "file")
+
+    assert get_digest(cloud / "a" / "file") in (DIGEST, None)
+    assert get_digest(cloud / "missing") is None
+
+
+def test_linked_digests(cloud):
+    (cloud / "a" / "plain").write_bytes(b"plain")
+    assert get_linked_digests(cloud / "a") == set()
+
+    store_file(make_temp(cloud / "a"), DIGEST, cloud / "a" / "file")
+    with mock.patch("app.files.store.get_digest", return_value=DIGEST):
+        assert get_linked_digests(cloud / "a") == {DIGEST}
+        assert get_linked_digests(cloud / "a" / "file") == {DIGEST}
+        assert get_linked_digests(cloud / "a" / "plain") == set()
+
+    unsupported = OSError(errno.ENOTSUP, os.strerror(errno.ENOTSUP))
+    with mock.patch("app.files.store.get_digest", return_value=None), mock.patch(
+        "app.files.store.os.listxattr", side_effect=unsupported
+    ):
+        assert get_linked_digests(cloud / "a") is None
+
+
+def test_linked_digests_foreign_links(cloud):
+    (cloud / "a" / "plain").write_bytes(b"plain")
+    os.link(cloud / "a" / "plain", cloud / "b" / "plain")
+    store_file(make_temp(cloud / "a"), DIGEST, cloud / "a" / "file")
+
+    def get_digest(path):
+        return DIGEST if path.endswith("file") else None
+
+    with mock.patch("app.files.store.get_digest", get_digest), mock.patch(
+        "app.files.store.os.listxattr", return_value=[]
+    ):
+        assert get_linked_digests(cloud / "a") == {DIGEST}
+
+
+def test_release(cloud):
+    store_file(make_temp(cloud / "a"), DIGEST, cloud / "a" / "file")
+    store_file(make_temp(cloud / "b"), DIGEST, cloud / "b" / "file")
+
+    os.remove(cloud / "a" / "file")
+    assert release({DIGEST}) == 0
+    assert get_blob_path(DIGEST).exists()
+
+    os.remove(cloud / "b" / "file")
+    assert release({DIGEST}) == 1
+    assert not get_blob_path(DIGEST).exists()
+
+
+def test_collect_orphans(cloud):
+    other = b"other"
+    other_digest = hashlib.sha256(other).hexdigest()
+    store_file(make_temp(cloud / "a"), DIGEST, cloud / "a" / "file")
+    store_file(make_temp(cloud / "a", other), other_digest, cloud / "a" / "other")
+
+    os.remove(cloud / "a" / "other")
+
+    assert release(None) == 1
+    assert get_blob_path(DIGEST).exists()
+    assert not get_blob_path(other_digest).exists()
+    assert collect_orphans() == 0
+
+
+def test_releasing_delete(cloud):
+    store_file(make_temp(cloud / "a"), DIGEST, cloud / "a" / "file")
+
+    with releasing(cloud / "a"):
+        shutil.rmtree(cloud / "a")
+
+    assert not get_blob_path(DIGEST).exists()
+
+
+def test_releasing_move_same_device(cloud):
+    store_file(make_temp(cloud / "a"), DIGEST, cloud / "a" / "file")
+
+    with mock.patch("app.files.store.get_linked_digests") as digests_m:
+        with releasing(cloud / "a" / "file", cloud / "b"):
+            shutil.move(cloud / "a" / "file", cloud / "b")
+
+    digests_m.assert_not_called()
+    assert os.path.samefile(get_blob_path(DIGEST), cloud / "b" / "file")
+
+
+def test_releasing_move_other_device(cloud):
+    store_file(make_temp(cloud / "a"), DIGEST, cloud / "a" / "file")
+
+    with mock.patch("app.files.store._same_device", return_value=False):
+        with releasing(cloud / "a" / "file", cloud / "b"):
+            shutil.copy(cloud / "a" / "file", cloud / "b" / "file")
+            os.remove(cloud / "a" / "file")
+
+    assert not get_blob_path(DIGEST).exists()
+    assert (cloud / "b" / "file").read_bytes() == DATA
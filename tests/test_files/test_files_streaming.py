@@ -0,0 +1,137 @@
+import errno
+import hashlib
+import io
+import os
+import stat
+from unittest import mock
+
+import pytest
+from werkzeug.datastructures import FileStorage, MultiDict
+from werkzeug.test import encode_multipart
+
+from app.files.streaming import (
+    MAX_FIELD_SIZE,
+    MultipartUpload,
+    UploadedFile,
+    save_uploaded_file,
+)
+from app.utils.fileops import FILE_MODE
+
+
+def make_body(data):
+    boundary, body = encode_multipart(data, boundary="test-boundary")
+    return boundary, io.BytesIO(body)
+
+
+class TestMultipartUpload:
+    def test_receive(self, tmp_path):
+        boundary, body = make_body(
+            MultiDict(
+                [
+                    ("files[]", FileStorage(io.BytesIO(b"data-1" * 1000), "file-1.txt")),
+                    ("files[]", FileStorage(io.BytesIO(b"data-2"), "file-2.txt")),
+                    ("folder", "2"),
+                ]
+            )
+        )
+        upload = MultipartUpload(tmp_path)
+        upload.receive(body, boundary, chunk_size=7)
+
+        assert upload.fields == {"folder": "2"}
+        files = upload.getlist("files[]")
+        assert [(x.filename, x.size) for x in files] == [
+            ("file-1.txt", 6000),
+            ("file-2.txt", 6),
+        ]
+
+        with open(files[0].temp_path, "rb") as f:
+            assert f.read() == b"data-1" * 1000
+        assert stat.S_IMODE(os.stat(files[0].temp_path).st_mode) == FILE_MODE
+        assert os.path.dirname(files[0].temp_path) == str(tmp_path)
+        assert os.path.basename(files[0].temp_path).startswith(".upload-")
+
+        upload.cleanup()
+        assert list(tmp_path.iterdir()) == []
+
+    def test_hash_files(self, tmp_path):
+        boundary, body = make_body(
+            MultiDict(
+                [
+                    ("files[]", FileStorage(io.BytesIO(b"data-1" * 1000), "file-1.txt")),
+                    ("files[]", FileStorage(io.BytesIO(b"data-2"), "file-2.txt")),
+                ]
+            )
+        )
+        upload = MultipartUpload(tmp_path, hash_files=True)
+        upload.receive(body, boundary, chunk_size=7)
+
+        assert [x.digest for x in upload.getlist("files[]")] == [
+            hashlib.sha256(b"data-1" * 1000).hexdigest(),
+            hashlib.sha256(b"data-2").hexdigest(),
+        ]
+        upload.cleanup()
+
+    def test_chunks_bigger_than_fields(self, tmp_path):
+        data = os.urandom(MAX_FIELD_SIZE * 3)
+        boundary, body = make_body(
+            MultiDict([("files[]", FileStorage(io.BytesIO(data), "big.bin")), ("folder", "0")])
+        )
+        upload = MultipartUpload(tmp_path)
+        upload.receive(body, boundary, chunk_size=MAX_FIELD_SIZE * 2)
+
+        (uploaded,) = upload.getlist("files[]")
+        with open(uploaded.temp_path, "rb") as f:
+            assert f.read() == data
+        assert upload.fields == {"folder": "0"}
+        upload.cleanup()
+
+    def test_field_too_large(self, tmp_path):
+        boundary, body = make_body(MultiDict([("folder", "0" * (MAX_FIELD_SIZE + 1))]))
+        upload = MultipartUpload(tmp_path)
+
+        with pytest.raises(ValueError, match="too large"):
+            upload.receive(body, boundary, chunk_size=1024)
+
+    def test_truncated(self, tmp_path):
+        boundary, body = make_body({"files[]": FileStorage(io.BytesIO(b"data"), "file.txt")})
+        body = io.BytesIO(body.getvalue()[:-20])
+
+        upload = MultipartUpload(tmp_path)
+        with pytest.raises(ValueError):
+            upload.receive(body, boundary, chunk_size=1024)
+
+        assert list(tmp_path.iterdir()) == []
+
+
+class TestSaveUploadedFile:
+    @pytest.fixture
+    def uploaded(self, tmp_path):
+        temp_path = tmp_path / ".upload-x.part"
+        temp_path.write_bytes(b"data")
+        return UploadedFile("files[]", "file.txt", str(temp_path), 4)
+
+    def test_rename(self, uploaded, tmp_path):
+        save_uploaded_file(uploaded, tmp_path / "file.txt")
+
+        assert (tmp_path / "file.txt").read_bytes() == b"data"
+        assert not os.path.exists(uploaded.temp_path)
+
+    def test_other_device(self, uploaded, tmp_path):
+        real_replace = os.replace
+
+        def replace(src, dst):
+            if src == uploaded.temp_path:
+                raise OSError(errno.EXDEV, "Invalid cross-device link")
+            return real_replace(src, dst)
+
+        with mock.patch("os.replace", side_effect=replace):
+            save_uploaded_file(uploaded, tmp_path / "file.txt")
+
+        assert (tmp_path / "file.txt").read_bytes() == b"data"
+        assert [x.name for x in tmp_path.iterdir()] == ["file.txt"]
+        assert stat.S_IMODE((tmp_path / "file.txt").stat().st_mode) == FILE_MODE
+
+    def test_permission_error(self, uploaded, tmp_path):
+        with mock.patch("os.replace", side_effect=PermissionError):
+            with pytest.raises(PermissionError):
+                save_uploaded_file(uploaded, tmp_path / "file.txt")
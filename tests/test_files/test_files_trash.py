@@ -0,0 +1,175 @@
+import errno
+import os
+from unittest import mock
+
+import pytest
+
+from app.files.trash import get_job_trash_dir, get_trash_dir, reclaim, restore, trash
+from app.utils import events
+from app.utils.exceptions import JobError
+from app.utils.jobs import CANCELLED, DONE, QUEUED, Job, job_runner
+
+
+@pytest.fixture(autouse=True)
+def cloud(tmp_path):
+    root = tmp_path / "cloud"
+    (root / "folder" / "inner").mkdir(parents=True)
+    (root / "folder" / "inner" / "a.txt").write_text("a")
+    (root / "b.txt").write_text("b")
+
+    with mock.patch("app.files.trash.cfg") as cfg_m, mock.patch(
+        "app.utils.jobs.cfg"
+    ) as jobs_cfg_m, mock.patch("app.files.store.cfg") as store_cfg_m:
+        cfg_m.CLOUD_PATH = store_cfg_m.CLOUD_PATH = root
+        cfg_m.TRASH_DIRNAME = ".trash"
+        cfg_m.TRASH_RETENTION = 0
+        store_cfg_m.STORE_DIRNAME = ".store"
+        jobs_cfg_m.JOBS_PATH = tmp_path / "jobs"
+        jobs_cfg_m.JOBS_SWEEP_INTERVAL = 60
+        jobs_cfg_m.JOB_TTL = 60
+        cfg_m.root = root
+        yield cfg_m
+
+
+@pytest.fixture(autouse=True)
+def runner_m():
+    with mock.patch.object(job_runner, "submit", side_effect=lambda job: job.save() or job):
+        yield
+
+
+@pytest.fixture(autouse=True)
+def publish_m():
+    with mock.patch("app.utils.events.publish") as publish_m:
+        yield publish_m
+
+
+class TestTrash:
+    def test_trash_folder(self, cloud, publish_m):
+        job = trash("folder/", "user-foo")
+
+        assert not (cloud.root / "folder").exists()
+        assert (get_trash_dir(job.id) / "folder" / "inner" / "a.txt").read_text() == "a"
+        assert job.data == {"path": "folder", "is_dir": True}
+        assert job.user == "user-foo"
+        assert Job.load(job.id).status == QUEUED
+        publish_m.assert_called_once_with(events.DELETED, "folder/", is_dir=True)
+
+    def test_trash_file(self, cloud):
+        job = trash("./b.txt")
+
+        assert not (cloud.root / "b.txt").exists()
+        assert job.data == {"path": "b.txt", "is_dir": False}
+
+    def test_retention(self, cloud):
+        cloud.TRASH_RETENTION = 60
+
+        job = trash("b.txt")
+
+        assert not job.is_due
+
+    def test_other_filesystem(self, cloud):
+        (cloud.root / "mnt" / "data").mkdir(parents=True)
+        (cloud.root / "mnt" / "data" / "c.txt").write_text("c")
+        real_rename = os.rename
+
+        # "mnt" is another filesystem, which can't be renamed to the trash of the cloud
+        def rename(src, dst):
+            if "mnt" in str(src) and not str(dst).startswith(str(cloud.root / "mnt")):
+                raise OSError(errno.EXDEV, "Invalid cross-device link")
+            return real_rename(src, dst)
+
+        def get_device(path):
+            return 2 if "mnt" in path.relative_to(cloud.root).parts else 1
+
+        with mock.patch("os.rename", side_effect=rename), mock.patch(
+            "app.files.trash._get_device", side_effect=get_device
+        ):
+            job = trash("mnt/data/c.txt")
+            assert job.data == {"path": "mnt/data/c.txt", "is_dir": False, "root": "mnt"}
+            assert get_job_trash_dir(job) == get_trash_dir(job.id, "mnt")
+            assert (cloud.root / "mnt" / ".trash" / job.id / "c.txt").read_text() == "c"
+            assert not (cloud.root / ".trash").exists() or not os.listdir(cloud.root / ".trash")
+
+            restore(job.id)
+            assert (cloud.root / "mnt" / "data" / "c.txt").read_text() == "c"
+
+            job = trash("mnt/data/c.txt")
+            job_runner.run(job.id)
+            assert not (cloud.root / "mnt" / "data" / "c.txt").exists()
+            assert not get_job_trash_dir(job).exists()
+
+    def test_other_error(self, cloud):
+        with mock.patch("os.rename", side_effect=OSError(errno.EBUSY, "busy")):
+            with pytest.raises(OSError):
+                trash("folder")
+
+        assert (cloud.root / "folder").exists()
+        assert not os.listdir(cloud.root / ".trash")
+
+    @pytest.mark.parametrize("relpath", ["missing", ".", "../cloud", ".store/blob", ".trash"])
+    def test_not_found(self, cloud, relpath, publish_m):
+        with pytest.raises(FileNotFoundError):
+            trash(relpath)
+
+        assert not (cloud.root / ".trash").exists() or not os.listdir(cloud.root / ".trash")
+        publish_m.assert_not_called()
+
+
+class TestReclaim:
+    def test_reclaim(self, cloud):
+        job = trash("folder")
+
+        job_runner.run(job.id)
+
+        assert Job.load(job.id).status == DONE
+        assert not get_trash_dir(job.id).exists()
+
+    def test_releases_blobs(self):
+        job = trash("folder")
+
+        with mock.patch("app.files.trash.releasing") as releasing_m:
+            reclaim(job)
+
+        releasing_m.assert_called_once_with(get_trash_dir(job.id))
+
+
+class TestRestore:
+    def test_restore(self, cloud, publish_m):
+        job = trash("folder")
+
+        restored = restore(job.id)
+
+        assert (cloud.root / "folder" / "inner" / "a.txt").read_text() == "a"
+        assert not get_trash_dir(job.id).exists()
+        assert restored.status == CANCELLED
+        assert Job.load(job.id).status == CANCELLED
+        publish_m.assert_called_with(events.CREATED, "folder", is_dir=True)
+
+        # The job won't remove it anymore
+        job_runner.run(job.id)
+        assert (cloud.root / "folder").exists()
+
+    def test_restore_into_removed_folder(self, cloud):
+        job = trash("folder/inner/a.txt")
+        trash("folder")
+
+        restore(job.id)
+
+        assert (cloud.root / "folder" / "inner" / "a.txt").read_text() == "a"
+
+    def test_already_reclaimed(self):
+        job = trash("folder")
+        job_runner.run(job.id)
+
+        with pytest.raises(JobError):
+            restore(job.id)
+
+    def test_path_exists(self, cloud):
+        job = trash("b.txt")
+        (cloud.root / "b.txt").write_text("new b")
+
+        with pytest.raises(FileExistsError):
+            restore(job.id)
+
+        assert Job.load(job.id).status == QUEUED
+        assert Job.load(job.id).claim()
@@ -0,0 +1,294 @@
+import os
+from pathlib import Path
+from unittest import mock
+
+import pytest
+
+from app.utils.folder_tree import FolderTree, Subfolder, get_folder_id, split_path
+from app.utils.ignore_matcher import IgnoreMatcher
+
+
+@pytest.fixture
+def cloud(tmp_path):
+    for folder in ("a/b/c", "a/d", "e"):
+        (tmp_path / folder).mkdir(parents=True)
+    return tmp_path
+
+
+def as_posix(folders):
+    return [x.as_posix() for x in folders]
+
+
+@pytest.mark.parametrize(
+    "relpath, expected",
+    [
+        ("a/b", ("a", "b")),
+        ("a/./b/", ("a", "b")),
+        ("a/../b", ("b",)),
+        (".", ()),
+        ("..", None),
+        ("a/../../b", None),
+        ("/etc", None),
+    ],
+)
+def test_split_path(relpath, expected):
+    assert split_path(relpath) == expected
+
+
+class TestFolderTree:
+    def test_get_folders(self, cloud):
+        tree = FolderTree()
+        expected = [".", "a", "a/b", "a/b/c", "a/d", "e"]
+        assert as_posix(tree.get_folders(cloud)) == expected
+
+    def test_metrics(self, cloud):
+        with mock.patch("app.utils.folder_tree.FOLDERS") as folders_m, mock.patch(
+            "app.utils.folder_tree.FOLDER_WALK_DURATION"
+        ) as walk_m:
+            FolderTree().get_folders(cloud)
+
+        folders_m.set.assert_called_once_with(6)
+        walk_m.time.assert_called_once_with()
+
+    def test_cached(self, cloud):
+        tree = FolderTree()
+        tree.get_folders(cloud)
+
+        with mock.patch("os.walk") as walk_m:
+            tree.get_folders(cloud)
+            walk_m.assert_not_called()
+
+    @mock.patch("app.utils.folder_tree.cfg")
+    def test_stale(self, cfg_m, cloud):
+        cfg_m.FOLDER_TREE_MAX_AGE = 0
+        tree = FolderTree()
+        tree.get_folders(cloud)
+        (cloud / "f").mkdir()
+
+        assert "f" in as_posix(tree.get_folders(cloud))
+
+    def test_invalidate(self, cloud):
+        tree = FolderTree()
+        tree.get_folders(cloud)
+        version = tree.version
+        (cloud / "f").mkdir()
+
+        tree.invalidate()
+        assert tree.version > version
+        assert "f" in as_posix(tree.get_folders(cloud))
+
+    def test_add(self, cloud):
+        tree = FolderTree()
+        tree.get_folders(cloud)
+        tree.add("e/f/g")
+        tree.add("../outside")
+
+        assert as_posix(tree.get_folders(cloud))[-3:] == ["e", "e/f", "e/f/g"]
+        assert "../outside" not in as_posix(tree.get_folders(cloud))
+
+    def test_add_not_built(self):
+        tree = FolderTree()
+        tree.add("a/b")
+        assert not tree.is_built
+
+    def test_remove(self, cloud):
+        tree = FolderTree()
+        tree.get_folders(cloud)
+        tree.remove("a/b")
+        tree.remove("not/found")
+
+        assert as_posix(tree.get_folders(cloud)) == [".", "a", "a/d", "e"]
+
+    def test_move(self, cloud):
+        tree = FolderTree()
+        tree.get_folders(cloud)
+        tree.move("a/b", "e/x")
+
+        expected = [".", "a", "a/d", "e", "e/x", "e/x/c"]
+        assert as_posix(tree.get_folders(cloud)) == expected
+
+    def test_reserved(self, cloud):
+        (cloud / "a" / ".staging" / "upload").mkdir(parents=True)
+        tree = FolderTree()
+
+        assert ".staging" not in str(tree.get_folders(cloud))
+        tree.add("e/.staging/x")
+        assert ".staging" not in str(tree.get_folders(cloud))
+
+    def test_rebuild_other_path(self, cloud, tmp_path_factory):
+        other = tmp_path_factory.mktemp("other")
+        tree = FolderTree()
+        tree.get_folders(cloud)
+
+        assert tree.get_folders(other) == [Path(".")]
+
+
+class TestFolderIds:
+    def test_stable(self, cloud):
+        tree = FolderTree()
+        tree.get_folders(cloud)
+        folder_id = tree.get_id("a/b")
+
+        assert folder_id == get_folder_id((cloud / "a" / "b").stat())
+        tree.invalidate()
+        tree.get_folders(cloud)
+        assert tree.get_id("a/b") == folder_id
+        assert tree.get_id("not/found") is None
+
+    def test_resolve(self, cloud):
+        tree = FolderTree()
+        folder_id = get_folder_id((cloud / "a" / "d").stat())
+
+        assert tree.resolve(cloud, folder_id) == Path("a/d")
+        assert tree.resolve(cloud, "0-0") is None
+
+    def test_resolve_not_walked(self, cloud):
+        tree = FolderTree()
+        tree.get_folders(cloud)
+        folder_id = tree.get_id("a/d")
+
+        with mock.patch("os.walk") as walk_m:
+            assert tree.resolve(cloud, folder_id) == Path("a/d")
+            walk_m.assert_not_called()
+
+    def test_moved(self, cloud):
+        tree = FolderTree()
+        tree.get_folders(cloud)
+        folder_id = tree.get_id("a/b")
+        os.rename(cloud / "a" / "b", cloud / "e" / "x")
+
+        tree.move("a/b", "e/x")
+
+        assert tree.get_id("e/x") == folder_id
+        assert tree.resolve(cloud, folder_id) == Path("e/x")
+        assert tree.resolve(cloud, tree.get_id("e/x/c")) == Path("e/x/c")
+
+    def test_removed(self, cloud):
+        tree = FolderTree()
+        tree.get_folders(cloud)
+        folder_id = tree.get_id("a/b/c")
+
+        tree.remove("a/b")
+
+        assert tree.resolve(cloud, folder_id) is None
+
+    def test_replaced(self, cloud):
+        tree = FolderTree()
+        tree.get_folders(cloud)
+        folder_id = tree.get_id("e")
+        os.rmdir(cloud / "e")
+        (cloud / "x").mkdir()
+        (cloud / "e").mkdir()
+
+        assert tree.resolve(cloud, folder_id) is None
+
+    def test_added(self, cloud):
+        tree = FolderTree()
+        tree.get_folders(cloud)
+        (cloud / "e" / "f").mkdir()
+
+        tree.add("e/f")
+
+        assert tree.resolve(cloud, tree.get_id("e/f")) == Path("e/f")
+
+
+class TestSubfolders:
+    def names(self, tree, cloud, relpath, **kwargs):
+        subfolders, _ = tree.get_subfolders(cloud, relpath, **kwargs)
+        return [x.name for x in subfolders]
+
+    def test_get_subfolders(self, cloud):
+        tree = FolderTree()
+        subfolders, cursor = tree.get_subfolders(cloud, "a")
+
+        assert subfolders == [
+            Subfolder("b", tree.get_id("a/b"), True),
+            Subfolder("d", tree.get_id("a/d"), False),
+        ]
+        assert cursor is None
+        assert tree.get_subfolders(cloud, "not/found") is None
+        assert tree.get_subfolders(cloud, "../outside") is None
+
+    def test_pages(self, cloud):
+        tree = FolderTree()
+
+        assert tree.get_subfolders(cloud, ".", limit=1)[1] == "a"
+        assert self.names(tree, cloud, ".", cursor="a") == ["e"]
+        assert self.names(tree, cloud, ".", prefix="E") == ["e"]
+        assert self.names(tree, cloud, ".", accept=lambda x: x != "a") == ["e"]
+
+    def test_updated(self, cloud):
+        tree = FolderTree()
+        tree.get_folders(cloud)
+
+        with mock.patch("os.walk") as walk_m:
+            assert self.names(tree, cloud, "a") == ["b", "d"]
+            tree.add("a/C")
+            tree.remove("a/d")
+            assert self.names(tree, cloud, "a") == ["b", "C"]
+            tree.move("a/b", "e/b")
+            assert self.names(tree, cloud, "a") == ["C"]
+            assert self.names(tree, cloud, "e") == ["b"]
+            walk_m.assert_not_called()
+
+
+class TestFolderTreeIgnored:
+    @pytest.fixture
+    def tree(self, cloud):
+        tree = FolderTree()
+        tree.get_folders(cloud, IgnoreMatcher(["^a$"]))
+        return tree
+
+    def test_pruned(self, tree, cloud):
+        assert as_posix(tree.get_folders(cloud, IgnoreMatcher(["^a$"]))) == [".", "e"]
+
+    def test_pruned_not_walked(self, cloud):
+        walked = []
+        real_walk = os.walk
+
+        def walk(*args, **kwargs):
+            for item in real_walk(*args, **kwargs):
+                walked.append(item[0])
+                yield item
+
+        with mock.patch("os.walk", walk):
+            FolderTree().get_folders(cloud, IgnoreMatcher(["^a$"]))
+
+        assert str(cloud / "a" / "b") not in walked
+
+    def test_matcher_changed(self, tree, cloud):
+        assert "a" in as_posix(tree.get_folders(cloud, IgnoreMatcher([])))
+
+    def test_add_ignored(self, tree, cloud):
+        tree.add("e/a")
+        tree.add("a/x")
+
+        matcher = IgnoreMatcher(["^a$"])
+        assert as_posix(tree.get_folders(cloud, matcher)) == [".", "e", "e/a"]
+
+    def test_move_to_ignored(self, cloud):
+        tree = FolderTree()
+        matcher = IgnoreMatcher(["ignored"])
+        tree.get_folders(cloud, matcher)
+        tree.move("a/b", "e/ignored")
+
+        assert as_posix(tree.get_folders(cloud, matcher)) == [".", "a", "a/d", "e"]
+
+    def test_move_under_ignored(self, cloud):
+        tree = FolderTree()
+        matcher = IgnoreMatcher(["^e$"])
+        tree.get_folders(cloud, matcher)
+        tree.move("a/b", "e/x")
+
+        assert as_posix(tree.get_folders(cloud, matcher)) == [".", "a", "a/d"]
+        assert tree.get_subfolders(cloud, "e", matcher) is None
+        assert tree.get_id("e/x") is None
+
+    def test_move_relists_subtree(self, cloud):
+        tree = FolderTree()
+        matcher = IgnoreMatcher(["^e/x/c$"])
+        tree.get_folders(cloud, matcher)
+        tree.move("a/b", "e/x")
+
+        assert as_posix(tree.get_folders(cloud, matcher)) == [".", "a", "a/d", "e", "e/x"]
+        assert tree.get_id("e/x/c") is None
@@ -40,3 +40,11 @@ def test_unignore_all(rem_igm_m, get_ign_m, client):
     assert rem_igm_m.call_count == 3
 
     get_ign_m.assert_called_once()
+
+
+@mock.patch("app.helpers.routes.folder_tree")
+def test_rescan(tree_m, client):
+    rv = client.get("/rescan")
+
+    tree_m.invalidate.assert_called_once_with()
+    assert rv.status_code == 200
@@ -0,0 +1,47 @@
+import pytest
+
+from app.utils.exceptions import IngoredWarning
+from app.utils.ignore_matcher import IgnoreMatcher, compile_ignored
+
+
+def test_empty():
+    matcher = IgnoreMatcher([])
+    assert not matcher
+    assert matcher.matches("anything") is False
+
+
+@pytest.mark.parametrize(
+    "relpath, expected",
+    [
+        ("node_modules", True),
+        ("a/b/NODE_MODULES/c", True),
+        (".git", True),
+        ("a/.git/objects", True),
+        ("a/git", False),
+        ("folder", False),
+    ],
+)
+def test_matches(relpath, expected):
+    matcher = IgnoreMatcher(["node_modules", r"\.git"])
+    assert matcher
+    assert matcher.matches(relpath) is expected
+
+
+def test_not_combinable():
+    matcher = IgnoreMatcher([r"(a)\1", "b"])
+    assert matcher.matches("xaax")
+    assert matcher.matches("b")
+    assert not matcher.matches("a")
+
+
+def test_invalid_pattern():
+    with pytest.warns(IngoredWarning, match="invalid ignored pattern"):
+        matcher = IgnoreMatcher(["(", "valid"])
+
+    assert matcher.matches("valid")
+    assert not matcher.matches("(")
+
+
+def test_compile_ignored_cached():
+    assert compile_ignored(("a", "b")) is compile_ignored(("a", "b"))
+    assert compile_ignored(("a", "b")) is not compile_ignored(("a",))
@@ -0,0 +1,162 @@
+from time import time
+from unittest import mock
+
+import pytest
+
+from app.utils.exceptions import JobError
+from app.utils import jobs
+from app.utils.jobs import (
+    CANCELLED,
+    DONE,
+    FAILED,
+    QUEUED,
+    RUNNING,
+    Job,
+    JobRunner,
+    get_lock_path,
+)
+
+
+@pytest.fixture(autouse=True)
+def cfg_m(tmp_path):
+    with mock.patch("app.utils.jobs.cfg") as cfg_m:
+        cfg_m.JOBS_PATH = tmp_path / "jobs"
+        cfg_m.JOBS_SWEEP_INTERVAL = 60
+        cfg_m.JOB_TTL = 60
+        yield cfg_m
+
+
+@pytest.fixture
+def runner():
+    runner = JobRunner()
+
+    @runner.register("add")
+    def add(job):
+        return job.data["a"] + job.data["b"]
+
+    yield runner
+    runner.stop()
+
+
+class TestJob:
+    def test_save_and_load(self):
+        job = Job.new("add", {"a": 1, "b": 2}, user="user-foo", delay=10)
+        job.save()
+
+        loaded = Job.load(job.id)
+        assert loaded.to_dict() == job.to_dict()
+        assert loaded.status == QUEUED
+        assert loaded.run_at == pytest.approx(loaded.created + 10)
+        assert not loaded.is_due
+
+    @pytest.mark.parametrize("job_id", ["../etc/passwd", "a" * 32])
+    def test_not_found(self, job_id):
+        with pytest.raises(JobError):
+            Job.load(job_id)
+
+    def test_claim(self):
+        job = Job.new("add")
+        job.save()
+
+        assert job.claim()
+        assert not Job.load(job.id).claim()
+
+        job.finish(DONE, result=3)
+        assert not get_lock_path(job.id).exists()
+        assert not job.claim()
+        assert Job.load(job.id).result == 3
+
+
+class TestRunner:
+    def test_run(self, runner):
+        job = Job.new("add", {"a": 1, "b": 2})
+        job.save()
+
+        runner.run(job.id)
+
+        job = Job.load(job.id)
+        assert job.status == DONE
+        assert job.result == 3
+        assert job.started <= job.finished
+
+    def test_run_once(self, runner):
+        job = Job.new("add", {"a": 1, "b": 2})
+        job.finish(CANCELLED)
+
+        runner.run(job.id)
+
+        assert Job.load(job.id).status == CANCELLED
+
+    @pytest.mark.parametrize(
+        "kind, data, error",
+        [("add", {"a": 1}, "'b'"), ("add", {"a": 1, "b": "x"}, "unsupported"), ("sub", {}, "sub")],
+    )
+    def test_failure(self, runner, kind, data, error):
+        job = Job.new(kind, data)
+        job.save()
+
+        runner.run(job.id)
+
+        job = Job.load(job.id)
+        assert job.status == FAILED
+        assert error in job.error
+        assert not get_lock_path(job.id).exists()
+
+    def test_missing(self, runner):
+        assert runner.run("a" * 32) is None
+
+    def test_sweep(self, runner, cfg_m):
+        due = Job.new("add", {"a": 1, "b": 2})
+        due.save()
+        delayed = Job.new("add", {"a": 1, "b": 2}, delay=60)
+        delayed.save()
+        old = Job.new("add")
+        old.finish(DONE)
+        old.finished = time() - 120
+        old.save()
+
+        assert runner.sweep() == 1
+
+        assert Job.load(due.id).status == DONE
+        assert Job.load(delayed.id).status == QUEUED
+        with pytest.raises(JobError):
+            Job.load(old.id)
+
+    @pytest.mark.skipif(jobs.fcntl is None, reason="the locks need fcntl")
+    def test_sweep_leftover_lock(self, runner):
+        # The process that was running the job died with its lock file
+        job = Job.new("add", {"a": 1, "b": 2})
+        job.status = RUNNING
+        job.save()
+        get_lock_path(job.id).write_text("")
+
+        assert runner.sweep() == 1
+
+        assert Job.load(job.id).status == DONE
+        assert Job.load(job.id).result == 3
+        assert not get_lock_path(job.id).exists()
+
+    def test_sweep_skips_locked(self, runner):
+        job = Job.new("add", {"a": 1, "b": 2})
+        job.save()
+        assert job.claim()
+
+        assert runner.sweep() == 0
+        assert Job.load(job.id).status == QUEUED
+        job.release()
+
+    def test_sweep_without_jobs(self, runner):
+        assert runner.sweep() == 0
+
+    def test_submit(self, runner):
+        job = runner.submit(Job.new("add", {"a": 1, "b": 2}))
+
+        assert runner.is_running
+        assert runner.join(5)
+        assert Job.load(job.id).result == 3
+
+    def test_submit_delayed(self, runner):
+        job = runner.submit(Job.new("add", {"a": 1, "b": 2}, delay=60))
+
+        assert runner.join(5)
+        assert Job.load(job.id).status == QUEUED
@@ -0,0 +1,114 @@
+import os
+from unittest import mock
+
+import pytest
+
+from app.utils.log_writer import LogWriter
+
+
+@pytest.fixture
+def log_path(tmp_path):
+    return tmp_path / "web.log"
+
+
+@pytest.fixture
+def writer(log_path):
+    writer = LogWriter(log_path, buffer_size=1024, flush_interval=60)
+    yield writer
+    writer.close()
+
+
+class TestLogWriter:
+    def test_write(self, writer, log_path):
+        writer.write("line 1\n")
+        writer.write("line 2\n")
+
+        assert writer.flush(5)
+        assert log_path.read_text() == "line 1\nline 2\n"
+
+    def test_batched(self, writer, log_path):
+        with mock.patch("os.write", wraps=os.write) as write_m:
+            for i in range(10):
+                writer.write("line %d\n" % i)
+            writer.flush(5)
+
+        write_m.assert_called_once()
+        assert len(log_path.read_text().splitlines()) == 10
+
+    def test_buffer_size(self, log_path):
+        writer = LogWriter(log_path, buffer_size=10, flush_interval=60)
+        writer.write("more than ten bytes\n")
+
+        try:
+            for _ in range(500):
+                if log_path.exists() and log_path.read_text():
+                    break
+                writer._thread.join(0.01)
+            assert log_path.read_text() == "more than ten bytes\n"
+        finally:
+            writer.close()
+
+    def test_buffer_size_in_bytes(self, log_path):
+        writer = LogWriter(log_path, buffer_size=10, flush_interval=60)
+        writer.write("ñññññ\n")
+
+        try:
+            for _ in range(500):
+                if log_path.exists() and log_path.read_bytes():
+                    break
+                writer._thread.join(0.01)
+            assert log_path.read_text(encoding="utf-8") == "ñññññ\n"
+        finally:
+            writer.close()
+
+    def test_flush_interval(self, log_path):
+        writer = LogWriter(log_path, buffer_size=1024, flush_interval=0.01)
+        writer.write("line\n")
+
+        try:
+            for _ in range(500):
+                if log_path.exists() and log_path.read_text():
+                    break
+                writer._thread.join(0.01)
+            assert log_path.read_text() == "line\n"
+        finally:
+            writer.close()
+
+    def test_close(self, writer, log_path):
+        writer.write("line\n")
+        writer.close()
+        assert log_path.read_text() == "line\n"
+
+    def test_append(self, writer, log_path):
+        log_path.write_text("previous\n")
+        writer.write("line\n")
+        writer.flush(5)
+        assert log_path.read_text() == "previous\nline\n"
+
+    def test_flush_not_started(self, writer):
+        assert writer.flush() is True
+
+    def test_rotate(self, log_path):
+        writer = LogWriter(
+            log_path, buffer_size=1, flush_interval=60, max_bytes=10, backup_count=2
+        )
+        try:
+            for i in range(4):
+                writer.write("line-%03d\n" % i)
+                writer.flush(5)
+        finally:
+            writer.close()
+
+        assert log_path.read_text() == "line-003\n"
+        assert log_path.with_name("web.log.1").read_text() == "line-002\n"
+        assert log_path.with_name("web.log.2").read_text() == "line-001\n"
+        assert not log_path.with_name("web.log.3").exists()
+
+    def test_rotated_by_other_process(self, writer, log_path):
+        writer.write("line 1\n")
+        writer.flush(5)
+        os.replace(log_path, log_path.with_name("web.log.1"))
+
+        writer.write("line 2\n")
+        writer.flush(5)
+        assert log_path.read_text() == "line 2\n"
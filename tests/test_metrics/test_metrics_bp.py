@@ -0,0 +1,7 @@
+from flask import Blueprint
+
+
+def test_import_blueprint():
+    from app.metrics import metrics_bp
+
+    assert isinstance(metrics_bp, Blueprint)
@@ -0,0 +1,78 @@
+from unittest import mock
+
+import pytest
+
+from app.utils.metrics import DOWNLOADED_BYTES, REQUEST_DURATION, REQUESTS, UPLOADED_BYTES
+
+
+@pytest.fixture(autouse=True)
+def metrics():
+    for metric in (REQUEST_DURATION, REQUESTS, UPLOADED_BYTES, DOWNLOADED_BYTES):
+        metric.clear()
+    yield
+
+
+def test_metrics(client):
+    rv = client.get("/metrics")
+
+    assert rv.status_code == 200
+    assert rv.content_type == "text/plain; version=0.0.4; charset=utf-8"
+    text = rv.get_data(as_text=True)
+    assert "# TYPE cloud_request_duration_seconds histogram" in text
+    assert "# TYPE cloud_folder_walk_seconds histogram" in text
+    assert "# TYPE cloud_log_queue_lines gauge" in text
+    assert "\ncloud_log_queue_lines 0\n" in text
+
+
+def test_disabled(client):
+    with mock.patch("app.metrics.routes.cfg") as cfg_m:
+        cfg_m.METRICS = False
+        assert client.get("/metrics").status_code == 404
+        assert client.get("/rescan").status_code == 200
+
+    labels = {"blueprint": "helpers", "endpoint": "helpers.rescan", "method": "GET"}
+    assert REQUESTS.get(status="200", **labels) == 0
+
+
+def test_requests_are_recorded(client):
+    client.get("/rescan")
+    client.get("/rescan")
+    client.get("/not-a-route/1")
+
+    labels = {"blueprint": "helpers", "endpoint": "helpers.rescan", "method": "GET"}
+    assert REQUESTS.get(status="200", **labels) == 2
+    assert REQUEST_DURATION.get(**labels)[0] == 2
+    assert REQUESTS.get(blueprint="", endpoint="", method="GET", status="404") == 1
+
+    text = client.get("/metrics").get_data(as_text=True)
+    assert (
+        'cloud_requests_total{blueprint="helpers",endpoint="helpers.rescan",method="GET",'
+        'status="200"} 2' in text
+    )
+    assert (
+        'cloud_request_duration_seconds_bucket{blueprint="helpers",endpoint="helpers.rescan",'
+        'method="GET",le="+Inf"} 2' in text
+    )
+
+
+def test_bytes(client, tmp_path):
+    (tmp_path / "folder").mkdir()
+    (tmp_path / "folder" / "a.txt").write_bytes(b"a" * 100)
+
+    with mock.patch("app.downloads.routes.cfg") as cfg_m, mock.patch(
+        "app.downloads.routes.is_visible", return_value=True
+    ), mock.patch("app.downloads.routes.get_path_filter", return_value=lambda *args, **kw: True):
+        cfg_m.CLOUD_PATH = tmp_path
+        cfg_m.DOWNLOAD_OFFLOAD = None
+        cfg_m.COMPRESS_MIN_SIZE = 1024
+        cfg_m.ARCHIVE_COMPRESSION = "stored"
+        client.get("/cloud/folder/a.txt")
+        client.get("/cloud/folder/a.txt", headers={"Range": "bytes=0-9"})
+        rv = client.get("/archive/folder?format=tar")
+        archive_size = len(rv.data)
+
+    client.post("/api/batch", data=b"x" * 50)
+
+    assert DOWNLOADED_BYTES.get(endpoint="downloads.download") == 110
+    assert DOWNLOADED_BYTES.get(endpoint="downloads.download_archive") == archive_size > 100
+    assert UPLOADED_BYTES.get(endpoint="api.run_batch") == 50
@@ -0,0 +1,98 @@
+from unittest import mock
+
+import pytest
+
+from app.utils.metrics import Counter, Gauge, Histogram, Registry
+
+
+class TestCounter:
+    def test_inc(self):
+        counter = Counter("requests_total", "Requests.", ["method"])
+
+        counter.inc(method="GET")
+        counter.inc(2, method="GET")
+        counter.inc(method="POST")
+
+        assert counter.get(method="GET") == 3
+        assert counter.render() == [
+            "# HELP requests_total Requests.",
+            "# TYPE requests_total counter",
+            'requests_total{method="GET"} 3',
+            'requests_total{method="POST"} 1',
+        ]
+
+    def test_invalid(self):
+        counter = Counter("requests_total", "Requests.", ["method"])
+
+        with pytest.raises(ValueError):
+            counter.inc(-1, method="GET")
+        with pytest.raises(ValueError):
+            counter.inc(path="/")
+
+    def test_escaped_labels(self):
+        counter = Counter("requests_total", "Requests.", ["path"])
+
+        counter.inc(path='a"b\\c\nd')
+
+        assert counter.render()[-1] == 'requests_total{path="a\\"b\\\\c\\nd"} 1'
+
+
+class TestGauge:
+    def test_set(self):
+        gauge = Gauge("folders", "Folders.")
+
+        gauge.set(5)
+        gauge.set(3)
+
+        assert gauge.render()[-1] == "folders 3"
+
+    def test_function(self):
+        gauge = Gauge("queue", "Queue.", function=mock.Mock(side_effect=[7, 2]))
+
+        assert gauge.render()[-1] == "queue 7"
+        assert gauge.get() == 2
+
+
+class TestHistogram:
+    def test_observe(self):
+        histogram = Histogram("latency", "Latency.", ["endpoint"], buckets=[1, 0.1])
+
+        for value in (0.05, 0.1, 0.5, 3):
+            histogram.observe(value, endpoint="index")
+
+        assert histogram.get(endpoint="index") == (4, 3.65)
+        assert histogram.render()[2:] == [
+            'latency_bucket{endpoint="index",le="0.1"} 2',
+            'latency_bucket{endpoint="index",le="1"} 3',
+            'latency_bucket{endpoint="index",le="+Inf"} 4',
+            'latency_sum{endpoint="index"} 3.65',
+            'latency_count{endpoint="index"} 4',
+        ]
+
+    def test_time(self):
+        histogram = Histogram("walk", "Walk.")
+
+        with mock.patch("app.utils.metrics.perf_counter", side_effect=[10, 12.5]):
+            with histogram.time():
+                pass
+
+        assert histogram.get() == (1, 2.5)
+
+
+class TestRegistry:
+    def test_render(self):
+        registry = Registry()
+        registry.register(Counter("a_total", "A.")).inc()
+        registry.register(Gauge("b", "B.")).set(1.5)
+
+        assert registry.render() == (
+            "# HELP a_total A.\n# TYPE a_total counter\na_total 1\n"
+            "# HELP b B.\n# TYPE b gauge\nb 1.5\n"
+        )
+
+    def test_duplicate(self):
+        registry = Registry()
+        registry.register(Counter("a_total", "A."))
+
+        with pytest.raises(ValueError):
+            registry.register(Gauge("a_total", "A."))
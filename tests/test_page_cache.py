@@ -0,0 +1,101 @@
+from unittest import mock
+
+import pytest
+from flask import Flask, flash, get_flashed_messages
+
+from app.utils.page_cache import PageCache
+
+
+@pytest.fixture
+def flask_app():
+    application = Flask(__name__)
+    application.secret_key = "secret"
+    return application
+
+
+@pytest.fixture(autouse=True)
+def cfg_m():
+    with mock.patch("app.utils.page_cache.cfg") as cfg_m:
+        cfg_m.PAGE_CACHE_SIZE = 2
+        yield cfg_m
+
+
+class TestPageCache:
+    def test_put(self):
+        cache = PageCache()
+
+        page = cache.put("a", "<p>a</p>")
+
+        assert page.body == b"<p>a</p>"
+        assert cache.get("a") == page
+        assert cache.put("b", b"<p>a</p>").etag == page.etag
+        assert cache.put("c", "<p>c</p>").etag != page.etag
+
+    def test_least_recently_used(self):
+        cache = PageCache()
+        for key in "abc":
+            cache.put(key, key)
+            cache.get("a")
+
+        assert cache.get("a") is not None
+        assert cache.get("b") is None
+        assert cache.get("c") is not None
+
+
+class TestRespond:
+    def respond(self, flask_app, cache, key, render, **kwargs):
+        with flask_app.test_request_context("/page", **kwargs):
+            return cache.respond(key, render)
+
+    def test_cached(self, flask_app):
+        cache = PageCache()
+        render_m = mock.Mock(return_value="<p>page</p>")
+
+        first = self.respond(flask_app, cache, (1,), render_m)
+        second = self.respond(flask_app, cache, (1,), render_m)
+
+        render_m.assert_called_once_with()
+        assert first.get_data() == second.get_data() == b"<p>page</p>"
+        assert first.get_etag() == second.get_etag()
+        assert first.headers["Cache-Control"] == "no-cache"
+
+        self.respond(flask_app, cache, (2,), render_m)
+        assert render_m.call_count == 2
+
+    def test_not_modified(self, flask_app):
+        cache = PageCache()
+        etag = self.respond(flask_app, cache, (1,), lambda: "page").get_etag()[0]
+
+        response = self.respond(
+            flask_app, cache, (1,), lambda: "page", headers={"If-None-Match": '"%s"' % etag}
+        )
+
+        assert response.status_code == 304
+
+    def test_pending_flashes(self, flask_app):
+        cache = PageCache()
+        with flask_app.test_request_context("/page"):
+            flash("Files uploaded successfully")
+            assert cache.respond((1,), lambda: "page") == "page"
+        assert cache.get(("/page", b"", 1)) is None
+
+    def test_flashes_while_rendering(self, flask_app):
+        cache = PageCache()
+
+        def render():
+            flash("message")
+            return ", ".join(get_flashed_messages())
+
+        with flask_app.test_request_context("/page"):
+            assert cache.respond((1,), render) == "message"
+        assert cache.get(("/page", b"", 1)) is None
+
+    def test_disabled(self, flask_app, cfg_m):
+        cfg_m.PAGE_CACHE_SIZE = 0
+        cache = PageCache()
+        render_m = mock.Mock(return_value="page")
+
+        self.respond(flask_app, cache, (1,), render_m)
+        self.respond(flask_app, cache, (1,), render_m)
+
+        assert render_m.call_count == 2
@@ -0,0 +1,254 @@
+import os
+from concurrent.futures import Future
+from concurrent.futures.process import BrokenProcessPool
+from unittest import mock
+
+import pytest
+
+from app.utils import previews
+from app.utils.exceptions import PreviewError
+from app.utils.previews import PreviewCache, can_preview
+
+
+@pytest.fixture
+def cloud(tmp_path):
+    root = tmp_path / "cloud"
+    root.mkdir()
+    for name in ["a.png", "b.png", "c.png"]:
+        (root / name).write_bytes(b"image " + name.encode())
+    return root
+
+
+@pytest.fixture
+def cfg_m(cloud):
+    with mock.patch("app.utils.previews.cfg") as cfg_m:
+        cfg_m.CLOUD_PATH = cloud
+        cfg_m.PREVIEWS = True
+        cfg_m.PREVIEW_WORKERS = 0
+        cfg_m.PREVIEW_DEFAULT_SIZE = 256
+        yield cfg_m
+
+
+@pytest.fixture
+def render_m():
+    def render(source, destination, size):
+        with open(destination, "wb") as f:
+            f.write(b"x" * 10)
+        return 10
+
+    with mock.patch("app.utils.previews.render_preview", side_effect=render) as render_m:
+        yield render_m
+
+
+@pytest.fixture
+def cache(tmp_path, cfg_m, render_m):
+    return PreviewCache(tmp_path / "previews", maxsize=25)
+
+
+class TestCanPreview:
+    @pytest.fixture(autouse=True)
+    def libraries(self):
+        with mock.patch("app.utils.previews.Image", mock.Mock()), mock.patch(
+            "app.utils.previews.PdfReader", None
+        ):
+            yield
+
+    @pytest.mark.parametrize(
+        "relpath, expected",
+        [("a/photo.JPG", True), ("b.webp", True), ("doc.pdf", False), ("notes.txt", False)],
+    )
+    def test_can_preview(self, relpath, expected):
+        assert can_preview(relpath) is expected
+
+    def test_pdf(self):
+        with mock.patch("app.utils.previews.PdfReader", mock.Mock()):
+            assert can_preview("doc.pdf") is True
+
+    def test_without_pillow(self):
+        with mock.patch("app.utils.previews.Image", None):
+            assert can_preview("a.png") is False
+
+
+class TestPreviewCache:
+    def test_rendered_once(self, cache, render_m, cloud):
+        path = cache.get("a.png", 128)
+
+        assert path.read_bytes() == b"x" * 10
+        assert cache.get("a.png", 128) == path
+        render_m.assert_called_once_with(os.fspath(cloud / "a.png"), os.fspath(path), 128)
+
+    def test_keyed_by_size_and_mtime(self, cache, render_m, cloud):
+        path = cache.get("a.png", 128)
+
+        assert cache.get("a.png", 256) != path
+        (cloud / "a.png").write_bytes(b"modified")
+        assert cache.get("a.png", 128) != path
+        assert render_m.call_count == 3
+
+    def test_evicts_least_recently_used(self, cache):
+        a = cache.get("a.png", 128)
+        b = cache.get("b.png", 128)
+        cache.get("a.png", 128)
+        c = cache.get("c.png", 128)
+
+        assert a.exists() and c.exists()
+        assert not b.exists()
+
+    def test_loaded_from_disk(self, cache, tmp_path, render_m):
+        a = cache.get("a.png", 128)
+        b = cache.get("b.png", 128)
+        os.utime(a, ns=(0, 0))
+
+        cache = PreviewCache(tmp_path / "previews", maxsize=25)
+        assert cache.get("b.png", 128) == b
+        cache.get("c.png", 128)
+
+        assert not a.exists()
+        assert b.exists()
+        assert render_m.call_count == 3
+
+    def test_missing_file(self, cache):
+        with pytest.raises(FileNotFoundError):
+            cache.get("missing.png", 128)
+
+    def test_failure_cached(self, cache, render_m):
+        render_m.side_effect = PreviewError("not an image")
+
+        with pytest.raises(PreviewError, match="not an image"):
+            cache.get("a.png", 128)
+        with pytest.raises(PreviewError, match="not an image"):
+            cache.get("a.png", 128)
+        assert render_m.call_count == 1
+
+    def test_failures_bounded(self, cache, render_m):
+        render_m.side_effect = PreviewError("not an image")
+
+        with mock.patch("app.utils.previews.MAX_FAILURES", 1):
+            for name in ["a.png", "b.png"]:
+                with pytest.raises(PreviewError):
+                    cache.get(name, 128)
+            with pytest.raises(PreviewError):
+                cache.get("a.png", 128)
+        assert render_m.call_count == 3
+
+    def test_worker_died(self, cache, cfg_m):
+        cfg_m.PREVIEW_WORKERS = 1
+        future = Future()
+        future.set_exception(BrokenProcessPool("died"))
+        with mock.patch("app.utils.previews.get_executor") as executor_m:
+            executor_m.return_value.submit.return_value = future
+
+            with pytest.raises(PreviewError, match="died"):
+                cache.get("a.png", 128)
+            with pytest.raises(PreviewError):
+                cache.get("a.png", 128)
+            assert executor_m.return_value.submit.call_count == 2
+
+    def test_read_error_not_cached(self, cache, render_m):
+        render_m.side_effect = PermissionError("denied")
+
+        with pytest.raises(PermissionError):
+            cache.get("a.png", 128)
+        with pytest.raises(PermissionError):
+            cache.get("a.png", 128)
+        assert render_m.call_count == 2
+
+    def test_pending_rendered_once(self, cache, cfg_m):
+        future = Future()
+        cfg_m.PREVIEW_WORKERS = 1
+        with mock.patch("app.utils.previews.get_executor") as executor_m:
+            executor_m.return_value.submit.return_value = future
+
+            assert cache.get("a.png", 128, wait=False) is None
+            assert cache.get("a.png", 128, wait=False) is None
+            executor_m.return_value.submit.assert_called_once()
+
+            future.set_result(10)
+            assert cache.get("a.png", 128, wait=False) is None
+            assert executor_m.return_value.submit.call_count == 2
+
+
+class TestSchedule:
+    def test_schedule(self, cache, render_m):
+        with mock.patch("app.utils.previews.can_preview", return_value=True):
+            cache.schedule("a.png")
+            cache.schedule("missing.png")
+
+        render_m.assert_called_once()
+        assert render_m.call_args.args[2] == 256
+
+    def test_disabled(self, cache, cfg_m, render_m):
+        cfg_m.PREVIEWS = False
+        with mock.patch("app.utils.previews.can_preview", return_value=True):
+            cache.schedule("a.png")
+
+        render_m.assert_not_called()
+
+    def test_not_previewable(self, cache, render_m):
+        with mock.patch("app.utils.previews.can_preview", return_value=False):
+            cache.schedule("a.png")
+
+        render_m.assert_not_called()
+
+
+def test_render_preview(tmp_path):
+    Image = pytest.importorskip("PIL.Image")
+    Image.new("RGBA", (400, 200), (255, 0, 0, 128)).save(tmp_path / "image.png")
+
+    size = previews.render_preview(
+        os.fspath(tmp_path / "image.png"), os.fspath(tmp_path / "preview.jpg"), 100
+    )
+
+    with Image.open(tmp_path / "preview.jpg") as preview:
+        assert preview.format == "JPEG"
+        assert preview.size == (100, 50)
+    assert size == (tmp_path / "preview.jpg").stat().st_size
+    assert sorted(os.listdir(tmp_path)) == ["image.png", "preview.jpg"]
+
+
+@pytest.mark.parametrize("data", [b"not an image", b"\x89PNG\r\n\x1a\n" + b"\0" * 100])
+def test_render_preview_invalid(tmp_path, data):
+    pytest.importorskip("PIL.Image")
+    (tmp_path / "image.png").write_bytes(data)
+
+    with pytest.raises(PreviewError):
+        previews.render_preview(
+            os.fspath(tmp_path / "image.png"), os.fspath(tmp_path / "preview.jpg"), 100
+        )
+
+
+def test_render_preview_missing(tmp_path):
+    pytest.importorskip("PIL.Image")
+
+    with pytest.raises(FileNotFoundError):
+        previews.render_preview(
+            os.fspath(tmp_path / "image.png"), os.fspath(tmp_path / "preview.jpg"), 100
+        )
+
+
+def test_broken_executor_replaced():
+    broken, executor = mock.Mock(), mock.Mock()
+    broken.submit.side_effect = BrokenProcessPool("died")
+    with mock.patch(
+        "app.utils.previews.ProcessPoolExecutor", side_effect=[broken, executor]
+    ), mock.patch("app.utils.previews._executor", None), mock.patch(
+        "app.utils.previews.cfg"
+    ) as cfg_m:
+        cfg_m.PREVIEW_WORKERS = 1
+        future = previews._submit(previews.render_preview, "a.png", "a.jpg", 128)
+        assert previews.get_executor() is executor
+
+    assert future is executor.submit.return_value
+    broken.shutdown.assert_called_once_with(wait=False)
+
+
+def test_executor_forkserver():
+    with mock.patch("app.utils.previews.ProcessPoolExecutor") as executor_m, mock.patch(
+        "app.utils.previews._executor", None
+    ), mock.patch("app.utils.previews.cfg") as cfg_m:
+        cfg_m.PREVIEW_WORKERS = 2
+        previews.get_executor()
+
+    context = executor_m.call_args.kwargs["mp_context"]
+    assert context.get_start_method() in ("forkserver", "spawn")
+    assert executor_m.call_args.kwargs["max_workers"] == 2
@@ -0,0 +1,270 @@
+import os
+from unittest import mock
+
+import pytest
+
+from app.utils import events
+from app.utils.search_index import SearchIndex, extract_text
+
+
+@pytest.fixture
+def cloud(tmp_path):
+    root = tmp_path / "cloud"
+    (root / "Music" / "Rock").mkdir(parents=True)
+    (root / ".store").mkdir()
+    (root / "notes.txt").write_text("the quick brown fox")
+    (root / "Music" / "song.mp3").write_bytes(b"\0mp3")
+    (root / "Music" / "Rock" / "playlist.txt").write_text("song.mp3")
+    (root / ".store" / "blob").write_bytes(b"blob")
+    (root / "Music" / ".upload-123.part").write_bytes(b"partial")
+    return root
+
+
+@pytest.fixture
+def cfg_m():
+    with mock.patch("app.utils.search_index.cfg") as cfg_m:
+        cfg_m.RESERVED_DIRNAMES = frozenset([".store"])
+        cfg_m.SEARCH_CONTENT = True
+        cfg_m.SEARCH_CONTENT_MAX_SIZE = 1024
+        cfg_m.SEARCH_SCAN_INTERVAL = None
+        yield cfg_m
+
+
+@pytest.fixture
+def index(tmp_path, cloud, cfg_m):
+    index = SearchIndex(tmp_path / "search.db", cloud)
+    yield index
+    index.stop()
+
+
+def paths(index):
+    with index.connect() as conn:
+        return [x for (x,) in conn.execute("SELECT path FROM entries ORDER BY path")]
+
+
+def search(index, *args, **kwargs):
+    return [x.path for x in index.search(*args, **kwargs)]
+
+
+class TestExtractText:
+    def test_text(self, tmp_path):
+        (tmp_path / "a.txt").write_text("hello world")
+
+        assert extract_text(tmp_path / "a.txt", 5) == "hello"
+
+    def test_binary(self, tmp_path):
+        (tmp_path / "a.txt").write_bytes(b"hello\0world")
+        (tmp_path / "a.bin").write_bytes(b"hello world")
+
+        assert extract_text(tmp_path / "a.txt", 100) is None
+        assert extract_text(tmp_path / "a.bin", 100) is None
+
+    def test_pdf_without_pypdf(self, tmp_path):
+        (tmp_path / "a.pdf").write_bytes(b"%PDF-1.4")
+
+        with mock.patch("app.utils.search_index.PdfReader", None):
+            assert extract_text(tmp_path / "a.pdf", 100) is None
+
+    def test_pdf(self, tmp_path):
+        (tmp_path / "a.pdf").write_bytes(b"%PDF-1.4")
+        pages = [mock.Mock(**{"extract_text.return_value": x}) for x in ("one", "two", "three")]
+
+        with mock.patch("app.utils.search_index.PdfReader") as reader_m:
+            reader_m.return_value.pages = pages
+            assert extract_text(tmp_path / "a.pdf", 5) == "one\nt"
+        pages[2].extract_text.assert_not_called()
+
+    def test_damaged_pdf(self, tmp_path):
+        (tmp_path / "a.pdf").write_bytes(b"%PDF-1.4")
+
+        with mock.patch("app.utils.search_index.PdfReader", side_effect=ValueError):
+            assert extract_text(tmp_path / "a.pdf", 100) is None
+
+
+class TestScan:
+    def test_scan(self, index):
+        assert index.scan() == 5
+        assert paths(index) == [
+            "Music",
+            "Music/Rock",
+            "Music/Rock/playlist.txt",
+            "Music/song.mp3",
+            "notes.txt",
+        ]
+
+    def test_only_changed_entries_are_indexed(self, index, cloud):
+        index.scan()
+
+        with mock.patch("app.utils.search_index.extract_text") as extract_m:
+            assert index.scan() == 0
+        extract_m.assert_not_called()
+
+        (cloud / "notes.txt").write_text("a lazy dog")
+        os.utime(cloud / "notes.txt", ns=(0, 1))
+        assert index.scan() == 1
+        assert search(index, "lazy", "content") == ["notes.txt"]
+        assert search(index, "quick", "content") == []
+
+    def test_removed_entries(self, index, cloud):
+        index.scan()
+        os.remove(cloud / "Music" / "Rock" / "playlist.txt")
+        os.rmdir(cloud / "Music" / "Rock")
+
+        index.scan()
+
+        assert paths(index) == ["Music", "Music/song.mp3", "notes.txt"]
+
+    def test_scan_folder(self, index):
+        assert index.scan("Music/Rock") == 1
+        assert paths(index) == ["Music/Rock", "Music/Rock/playlist.txt"]
+
+    def test_content_disabled(self, index, cfg_m):
+        cfg_m.SEARCH_CONTENT = False
+        index.scan()
+
+        assert search(index, "quick", "content") == []
+
+
+class TestSearch:
+    @pytest.fixture(autouse=True)
+    def scanned(self, index):
+        index.scan()
+
+    @pytest.mark.parametrize(
+        "query, expected",
+        [
+            ("song", ["Music/song.mp3"]),
+            ("SONG", ["Music/song.mp3"]),
+            ("s", ["Music", "Music/Rock/playlist.txt", "Music/song.mp3", "notes.txt"]),
+            ("mp", ["Music/song.mp3"]),
+            ("list.t", ["Music/Rock/playlist.txt"]),
+            ("Music", ["Music"]),
+            ('"x', []),
+        ],
+    )
+    def test_name(self, index, query, expected):
+        assert sorted(search(index, query)) == expected
+
+    @pytest.mark.parametrize(
+        "query, expected",
+        [
+            ("song", ["Music/song.mp3"]),
+            ("so", ["Music/song.mp3"]),
+            ("ong", []),
+            ("m", ["Music"]),
+        ],
+    )
+    def test_name_prefix(self, index, query, expected):
+        assert sorted(search(index, query, prefix=True)) == expected
+
+    def test_path(self, index):
+        assert sorted(search(index, "music/r", "path")) == [
+            "Music/Rock",
+            "Music/Rock/playlist.txt",
+        ]
+        assert search(index, "rock/", "path", prefix=True) == []
+
+    def test_content(self, index):
+        assert search(index, "brown fox", "content") == ["notes.txt"]
+        assert search(index, "fox brown", "content") == []
+        assert search(index, "qui", "content", prefix=True) == ["notes.txt"]
+        assert search(index, "mp3", "content") == ["Music/Rock/playlist.txt"]
+
+    def test_pages(self, index):
+        first = index.search("s", limit=2)
+        second = index.search("s", after=first[-1].id, limit=2)
+
+        assert len(first) == len(second) == 2
+        assert first[-1].id < second[0].id
+
+    def test_invalid_field(self, index):
+        with pytest.raises(ValueError):
+            index.search("song", "size")
+
+
+class TestUpdate:
+    @pytest.fixture(autouse=True)
+    def scanned(self, index):
+        index.scan()
+
+    def test_move_folder(self, index, cloud):
+        os.rename(cloud / "Music", cloud / "Audio")
+
+        index.move("Music", "Audio")
+
+        assert paths(index) == [
+            "Audio",
+            "Audio/Rock",
+            "Audio/Rock/playlist.txt",
+            "Audio/song.mp3",
+            "notes.txt",
+        ]
+        assert search(index, "audio") == ["Audio"]
+        assert search(index, "music") == []
+        assert search(index, "song.mp3", "content") == ["Audio/Rock/playlist.txt"]
+
+    def test_move_twice(self, index, cloud):
+        os.rename(cloud / "Music", cloud / "Audio")
+
+        index.move("Music", "Audio")
+        index.move("Music", "Audio")
+
+        assert paths(index) == [
+            "Audio",
+            "Audio/Rock",
+            "Audio/Rock/playlist.txt",
+            "Audio/song.mp3",
+            "notes.txt",
+        ]
+        assert search(index, "song.mp3", "content") == ["Audio/Rock/playlist.txt"]
+
+    def test_remove_folder(self, index):
+        index.remove("Music")
+
+        assert paths(index) == ["notes.txt"]
+        assert search(index, "mp3", "content") == []
+
+    def test_update_missing(self, index, cloud):
+        os.remove(cloud / "notes.txt")
+
+        index.update("notes.txt")
+
+        assert search(index, "notes") == []
+
+
+class TestWorker:
+    def test_events_ignored_when_stopped(self, index):
+        index.handle_event(events.Event(events.CREATED, "x.txt", None, False))
+
+        assert index._queue.qsize() == 0
+
+    def test_worker(self, index, cloud):
+        index.start()
+        assert index.join(5)
+        assert len(paths(index)) == 5
+
+        (cloud / "new.txt").write_text("new")
+        os.rename(cloud / "Music", cloud / "Audio")
+        (cloud / "d" / "e").mkdir(parents=True)
+        (cloud / "d" / "e" / "f.txt").write_text("f")
+        os.remove(cloud / "notes.txt")
+        for event in [
+            events.Event(events.CREATED, "new.txt", None, False),
+            events.Event(events.MOVED, "Music", "Audio", True),
+            events.Event(events.CREATED, "d", None, True),
+            events.Event(events.DELETED, "notes.txt", None, False),
+            events.Event(events.CREATED, ".store/blob", None, False),
+        ]:
+            index.handle_event(event)
+        assert index.join(5)
+
+        assert paths(index) == [
+            "Audio",
+            "Audio/Rock",
+            "Audio/Rock/playlist.txt",
+            "Audio/song.mp3",
+            "d",
+            "d/e",
+            "d/e/f.txt",
+            "new.txt",
+        ]
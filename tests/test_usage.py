@@ -0,0 +1,207 @@
+import os
+from unittest import mock
+
+import pytest
+
+from app.utils import events
+from app.utils.exceptions import QuotaError
+from app.utils.usage import NO_USAGE, Usage, UsageIndex, ancestors
+
+
+@pytest.fixture
+def cloud(tmp_path):
+    root = tmp_path / "cloud"
+    (root / "a" / "b").mkdir(parents=True)
+    (root / ".store").mkdir()
+    (root / "x.txt").write_bytes(b"x" * 10)
+    (root / "a" / "y.txt").write_bytes(b"y" * 20)
+    (root / "a" / "b" / "z.txt").write_bytes(b"z" * 30)
+    (root / ".store" / "blob").write_bytes(b"blob")
+    (root / "a" / ".upload-123.part").write_bytes(b"partial")
+    return root
+
+
+@pytest.fixture
+def cfg_m():
+    with mock.patch("app.utils.usage.cfg") as cfg_m:
+        cfg_m.RESERVED_DIRNAMES = frozenset([".store"])
+        cfg_m.USAGE_INDEX = True
+        cfg_m.USAGE_SCAN_INTERVAL = None
+        cfg_m.FOLDER_QUOTAS = {}
+        cfg_m.USER_QUOTAS = {}
+        cfg_m.DEFAULT_USER_QUOTA = None
+        yield cfg_m
+
+
+@pytest.fixture
+def index(tmp_path, cloud, cfg_m):
+    index = UsageIndex(tmp_path / "usage.db", cloud)
+    index.scan()
+    yield index
+    index.stop()
+
+
+def folders(index):
+    with index.connect() as conn:
+        return {x: (y, z) for x, y, z in conn.execute("SELECT * FROM folders WHERE files")}
+
+
+def apply(index, kind, path, dest=None, is_dir=False, user=None):
+    with index.connect() as conn:
+        index.apply(events.Event(kind, path, dest, is_dir, user), conn)
+
+
+def test_ancestors():
+    assert ancestors("a/b/c") == ["a/b/c", "a/b", "a", "."]
+    assert ancestors(".") == ["."]
+
+
+class TestScan:
+    def test_scan(self, index):
+        assert folders(index) == {".": (60, 3), "a": (50, 2), "a/b": (30, 1)}
+        assert index.folder_usage("a/") == Usage(50, 2)
+        assert index.folder_usage("missing") == NO_USAGE
+
+    def test_reconcile(self, index, cloud):
+        (cloud / "a" / "y.txt").write_bytes(b"y" * 5)
+        os.remove(cloud / "x.txt")
+        os.rename(cloud / "a" / "b", cloud / "c")
+
+        assert index.scan() == 4
+        assert folders(index) == {".": (35, 2), "a": (5, 1), "c": (30, 1)}
+        assert index.scan() == 0
+
+    def test_scan_folder(self, index, cloud):
+        (cloud / "x.txt").write_bytes(b"x" * 15)
+        (cloud / "a" / "y.txt").write_bytes(b"y" * 5)
+        os.remove(cloud / "a" / "b" / "z.txt")
+        os.rmdir(cloud / "a" / "b")
+
+        assert index.scan("a") == 2
+        assert folders(index) == {".": (15, 2), "a": (5, 1)}
+        assert index.scan() == 1
+
+    def test_scan_keeps_owners(self, index, cloud):
+        index.update("x.txt", "user-foo")
+        (cloud / "x.txt").write_bytes(b"x" * 15)
+
+        index.scan()
+
+        assert index.user_usage("user-foo") == Usage(15, 1)
+
+
+class TestUpdates:
+    def test_created(self, index, cloud):
+        (cloud / "a" / "b" / "new.txt").write_bytes(b"n" * 5)
+
+        apply(index, events.CREATED, "a/b/new.txt", user="user-foo")
+
+        assert folders(index) == {".": (65, 4), "a": (55, 3), "a/b": (35, 2)}
+        assert index.user_usage("user-foo") == Usage(5, 1)
+        assert index.user_usage("user-bar") == NO_USAGE
+
+    def test_events_are_idempotent(self, index, cloud):
+        (cloud / "a" / "y.txt").write_bytes(b"y" * 25)
+
+        apply(index, events.MODIFIED, "a/y.txt")
+        apply(index, events.MODIFIED, "a/y.txt")
+
+        assert folders(index) == {".": (65, 3), "a": (55, 2), "a/b": (30, 1)}
+
+    def test_modified_keeps_owner(self, index, cloud):
+        apply(index, events.CREATED, "x.txt", user="user-foo")
+        (cloud / "x.txt").write_bytes(b"x" * 12)
+
+        apply(index, events.MODIFIED, "x.txt")
+
+        assert index.user_usage("user-foo") == Usage(12, 1)
+
+    def test_deleted(self, index):
+        apply(index, events.CREATED, "a/b/z.txt", user="user-foo")
+
+        apply(index, events.DELETED, "a", is_dir=True)
+
+        assert folders(index) == {".": (10, 1)}
+        assert index.user_usage("user-foo") == NO_USAGE
+
+    def test_moved(self, index, cloud):
+        apply(index, events.CREATED, "a/b/z.txt", user="user-foo")
+        (cloud / "c").mkdir()
+        os.rename(cloud / "a" / "b", cloud / "c" / "b")
+
+        apply(index, events.MOVED, "a/b", "c/b", is_dir=True)
+
+        assert folders(index) == {".": (60, 3), "a": (20, 1), "c": (30, 1), "c/b": (30, 1)}
+        assert index.user_usage("user-foo") == Usage(30, 1)
+        index.scan()
+        assert folders(index) == {".": (60, 3), "a": (20, 1), "c": (30, 1), "c/b": (30, 1)}
+
+    def test_moved_twice(self, index, cloud):
+        (cloud / "c").mkdir()
+        os.rename(cloud / "a" / "b", cloud / "c" / "b")
+
+        apply(index, events.MOVED, "a/b", "c/b", is_dir=True)
+        apply(index, events.MOVED, "a/b", "c/b", is_dir=True)
+
+        assert folders(index) == {".": (60, 3), "a": (20, 1), "c": (30, 1), "c/b": (30, 1)}
+        assert index.folder_usage("c/b") == Usage(30, 1)
+
+    def test_moved_to_reserved(self, index):
+        apply(index, events.MOVED, "a", ".store/a", is_dir=True)
+
+        assert folders(index) == {".": (10, 1)}
+
+    def test_folder_created(self, tmp_path, cloud, cfg_m):
+        index = UsageIndex(tmp_path / "usage.db", cloud)
+
+        apply(index, events.CREATED, "a", is_dir=True)
+
+        assert folders(index) == {".": (50, 2), "a": (50, 2), "a/b": (30, 1)}
+
+    def test_temporary_files_are_ignored(self, index):
+        apply(index, events.CREATED, "a/.upload-123.part")
+
+        assert index.folder_usage("a") == Usage(50, 2)
+
+
+class TestCheckQuota:
+    def test_folder_quota(self, index, cfg_m):
+        cfg_m.FOLDER_QUOTAS = {"a/": 60}
+
+        index.check_quota("a/b", "user-foo", 10)
+        with pytest.raises(QuotaError, match="'a'"):
+            index.check_quota("a/b", "user-foo", 11)
+        index.check_quota("x", "user-foo", 100)
+
+    def test_user_quota(self, index, cfg_m):
+        cfg_m.USER_QUOTAS = {"user-foo": 15}
+        cfg_m.DEFAULT_USER_QUOTA = 5
+        index.update("x.txt", "user-foo")
+
+        index.check_quota(".", "user-foo", 5)
+        with pytest.raises(QuotaError, match="user-foo"):
+            index.check_quota(".", "user-foo", 6)
+        with pytest.raises(QuotaError, match="user-bar"):
+            index.check_quota(".", "user-bar", 6)
+        index.check_quota(".", None, 100)
+
+    def test_disabled(self, index, cfg_m):
+        cfg_m.FOLDER_QUOTAS = {".": 0}
+        cfg_m.USAGE_INDEX = False
+
+        index.check_quota(".", None, 100)
+
+    def test_remaining_quota(self, index, cfg_m):
+        cfg_m.FOLDER_QUOTAS = {"a/": 60}
+        cfg_m.USER_QUOTAS = {"user-foo": 15}
+        index.update("x.txt", "user-foo")
+
+        assert index.remaining_quota("a/b", "user-foo") == 5
+        assert index.remaining_quota("a/b", None) == 10
+        assert index.remaining_quota("x", None) is None
+        assert index.remaining_quota("x", "user-bar") is None
+
+    def test_remaining_quota_exceeded(self, index, cfg_m):
+        cfg_m.FOLDER_QUOTAS = {"a": 10}
+
+        assert index.remaining_quota("a", None) == 0
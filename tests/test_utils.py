@@ -11,13 +11,18 @@ from app.utils import (
     gen_random_password,
     get_folders,
     get_ignored,
+    get_path_filter,
     get_post_arg,
     get_sudoers,
     get_user,
+    is_visible,
     log,
     remove_from_ignored,
+    resolve_folder_id,
 )
+from app.utils.config_store import config_store
 from app.utils.exceptions import IngoredWarning, SudoersWarning
+from app.utils.folder_tree import folder_tree
 
 
 def test_warning():
@@ -25,6 +30,13 @@ def test_warning():
         warnings.warn("Sudoers Warning", SudoersWarning)
 
 
+@pytest.fixture(autouse=True)
+def clear_config_store():
+    config_store.clear()
+    yield
+    config_store.clear()
+
+
 @mock.patch("app.utils.cfg")
 def test_get_sudoers(mocker):
     fp = mocker.SUDOERS_PATH.open.return_value.__enter__.return_value
@@ -32,14 +44,31 @@ def test_get_sudoers(mocker):
     assert get_sudoers() == ["user_a"]
 
     with pytest.warns(SudoersWarning, match="json decode error"):
+        config_store.clear()
         fp.read.return_value = "invalid"
         assert get_sudoers() == []
 
     with pytest.warns(SudoersWarning, match="Sudoers file not found"):
+        config_store.clear()
         fp.read.side_effect = FileNotFoundError
         assert get_sudoers() == []
 
 
+def test_get_sudoers_cached(tmp_path):
+    sudoers_path = tmp_path / "sudoers.json"
+    sudoers_path.write_text('["user_a"]')
+
+    with mock.patch("app.utils.cfg.SUDOERS_PATH", sudoers_path):
+        assert get_sudoers() == ["user_a"]
+
+        with mock.patch("json.load") as load_m:
+            assert get_sudoers() == ["user_a"]
+            load_m.assert_not_called()
+
+        sudoers_path.write_text('["user_a", "user_b"]')
+        assert get_sudoers() == ["user_a", "user_b"]
+
+
 @mock.patch("app.utils.cfg.IGNORED_PATH")
 class TestGetignored:
     def test_normal(self, ign_path_m):
@@ -58,66 +87,80 @@ class TestGetignored:
         assert ignored == []
 
 
+@mock.patch("app.utils.atomic_write_text")
 @mock.patch("app.utils.cfg.IGNORED_PATH")
 @mock.patch("app.utils.get_ignored")
 class TestAddToignored:
-    def test_true(self, ign_m, ign_path_m):
+    def test_true(self, ign_m, ign_path_m, write_m):
         ign_m.return_value = ["aaa", "bbb"]
         result = add_to_ignored("ccc")
 
         expected_call = json.dumps(["aaa", "bbb", "ccc"], indent=4)
         assert result is True
-        ign_path_m.write_text.assert_called_once_with(expected_call)
+        write_m.assert_called_once_with(ign_path_m, expected_call)
 
-    def test_false(self, ign_m, ign_path_m):
+    def test_false(self, ign_m, ign_path_m, write_m):
         ign_m.return_value = ["aaa", "bbb", "ccc"]
         result = add_to_ignored("ccc")
 
         assert result is False
-        ign_path_m.write_text.assert_not_called()
+        write_m.assert_not_called()
 
 
+@mock.patch("app.utils.atomic_write_text")
 @mock.patch("app.utils.cfg.IGNORED_PATH")
 @mock.patch("app.utils.get_ignored")
 class TestRemoveFromignored:
-    def test_true(self, ign_m, ign_path_m):
+    def test_true(self, ign_m, ign_path_m, write_m):
         ign_m.return_value = ["aaa", "bbb", "ccc"]
         result = remove_from_ignored("ccc")
 
         expected_call = json.dumps(["aaa", "bbb"], indent=4)
         assert result is True
-        ign_path_m.write_text.assert_called_once_with(expected_call)
+        write_m.assert_called_once_with(ign_path_m, expected_call)
 
-    def test_false(self, ign_m, ign_path_m):
+    def test_false(self, ign_m, ign_path_m, write_m):
         ign_m.return_value = ["aaa", "bbb"]
         result = remove_from_ignored("ccd")
 
         assert result is False
-        ign_path_m.write_text.assert_not_called()
+        write_m.assert_not_called()
+
+
+def test_add_and_remove_ignored(tmp_path):
+    ignored_path = tmp_path / "ignored.json"
+    ignored_path.write_text("[]")
+
+    with mock.patch("app.utils.cfg.IGNORED_PATH", ignored_path):
+        assert add_to_ignored("folder-1") is True
+        assert get_ignored() == ["folder-1"]
+        assert remove_from_ignored("folder-1") is True
+        assert get_ignored() == []
+
+    assert [x.name for x in tmp_path.iterdir()] == ["ignored.json"]
 
 
 @pytest.mark.skipif(sys.platform != "win32", reason="Does not work on linux")
-@mock.patch("app.utils.cfg", spec=True)
+@mock.patch("app.utils.log_writer", spec=True)
 @mock.patch("app.utils.request", spec=True)
 @mock.patch("app.utils.asctime", spec=True)
-def test_log(asc_m, req_m, cfg_m):
+def test_log(asc_m, req_m, writer_m):
     str_time = datetime(2019, 1, 1).ctime()
     asc_m.return_value = str_time
     req_m.remote_addr = "10.0.0.1"
-    fp = cfg_m.LOG_PATH.open.return_value.__enter__.return_value
 
     args = f"[{str_time}] - 10.0.0.1 - hello-world\n"
 
     log("hello-world")
     asc_m.assert_called_once()
-    fp.write.assert_called_once_with(args)
+    writer_m.write.assert_called_once_with(args)
 
     log("a=%s, b=%r, c=%03d", "letter-a", "letter-b", 10)
     args = f"[{str_time}] - 10.0.0.1 - a=letter-a, b='letter-b', c=010\n"
 
     assert asc_m.call_count == 2
-    fp.write.assert_called_with(args)
-    assert fp.write.call_count == 2
+    writer_m.write.assert_called_with(args)
+    assert writer_m.write.call_count == 2
 
 
 @pytest.mark.skipif(sys.platform != "win32", reason="Does not work on linux")
@@ -141,13 +184,13 @@ class TestGetUser:
 class TestGetFolders:
     def setup_class(self):
         self.input_data = (
-            ("/test/folder-1",),
-            ("/test/folder-1/subfolder-1.2/subsubfolder-1.2.1",),
-            ("/test/folder-1/subfolder-1.1",),
-            ("/test/folder-1/subfolder-1.2",),
-            ("/test/folder-2",),
-            ("/test/folder-2/subfolder-2.1",),
-            ("/test/.data/something",),
+            ("/test/folder-1", [], []),
+            ("/test/folder-1/subfolder-1.2/subsubfolder-1.2.1", [], []),
+            ("/test/folder-1/subfolder-1.1", [], []),
+            ("/test/folder-1/subfolder-1.2", [], []),
+            ("/test/folder-2", [], []),
+            ("/test/folder-2/subfolder-2.1", [], []),
+            ("/test/.data/something", [], []),
         )
         self.output_data = (
             ".data/something",
@@ -166,6 +209,7 @@ class TestGetFolders:
         self.gu_m = mock.patch("app.utils.get_user", spec=True).start()
         self.sud_m = mock.patch("app.utils.get_sudoers", spec=True).start()
         self.ign_m = mock.patch("app.utils.get_ignored", spec=True).start()
+        folder_tree.invalidate()
 
         yield
 
@@ -208,6 +252,101 @@ class TestGetFolders:
         assert real == expected
 
 
+class TestResolveFolderId:
+    @pytest.fixture(scope="function", autouse=True)
+    def mocks(self, tmp_path):
+        for folder in ("folder-1", "folder-2", ".data"):
+            (tmp_path / folder).mkdir()
+
+        self.cfg_m = mock.patch("app.utils.cfg", spec=True).start()
+        self.gu_m = mock.patch("app.utils.get_user", spec=True).start()
+        self.sud_m = mock.patch("app.utils.get_sudoers", spec=True).start()
+        self.ign_m = mock.patch("app.utils.get_ignored", spec=True).start()
+        self.cfg_m.CLOUD_PATH = tmp_path
+        self.gu_m.return_value = "user"
+        self.sud_m.return_value = []
+        self.ign_m.return_value = ["folder-2"]
+        folder_tree.invalidate()
+
+        yield
+
+        mock.patch.stopall()
+        folder_tree.invalidate()
+
+    def test_resolve(self):
+        get_folders()
+        folder_id = folder_tree.get_id("folder-1")
+
+        assert resolve_folder_id(folder_id).as_posix() == "folder-1"
+        assert resolve_folder_id("0-0") is None
+
+    def test_ignored(self, tmp_path):
+        stat = (tmp_path / "folder-2").stat()
+
+        assert resolve_folder_id("%x-%x" % (stat.st_dev, stat.st_ino)) is None
+
+    def test_sudoers(self):
+        get_folders()
+        folder_id = folder_tree.get_id(".data")
+
+        assert resolve_folder_id(folder_id) is None
+        self.sud_m.return_value = ["user"]
+        assert resolve_folder_id(folder_id).as_posix() == ".data"
+
+
+class TestIsVisible:
+    @pytest.fixture(scope="function", autouse=True)
+    def mocks(self):
+        self.gu_m = mock.patch("app.utils.get_user", spec=True).start()
+        self.sud_m = mock.patch("app.utils.get_sudoers", spec=True).start()
+        self.ign_m = mock.patch("app.utils.get_ignored", spec=True).start()
+        self.gu_m.return_value = "user"
+        self.sud_m.return_value = []
+        self.ign_m.return_value = ["folder-2"]
+
+        yield
+
+        mock.patch.stopall()
+
+    @pytest.mark.parametrize(
+        "relpath, expected",
+        [
+            ("file.txt", True),
+            ("folder-1/file.txt", True),
+            ("folder-1/sub/folder-2.txt", True),
+            ("folder-2/file.txt", False),
+            ("folder-1/folder-2/file.txt", False),
+            (".data/file.txt", False),
+            (".staging/x/0", False),
+            ("folder-1/.staging/x/0", False),
+            ("../outside.txt", False),
+            ("folder-1/../../outside.txt", False),
+        ],
+    )
+    def test_files(self, relpath, expected):
+        assert is_visible(relpath) is expected
+
+    def test_folders(self):
+        assert is_visible("folder-1", is_dir=True) is True
+        assert is_visible("folder-2", is_dir=True) is False
+        assert is_visible("folder-2") is True
+
+    def test_sudoers(self):
+        self.sud_m.return_value = ["user"]
+
+        assert is_visible(".data/file.txt") is True
+        assert is_visible("folder-2/file.txt") is False
+        assert is_visible(".staging/x/0") is False
+
+    def test_path_filter_loads_rules_once(self):
+        path_filter = get_path_filter()
+        results = [path_filter(x) for x in ["a", "folder-2/b", ".c", "d/e"]]
+
+        assert results == [True, False, False, True]
+        self.sud_m.assert_called_once_with()
+        self.ign_m.assert_called_once_with()
+
+
 def test_gen_random_password():
     p1 = gen_random_password()
     p2 = gen_random_password()
@@ -0,0 +1,215 @@
+import errno
+import os
+import sys
+import time
+from unittest import mock
+
+import pytest
+
+from app.config import cfg
+from app.utils import events
+from app.utils.exceptions import WatcherWarning
+from app.utils.ignore_matcher import IgnoreMatcher
+from app.utils import watcher as watcher_module
+from app.utils.watcher import EVENT_HEADER, IN_Q_OVERFLOW, InotifyWatcher, PollingWatcher
+
+
+@pytest.fixture
+def received():
+    received = []
+    events.subscribe(received.append)
+    yield received
+    events.unsubscribe(received.append)
+
+
+@pytest.fixture
+def cloud(tmp_path):
+    (tmp_path / "a" / "b").mkdir(parents=True)
+    (tmp_path / "a" / "file.txt").write_text("data")
+    return tmp_path
+
+
+def wait_for(received, event, timeout=5):
+    limit = time.monotonic() + timeout
+    while time.monotonic() < limit:
+        if event in received:
+            return True
+        time.sleep(0.01)
+    return False
+
+
+def force_change(folder):
+    # Some filesystems have coarse timestamps, so force a different mtime
+    stat = folder.stat()
+    ns = stat.st_mtime_ns + 10 ** 9
+    os.utime(folder, ns=(ns, ns))
+
+
+class TestPollingWatcher:
+    @pytest.fixture
+    def watcher(self, cloud):
+        watcher = PollingWatcher(cloud, interval=0.01)
+        watcher.setup()
+        return watcher
+
+    def test_no_changes(self, watcher, received):
+        watcher.check()
+        assert received == []
+
+    def test_created(self, watcher, cloud, received):
+        (cloud / "a" / "c" / "d").mkdir(parents=True)
+        (cloud / "a" / "c" / "new.txt").write_text("data")
+        force_change(cloud / "a")
+        watcher.check()
+
+        assert events.Event("created", "a/c", None, True) in received
+        assert events.Event("created", "a/c/d", None, True) in received
+        assert events.Event("created", "a/c/new.txt", None, False) in received
+
+    def test_deleted(self, watcher, cloud, received):
+        (cloud / "a" / "b").rmdir()
+        (cloud / "a" / "file.txt").unlink()
+        force_change(cloud / "a")
+        watcher.check()
+
+        assert events.Event("deleted", "a/b", None, True) in received
+        assert events.Event("deleted", "a/file.txt", None, False) in received
+
+    def test_thread(self, cloud, received):
+        watcher = PollingWatcher(cloud, interval=0.01)
+        with mock.patch("app.utils.watcher.folder_tree") as tree_m:
+            watcher.start()
+            assert watcher.ready.wait(5)
+            tree_m.set_live.assert_called_once_with(cloud)
+
+        (cloud / "new").mkdir()
+        force_change(cloud)
+        try:
+            assert wait_for(received, events.Event("created", "new", None, True))
+        finally:
+            watcher.stop()
+
+
+@pytest.mark.skipif(sys.platform != "linux", reason="inotify is only on linux")
+class TestInotifyWatcher:
+    @pytest.fixture
+    def watcher(self, cloud):
+        watcher = InotifyWatcher(cloud)
+        watcher.timeout = 0.05
+        with mock.patch("app.utils.watcher.folder_tree"):
+            watcher.start()
+            assert watcher.ready.wait(5)
+        yield watcher
+        watcher.stop()
+
+    def test_create_file(self, watcher, cloud, received):
+        (cloud / "a" / "b" / "new.txt").write_text("data")
+        assert wait_for(received, events.Event("created", "a/b/new.txt", None, False))
+        assert wait_for(received, events.Event("modified", "a/b/new.txt", None, False))
+
+    def test_create_tree(self, watcher, cloud, received):
+        (cloud / "x").mkdir()
+        assert wait_for(received, events.Event("created", "x", None, True))
+
+        (cloud / "x" / "y").mkdir()
+        assert wait_for(received, events.Event("created", "x/y", None, True))
+
+    def test_move(self, watcher, cloud, received):
+        (cloud / "a" / "b").rename(cloud / "c")
+        assert wait_for(received, events.Event("moved", "a/b", "c", True))
+
+        (cloud / "c" / "z").mkdir()
+        assert wait_for(received, events.Event("created", "c/z", None, True))
+
+    def test_delete(self, watcher, cloud, received):
+        (cloud / "a" / "file.txt").unlink()
+        assert wait_for(received, events.Event("deleted", "a/file.txt", None, False))
+
+    def test_overflow(self, watcher, received):
+        parsed = watcher.parse(EVENT_HEADER.pack(-1, IN_Q_OVERFLOW, 0, 0))
+        assert parsed == [("rescan", ".", None, True)]
+
+    def test_excluded_folders(self, cloud, received):
+        (cloud / cfg.TRASH_DIRNAME / "x").mkdir(parents=True)
+        (cloud / "a" / "ignored" / "y").mkdir(parents=True)
+
+        watcher = InotifyWatcher(cloud)
+        watcher.timeout = 0.05
+        matcher = IgnoreMatcher(["ignored"])
+        with mock.patch("app.utils.watcher.folder_tree"), mock.patch(
+            "app.utils.watcher.get_ignore_matcher", return_value=matcher
+        ):
+            watcher.start()
+            try:
+                assert watcher.ready.wait(5)
+                assert sorted(watcher._wds) == [".", "a", "a/b"]
+
+                (cloud / cfg.TRASH_DIRNAME / "x" / "new.txt").write_text("data")
+                (cloud / "a" / "b" / "new.txt").write_text("data")
+                assert wait_for(received, events.Event("created", "a/b/new.txt", None, False))
+                assert not [x for x in received if x.path.startswith(cfg.TRASH_DIRNAME)]
+            finally:
+                watcher.stop()
+
+    def test_fallback_to_polling(self, cloud, received):
+        watcher = InotifyWatcher(cloud)
+        error = OSError(errno.ENOSPC, os.strerror(errno.ENOSPC))
+        with mock.patch("app.utils.watcher.folder_tree"), mock.patch.object(
+            cfg, "WATCHER_POLL_INTERVAL", 0.01
+        ), mock.patch.object(watcher, "_add_watch", side_effect=error), pytest.warns(
+            WatcherWarning, match="polling"
+        ):
+            watcher.start()
+            assert watcher.ready.wait(5)
+
+        assert watcher._fd is None
+        (cloud / "new").mkdir()
+        force_change(cloud)
+        try:
+            assert wait_for(received, events.Event("created", "new", None, True))
+        finally:
+            watcher.stop()
+
+
+class TestFork:
+    @pytest.fixture(autouse=True)
+    def cfg_m(self, cloud):
+        with mock.patch("app.utils.watcher.cfg") as cfg_m, mock.patch(
+            "app.utils.watcher._watcher", None
+        ):
+            cfg_m.WATCHER = "polling"
+            cfg_m.CLOUD_PATH = cloud
+            cfg_m.WATCHER_POLL_INTERVAL = 0.01
+            yield cfg_m
+
+    def test_started_once_per_process(self, cloud):
+        with mock.patch("app.utils.watcher.PollingWatcher") as watcher_m:
+            assert watcher_module.start_watcher() is watcher_module.start_watcher()
+            watcher_m.assert_called_once_with(cloud)
+
+            # A forked child runs its own watcher
+            with mock.patch("os.getpid", return_value=-1):
+                watcher_module.start_watcher()
+            assert watcher_m.call_count == 2
+
+    def test_not_live_after_fork(self, cloud):
+        with mock.patch("app.utils.watcher.PollingWatcher"), mock.patch(
+            "app.utils.watcher.folder_tree"
+        ) as tree_m:
+            watcher_module.start_watcher()
+            watcher_module._after_fork()
+
+        tree_m.set_live.assert_called_once_with(None)
+        assert watcher_module._watcher is None
+
+    def test_app_restarts_after_fork(self):
+        import app
+
+        with mock.patch("app.start_background_threads") as start_m:
+            with mock.patch("app._started", False):
+                app._after_fork()
+            start_m.assert_not_called()
+
+            with mock.patch("app._started", True):
+                app._after_fork()
+            start_m.assert_called_once_with()